@@ -0,0 +1,3 @@
+# This file is autogenerated. Do not edit!
+src/borrowed/xlogreader.c: | /root/package/src/borrowed/ 
+	$(LN_S)  $@
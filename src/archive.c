@@ -8,23 +8,35 @@
  *-------------------------------------------------------------------------
  */
 
+#include <fcntl.h>
+#include <poll.h>
+#include <signal.h>
+#include <sys/socket.h>
+#include <sys/un.h>
 #include <unistd.h>
+#ifdef __linux__
+#include <sys/inotify.h>
+#endif
 #include "pg_probackup.h"
 #include "utils/thread.h"
 #include "portability/instr_time.h"
 
-static int push_file_internal_uncompressed(const char *wal_file_name, const char *pg_xlog_dir,
-								  const char *archive_dir, bool overwrite, bool no_sync,
-								  uint32 archive_timeout);
+static int push_file_internal(const char *wal_file_name, const char *pg_xlog_dir,
+							  const char *archive_dir, bool overwrite, bool no_sync,
+							  CompressAlg compress_alg, int compress_level,
+							  uint32 archive_timeout, pg_crc32 *crc);
 static int push_file_internal_gz(const char *wal_file_name, const char *pg_xlog_dir,
 									 const char *archive_dir, bool overwrite, bool no_sync,
-									 int compress_level, uint32 archive_timeout);
+									 int compress_level, uint32 archive_timeout,
+									 pg_crc32 *crc);
 static void *push_files(void *arg);
 static void *get_files(void *arg);
 static bool get_wal_file(const char *filename, const char *from_path, const char *to_path,
 													bool prefetch_mode);
 static int get_wal_file_internal(const char *from_path, const char *to_path, FILE *out,
 								 bool is_decompress);
+static int get_wal_file_decompress(const char *from_path, const char *tail,
+								   const char *to_path, FILE *out);
 static const char *get_gz_error(gzFile gzf, int errnum);
 //static void copy_file_attributes(const char *from_path,
 //								 fio_location from_location,
@@ -41,9 +53,37 @@ static bool wal_satisfy_from_prefetch(TimeLineID tli, XLogSegNo segno, const cha
 
 static uint32 maintain_prefetch(const char *prefetch_dir, XLogSegNo first_segno, uint32 wal_seg_size);
 
+static uint32 fetch_wal_files(parray *files, const char *prefetch_dir, const char *archive_dir,
+							  int num_threads);
+static bool prefetch_wal_file(const char *filename, const char *archive_dir,
+							  const char *prefetch_dir);
+static bool wal_satisfy_from_background_prefetch(TimeLineID tli, XLogSegNo segno,
+												 const char *wal_file_name,
+												 const char *prefetch_dir,
+												 const char *archive_dir,
+												 const char *absolute_wal_file_path,
+												 int batch_size, uint32 wal_seg_size,
+												 bool validate_wal);
+static void run_prefetch_worker(const char *prefetch_dir, const char *archive_dir,
+								int batch_size, uint32 wal_seg_size, bool validate_wal);
+
 static bool prefetch_stop = false;
 static uint32 xlog_seg_size;
 
+/* files of background prefetch worker in prefetch directory */
+#define PREFETCH_PID_FILE		"prefetch.pid"
+#define PREFETCH_REQUEST_FILE	"prefetch.request"
+/* marker of prefetched segment, which is already validated */
+#define PREFETCH_VALID_SUFFIX	".valid"
+/* prefetch window covers this many seconds of recovery ... */
+#define PREFETCH_LOOKAHEAD		10
+/* ... but it is never larger than this many batches */
+#define PREFETCH_MAX_BATCHES	8
+/* worker exits if there were no requests for this many seconds */
+#define PREFETCH_IDLE_TIMEOUT	60
+/* pause of worker, when there is nothing to do, in microseconds */
+#define PREFETCH_SLEEP_INTERVAL	(200 * 1000)
+
 typedef struct
 {
 	const char *first_filename;
@@ -92,9 +132,12 @@ typedef struct WALSegno
 static int push_file(WALSegno *xlogfile, const char *archive_status_dir,
 								   const char *pg_xlog_dir, const char *archive_dir,
 								   bool overwrite, bool no_sync, uint32 archive_timeout,
-								   bool no_ready_rename, bool is_compress,
+								   bool no_ready_rename, CompressAlg compress_alg,
 								   int compress_level);
 
+static void rename_ready_file(const char *archive_status_dir,
+							  const char *wal_file_name);
+
 static parray *setup_push_filelist(const char *archive_status_dir,
 								   const char *first_file, int batch_size);
 
@@ -138,7 +181,8 @@ do_archive_push(InstanceState *instanceState, InstanceConfig *instance, char *pg
 	if (!no_ready_rename || batch_size > 1)
 		join_path_components(archive_status_dir, pg_xlog_dir, "archive_status");
 
-	if (instance->compress_alg == ZLIB_COMPRESS)
+	if (instance->compress_alg != NONE_COMPRESS &&
+		instance->compress_alg != NOT_DEFINED_COMPRESS)
 		is_compress = true;
 
 	/*  Setup filelist and locks */
@@ -152,17 +196,17 @@ do_archive_push(InstanceState *instanceState, InstanceConfig *instance, char *pg
 					"threads: %i/%i, batch: %lu/%i, compression: %s",
 						PROGRAM_NAME, wal_file_name, n_threads, num_threads,
 						parray_num(batch_files), batch_size,
-						is_compress ? "zlib" : "none");
+						is_compress ? deparse_compress_alg(instance->compress_alg) : "none");
 
 	num_threads = n_threads;
 
 	/* Single-thread push
 	 * We don`t want to start multi-thread push, if number of threads in equal to 1,
 	 * or the number of files ready to push is small.
-	 * Multithreading in remote mode isn`t cheap,
-	 * establishing ssh connection can take 100-200ms, so running and terminating
-	 * one thread using generic multithread approach can take
-	 * almost as much time as copying itself.
+	 * In remote mode all threads share one ssh session, but establishing
+	 * it can take 100-200ms, so running and terminating threads using
+	 * generic multithread approach can take almost as much time as
+	 * copying itself.
 	 * TODO: maybe we should be more conservative and force single thread
 	 * push if batch_files array is small.
 	 */
@@ -180,7 +224,8 @@ do_archive_push(InstanceState *instanceState, InstanceConfig *instance, char *pg
 						   overwrite, no_sync,
 						   instance->archive_timeout,
 						   no_ready_rename || first_wal,
-						   is_compress && IsXLogFileName(xlogfile->name) ? true : false,
+						   is_compress && IsXLogFileName(xlogfile->name) ?
+								instance->compress_alg : NONE_COMPRESS,
 						   instance->compress_level);
 			if (rc == 0)
 				n_total_pushed++;
@@ -302,7 +347,8 @@ push_files(void *arg)
 					   args->overwrite, args->no_sync,
 					   args->archive_timeout, no_ready_rename,
 					   /* do not compress .backup, .partial and .history files */
-					   args->compress && IsXLogFileName(xlogfile->name) ? true : false,
+					   args->compress && IsXLogFileName(xlogfile->name) ?
+							args->compress_alg : NONE_COMPRESS,
 					   args->compress_level);
 
 		if (rc == 0)
@@ -322,66 +368,109 @@ int
 push_file(WALSegno *xlogfile, const char *archive_status_dir,
 		  const char *pg_xlog_dir, const char *archive_dir,
 		  bool overwrite, bool no_sync, uint32 archive_timeout,
-		  bool no_ready_rename, bool is_compress,
+		  bool no_ready_rename, CompressAlg compress_alg,
 		  int compress_level)
 {
 	int     rc;
+	pg_crc32	crc;
+	char	archived_name[MAXFNAMELEN];
 
 	elog(LOG, "pushing file \"%s\"", xlogfile->name);
 
-	/* If compression is not required, then just copy it as is */
-	if (!is_compress)
-		rc = push_file_internal_uncompressed(xlogfile->name, pg_xlog_dir,
-											 archive_dir, overwrite, no_sync,
-											 archive_timeout);
-	else
+	/* zlib uses streaming compression, other algorithms compress segment as a whole */
+	if (compress_alg == ZLIB_COMPRESS)
 		rc = push_file_internal_gz(xlogfile->name, pg_xlog_dir, archive_dir,
 								   overwrite, no_sync, compress_level,
-								   archive_timeout);
+								   archive_timeout, &crc);
+	else
+		rc = push_file_internal(xlogfile->name, pg_xlog_dir,
+								archive_dir, overwrite, no_sync,
+								compress_alg, compress_level,
+								archive_timeout, &crc);
+
+	/* record the file in WAL index, if archive has one */
+	if (compress_alg != NONE_COMPRESS && compress_alg != NOT_DEFINED_COMPRESS)
+		snprintf(archived_name, MAXFNAMELEN, "%s.%s", xlogfile->name,
+				 wal_compress_suffix(compress_alg));
+	else
+		strlcpy(archived_name, xlogfile->name, MAXFNAMELEN);
 
-	/* take '--no-ready-rename' flag into account */
-	if (!no_ready_rename && archive_status_dir != NULL)
+	if (wal_index_add_file(archive_dir, archived_name, crc, no_sync) &&
+		IsXLogFileName(xlogfile->name))
 	{
-		char	wal_file_dummy[MAXPGPATH];
-		char	wal_file_ready[MAXPGPATH];
-		char	wal_file_done[MAXPGPATH];
-
-		join_path_components(wal_file_dummy, archive_status_dir, xlogfile->name);
-		snprintf(wal_file_ready, MAXPGPATH, "%s.%s", wal_file_dummy, "ready");
-		snprintf(wal_file_done, MAXPGPATH, "%s.%s", wal_file_dummy, "done");
-
-		canonicalize_path(wal_file_ready);
-		canonicalize_path(wal_file_done);
-		/* It is ok to rename status file in archive_status directory */
-		elog(LOG, "Rename \"%s\" to \"%s\"", wal_file_ready, wal_file_done);
-
-		/* do not error out, if rename failed */
-		if (fio_rename(FIO_DB_HOST, wal_file_ready, wal_file_done) < 0)
-			elog(WARNING, "Cannot rename ready file \"%s\" to \"%s\": %s",
-				wal_file_ready, wal_file_done, strerror(errno));
+		TimeLineID	tli;
+		XLogSegNo	segno;
+		WalSegmentSummary summary;
+
+		/* the segment is still in pg_wal, summarize it there */
+		GetXLogFromFileName(xlogfile->name, &tli, &segno, instance_config.xlog_seg_size);
+		if (summarize_wal_segment(pg_xlog_dir, tli, segno,
+								  instance_config.xlog_seg_size, &summary))
+			wal_summary_add(archive_dir, tli, &summary,
+							instance_config.xlog_seg_size, no_sync);
+		else
+			elog(LOG, "Cannot summarize WAL segment \"%s\"", xlogfile->name);
 	}
 
+	/* take '--no-ready-rename' flag into account */
+	if (!no_ready_rename && archive_status_dir != NULL)
+		rename_ready_file(archive_status_dir, xlogfile->name);
+
 	return rc;
 }
 
 /*
- * Copy non WAL file, such as .backup or .history file, into WAL archive.
- * Such files are not compressed.
+ * Mark WAL file as archived, so PostgreSQL does not call archive_command
+ * for it.
+ */
+static void
+rename_ready_file(const char *archive_status_dir, const char *wal_file_name)
+{
+	char	wal_file_dummy[MAXPGPATH];
+	char	wal_file_ready[MAXPGPATH];
+	char	wal_file_done[MAXPGPATH];
+
+	join_path_components(wal_file_dummy, archive_status_dir, wal_file_name);
+	snprintf(wal_file_ready, MAXPGPATH, "%s.%s", wal_file_dummy, "ready");
+	snprintf(wal_file_done, MAXPGPATH, "%s.%s", wal_file_dummy, "done");
+
+	canonicalize_path(wal_file_ready);
+	canonicalize_path(wal_file_done);
+	/* It is ok to rename status file in archive_status directory */
+	elog(LOG, "Rename \"%s\" to \"%s\"", wal_file_ready, wal_file_done);
+
+	/* do not error out, if rename failed */
+	if (fio_rename(FIO_DB_HOST, wal_file_ready, wal_file_done) < 0)
+		elog(WARNING, "Cannot rename ready file \"%s\" to \"%s\": %s",
+			wal_file_ready, wal_file_done, strerror(errno));
+}
+
+/*
+ * Copy file into WAL archive as is, or compress the whole WAL segment
+ * with zstd or lz4 algorithm. Non WAL files, such as .backup or .history
+ * file, are never compressed.
  * Returns:
  *  0 - file was successfully pushed
  *  1 - push was skipped because file already exists in the archive and
  *      has the same checksum
+ * Checksum of the file content is returned in crc.
  */
 int
-push_file_internal_uncompressed(const char *wal_file_name, const char *pg_xlog_dir,
-								const char *archive_dir, bool overwrite, bool no_sync,
-								uint32 archive_timeout)
+push_file_internal(const char *wal_file_name, const char *pg_xlog_dir,
+				   const char *archive_dir, bool overwrite, bool no_sync,
+				   CompressAlg compress_alg, int compress_level,
+				   uint32 archive_timeout, pg_crc32 *crc)
 {
 	FILE	   *in = NULL;
 	int			out = -1;
 	char       *buf = pgut_malloc(OUT_BUF_SIZE); /* 1MB buffer */
 	char		from_fullpath[MAXPGPATH];
 	char		to_fullpath[MAXPGPATH];
+	bool		is_compress = compress_alg != NONE_COMPRESS &&
+							  compress_alg != NOT_DEFINED_COMPRESS;
+	/* whole segment, used for compression */
+	char	   *segment = NULL;
+	size_t		segment_size = 0;
 	/* partial handling */
 	struct stat		st;
 	char		to_fullpath_part[MAXPGPATH];
@@ -398,6 +487,15 @@ push_file_internal_uncompressed(const char *wal_file_name, const char *pg_xlog_d
 	join_path_components(to_fullpath, archive_dir, wal_file_name);
 	canonicalize_path(to_fullpath);
 
+	/* destination file with .zst or .lz4 suffix */
+	if (is_compress)
+	{
+		size_t		len = strlen(to_fullpath);
+
+		snprintf(to_fullpath + len, sizeof(to_fullpath) - len, ".%s",
+				 wal_compress_suffix(compress_alg));
+	}
+
 	/* Open source file for read */
 	in = fopen(from_fullpath, PG_BINARY_R);
 	if (in == NULL)
@@ -505,13 +603,40 @@ part_opened:
 		pg_crc32 crc32_src;
 		pg_crc32 crc32_dst;
 
-		crc32_src = fio_get_crc32(FIO_DB_HOST,     from_fullpath, false, false);
-		crc32_dst = fio_get_crc32(FIO_BACKUP_HOST, to_fullpath,   false, false);
+		crc32_src = fio_get_crc32(FIO_DB_HOST, from_fullpath, false, false);
+
+		if (is_compress)
+		{
+			char	   *content = NULL;
+			size_t		content_size = 0;
+
+			struct stat	src_st;
+
+			if (fstat(fileno(in), &src_st) != 0)
+				elog(ERROR, "Cannot stat source file \"%s\": %s",
+							from_fullpath, strerror(errno));
+
+			/*
+			 * Content, which doesn't fit into the source size, differs anyway.
+			 * Unreadable file will be overwritten or reported below.
+			 */
+			INIT_CRC32C(crc32_dst);
+			if (read_compressed_wal_file(to_fullpath, FIO_BACKUP_HOST, compress_alg,
+										 src_st.st_size, &content, &content_size) == SEND_OK)
+			{
+				COMP_CRC32C(crc32_dst, content, content_size);
+				pg_free(content);
+			}
+			FIN_CRC32C(crc32_dst);
+		}
+		else
+			crc32_dst = fio_get_crc32(FIO_BACKUP_HOST, to_fullpath, false, false);
 
 		if (crc32_src == crc32_dst)
 		{
 			elog(LOG, "WAL file already exists in archive with the same "
 					"checksum, skip pushing: \"%s\"", from_fullpath);
+			*crc = crc32_src;
 			/* cleanup */
 			fclose(in);
 			fio_close(out);
@@ -538,6 +663,7 @@ part_opened:
 	}
 
 	/* copy content */
+	INIT_CRC32C(*crc);
 	errno = 0;
 	for (;;)
 	{
@@ -554,7 +680,17 @@ part_opened:
 						from_fullpath, strerror(save_errno));
 		}
 
-		if (read_len > 0 && fio_write_async(out, buf, read_len) != read_len)
+		/* accumulate the whole segment, it is compressed after reading */
+		if (is_compress)
+		{
+			if (read_len > 0)
+			{
+				segment = pgut_realloc(segment, segment_size + read_len);
+				memcpy(segment + segment_size, buf, read_len);
+				segment_size += read_len;
+			}
+		}
+		else if (read_len > 0 && fio_write_async(out, buf, read_len) != read_len)
 		{
 			int save_errno = errno;
 			if (fio_remove(FIO_BACKUP_HOST, to_fullpath_part, false) != 0)
@@ -563,13 +699,48 @@ part_opened:
 						to_fullpath_part, strerror(save_errno));
 		}
 
+		COMP_CRC32C(*crc, buf, read_len);
+
 		if (feof(in))
 			break;
 	}
 
+	FIN_CRC32C(*crc);
+
 	/* close source file */
 	fclose(in);
 
+	if (is_compress)
+	{
+		size_t		compressed_size = compress_bound(compress_alg, segment_size);
+		char	   *compressed = pgut_malloc(compressed_size);
+		const char *errormsg = NULL;
+		int32		rc;
+
+		rc = do_compress_wal(compressed, compressed_size, segment, segment_size,
+							 compress_alg, compress_level, &errormsg);
+		if (rc < 0)
+		{
+			if (fio_remove(FIO_BACKUP_HOST, to_fullpath_part, false) != 0)
+				elog(WARNING, "Cannot cleanup temp WAL file \"%s\": %s", to_fullpath_part, strerror(errno));
+			elog(ERROR, "Cannot compress WAL file \"%s\" with %s: %s",
+						from_fullpath, deparse_compress_alg(compress_alg),
+						errormsg ? errormsg : "unknown error");
+		}
+
+		if (fio_write_async(out, compressed, rc) != rc)
+		{
+			int save_errno = errno;
+			if (fio_remove(FIO_BACKUP_HOST, to_fullpath_part, false) != 0)
+				elog(WARNING, "Cannot cleanup temp WAL file \"%s\": %s", to_fullpath_part, strerror(errno));
+			elog(ERROR, "Cannot write to destination temp file \"%s\": %s",
+						to_fullpath_part, strerror(save_errno));
+		}
+
+		pg_free(compressed);
+		pg_free(segment);
+	}
+
 	/* Writing is asynchronous in case of push in remote mode, so check agent status */
 	if (fio_check_error_fd(out, &errmsg))
 	{
@@ -621,11 +792,13 @@ part_opened:
  *  0 - file was successfully pushed
  *  1 - push was skipped because file already exists in the archive and
  *      has the same checksum
+ * Checksum of the file content is returned in crc.
  */
 int
 push_file_internal_gz(const char *wal_file_name, const char *pg_xlog_dir,
 					  const char *archive_dir, bool overwrite, bool no_sync,
-					  int compress_level, uint32 archive_timeout)
+					  int compress_level, uint32 archive_timeout,
+					  pg_crc32 *crc)
 {
 	FILE	   *in = NULL;
 	gzFile		out = NULL;
@@ -771,6 +944,7 @@ part_opened:
 		{
 			elog(LOG, "WAL file already exists in archive with the same "
 					"checksum, skip pushing: \"%s\"", from_fullpath);
+			*crc = crc32_src;
 			/* cleanup */
 			fclose(in);
 			fio_gzclose(out);
@@ -798,6 +972,7 @@ part_opened:
 
 	/* copy content */
 	/* TODO: move to separate function */
+	INIT_CRC32C(*crc);
 	for (;;)
 	{
 		size_t  read_len = 0;
@@ -822,10 +997,14 @@ part_opened:
 					to_fullpath_gz_part, get_gz_error(out, save_errno));
 		}
 
+		COMP_CRC32C(*crc, buf, read_len);
+
 		if (feof(in))
 			break;
 	}
 
+	FIN_CRC32C(*crc);
+
 	/* close source file */
 	fclose(in);
 
@@ -979,207 +1158,1033 @@ setup_push_filelist(const char *archive_status_dir, const char *first_file,
 	return batch_files;
 }
 
+/* ------------- ARCHIVE-PUSH DAEMON ---------- */
+
 /*
- * pg_backup specific restore command.
- * Move files from arclog_path to pgdata/wal_file_path.
- *
- *  The problem with archive-get: we must be very careful about
- * erroring out, because postgres will interpretent our negative exit code
- * as the fact, that requested file is missing and may take irreversible actions.
- * So if file copying has failed we must retry several times before bailing out.
+ * The daemon keeps the configuration, the thread pool and the connection
+ * to the backup host between WAL files.  It pushes every file which gets
+ * a '.ready' file in archive_status directory and renames it to '.done',
+ * so PostgreSQL calls archive_command only for the files the daemon has
+ * not got to yet.  In this case archive_command, started with the same
+ * --archive-socket, just passes the file name to the daemon over a local
+ * socket and waits for the answer.
  *
- * TODO: add support of -D option.
- * TOTHINK: what can be done about ssh connection been broken?
- * TOTHINk: do we need our own rmtree function ?
- * TOTHINk: so sort of async prefetch ?
-
+ * Protocol is line based: the client sends the name of WAL file, the
+ * daemon answers "OK" when the file is in the archive or "ERROR: <message>".
+ * Any answer except "OK" makes the client push the file itself, so an
+ * error message reaches PostgreSQL log exactly as without the daemon.
  */
-void
-do_archive_get(InstanceState *instanceState, InstanceConfig *instance, const char *prefetch_dir_arg,
-			   char *wal_file_path, char *wal_file_name, int batch_size,
-			   bool validate_wal)
-{
-	int         fail_count = 0;
-	char        backup_wal_file_path[MAXPGPATH];
-	char        absolute_wal_file_path[MAXPGPATH];
-	char        current_dir[MAXPGPATH];
-	char        prefetch_dir[MAXPGPATH];
-	char        pg_xlog_dir[MAXPGPATH];
-	char        prefetched_file[MAXPGPATH];
-
-	/* reporting */
-	uint32      n_fetched = 0;
-	int         n_actual_threads = num_threads;
-	uint32      n_files_in_prefetch = 0;
-
-	/* time reporting */
-	instr_time  start_time, end_time;
-	double      get_time;
-	char        pretty_time_str[20];
 
-	if (wal_file_name == NULL)
-		elog(ERROR, "Required parameter not specified: --wal-file-name %%f");
+typedef enum
+{
+	DAEMON_FILE_QUEUED,
+	DAEMON_FILE_PUSHING,
+	DAEMON_FILE_PUSHED
+} ArchiveDaemonFileState;
 
-	if (wal_file_path == NULL)
-		elog(ERROR, "Required parameter not specified: --wal_file_path %%p");
+typedef struct
+{
+	char		name[MAXFNAMELEN];
+	ArchiveDaemonFileState state;
+	/* requested by archive_command, PostgreSQL renames ready file itself */
+	bool		requested;
+} ArchiveDaemonFile;
 
-	if (!getcwd(current_dir, sizeof(current_dir)))
-		elog(ERROR, "getcwd() error");
+typedef struct
+{
+	int			fd;
+	char		request[MAXFNAMELEN];
+	size_t		request_len;
+	/* WAL file the client is waiting for, empty until request is read */
+	char		wal_file_name[MAXFNAMELEN];
+} ArchiveDaemonClient;
 
-	/* path to PGDATA/pg_wal directory */
-	join_path_components(pg_xlog_dir, current_dir, XLOGDIR);
+typedef struct
+{
+	const char *pg_xlog_dir;
+	const char *archive_dir;
+	const char *archive_status_dir;
+	bool		overwrite;
+	bool		no_sync;
+	bool		no_ready_rename;
+	uint32		archive_timeout;
+	CompressAlg compress_alg;
+	int			compress_level;
 
-	/* destination full filepath, usually it is PGDATA/pg_wal/RECOVERYXLOG */
-	join_path_components(absolute_wal_file_path, current_dir, wal_file_path);
+	/* protects everything below */
+	pthread_mutex_t lock;
+	pthread_cond_t queue_cond;
+	/* files known to the daemon, pushed ones are kept while they are ready */
+	parray	   *files;
+	bool		stop;
+	uint32		n_pushed;
+	uint32		n_skipped;
 
-	/* full filepath to WAL file in archive directory.
-	 * $BACKUP_PATH/wal/instance_name/000000010000000000000001 */
-	join_path_components(backup_wal_file_path, instanceState->instance_wal_subdir_path, wal_file_name);
+	/* workers write here to wake up the main loop */
+	int			wakeup_pipe[2];
+} archive_daemon_state;
 
-	INSTR_TIME_SET_CURRENT(start_time);
-	if (num_threads > batch_size)
-		n_actual_threads = batch_size;
-	elog(INFO, "%s archive-get WAL file: %s, remote: %s, threads: %i/%i, batch: %i",
-			PROGRAM_NAME, wal_file_name, IsSshProtocol() ? "ssh" : "none", n_actual_threads, num_threads, batch_size);
+typedef struct
+{
+	archive_daemon_state *state;
+	int			thread_num;
+} archive_daemon_arg;
 
-	num_threads = n_actual_threads;
+/* period of archive_status rescan to catch missed events, in milliseconds */
+#define ARCHIVE_DAEMON_RESCAN_INTERVAL	(10 * 1000)
+/* poll timeout, without inotify archive_status is rescanned that often */
+#define ARCHIVE_DAEMON_POLL_TIMEOUT		1000
 
-	elog(VERBOSE, "Obtaining XLOG_SEG_SIZE from pg_control file");
-	instance->xlog_seg_size = get_xlog_seg_size(current_dir);
+static ArchiveDaemonFile *
+archive_daemon_find_file(archive_daemon_state *state, const char *wal_file_name)
+{
+	int			i;
 
-	/* Prefetch optimization kicks in only if simple XLOG segments is requested
-	 * and batching is enabled.
-	 *
-	 * We check that file do exists in prefetch directory, then we validate it and
-	 * rename to destination path.
-	 * If file do not exists, then we run prefetch and rename it.
-	 */
-	if (IsXLogFileName(wal_file_name) && batch_size > 1)
+	for (i = 0; i < parray_num(state->files); i++)
 	{
-		XLogSegNo segno;
-		TimeLineID tli;
+		ArchiveDaemonFile *file = (ArchiveDaemonFile *) parray_get(state->files, i);
 
-		GetXLogFromFileName(wal_file_name, &tli, &segno, instance->xlog_seg_size);
+		if (strcmp(file->name, wal_file_name) == 0)
+			return file;
+	}
 
-		if (prefetch_dir_arg)
-			/* use provided prefetch directory */
-			snprintf(prefetch_dir, sizeof(prefetch_dir), "%s", prefetch_dir_arg);
-		else
-			/* use default path */
-			join_path_components(prefetch_dir, pg_xlog_dir, "pbk_prefetch");
+	return NULL;
+}
 
-		/* Construct path to WAL file in prefetch directory.
-		 * current_dir/pg_wal/pbk_prefech/000000010000000000000001
-		 */
-		join_path_components(prefetched_file, prefetch_dir, wal_file_name);
+/*
+ * Add WAL file to the queue, unless the daemon already knows about it.
+ * Caller must hold the lock.
+ */
+static ArchiveDaemonFile *
+archive_daemon_queue_file(archive_daemon_state *state, const char *wal_file_name)
+{
+	ArchiveDaemonFile *file = archive_daemon_find_file(state, wal_file_name);
 
-		/* check if file is available in prefetch directory */
-		if (access(prefetched_file, F_OK) == 0)
-		{
-			/* Prefetched WAL segment is available, before using it, we must validate it.
-			 * But for validation to work properly(because of contrecord), we must be sure
-			 * that next WAL segment is also available in prefetch directory.
-			 * If next segment do not exists in prefetch directory, we must provide it from
-			 * archive. If it is NOT available in the archive, then file in prefetch directory
-			 * cannot be trusted. In this case we discard all prefetched files and
-			 * copy requested file directly from archive.
-			 */
-			if (!next_wal_segment_exists(tli, segno, prefetch_dir, instance->xlog_seg_size))
-				n_fetched = run_wal_prefetch(prefetch_dir, instanceState->instance_wal_subdir_path,
-											 tli, segno, num_threads, false, batch_size,
-											 instance->xlog_seg_size);
+	if (file)
+		return file;
 
-			n_files_in_prefetch = maintain_prefetch(prefetch_dir, segno, instance->xlog_seg_size);
+	file = pgut_new0(ArchiveDaemonFile);
+	strlcpy(file->name, wal_file_name, MAXFNAMELEN);
+	file->state = DAEMON_FILE_QUEUED;
+	parray_append(state->files, file);
 
-			if (wal_satisfy_from_prefetch(tli, segno, wal_file_name, prefetch_dir,
-										  absolute_wal_file_path, instance->xlog_seg_size,
-										  validate_wal))
-			{
-				n_files_in_prefetch--;
-				elog(INFO, "%s archive-get used prefetched WAL segment %s, prefetch state: %u/%u",
-						PROGRAM_NAME, wal_file_name, n_files_in_prefetch, batch_size);
-				goto get_done;
-			}
-			else
-			{
-				/* discard prefetch */
-//				n_fetched = 0;
-				pgut_rmtree(prefetch_dir, false, false);
-			}
-		}
-		else
-		{
-			/* Do prefetch maintenance here */
+	pthread_cond_signal(&state->queue_cond);
 
-			mkdir(prefetch_dir, DIR_PERMISSION); /* In case prefetch directory do not exists yet */
+	return file;
+}
 
-			/* We`ve failed to satisfy current request from prefetch directory,
-			 * therefore we can discard its content, since it may be corrupted or
-			 * contain stale files.
-			 *
-			 * UPDATE: we should not discard prefetch easily, because failing to satisfy
-			 * request for WAL may come from this recovery behavior:
-			 * https://www.postgresql.org/message-id/flat/16159-f5a34a3a04dc67e0%40postgresql.org
-			 */
-//			rmtree(prefetch_dir, false);
+/*
+ * Forget WAL file whose ready file is gone, unless somebody needs it.
+ * Caller must hold the lock.
+ */
+static void
+archive_daemon_forget_file(archive_daemon_state *state, const char *wal_file_name)
+{
+	int			i;
 
-			/* prefetch files */
-			n_fetched = run_wal_prefetch(prefetch_dir, instanceState->instance_wal_subdir_path,
-										 tli, segno, num_threads, true, batch_size,
-										 instance->xlog_seg_size);
+	for (i = 0; i < parray_num(state->files); i++)
+	{
+		ArchiveDaemonFile *file = (ArchiveDaemonFile *) parray_get(state->files, i);
 
-			n_files_in_prefetch = maintain_prefetch(prefetch_dir, segno, instance->xlog_seg_size);
+		if (strcmp(file->name, wal_file_name) != 0)
+			continue;
 
-			if (wal_satisfy_from_prefetch(tli, segno, wal_file_name, prefetch_dir, absolute_wal_file_path,
-										  instance->xlog_seg_size, validate_wal))
-			{
-				n_files_in_prefetch--;
-				elog(INFO, "%s archive-get copied WAL file %s, prefetch state: %u/%u",
-						PROGRAM_NAME, wal_file_name, n_files_in_prefetch, batch_size);
-				goto get_done;
-			}
-//			else
-//			{
-//				/* yet again failed to satisfy request from prefetch */
-//				n_fetched = 0;
-//				rmtree(prefetch_dir, false);
-//			}
+		if (file->state != DAEMON_FILE_PUSHING && !file->requested)
+		{
+			pfree(file);
+			parray_remove(state->files, i);
 		}
+		return;
 	}
+}
 
-	/* we use it to extend partial file later  */
-	xlog_seg_size = instance->xlog_seg_size;
-
-	/* Either prefetch didn`t cut it, or batch mode is disabled or
-	 * the requested file is not WAL segment.
-	 * Copy file from the archive directly.
-	 * Retry several times before bailing out.
-	 *
-	 * TODO:
-	 * files copied from archive directly are not validated, which is not ok.
-	 * TOTHINK:
-	 * Current WAL validation cannot be applied to partial files.
-	 */
+/*
+ * PostgreSQL archives the oldest ready file first.  Ready file of the oldest
+ * file is left to PostgreSQL even if archive_command has not been called
+ * for it yet, otherwise PostgreSQL may find it missing after archiving.
+ * Caller must hold the lock.
+ */
+static bool
+archive_daemon_is_oldest(archive_daemon_state *state, ArchiveDaemonFile *file)
+{
+	int			i;
 
-	while (fail_count < 3)
+	for (i = 0; i < parray_num(state->files); i++)
 	{
-		if (get_wal_file(wal_file_name, backup_wal_file_path, absolute_wal_file_path, false))
-		{
-			fail_count = 0;
-			elog(LOG, "%s archive-get copied WAL file %s", PROGRAM_NAME, wal_file_name);
-			n_fetched++;
-			break;
-		}
-		else
-			fail_count++;
+		ArchiveDaemonFile *other = (ArchiveDaemonFile *) parray_get(state->files, i);
 
-		elog(LOG, "Failed to get WAL file %s, retry %i/3", wal_file_name, fail_count);
+		if (strcmp(other->name, file->name) < 0)
+			return false;
 	}
 
-	/* TODO/TOTHINK:
-	 * If requested file is corrupted, we have no way to warn PostgreSQL about it.
-	 * We either can:
-	 * 1. feed to recovery and let PostgreSQL sort it out. Currently we do this.
+	return true;
+}
+
+/*
+ * Files requested by archive_command go first, because PostgreSQL is
+ * waiting for them, other files are pushed in WAL order.
+ * Caller must hold the lock.
+ */
+static ArchiveDaemonFile *
+archive_daemon_next_file(archive_daemon_state *state)
+{
+	ArchiveDaemonFile *next = NULL;
+	int			i;
+
+	for (i = 0; i < parray_num(state->files); i++)
+	{
+		ArchiveDaemonFile *file = (ArchiveDaemonFile *) parray_get(state->files, i);
+
+		if (file->state != DAEMON_FILE_QUEUED)
+			continue;
+
+		if (next == NULL ||
+			(file->requested && !next->requested) ||
+			(file->requested == next->requested && strcmp(file->name, next->name) < 0))
+			next = file;
+	}
+
+	return next;
+}
+
+static void *
+archive_daemon_worker(void *arg)
+{
+	archive_daemon_arg *args = (archive_daemon_arg *) arg;
+	archive_daemon_state *state = args->state;
+
+	my_thread_num = args->thread_num;
+
+	for (;;)
+	{
+		ArchiveDaemonFile *file;
+		WALSegno	xlogfile;
+		bool		is_compress;
+		bool		rename_ready;
+		int			rc;
+
+		pthread_mutex_lock(&state->lock);
+		while (!state->stop && (file = archive_daemon_next_file(state)) == NULL)
+			pthread_cond_wait(&state->queue_cond, &state->lock);
+
+		if (state->stop)
+		{
+			pthread_mutex_unlock(&state->lock);
+			break;
+		}
+
+		file->state = DAEMON_FILE_PUSHING;
+		strlcpy(xlogfile.name, file->name, MAXFNAMELEN);
+		pthread_mutex_unlock(&state->lock);
+
+		/* do not compress .backup, .partial and .history files */
+		is_compress = state->compress_alg != NONE_COMPRESS &&
+					  state->compress_alg != NOT_DEFINED_COMPRESS &&
+					  IsXLogFileName(xlogfile.name);
+
+		/* ready file is renamed below, when it is clear who owns it */
+		rc = push_file(&xlogfile, NULL, state->pg_xlog_dir, state->archive_dir,
+					   state->overwrite, state->no_sync, state->archive_timeout,
+					   true, is_compress ? state->compress_alg : NONE_COMPRESS,
+					   state->compress_level);
+
+		pthread_mutex_lock(&state->lock);
+		file->state = DAEMON_FILE_PUSHED;
+		rename_ready = !file->requested && !state->no_ready_rename &&
+					   !archive_daemon_is_oldest(state, file);
+		if (rc == 0)
+			state->n_pushed++;
+		else
+			state->n_skipped++;
+		pthread_mutex_unlock(&state->lock);
+
+		/*
+		 * Do not rename ready file of the file PostgreSQL is archiving,
+		 * otherwise it complains that the ready file is missing.
+		 */
+		if (rename_ready)
+			rename_ready_file(state->archive_status_dir, xlogfile.name);
+
+		/* wake up the main loop to answer waiting clients */
+		if (write(state->wakeup_pipe[1], "", 1) < 0 && errno != EAGAIN)
+			elog(WARNING, "Cannot wake up archive-push daemon: %s", strerror(errno));
+	}
+
+	/* close ssh connection */
+	fio_disconnect();
+
+	return NULL;
+}
+
+/*
+ * Queue every WAL file with '.ready' file and forget pushed files whose
+ * ready file is gone.
+ */
+static void
+archive_daemon_rescan(archive_daemon_state *state)
+{
+	DIR		   *dir;
+	struct dirent *dent;
+	parray	   *ready_files = parray_new();
+	int			i;
+
+	dir = opendir(state->archive_status_dir);
+	if (dir == NULL)
+		elog(ERROR, "Cannot open directory \"%s\": %s",
+			 state->archive_status_dir, strerror(errno));
+
+	while (errno = 0, (dent = readdir(dir)) != NULL)
+	{
+		size_t		len = strlen(dent->d_name);
+
+		if (len <= strlen(".ready") || len >= MAXFNAMELEN ||
+			strcmp(dent->d_name + len - strlen(".ready"), ".ready") != 0)
+			continue;
+
+		dent->d_name[len - strlen(".ready")] = '\0';
+		parray_append(ready_files, pgut_strdup(dent->d_name));
+	}
+
+	if (errno)
+		elog(ERROR, "Cannot read directory \"%s\": %s",
+			 state->archive_status_dir, strerror(errno));
+	closedir(dir);
+
+	parray_qsort(ready_files, pgCompareString);
+
+	pthread_mutex_lock(&state->lock);
+
+	for (i = 0; i < parray_num(state->files); i++)
+	{
+		ArchiveDaemonFile *file = (ArchiveDaemonFile *) parray_get(state->files, i);
+
+		if (file->state != DAEMON_FILE_PUSHED || file->requested ||
+			parray_bsearch(ready_files, file->name, pgCompareString) != NULL)
+			continue;
+
+		pfree(file);
+		parray_remove(state->files, i);
+		i--;
+	}
+
+	for (i = 0; i < parray_num(ready_files); i++)
+		archive_daemon_queue_file(state, (char *) parray_get(ready_files, i));
+
+	pthread_mutex_unlock(&state->lock);
+
+	parray_walk(ready_files, pfree);
+	parray_free(ready_files);
+}
+
+/*
+ * Create listening socket.  Leftover socket of a terminated daemon is
+ * removed, but a running daemon is never replaced.
+ */
+static int
+archive_daemon_listen(const char *socket_path)
+{
+	struct sockaddr_un addr;
+	struct stat st;
+	int			fd;
+
+	if (strlen(socket_path) >= sizeof(addr.sun_path))
+		elog(ERROR, "Socket path \"%s\" is too long", socket_path);
+
+	memset(&addr, 0, sizeof(addr));
+	addr.sun_family = AF_UNIX;
+	strlcpy(addr.sun_path, socket_path, sizeof(addr.sun_path));
+
+	if (lstat(socket_path, &st) == 0)
+	{
+		if (!S_ISSOCK(st.st_mode))
+			elog(ERROR, "File \"%s\" already exists and is not a socket", socket_path);
+
+		fd = socket(AF_UNIX, SOCK_STREAM, 0);
+		if (fd >= 0 && connect(fd, (struct sockaddr *) &addr, sizeof(addr)) == 0)
+			elog(ERROR, "Another archive-push daemon is listening on socket \"%s\"",
+				 socket_path);
+		if (fd >= 0)
+			close(fd);
+
+		elog(LOG, "Removing stale socket \"%s\"", socket_path);
+		if (unlink(socket_path) != 0)
+			elog(ERROR, "Cannot remove socket \"%s\": %s", socket_path, strerror(errno));
+	}
+
+	fd = socket(AF_UNIX, SOCK_STREAM, 0);
+	if (fd < 0)
+		elog(ERROR, "Cannot create socket: %s", strerror(errno));
+
+	if (bind(fd, (struct sockaddr *) &addr, sizeof(addr)) != 0)
+		elog(ERROR, "Cannot bind socket \"%s\": %s", socket_path, strerror(errno));
+
+	/* only PostgreSQL OS user may talk to the daemon */
+	if (chmod(socket_path, FILE_PERMISSION) != 0)
+		elog(ERROR, "Cannot change mode of socket \"%s\": %s", socket_path, strerror(errno));
+
+	if (listen(fd, SOMAXCONN) != 0)
+		elog(ERROR, "Cannot listen on socket \"%s\": %s", socket_path, strerror(errno));
+
+	if (fcntl(fd, F_SETFL, O_NONBLOCK) != 0)
+		elog(ERROR, "Cannot set socket \"%s\" to non-blocking mode: %s",
+			 socket_path, strerror(errno));
+
+	return fd;
+}
+
+/* Send the answer to the client and close the connection */
+static void
+archive_daemon_reply(ArchiveDaemonClient *client, const char *reply)
+{
+	char		buf[MAXPGPATH];
+	int			len = snprintf(buf, sizeof(buf), "%s\n", reply);
+
+	/* the answer is tiny, it fits into socket buffer */
+	if (send(client->fd, buf, len, MSG_NOSIGNAL) != len)
+		elog(LOG, "Cannot send answer to archive-push client: %s", strerror(errno));
+
+	close(client->fd);
+	client->fd = -1;
+}
+
+/*
+ * Read the request of the client and queue requested WAL file.
+ */
+static void
+archive_daemon_read_request(archive_daemon_state *state, ArchiveDaemonClient *client)
+{
+	char		wal_file_path[MAXPGPATH];
+	char	   *newline;
+	ssize_t		rc;
+	ArchiveDaemonFile *file;
+
+	rc = recv(client->fd, client->request + client->request_len,
+			  sizeof(client->request) - client->request_len, 0);
+	if (rc <= 0)
+	{
+		if (rc < 0 && (errno == EAGAIN || errno == EINTR))
+			return;
+
+		close(client->fd);
+		client->fd = -1;
+		return;
+	}
+	client->request_len += rc;
+
+	newline = memchr(client->request, '\n', client->request_len);
+	if (newline == NULL)
+	{
+		if (client->request_len == sizeof(client->request))
+			archive_daemon_reply(client, "ERROR: WAL file name is too long");
+		return;
+	}
+	*newline = '\0';
+
+	if (client->request[0] == '\0' || strchr(client->request, '/') != NULL)
+	{
+		archive_daemon_reply(client, "ERROR: invalid WAL file name");
+		return;
+	}
+
+	/*
+	 * archive_command can be configured with another pg_wal directory, e.g.
+	 * at a replica. Leave such files to the client.
+	 */
+	join_path_components(wal_file_path, state->pg_xlog_dir, client->request);
+	if (access(wal_file_path, F_OK) != 0)
+	{
+		char		reply[MAXPGPATH];
+
+		snprintf(reply, sizeof(reply), "ERROR: cannot access WAL file \"%s\": %s",
+				 wal_file_path, strerror(errno));
+		archive_daemon_reply(client, reply);
+		return;
+	}
+
+	elog(VERBOSE, "archive_command is waiting for WAL file \"%s\"", client->request);
+
+	pthread_mutex_lock(&state->lock);
+	file = archive_daemon_queue_file(state, client->request);
+	file->requested = true;
+	pthread_mutex_unlock(&state->lock);
+
+	strlcpy(client->wal_file_name, client->request, MAXFNAMELEN);
+}
+
+/*
+ * Run archive-push in daemon mode until it is interrupted.
+ */
+void
+do_archive_push_daemon(InstanceState *instanceState, InstanceConfig *instance,
+					   char *pg_xlog_dir, const char *socket_path,
+					   bool overwrite, bool no_sync, bool no_ready_rename)
+{
+	archive_daemon_state state;
+	char		archive_status_dir[MAXPGPATH];
+	pthread_t  *threads;
+	archive_daemon_arg *threads_args;
+	parray	   *clients = parray_new();
+	struct pollfd *pfds = NULL;
+	int			n_pfds = 0;
+	int			listen_fd;
+	int			inotify_fd = -1;
+	bool		need_rescan = true;
+	instr_time	last_rescan;
+	int			i;
+
+	join_path_components(archive_status_dir, pg_xlog_dir, "archive_status");
+
+	memset(&state, 0, sizeof(state));
+	state.pg_xlog_dir = pg_xlog_dir;
+	state.archive_dir = instanceState->instance_wal_subdir_path;
+	state.archive_status_dir = archive_status_dir;
+	state.overwrite = overwrite;
+	state.no_sync = no_sync;
+	state.no_ready_rename = no_ready_rename;
+	state.archive_timeout = instance->archive_timeout;
+	state.compress_alg = instance->compress_alg;
+	state.compress_level = instance->compress_level;
+	state.files = parray_new();
+	pthread_mutex_init(&state.lock, NULL);
+	pthread_cond_init(&state.queue_cond, NULL);
+
+	if (pipe(state.wakeup_pipe) != 0)
+		elog(ERROR, "Cannot create pipe: %s", strerror(errno));
+	if (fcntl(state.wakeup_pipe[0], F_SETFL, O_NONBLOCK) != 0 ||
+		fcntl(state.wakeup_pipe[1], F_SETFL, O_NONBLOCK) != 0)
+		elog(ERROR, "Cannot set pipe to non-blocking mode: %s", strerror(errno));
+
+#ifdef __linux__
+	inotify_fd = inotify_init1(IN_NONBLOCK | IN_CLOEXEC);
+	if (inotify_fd < 0 ||
+		inotify_add_watch(inotify_fd, archive_status_dir,
+						  IN_CREATE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE) < 0)
+	{
+		elog(WARNING, "Cannot watch directory \"%s\": %s, falling back to polling",
+			 archive_status_dir, strerror(errno));
+		if (inotify_fd >= 0)
+			close(inotify_fd);
+		inotify_fd = -1;
+	}
+#endif
+
+	listen_fd = archive_daemon_listen(socket_path);
+
+	elog(INFO, "%s archive-push daemon is started, socket: \"%s\", threads: %i, compression: %s",
+		 PROGRAM_NAME, socket_path, num_threads,
+		 instance->compress_alg != NONE_COMPRESS && instance->compress_alg != NOT_DEFINED_COMPRESS ?
+			deparse_compress_alg(instance->compress_alg) : "none");
+
+	threads = (pthread_t *) palloc(sizeof(pthread_t) * num_threads);
+	threads_args = (archive_daemon_arg *) palloc(sizeof(archive_daemon_arg) * num_threads);
+
+	for (i = 0; i < num_threads; i++)
+	{
+		threads_args[i].state = &state;
+		threads_args[i].thread_num = i + 1;
+		pthread_create(&threads[i], NULL, archive_daemon_worker, &threads_args[i]);
+	}
+
+	INSTR_TIME_SET_CURRENT(last_rescan);
+
+	while (!interrupted && !thread_interrupted)
+	{
+		instr_time	now;
+		int			n;
+
+		INSTR_TIME_SET_CURRENT(now);
+		INSTR_TIME_SUBTRACT(now, last_rescan);
+		if (need_rescan || inotify_fd < 0 ||
+			INSTR_TIME_GET_MILLISEC(now) >= ARCHIVE_DAEMON_RESCAN_INTERVAL)
+		{
+			archive_daemon_rescan(&state);
+			INSTR_TIME_SET_CURRENT(last_rescan);
+			need_rescan = false;
+		}
+
+		/* answer clients whose files are pushed */
+		pthread_mutex_lock(&state.lock);
+		for (i = 0; i < parray_num(clients); i++)
+		{
+			ArchiveDaemonClient *client = (ArchiveDaemonClient *) parray_get(clients, i);
+			ArchiveDaemonFile *file;
+
+			if (client->wal_file_name[0] == '\0')
+				continue;
+
+			file = archive_daemon_find_file(&state, client->wal_file_name);
+			if (file && file->state == DAEMON_FILE_PUSHED)
+			{
+				/* ready file stays until PostgreSQL renames it */
+				file->requested = false;
+				archive_daemon_reply(client, "OK");
+			}
+		}
+		pthread_mutex_unlock(&state.lock);
+
+		for (i = 0; i < parray_num(clients); i++)
+		{
+			ArchiveDaemonClient *client = (ArchiveDaemonClient *) parray_get(clients, i);
+
+			if (client->fd >= 0)
+				continue;
+
+			pfree(client);
+			parray_remove(clients, i);
+			i--;
+		}
+
+		/* wait for something to happen */
+		if (n_pfds < parray_num(clients) + 3)
+		{
+			n_pfds = parray_num(clients) + 3;
+			pfds = pgut_realloc(pfds, sizeof(struct pollfd) * n_pfds);
+		}
+
+		pfds[0].fd = listen_fd;
+		pfds[1].fd = state.wakeup_pipe[0];
+		pfds[2].fd = inotify_fd;
+		for (i = 0; i < parray_num(clients); i++)
+			pfds[i + 3].fd = ((ArchiveDaemonClient *) parray_get(clients, i))->fd;
+		for (i = 0; i < parray_num(clients) + 3; i++)
+		{
+			pfds[i].events = POLLIN;
+			pfds[i].revents = 0;
+		}
+
+		n = poll(pfds, parray_num(clients) + 3, ARCHIVE_DAEMON_POLL_TIMEOUT);
+		if (n < 0)
+		{
+			if (errno == EINTR)
+				continue;
+			elog(ERROR, "poll() failed: %s", strerror(errno));
+		}
+		if (n == 0)
+			continue;
+
+		if (pfds[1].revents)
+		{
+			char		buf[64];
+
+			while (read(state.wakeup_pipe[0], buf, sizeof(buf)) > 0)
+				;
+		}
+
+#ifdef __linux__
+		if (pfds[2].revents)
+		{
+			/* events are aligned as required by inotify(7) */
+			char		buf[4096] __attribute__((aligned(__alignof__(struct inotify_event))));
+			ssize_t		len;
+
+			while ((len = read(inotify_fd, buf, sizeof(buf))) > 0)
+			{
+				char	   *ptr;
+
+				for (ptr = buf; ptr < buf + len;
+					 ptr += sizeof(struct inotify_event) + ((struct inotify_event *) ptr)->len)
+				{
+					struct inotify_event *event = (struct inotify_event *) ptr;
+					size_t		name_len;
+
+					if (event->mask & IN_Q_OVERFLOW)
+					{
+						need_rescan = true;
+						continue;
+					}
+
+					name_len = event->len > 0 ? strlen(event->name) : 0;
+					if (name_len <= strlen(".ready") || name_len >= MAXFNAMELEN ||
+						strcmp(event->name + name_len - strlen(".ready"), ".ready") != 0)
+						continue;
+
+					event->name[name_len - strlen(".ready")] = '\0';
+
+					pthread_mutex_lock(&state.lock);
+					if (event->mask & (IN_CREATE | IN_MOVED_TO))
+						archive_daemon_queue_file(&state, event->name);
+					else
+						archive_daemon_forget_file(&state, event->name);
+					pthread_mutex_unlock(&state.lock);
+				}
+			}
+		}
+#endif
+
+		for (i = 0; i < parray_num(clients); i++)
+		{
+			ArchiveDaemonClient *client = (ArchiveDaemonClient *) parray_get(clients, i);
+
+			if (pfds[i + 3].revents && client->wal_file_name[0] == '\0')
+				archive_daemon_read_request(&state, client);
+			else if (pfds[i + 3].revents & (POLLHUP | POLLERR))
+			{
+				/* client has gone, e.g. PostgreSQL is stopped */
+				close(client->fd);
+				client->fd = -1;
+			}
+		}
+
+		if (pfds[0].revents)
+		{
+			int			fd;
+
+			while ((fd = accept(listen_fd, NULL, NULL)) >= 0)
+			{
+				ArchiveDaemonClient *client = pgut_new0(ArchiveDaemonClient);
+
+				if (fcntl(fd, F_SETFL, O_NONBLOCK) != 0)
+					elog(ERROR, "Cannot set socket to non-blocking mode: %s", strerror(errno));
+
+				client->fd = fd;
+				parray_append(clients, client);
+			}
+
+			if (errno != EAGAIN && errno != EWOULDBLOCK && errno != EINTR)
+				elog(ERROR, "Cannot accept connection on socket \"%s\": %s",
+					 socket_path, strerror(errno));
+		}
+	}
+
+	/*
+	 * Stop accepting new requests first, waiting clients push their files
+	 * themselves after the connection is closed.
+	 */
+	close(listen_fd);
+	unlink(socket_path);
+
+	for (i = 0; i < parray_num(clients); i++)
+	{
+		ArchiveDaemonClient *client = (ArchiveDaemonClient *) parray_get(clients, i);
+
+		if (client->fd >= 0)
+			close(client->fd);
+	}
+
+	pthread_mutex_lock(&state.lock);
+	state.stop = true;
+	pthread_cond_broadcast(&state.queue_cond);
+	pthread_mutex_unlock(&state.lock);
+
+	for (i = 0; i < num_threads; i++)
+		pthread_join(threads[i], NULL);
+
+	fio_disconnect();
+
+	if (thread_interrupted)
+		elog(ERROR, "%s archive-push daemon is stopped because of an error, "
+			 "pushed: %u, skipped: %u",
+			 PROGRAM_NAME, state.n_pushed, state.n_skipped);
+
+	elog(INFO, "%s archive-push daemon is stopped, pushed: %u, skipped: %u",
+		 PROGRAM_NAME, state.n_pushed, state.n_skipped);
+}
+
+/*
+ * Pass WAL file to archive-push daemon listening on socket_path and wait
+ * until the daemon pushes it.  Returns false if the daemon is not running
+ * or could not push the file, so the caller has to push it itself.
+ */
+bool
+archive_push_via_daemon(const char *socket_path, const char *wal_file_name)
+{
+	struct sockaddr_un addr;
+	char		request[MAXPGPATH];
+	char		reply[MAXPGPATH];
+	size_t		reply_len = 0;
+	int			request_len;
+	int			fd;
+
+	if (strlen(socket_path) >= sizeof(addr.sun_path))
+		elog(ERROR, "Socket path \"%s\" is too long", socket_path);
+
+	memset(&addr, 0, sizeof(addr));
+	addr.sun_family = AF_UNIX;
+	strlcpy(addr.sun_path, socket_path, sizeof(addr.sun_path));
+
+	fd = socket(AF_UNIX, SOCK_STREAM, 0);
+	if (fd < 0)
+		elog(ERROR, "Cannot create socket: %s", strerror(errno));
+
+	if (connect(fd, (struct sockaddr *) &addr, sizeof(addr)) != 0)
+	{
+		elog(WARNING, "Cannot connect to archive-push daemon on socket \"%s\": %s",
+			 socket_path, strerror(errno));
+		close(fd);
+		return false;
+	}
+
+	request_len = snprintf(request, sizeof(request), "%s\n", wal_file_name);
+	if (send(fd, request, request_len, MSG_NOSIGNAL) != request_len)
+	{
+		elog(WARNING, "Cannot send request to archive-push daemon: %s", strerror(errno));
+		close(fd);
+		return false;
+	}
+
+	/* the daemon answers when the file is pushed, which can take a while */
+	while (reply_len == 0 || reply[reply_len - 1] != '\n')
+	{
+		struct pollfd pfd;
+		ssize_t		rc;
+
+		if (interrupted)
+			elog(ERROR, "Interrupted while waiting for archive-push daemon");
+
+		if (reply_len == sizeof(reply) - 1)
+			break;
+
+		pfd.fd = fd;
+		pfd.events = POLLIN;
+		rc = poll(&pfd, 1, ARCHIVE_DAEMON_POLL_TIMEOUT);
+		if (rc < 0 && errno != EINTR)
+			elog(ERROR, "poll() failed: %s", strerror(errno));
+		if (rc <= 0)
+			continue;
+
+		rc = recv(fd, reply + reply_len, sizeof(reply) - 1 - reply_len, 0);
+		if (rc < 0 && errno == EINTR)
+			continue;
+		if (rc <= 0)
+			break;
+		reply_len += rc;
+	}
+	close(fd);
+	reply[reply_len] = '\0';
+
+	if (reply_len == 0 || reply[reply_len - 1] != '\n')
+	{
+		elog(WARNING, "archive-push daemon closed connection without answer");
+		return false;
+	}
+	reply[reply_len - 1] = '\0';
+
+	if (strcmp(reply, "OK") != 0)
+	{
+		elog(WARNING, "archive-push daemon cannot push WAL file \"%s\": %s",
+			 wal_file_name, reply);
+		return false;
+	}
+
+	elog(INFO, "%s archive-push WAL file: %s, pushed by archive-push daemon",
+		 PROGRAM_NAME, wal_file_name);
+	return true;
+}
+
+/*
+ * pg_backup specific restore command.
+ * Move files from arclog_path to pgdata/wal_file_path.
+ *
+ *  The problem with archive-get: we must be very careful about
+ * erroring out, because postgres will interpretent our negative exit code
+ * as the fact, that requested file is missing and may take irreversible actions.
+ * So if file copying has failed we must retry several times before bailing out.
+ *
+ * TODO: add support of -D option.
+ * TOTHINK: what can be done about ssh connection been broken?
+ * TOTHINk: do we need our own rmtree function ?
+ * TOTHINk: so sort of async prefetch ?
+
+ */
+void
+do_archive_get(InstanceState *instanceState, InstanceConfig *instance, const char *prefetch_dir_arg,
+			   char *wal_file_path, char *wal_file_name, int batch_size,
+			   bool validate_wal, bool background_prefetch)
+{
+	int         fail_count = 0;
+	char        backup_wal_file_path[MAXPGPATH];
+	char        absolute_wal_file_path[MAXPGPATH];
+	char        current_dir[MAXPGPATH];
+	char        prefetch_dir[MAXPGPATH];
+	char        pg_xlog_dir[MAXPGPATH];
+	char        prefetched_file[MAXPGPATH];
+
+	/* reporting */
+	uint32      n_fetched = 0;
+	int         n_actual_threads = num_threads;
+	uint32      n_files_in_prefetch = 0;
+
+	/* time reporting */
+	instr_time  start_time, end_time;
+	double      get_time;
+	char        pretty_time_str[20];
+
+	if (wal_file_name == NULL)
+		elog(ERROR, "Required parameter not specified: --wal-file-name %%f");
+
+	if (wal_file_path == NULL)
+		elog(ERROR, "Required parameter not specified: --wal_file_path %%p");
+
+	if (!getcwd(current_dir, sizeof(current_dir)))
+		elog(ERROR, "getcwd() error");
+
+	/* path to PGDATA/pg_wal directory */
+	join_path_components(pg_xlog_dir, current_dir, XLOGDIR);
+
+	/* destination full filepath, usually it is PGDATA/pg_wal/RECOVERYXLOG */
+	join_path_components(absolute_wal_file_path, current_dir, wal_file_path);
+
+	/* full filepath to WAL file in archive directory.
+	 * $BACKUP_PATH/wal/instance_name/000000010000000000000001 */
+	join_path_components(backup_wal_file_path, instanceState->instance_wal_subdir_path, wal_file_name);
+
+	INSTR_TIME_SET_CURRENT(start_time);
+	if (num_threads > batch_size)
+		n_actual_threads = batch_size;
+	elog(INFO, "%s archive-get WAL file: %s, remote: %s, threads: %i/%i, batch: %i",
+			PROGRAM_NAME, wal_file_name, IsSshProtocol() ? "ssh" : "none", n_actual_threads, num_threads, batch_size);
+
+	num_threads = n_actual_threads;
+
+	elog(VERBOSE, "Obtaining XLOG_SEG_SIZE from pg_control file");
+	instance->xlog_seg_size = get_xlog_seg_size(current_dir);
+
+	/* we use it to decompress WAL segments and to extend partial file later */
+	xlog_seg_size = instance->xlog_seg_size;
+
+	/* Prefetch optimization kicks in only if simple XLOG segments is requested
+	 * and batching is enabled.
+	 *
+	 * We check that file do exists in prefetch directory, then we validate it and
+	 * rename to destination path.
+	 * If file do not exists, then we run prefetch and rename it.
+	 */
+	if (IsXLogFileName(wal_file_name) && batch_size > 1)
+	{
+		XLogSegNo segno;
+		TimeLineID tli;
+
+		GetXLogFromFileName(wal_file_name, &tli, &segno, instance->xlog_seg_size);
+
+		if (prefetch_dir_arg)
+			/* use provided prefetch directory */
+			snprintf(prefetch_dir, sizeof(prefetch_dir), "%s", prefetch_dir_arg);
+		else
+			/* use default path */
+			join_path_components(prefetch_dir, pg_xlog_dir, "pbk_prefetch");
+
+		/* Construct path to WAL file in prefetch directory.
+		 * current_dir/pg_wal/pbk_prefech/000000010000000000000001
+		 */
+		join_path_components(prefetched_file, prefetch_dir, wal_file_name);
+
+		if (background_prefetch)
+		{
+			/* segment is likely prefetched and validated by background worker */
+			if (wal_satisfy_from_background_prefetch(tli, segno, wal_file_name, prefetch_dir,
+													 instanceState->instance_wal_subdir_path,
+													 absolute_wal_file_path, batch_size,
+													 instance->xlog_seg_size, validate_wal))
+			{
+				elog(INFO, "%s archive-get used prefetched WAL segment %s",
+						PROGRAM_NAME, wal_file_name);
+				goto get_done;
+			}
+		}
+		/* check if file is available in prefetch directory */
+		else if (access(prefetched_file, F_OK) == 0)
+		{
+			/* Prefetched WAL segment is available, before using it, we must validate it.
+			 * But for validation to work properly(because of contrecord), we must be sure
+			 * that next WAL segment is also available in prefetch directory.
+			 * If next segment do not exists in prefetch directory, we must provide it from
+			 * archive. If it is NOT available in the archive, then file in prefetch directory
+			 * cannot be trusted. In this case we discard all prefetched files and
+			 * copy requested file directly from archive.
+			 */
+			if (!next_wal_segment_exists(tli, segno, prefetch_dir, instance->xlog_seg_size))
+				n_fetched = run_wal_prefetch(prefetch_dir, instanceState->instance_wal_subdir_path,
+											 tli, segno, num_threads, false, batch_size,
+											 instance->xlog_seg_size);
+
+			n_files_in_prefetch = maintain_prefetch(prefetch_dir, segno, instance->xlog_seg_size);
+
+			if (wal_satisfy_from_prefetch(tli, segno, wal_file_name, prefetch_dir,
+										  absolute_wal_file_path, instance->xlog_seg_size,
+										  validate_wal))
+			{
+				n_files_in_prefetch--;
+				elog(INFO, "%s archive-get used prefetched WAL segment %s, prefetch state: %u/%u",
+						PROGRAM_NAME, wal_file_name, n_files_in_prefetch, batch_size);
+				goto get_done;
+			}
+			else
+			{
+				/* discard prefetch */
+//				n_fetched = 0;
+				pgut_rmtree(prefetch_dir, false, false);
+			}
+		}
+		else
+		{
+			/* Do prefetch maintenance here */
+
+			mkdir(prefetch_dir, DIR_PERMISSION); /* In case prefetch directory do not exists yet */
+
+			/* We`ve failed to satisfy current request from prefetch directory,
+			 * therefore we can discard its content, since it may be corrupted or
+			 * contain stale files.
+			 *
+			 * UPDATE: we should not discard prefetch easily, because failing to satisfy
+			 * request for WAL may come from this recovery behavior:
+			 * https://www.postgresql.org/message-id/flat/16159-f5a34a3a04dc67e0%40postgresql.org
+			 */
+//			rmtree(prefetch_dir, false);
+
+			/* prefetch files */
+			n_fetched = run_wal_prefetch(prefetch_dir, instanceState->instance_wal_subdir_path,
+										 tli, segno, num_threads, true, batch_size,
+										 instance->xlog_seg_size);
+
+			n_files_in_prefetch = maintain_prefetch(prefetch_dir, segno, instance->xlog_seg_size);
+
+			if (wal_satisfy_from_prefetch(tli, segno, wal_file_name, prefetch_dir, absolute_wal_file_path,
+										  instance->xlog_seg_size, validate_wal))
+			{
+				n_files_in_prefetch--;
+				elog(INFO, "%s archive-get copied WAL file %s, prefetch state: %u/%u",
+						PROGRAM_NAME, wal_file_name, n_files_in_prefetch, batch_size);
+				goto get_done;
+			}
+//			else
+//			{
+//				/* yet again failed to satisfy request from prefetch */
+//				n_fetched = 0;
+//				rmtree(prefetch_dir, false);
+//			}
+		}
+	}
+
+	/* Either prefetch didn`t cut it, or batch mode is disabled or
+	 * the requested file is not WAL segment.
+	 * Copy file from the archive directly.
+	 * Retry several times before bailing out.
+	 *
+	 * TODO:
+	 * files copied from archive directly are not validated, which is not ok.
+	 * TOTHINK:
+	 * Current WAL validation cannot be applied to partial files.
+	 */
+
+	while (fail_count < 3)
+	{
+		if (get_wal_file(wal_file_name, backup_wal_file_path, absolute_wal_file_path, false))
+		{
+			fail_count = 0;
+			elog(LOG, "%s archive-get copied WAL file %s", PROGRAM_NAME, wal_file_name);
+			n_fetched++;
+			break;
+		}
+		else
+			fail_count++;
+
+		elog(LOG, "Failed to get WAL file %s, retry %i/3", wal_file_name, fail_count);
+	}
+
+	/* TODO/TOTHINK:
+	 * If requested file is corrupted, we have no way to warn PostgreSQL about it.
+	 * We either can:
+	 * 1. feed to recovery and let PostgreSQL sort it out. Currently we do this.
 	 * 2. error out.
 	 *
 	 * Also note, that we can detect corruption only if prefetch mode is used.
@@ -1211,10 +2216,9 @@ uint32 run_wal_prefetch(const char *prefetch_dir, const char *archive_dir,
 					 TimeLineID tli, XLogSegNo first_segno, int num_threads,
 					 bool inclusive, int batch_size, uint32 wal_seg_size)
 {
-	int         i;
 	XLogSegNo   segno;
 	parray     *batch_files = parray_new();
-	int 		n_total_fetched = 0;
+	uint32		n_total_fetched;
 
 	if (!inclusive)
 		first_segno++;
@@ -1229,24 +2233,40 @@ uint32 run_wal_prefetch(const char *prefetch_dir, const char *archive_dir,
 
 		parray_append(batch_files, xlogfile);
 
-	}
+	}
+
+	n_total_fetched = fetch_wal_files(batch_files, prefetch_dir, archive_dir, num_threads);
+
+	parray_walk(batch_files, pfree);
+	parray_free(batch_files);
+
+	return n_total_fetched;
+}
+
+/*
+ * Copy WAL segments into prefetch directory. Copying stops at the first
+ * segment missing in the archive.
+ */
+static uint32
+fetch_wal_files(parray *files, const char *prefetch_dir, const char *archive_dir,
+				int num_threads)
+{
+	int         i;
+	uint32		n_total_fetched = 0;
+
+	prefetch_stop = false;
 
 	/* copy segments */
 	if (num_threads == 1)
 	{
-		for (i = 0; i < parray_num(batch_files); i++)
+		for (i = 0; i < parray_num(files); i++)
 		{
-			char    to_fullpath[MAXPGPATH];
-			char    from_fullpath[MAXPGPATH];
-			WALSegno *xlogfile = (WALSegno *) parray_get(batch_files, i);
-
-			join_path_components(to_fullpath, prefetch_dir, xlogfile->name);
-			join_path_components(from_fullpath, archive_dir, xlogfile->name);
+			WALSegno *xlogfile = (WALSegno *) parray_get(files, i);
 
 			/* It is ok, maybe requested batch is greater than the number of available
 			 * files in the archive
 			 */
-			if (!get_wal_file(xlogfile->name, from_fullpath, to_fullpath, true))
+			if (!prefetch_wal_file(xlogfile->name, archive_dir, prefetch_dir))
 			{
 				elog(LOG, "Thread [%d]: Failed to prefetch WAL segment %s", 0, xlogfile->name);
 				break;
@@ -1273,7 +2293,7 @@ uint32 run_wal_prefetch(const char *prefetch_dir, const char *archive_dir,
 			arg->archive_dir = archive_dir;
 
 			arg->thread_num = i+1;
-			arg->files = batch_files;
+			arg->files = files;
 			arg->n_fetched = 0;
 		}
 
@@ -1290,8 +2310,11 @@ uint32 run_wal_prefetch(const char *prefetch_dir, const char *archive_dir,
 			pthread_join(threads[i], NULL);
 			n_total_fetched += threads_args[i].n_fetched;
 		}
+
+		pfree(threads);
+		pfree(threads_args);
 	}
-	/* TODO: free batch_files */
+
 	return n_total_fetched;
 }
 
@@ -1302,8 +2325,6 @@ static void *
 get_files(void *arg)
 {
 	int		i;
-	char    to_fullpath[MAXPGPATH];
-	char    from_fullpath[MAXPGPATH];
 	archive_get_arg *args = (archive_get_arg *) arg;
 
 	my_thread_num = args->thread_num;
@@ -1318,10 +2339,7 @@ get_files(void *arg)
 		if (!pg_atomic_test_set_flag(&xlogfile->lock))
 			continue;
 
-		join_path_components(from_fullpath, args->archive_dir, xlogfile->name);
-		join_path_components(to_fullpath, args->prefetch_dir, xlogfile->name);
-
-		if (!get_wal_file(xlogfile->name, from_fullpath, to_fullpath, true))
+		if (!prefetch_wal_file(xlogfile->name, args->archive_dir, args->prefetch_dir))
 		{
 			/* It is ok, maybe requested batch is greater than the number of available
 			 * files in the archive
@@ -1340,6 +2358,36 @@ get_files(void *arg)
 	return NULL;
 }
 
+/*
+ * Copy WAL segment into prefetch directory. Segment is copied into
+ * temporary file first, so a segment in prefetch directory is always
+ * complete, even if it is being prefetched by background worker.
+ */
+static bool
+prefetch_wal_file(const char *filename, const char *archive_dir, const char *prefetch_dir)
+{
+	char    from_fullpath[MAXPGPATH];
+	char    to_fullpath[MAXPGPATH];
+	char    to_fullpath_part[MAXPGPATH];
+
+	join_path_components(from_fullpath, archive_dir, filename);
+	join_path_components(to_fullpath, prefetch_dir, filename);
+	snprintf(to_fullpath_part, sizeof(to_fullpath_part), "%s.part", to_fullpath);
+
+	if (!get_wal_file(filename, from_fullpath, to_fullpath_part, true))
+		return false;
+
+	if (rename(to_fullpath_part, to_fullpath) != 0)
+	{
+		elog(WARNING, "Cannot rename file '%s' to '%s': %s",
+				to_fullpath_part, to_fullpath, strerror(errno));
+		unlink(to_fullpath_part);
+		return false;
+	}
+
+	return true;
+}
+
 /*
  * Copy WAL segment from archive catalog to pgdata with possible decompression.
  * When running in prefetch mode, we should not error out.
@@ -1377,7 +2425,7 @@ get_wal_file(const char *filename, const char *from_fullpath,
 	setvbuf(out, NULL, _IONBF, BUFSIZ);
 
 	/* In prefetch mode, we do look only for full WAL segments
-	 * In non-prefetch mode, do look up '.partial' and '.gz.partial'
+	 * In non-prefetch mode, do look up '.partial' and compressed '.partial'
 	 * segments.
 	 */
 	if (fio_is_remote(FIO_BACKUP_HOST))
@@ -1387,6 +2435,9 @@ get_wal_file(const char *filename, const char *from_fullpath,
 		/* If requested file is regular WAL segment, then try to open it with '.gz' suffix... */
 		if (IsXLogFileName(filename))
 			rc = fio_send_file_gz(from_fullpath_gz, to_fullpath, out, &errmsg);
+		/* ... then with '.zst' and '.lz4' suffixes ... */
+		if (rc == FILE_MISSING && IsXLogFileName(filename))
+			rc = get_wal_file_decompress(from_fullpath, "", to_fullpath, out);
 		if (rc == FILE_MISSING)
 			/* ... failing that, use uncompressed */
 			rc = fio_send_file(from_fullpath, to_fullpath, out, NULL, &errmsg);
@@ -1398,6 +2449,8 @@ get_wal_file(const char *filename, const char *from_fullpath,
 			/* '.gz.partial' goes first ... */
 			snprintf(from_partial, sizeof(from_partial), "%s.gz.partial", from_fullpath);
 			rc = fio_send_file_gz(from_partial, to_fullpath, out, &errmsg);
+			if (rc == FILE_MISSING)
+				rc = get_wal_file_decompress(from_fullpath, ".partial", to_fullpath, out);
 			if (rc == FILE_MISSING)
 			{
 				/* ... failing that, use '.partial' */
@@ -1424,6 +2477,9 @@ get_wal_file(const char *filename, const char *from_fullpath,
 		/* If requested file is regular WAL segment, then try to open it with '.gz' suffix... */
 		if (IsXLogFileName(filename))
 			rc = get_wal_file_internal(from_fullpath_gz, to_fullpath, out, true);
+		/* ... then with '.zst' and '.lz4' suffixes ... */
+		if (rc == FILE_MISSING && IsXLogFileName(filename))
+			rc = get_wal_file_decompress(from_fullpath, "", to_fullpath, out);
 		if (rc == FILE_MISSING)
 			/* ... failing that, use uncompressed */
 			rc = get_wal_file_internal(from_fullpath, to_fullpath, out, false);
@@ -1436,6 +2492,8 @@ get_wal_file(const char *filename, const char *from_fullpath,
 			/* '.gz.partial' goes first ... */
 			snprintf(from_partial, sizeof(from_partial), "%s.gz.partial", from_fullpath);
 			rc = get_wal_file_internal(from_partial, to_fullpath, out, true);
+			if (rc == FILE_MISSING)
+				rc = get_wal_file_decompress(from_fullpath, ".partial", to_fullpath, out);
 			if (rc == FILE_MISSING)
 			{
 				/* ... failing that, use '.partial' */
@@ -1613,6 +2671,123 @@ cleanup:
 	return exit_code;
 }
 
+/*
+ * Copy WAL segment compressed with zstd or lz4 from archive.
+ * Segment is looked up with all suffixes of such algorithms, followed by tail.
+ * Return codes are the same as of get_wal_file_internal().
+ */
+int
+get_wal_file_decompress(const char *from_path, const char *tail,
+						const char *to_path, FILE *out)
+{
+	CompressAlg	algs[] = {ZSTD_COMPRESS, LZ4_COMPRESS};
+	int			i;
+	int			exit_code = FILE_MISSING;
+
+	for (i = 0; i < lengthof(algs) && exit_code == FILE_MISSING; i++)
+	{
+		char		path[MAXPGPATH];
+		char	   *content = NULL;
+		size_t		content_size = 0;
+
+		snprintf(path, sizeof(path), "%s.%s%s", from_path,
+				 wal_compress_suffix(algs[i]), tail);
+
+		exit_code = read_compressed_wal_file(path, FIO_BACKUP_HOST, algs[i],
+											 xlog_seg_size, &content, &content_size);
+		if (exit_code != SEND_OK)
+			continue;
+
+		if (fwrite(content, 1, content_size, out) != content_size)
+		{
+			elog(WARNING, "Cannot write to WAL file '%s': %s",
+				 to_path, strerror(errno));
+			exit_code = WRITE_FAILED;
+		}
+		pg_free(content);
+	}
+
+	return exit_code;
+}
+
+/*
+ * Read WAL file compressed as a whole with zstd or lz4 and decompress it.
+ * Decompressed content must not exceed max_size bytes.
+ * On success, returns SEND_OK and palloc'd content with its size.
+ * Return codes:
+ *   FILE_MISSING (-1)
+ *   OPEN_FAILED  (-2)
+ *   READ_FAILED  (-3)
+ *   ZLIB_ERROR   (-5)
+ */
+int
+read_compressed_wal_file(const char *path, fio_location location, CompressAlg alg,
+						 size_t max_size, char **content, size_t *content_size)
+{
+	struct stat	st;
+	int			fd;
+	char	   *compressed;
+	size_t		read_size = 0;
+	int32		rc;
+	const char *errormsg = NULL;
+
+	if (fio_stat(location, path, &st, true) < 0)
+	{
+		if (errno == ENOENT)
+			return FILE_MISSING;
+
+		elog(WARNING, "Cannot stat compressed WAL file \"%s\": %s",
+			 path, strerror(errno));
+		return OPEN_FAILED;
+	}
+
+	elog(LOG, "Attempting to open compressed WAL file '%s'", path);
+
+	fd = fio_open(location, path, O_RDONLY | PG_BINARY);
+	if (fd < 0)
+	{
+		if (errno == ENOENT)
+			return FILE_MISSING;
+
+		elog(WARNING, "Cannot open compressed WAL file \"%s\": %s",
+			 path, strerror(errno));
+		return OPEN_FAILED;
+	}
+
+	compressed = pgut_malloc(st.st_size);
+	while (read_size < st.st_size)
+	{
+		ssize_t		len = fio_read(fd, compressed + read_size, st.st_size - read_size);
+
+		if (len <= 0)
+		{
+			elog(WARNING, "Cannot read compressed WAL file \"%s\": %s",
+				 path, len < 0 ? strerror(errno) : "unexpected end of file");
+			fio_close(fd);
+			pg_free(compressed);
+			return READ_FAILED;
+		}
+		read_size += len;
+	}
+	fio_close(fd);
+
+	*content = pgut_malloc(max_size);
+	rc = do_decompress(*content, max_size, compressed, read_size, alg, &errormsg);
+	pg_free(compressed);
+
+	if (rc < 0)
+	{
+		elog(WARNING, "Cannot decompress WAL file \"%s\": %s",
+			 path, errormsg ? errormsg : "unknown error");
+		pg_free(*content);
+		*content = NULL;
+		return ZLIB_ERROR;
+	}
+
+	*content_size = rc;
+	return SEND_OK;
+}
+
 bool next_wal_segment_exists(TimeLineID tli, XLogSegNo segno, const char *prefetch_dir, uint32 wal_seg_size)
 {
 	char        next_wal_filename[MAXFNAMELEN];
@@ -1699,12 +2874,23 @@ uint32 maintain_prefetch(const char *prefetch_dir, XLogSegNo first_segno, uint32
 
 	while ((dir_ent = readdir(dir)))
 	{
+		const char *suffix = dir_ent->d_name + XLOG_FNAME_LEN;
+
 		/* Skip entries point current dir or parent dir */
 		if (strcmp(dir_ent->d_name, ".") == 0 ||
 			strcmp(dir_ent->d_name, "..") == 0)
 			continue;
 
-		if (IsXLogFileName(dir_ent->d_name))
+		/* Skip files of background prefetch worker */
+		if (strcmp(dir_ent->d_name, PREFETCH_PID_FILE) == 0 ||
+			strncmp(dir_ent->d_name, PREFETCH_REQUEST_FILE, strlen(PREFETCH_REQUEST_FILE)) == 0)
+			continue;
+
+		/* segments, segments being copied and validation markers */
+		if (strlen(dir_ent->d_name) >= XLOG_FNAME_LEN &&
+			strspn(dir_ent->d_name, "0123456789ABCDEF") == XLOG_FNAME_LEN &&
+			(*suffix == '\0' || strcmp(suffix, ".part") == 0 ||
+			 strcmp(suffix, PREFETCH_VALID_SUFFIX) == 0))
 		{
 
 			GetXLogFromFileName(dir_ent->d_name, &tli, &segno, wal_seg_size);
@@ -1712,7 +2898,8 @@ uint32 maintain_prefetch(const char *prefetch_dir, XLogSegNo first_segno, uint32
 			/* potentially useful segment, keep it */
 			if (segno >= first_segno)
 			{
-				n_files++;
+				if (*suffix == '\0')
+					n_files++;
 				continue;
 			}
 		}
@@ -1725,3 +2912,450 @@ uint32 maintain_prefetch(const char *prefetch_dir, XLogSegNo first_segno, uint32
 
 	return n_files;
 }
+
+/*
+ * Tell background prefetch worker which segment is requested by recovery.
+ */
+static void
+set_prefetch_request(const char *prefetch_dir, const char *wal_file_name)
+{
+	char		path[MAXPGPATH];
+	char		path_temp[MAXPGPATH];
+	FILE	   *out;
+
+	join_path_components(path, prefetch_dir, PREFETCH_REQUEST_FILE);
+	snprintf(path_temp, sizeof(path_temp), "%s.tmp", path);
+
+	out = fopen(path_temp, PG_BINARY_W);
+	if (out == NULL)
+	{
+		elog(WARNING, "Cannot open file \"%s\": %s", path_temp, strerror(errno));
+		return;
+	}
+
+	if (fprintf(out, "%s\n", wal_file_name) < 0 || fclose(out) != 0)
+	{
+		elog(WARNING, "Cannot write file \"%s\": %s", path_temp, strerror(errno));
+		unlink(path_temp);
+		return;
+	}
+
+	if (rename(path_temp, path) != 0)
+	{
+		elog(WARNING, "Cannot rename file \"%s\" to \"%s\": %s",
+			 path_temp, path, strerror(errno));
+		unlink(path_temp);
+	}
+}
+
+/*
+ * Read the segment last requested by recovery and the time of request.
+ */
+static bool
+get_prefetch_request(const char *prefetch_dir, char *wal_file_name, time_t *request_time)
+{
+	char		path[MAXPGPATH];
+	char		buf[MAXFNAMELEN];
+	struct stat st;
+	FILE	   *in;
+	bool		ok;
+
+	join_path_components(path, prefetch_dir, PREFETCH_REQUEST_FILE);
+
+	in = fopen(path, PG_BINARY_R);
+	if (in == NULL)
+		return false;
+
+	ok = fgets(buf, sizeof(buf), in) != NULL && fstat(fileno(in), &st) == 0;
+	fclose(in);
+
+	if (!ok)
+		return false;
+
+	buf[strcspn(buf, "\n")] = '\0';
+	if (!IsXLogFileName(buf))
+		return false;
+
+	strcpy(wal_file_name, buf);
+	*request_time = st.st_mtime;
+
+	return true;
+}
+
+/*
+ * Get pid of running background prefetch worker, 0 if there is no such worker.
+ */
+static pid_t
+get_prefetch_worker_pid(const char *prefetch_dir)
+{
+	char		path[MAXPGPATH];
+	FILE	   *in;
+	int			pid = 0;
+
+	join_path_components(path, prefetch_dir, PREFETCH_PID_FILE);
+
+	in = fopen(path, PG_BINARY_R);
+	if (in == NULL)
+		return 0;
+
+	if (fscanf(in, "%d", &pid) != 1)
+		pid = 0;
+	fclose(in);
+
+	if (pid <= 0 || (kill(pid, 0) != 0 && errno != EPERM))
+		return 0;
+
+	return pid;
+}
+
+/*
+ * Register this process as background prefetch worker. Returns false,
+ * if another worker is already running.
+ */
+static bool
+lock_prefetch_worker(const char *prefetch_dir)
+{
+	char		path[MAXPGPATH];
+	char		buf[32];
+	int			fd;
+	int			len;
+
+	join_path_components(path, prefetch_dir, PREFETCH_PID_FILE);
+
+	fd = open(path, O_WRONLY | O_CREAT | O_EXCL | PG_BINARY, FILE_PERMISSION);
+	if (fd < 0 && errno == EEXIST && get_prefetch_worker_pid(prefetch_dir) == 0)
+	{
+		/* worker has died, remove its pid file */
+		unlink(path);
+		fd = open(path, O_WRONLY | O_CREAT | O_EXCL | PG_BINARY, FILE_PERMISSION);
+	}
+
+	if (fd < 0)
+	{
+		if (errno != EEXIST)
+			elog(WARNING, "Cannot create file \"%s\": %s", path, strerror(errno));
+		return false;
+	}
+
+	len = snprintf(buf, sizeof(buf), "%d\n", (int) getpid());
+	if (write(fd, buf, len) != len || close(fd) != 0)
+	{
+		elog(WARNING, "Cannot write file \"%s\": %s", path, strerror(errno));
+		unlink(path);
+		return false;
+	}
+
+	return true;
+}
+
+/*
+ * Start background prefetch worker, unless it is running already.
+ * Worker is detached from archive-get, so it can keep prefetching between
+ * calls of restore_command.  It must be started before the connection to
+ * the backup host is established, the worker opens its own connection.
+ */
+static void
+start_prefetch_worker(const char *prefetch_dir, const char *archive_dir,
+					  int batch_size, uint32 wal_seg_size, bool validate_wal)
+{
+	pid_t		pid;
+
+	if (get_prefetch_worker_pid(prefetch_dir) != 0)
+		return;
+
+	pid = fork();
+	if (pid < 0)
+	{
+		elog(WARNING, "Cannot start WAL prefetch worker: %s", strerror(errno));
+		return;
+	}
+
+	if (pid > 0)
+	{
+		elog(LOG, "WAL prefetch worker is started with pid %d", (int) pid);
+		return;
+	}
+
+	/* do not let recovery wait for the worker and its signals reach it */
+	setsid();
+	if (freopen("/dev/null", PG_BINARY_R, stdin) == NULL ||
+		freopen("/dev/null", PG_BINARY_W, stdout) == NULL)
+		elog(WARNING, "Cannot redirect standard streams of WAL prefetch worker: %s",
+			 strerror(errno));
+
+	if (lock_prefetch_worker(prefetch_dir))
+		run_prefetch_worker(prefetch_dir, archive_dir, batch_size,
+							wal_seg_size, validate_wal);
+
+	exit(0);
+}
+
+/*
+ * Mark prefetched segment as validated, so archive-get does not parse it.
+ */
+static bool
+create_prefetch_valid_marker(const char *prefetch_dir, TimeLineID tli,
+							 XLogSegNo segno, uint32 wal_seg_size)
+{
+	char		name[MAXFNAMELEN];
+	char		marker[MAXPGPATH];
+	int			fd;
+
+	GetXLogFileName(name, tli, segno, wal_seg_size);
+	join_path_components(marker, prefetch_dir, name);
+	strlcat(marker, PREFETCH_VALID_SUFFIX, MAXPGPATH);
+
+	fd = open(marker, O_WRONLY | O_CREAT | PG_BINARY, FILE_PERMISSION);
+	if (fd < 0 || close(fd) != 0)
+	{
+		elog(WARNING, "Cannot create file \"%s\": %s", marker, strerror(errno));
+		return false;
+	}
+	return true;
+}
+
+/*
+ * Keep a window of segments following the requested one in prefetch
+ * directory, so restore_command finds them ready. The window is sized after
+ * the speed of recovery, but it is at least batch_size segments.
+ * With validate_wal every prefetched segment is validated as soon as the
+ * next segment is prefetched and a marker file is created for it, so
+ * archive-get does not need to parse it.
+ */
+static void
+run_prefetch_worker(const char *prefetch_dir, const char *archive_dir,
+					int batch_size, uint32 wal_seg_size, bool validate_wal)
+{
+	char		pid_file[MAXPGPATH];
+	TimeLineID	last_tli = 0;
+	XLogSegNo	last_segno = 0;
+	instr_time	last_request_time;
+	/* requests per second, exponential moving average */
+	double		rate = 0;
+	/* the segment which failed validation, it is not prefetched again */
+	TimeLineID	invalid_tli = 0;
+	XLogSegNo	invalid_segno = 0;
+
+	join_path_components(pid_file, prefetch_dir, PREFETCH_PID_FILE);
+
+	elog(LOG, "WAL prefetch worker is running, prefetch directory: \"%s\"", prefetch_dir);
+
+	INSTR_TIME_SET_CURRENT(last_request_time);
+
+	while (!interrupted)
+	{
+		char		wal_file_name[MAXFNAMELEN];
+		time_t		request_time;
+		TimeLineID	tli;
+		XLogSegNo	segno;
+		XLogSegNo	s;
+		uint32		window;
+		uint32		n_fetched;
+		uint32		n_validated = 0;
+		instr_time	now;
+		parray	   *files;
+
+		if (!get_prefetch_request(prefetch_dir, wal_file_name, &request_time))
+			break;
+
+		/* recovery is over or paused */
+		if (time(NULL) - request_time > PREFETCH_IDLE_TIMEOUT)
+			break;
+
+		/* prefetch directory is gone or another worker took over */
+		if (get_prefetch_worker_pid(prefetch_dir) != getpid())
+			break;
+
+		GetXLogFromFileName(wal_file_name, &tli, &segno, wal_seg_size);
+
+		INSTR_TIME_SET_CURRENT(now);
+		if (tli == last_tli && segno > last_segno)
+		{
+			instr_time	elapsed = now;
+			double		seconds;
+
+			INSTR_TIME_SUBTRACT(elapsed, last_request_time);
+			seconds = Max(INSTR_TIME_GET_DOUBLE(elapsed), 0.001);
+
+			if (rate == 0)
+				rate = (segno - last_segno) / seconds;
+			else
+				rate = (rate + (segno - last_segno) / seconds) / 2;
+
+			last_segno = segno;
+			last_request_time = now;
+		}
+		else if (tli != last_tli || segno < last_segno)
+		{
+			last_tli = tli;
+			last_segno = segno;
+			last_request_time = now;
+		}
+
+		window = (uint32) Min(rate * PREFETCH_LOOKAHEAD + 1,
+							  (double) batch_size * PREFETCH_MAX_BATCHES);
+		window = Max(window, batch_size);
+
+		/* drop consumed segments */
+		maintain_prefetch(prefetch_dir, segno, wal_seg_size);
+
+		/* the requested segment is handled by archive-get itself */
+		files = parray_new();
+		for (s = segno + 1; s <= segno + window; s++)
+		{
+			char		path[MAXPGPATH];
+			WALSegno   *xlogfile;
+
+			if (tli == invalid_tli && s == invalid_segno)
+				break;
+
+			xlogfile = palloc(sizeof(WALSegno));
+			pg_atomic_init_flag(&xlogfile->lock);
+			GetXLogFileName(xlogfile->name, tli, s, wal_seg_size);
+
+			join_path_components(path, prefetch_dir, xlogfile->name);
+			if (access(path, F_OK) == 0)
+			{
+				pfree(xlogfile);
+				continue;
+			}
+
+			parray_append(files, xlogfile);
+		}
+
+		n_fetched = parray_num(files) > 0 ?
+			fetch_wal_files(files, prefetch_dir, archive_dir,
+							Min(num_threads, parray_num(files))) : 0;
+
+		parray_walk(files, pfree);
+		parray_free(files);
+
+		if (n_fetched > 0)
+			elog(VERBOSE, "Prefetched %u WAL segments after %s, window: %u",
+				 n_fetched, wal_file_name, window);
+
+		/*
+		 * Validate segments, whose next segment is prefetched. The run of
+		 * such segments is read by num_threads threads at once. If it fails,
+		 * the segments are validated one by one to find the invalid one,
+		 * because the failure interrupts reading of the other segments.
+		 */
+		if (validate_wal)
+		{
+			XLogSegNo	run_first = 0;
+			XLogSegNo	run_last = 0;
+
+			for (s = segno + 1; s < segno + window; s++)
+			{
+				char		name[MAXFNAMELEN];
+				char		path[MAXPGPATH];
+				char		marker[MAXPGPATH];
+
+				GetXLogFileName(name, tli, s, wal_seg_size);
+				join_path_components(path, prefetch_dir, name);
+				snprintf(marker, sizeof(marker), "%s%s", path, PREFETCH_VALID_SUFFIX);
+
+				if (access(marker, F_OK) == 0)
+				{
+					if (run_first != 0)
+						break;
+					continue;
+				}
+
+				if (access(path, F_OK) != 0 ||
+					!next_wal_segment_exists(tli, s, prefetch_dir, wal_seg_size))
+					break;
+
+				if (run_first == 0)
+					run_first = s;
+				run_last = s;
+			}
+
+			if (run_first != 0 && run_last > run_first &&
+				validate_wal_segments(tli, run_first, run_last,
+									  prefetch_dir, wal_seg_size))
+			{
+				for (s = run_first; s <= run_last; s++)
+				{
+					if (!create_prefetch_valid_marker(prefetch_dir, tli, s, wal_seg_size))
+						break;
+					n_validated++;
+				}
+			}
+			else if (run_first != 0)
+			{
+				for (s = run_first; s <= run_last; s++)
+				{
+					char		name[MAXFNAMELEN];
+					char		path[MAXPGPATH];
+
+					GetXLogFileName(name, tli, s, wal_seg_size);
+					join_path_components(path, prefetch_dir, name);
+
+					if (!validate_wal_segment(tli, s, prefetch_dir, wal_seg_size))
+					{
+						/* the segment may be consumed by recovery meanwhile */
+						if (access(path, F_OK) == 0)
+						{
+							elog(WARNING, "Prefetched WAL segment %s is invalid, cannot use it", name);
+							unlink(path);
+							invalid_tli = tli;
+							invalid_segno = s;
+						}
+						break;
+					}
+
+					if (!create_prefetch_valid_marker(prefetch_dir, tli, s, wal_seg_size))
+						break;
+					n_validated++;
+				}
+			}
+		}
+
+		if (n_fetched == 0 && n_validated == 0)
+			pg_usleep(PREFETCH_SLEEP_INTERVAL);
+	}
+
+	if (get_prefetch_worker_pid(prefetch_dir) == getpid())
+		unlink(pid_file);
+
+	elog(LOG, "WAL prefetch worker is stopped");
+}
+
+/*
+ * Try to satisfy request for WAL segment with segment prefetched by
+ * background worker.  Worker is informed about the request and started,
+ * if it is not running.
+ */
+static bool
+wal_satisfy_from_background_prefetch(TimeLineID tli, XLogSegNo segno, const char *wal_file_name,
+									 const char *prefetch_dir, const char *archive_dir,
+									 const char *absolute_wal_file_path,
+									 int batch_size, uint32 wal_seg_size, bool validate_wal)
+{
+	char		marker[MAXPGPATH];
+	bool		is_valid;
+
+	if (mkdir(prefetch_dir, DIR_PERMISSION) != 0 && errno != EEXIST)
+	{
+		elog(WARNING, "Cannot create directory \"%s\": %s", prefetch_dir, strerror(errno));
+		return false;
+	}
+
+	set_prefetch_request(prefetch_dir, wal_file_name);
+	start_prefetch_worker(prefetch_dir, archive_dir, batch_size, wal_seg_size, validate_wal);
+
+	join_path_components(marker, prefetch_dir, wal_file_name);
+	strlcat(marker, PREFETCH_VALID_SUFFIX, MAXPGPATH);
+	is_valid = access(marker, F_OK) == 0;
+
+	if (!wal_satisfy_from_prefetch(tli, segno, wal_file_name, prefetch_dir,
+								   absolute_wal_file_path, wal_seg_size,
+								   validate_wal && !is_valid))
+		return false;
+
+	if (is_valid)
+		unlink(marker);
+
+	return true;
+}
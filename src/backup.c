@@ -26,9 +26,8 @@
 
 /* list of files contained in backup */
 parray *backup_files_list = NULL;
-
-/* We need critical section for datapagemap_add() in case of using threads */
-static pthread_mutex_t backup_pagemap_mutex = PTHREAD_MUTEX_INITIALIZER;
+/* index of backup_files_list by rel_path, used while pagemap is extracted */
+static parray_index *backup_files_index = NULL;
 
 /* Is pg_start_backup() was executed */
 bool backup_in_progress = false;
@@ -87,10 +86,12 @@ do_backup_pg(InstanceState *instanceState, PGconn *backup_conn,
 	/* arrays with meta info for multi threaded backup */
 	pthread_t	*threads;
 	backup_files_arg *threads_args;
+	FileScheduler *scheduler;
 	bool		backup_isok = true;
 
 	pgBackup   *prev_backup = NULL;
 	parray	   *prev_backup_filelist = NULL;
+	parray_index *prev_backup_filelist_index = NULL;
 	parray	   *backup_list = NULL;
 	parray	   *database_map = NULL;
 
@@ -320,10 +321,15 @@ do_backup_pg(InstanceState *instanceState, PGconn *backup_conn,
 			 * reading WAL segments present in archives up to the point
 			 * where this backup has started.
 			 */
+			backup_files_index = parray_index_build(backup_files_list,
+													pgFileHashRelPath,
+													pgFileCompareRelPath);
 			pagemap_isok = extractPageMap(instanceState->instance_wal_subdir_path,
 						   instance_config.xlog_seg_size,
 						   prev_backup->start_lsn, prev_backup->tli,
 						   current.start_lsn, current.tli, tli_list);
+			parray_index_free(backup_files_index);
+			backup_files_index = NULL;
 		}
 		else if (current.backup_mode == BACKUP_MODE_DIFF_PTRACK)
 		{
@@ -366,14 +372,11 @@ do_backup_pg(InstanceState *instanceState, PGconn *backup_conn,
 
 	}
 
-	/* setup thread locks */
-	pfilearray_clear_locks(backup_files_list);
-
-	/* Sort by size for load balancing */
-	parray_qsort(backup_files_list, pgFileCompareSize);
-	/* Sort the array for binary search */
+	/* Index the array for lookups by rel_path */
 	if (prev_backup_filelist)
-		parray_qsort(prev_backup_filelist, pgFileCompareRelPath);
+		prev_backup_filelist_index = parray_index_build(prev_backup_filelist,
+														pgFileHashRelPath,
+														pgFileCompareRelPath);
 
 	/* write initial backup_content.control file and update backup.control  */
 	write_backup_filelist(&current, backup_files_list,
@@ -383,6 +386,9 @@ do_backup_pg(InstanceState *instanceState, PGconn *backup_conn,
 	/* Init backup page header map */
 	init_header_map(&current);
 
+	/* Largest files go first for load balancing */
+	scheduler = scheduler_init(backup_files_list, num_threads, 0);
+
 	/* init thread args with own file lists */
 	threads = (pthread_t *) palloc(sizeof(pthread_t) * num_threads);
 	threads_args = (backup_files_arg *) palloc(sizeof(backup_files_arg)*num_threads);
@@ -396,8 +402,10 @@ do_backup_pg(InstanceState *instanceState, PGconn *backup_conn,
 		arg->to_root = current.database_dir;
 		arg->files_list = backup_files_list;
 		arg->prev_filelist = prev_backup_filelist;
+		arg->prev_filelist_index = prev_backup_filelist_index;
 		arg->prev_start_lsn = prev_backup_start_lsn;
 		arg->hdr_map = &(current.hdr_map);
+		arg->scheduler = scheduler;
 		arg->thread_num = i+1;
 		/* By default there are some error */
 		arg->ret = 1;
@@ -426,6 +434,10 @@ do_backup_pg(InstanceState *instanceState, PGconn *backup_conn,
 	time(&end_time);
 	pretty_time_interval(difftime(end_time, start_time),
 						 pretty_time, lengthof(pretty_time));
+
+	scheduler_report(scheduler);
+	scheduler_free(scheduler);
+
 	if (backup_isok)
 		elog(INFO, "Data files are transferred, time elapsed: %s",
 			pretty_time);
@@ -434,11 +446,8 @@ do_backup_pg(InstanceState *instanceState, PGconn *backup_conn,
 			pretty_time);
 
 	/* clean previous backup file list */
-	if (prev_backup_filelist)
-	{
-		parray_walk(prev_backup_filelist, pgFileFree);
-		parray_free(prev_backup_filelist);
-	}
+	parray_index_free(prev_backup_filelist_index);
+	pgFileListFree(prev_backup_filelist);
 
 	/* Notify end of backup */
 	pg_stop_backup(instanceState, &current, backup_conn, nodeInfo);
@@ -469,7 +478,7 @@ do_backup_pg(InstanceState *instanceState, PGconn *backup_conn,
 	}
 
 	/* close and sync page header map */
-	if (current.hdr_map.fp)
+	if (current.hdr_map.fd >= 0)
 	{
 		cleanup_header_map(&(current.hdr_map));
 
@@ -504,9 +513,16 @@ do_backup_pg(InstanceState *instanceState, PGconn *backup_conn,
 		elog(WARNING, "Backup files are not synced to disk");
 	else
 	{
+		fio_batch  *batch;
+		int		   *sync_errno;
+
 		elog(INFO, "Syncing backup files to disk");
 		time(&start_time);
 
+		/* send sync requests in batches, results are checked afterwards */
+		sync_errno = palloc0(sizeof(int) * parray_num(backup_files_list));
+		batch = fio_batch_begin(FIO_BACKUP_HOST);
+
 		for (i = 0; i < parray_num(backup_files_list); i++)
 		{
 			char    to_fullpath[MAXPGPATH];
@@ -522,9 +538,22 @@ do_backup_pg(InstanceState *instanceState, PGconn *backup_conn,
 			/* construct fullpath */
 			join_path_components(to_fullpath, current.database_dir, file->rel_path);
 
-			if (fio_sync(FIO_BACKUP_HOST, to_fullpath) != 0)
-				elog(ERROR, "Cannot sync file \"%s\": %s", to_fullpath, strerror(errno));
+			fio_batch_sync(batch, to_fullpath, &sync_errno[i]);
 		}
+		fio_batch_end(batch);
+
+		for (i = 0; i < parray_num(backup_files_list); i++)
+		{
+			char    to_fullpath[MAXPGPATH];
+			pgFile *file = (pgFile *) parray_get(backup_files_list, i);
+
+			if (sync_errno[i] == 0)
+				continue;
+
+			join_path_components(to_fullpath, current.database_dir, file->rel_path);
+			elog(ERROR, "Cannot sync file \"%s\": %s", to_fullpath, strerror(sync_errno[i]));
+		}
+		pfree(sync_errno);
 
 		time(&end_time);
 		pretty_time_interval(difftime(end_time, start_time),
@@ -1085,7 +1114,7 @@ wait_wal_lsn(const char *wal_segment_dir, XLogRecPtr target_lsn, bool is_start_l
 	uint32		try_count = 0,
 				timeout;
 	char		*wal_delivery_str = in_stream_dir ? "streamed":"archived";
-	char		gz_wal_segment_path[MAXPGPATH];
+	CompressAlg	compress_algs[] = {ZLIB_COMPRESS, ZSTD_COMPRESS, LZ4_COMPRESS};
 
 	/* Compute the name of the WAL file containing requested LSN */
 	GetXLogSegNo(target_lsn, targetSegNo, instance_config.xlog_seg_size);
@@ -1115,9 +1144,6 @@ wait_wal_lsn(const char *wal_segment_dir, XLogRecPtr target_lsn, bool is_start_l
 		elog(LOG, "Looking for LSN %X/%X in segment: %s",
 			 (uint32) (target_lsn >> 32), (uint32) target_lsn, wal_segment);
 
-	snprintf(gz_wal_segment_path, sizeof(gz_wal_segment_path), "%s.gz",
-			 wal_segment_path);
-
 	/* Wait until target LSN is archived or streamed */
 	while (true)
 	{
@@ -1128,7 +1154,16 @@ wait_wal_lsn(const char *wal_segment_dir, XLogRecPtr target_lsn, bool is_start_l
 			/* Try to find compressed WAL file */
 			if (!file_exists)
 			{
-				file_exists = fileExists(gz_wal_segment_path, FIO_BACKUP_HOST);
+				int			i;
+
+				for (i = 0; i < lengthof(compress_algs) && !file_exists; i++)
+				{
+					char		compressed_wal_segment_path[MAXPGPATH];
+
+					snprintf(compressed_wal_segment_path, sizeof(compressed_wal_segment_path),
+							 "%s.%s", wal_segment_path, wal_compress_suffix(compress_algs[i]));
+					file_exists = fileExists(compressed_wal_segment_path, FIO_BACKUP_HOST);
+				}
 				if (file_exists)
 					elog(LOG, "Found compressed WAL segment: %s", wal_segment_path);
 			}
@@ -1769,26 +1804,22 @@ backup_cleanup(bool fatal, void *userdata)
 static void *
 backup_files(void *arg)
 {
-	int			i;
+	FileTask   *task;
 	char		from_fullpath[MAXPGPATH];
 	char		to_fullpath[MAXPGPATH];
 	static time_t prev_time;
 
 	backup_files_arg *arguments = (backup_files_arg *) arg;
-	int 		n_backup_files_list = parray_num(arguments->files_list);
+	size_t		n_tasks = scheduler_num_tasks(arguments->scheduler);
 
 	prev_time = current.start_time;
 
-	/* backup a file */
-	for (i = 0; i < n_backup_files_list; i++)
+	/* backup a file, directories are already copied */
+	while ((task = scheduler_next_task(arguments->scheduler, arguments->thread_num)) != NULL)
 	{
-		pgFile	*file = (pgFile *) parray_get(arguments->files_list, i);
+		pgFile	*file = task->file;
 		pgFile	*prev_file = NULL;
 
-		/* We have already copied all directories */
-		if (S_ISDIR(file->mode))
-			continue;
-
 		if (arguments->thread_num == 1)
 		{
 			/* update backup_content.control every 60 seconds */
@@ -1802,15 +1833,13 @@ backup_files(void *arg)
 			}
 		}
 
-		if (!pg_atomic_test_set_flag(&file->lock))
-			continue;
-
 		/* check for interrupt */
 		if (interrupted || thread_interrupted)
 			elog(ERROR, "interrupted during backup");
 
-		elog(progress ? INFO : LOG, "Progress: (%d/%d). Process file \"%s\"",
-			 i + 1, n_backup_files_list, file->rel_path);
+		elog(progress ? INFO : LOG, "Progress: (%lu/%lu). Process file \"%s\"",
+			 (unsigned long) scheduler_task_num(arguments->scheduler, task),
+			 (unsigned long) n_tasks, file->rel_path);
 
 		/* Handle zero sized files */
 		if (file->size == 0)
@@ -1832,8 +1861,8 @@ backup_files(void *arg)
 		if (current.backup_mode != BACKUP_MODE_FULL)
 		{
 			pgFile	**prev_file_tmp = NULL;
-			prev_file_tmp = (pgFile **) parray_bsearch(arguments->prev_filelist,
-											file, pgFileCompareRelPath);
+			prev_file_tmp = (pgFile **) parray_index_find(arguments->prev_filelist_index,
+														  file);
 			if (prev_file_tmp)
 			{
 				/* File exists in previous backup */
@@ -1934,31 +1963,32 @@ parse_filelist_filenames(parray *files, const char *root)
 }
 
 /*
- * Find pgfile by given rnode in the backup_files_list
- * and add given blkno to its pagemap.
+ * Find pgfile by given rnode and segment number in the backup_files_list
+ * and add given blocks to its pagemap. Blocks are numbered within
+ * the segment and must be sorted in ascending order.
  */
 void
-process_block_change(ForkNumber forknum, RelFileNode rnode, BlockNumber blkno)
+process_block_changes(ForkNumber forknum, RelFileNode rnode, int segno,
+					  BlockNumber *blknos, int n_blknos)
 {
-//	char	   *path;
 	char	   *rel_path;
-	BlockNumber blkno_inseg;
-	int			segno;
 	pgFile	  **file_item;
 	pgFile		f;
-
-	segno = blkno / RELSEG_SIZE;
-	blkno_inseg = blkno % RELSEG_SIZE;
+	int			i;
 
 	rel_path = relpathperm(rnode, forknum);
 	if (segno > 0)
 		f.rel_path = psprintf("%s.%u", rel_path, segno);
 	else
 		f.rel_path = rel_path;
+	f.rel_path_hash = 0;
 
 	/* backup_files_list should be sorted before */
-	file_item = (pgFile **) parray_bsearch(backup_files_list, &f,
-										   pgFileCompareRelPath);
+	if (backup_files_index)
+		file_item = (pgFile **) parray_index_find(backup_files_index, &f);
+	else
+		file_item = (pgFile **) parray_bsearch(backup_files_list, &f,
+											   pgFileCompareRelPath);
 
 	/*
 	 * If we don't have any record of this file in the file map, it means
@@ -1968,20 +1998,22 @@ process_block_change(ForkNumber forknum, RelFileNode rnode, BlockNumber blkno)
 	 */
 	if (file_item)
 	{
-		/* We need critical section only we use more than one threads */
-		if (num_threads > 1)
-			pthread_mutex_lock(&backup_pagemap_mutex);
+		datapagemap_t *pagemap = &(*file_item)->pagemap;
 
-		datapagemap_add(&(*file_item)->pagemap, blkno_inseg);
+		/* Blocks are sorted, so the bitmap is allocated only once */
+		if (pagemap->bitmap == NULL)
+		{
+			pagemap->bitmapsize = blknos[n_blknos - 1] / 8 + 1;
+			pagemap->bitmap = pgut_malloc0(pagemap->bitmapsize);
+		}
 
-		if (num_threads > 1)
-			pthread_mutex_unlock(&backup_pagemap_mutex);
+		for (i = 0; i < n_blknos; i++)
+			datapagemap_add(pagemap, blknos[i]);
 	}
 
 	if (segno > 0)
 		pg_free(f.rel_path);
 	pg_free(rel_path);
-
 }
 
 /*
@@ -937,47 +937,91 @@ catalog_get_backup_list(InstanceState *instanceState, time_t requested_backup_id
 	DIR		   *data_dir = NULL;
 	struct dirent *data_ent = NULL;
 	parray	   *backups = NULL;
+	parray	   *backup_dirs = NULL;
+	CatalogSummary *summary;
+	time_t		check_time = time(NULL);
+	bool		summary_changed = false;
+	int			n_read = 0;
 	int			i;
 
-	/* open backup instance backups directory */
-	data_dir = fio_opendir(FIO_BACKUP_HOST, instanceState->instance_backup_subdir_path);
-	if (data_dir == NULL)
+	/*
+	 * Backups are taken from the catalog summary, control files are read
+	 * only for new or changed backups.
+	 */
+	summary = catalog_summary_open(instanceState->instance_backup_subdir_path);
+	if (summary)
+		backup_dirs = catalog_summary_backup_dirs(summary,
+												  instanceState->instance_backup_subdir_path);
+
+	if (backup_dirs == NULL)
 	{
-		elog(WARNING, "cannot open directory \"%s\": %s", instanceState->instance_backup_subdir_path,
-			strerror(errno));
-		goto err_proc;
+		summary_changed = true;
+		backup_dirs = parray_new();
+
+		/* open backup instance backups directory */
+		data_dir = fio_opendir(FIO_BACKUP_HOST, instanceState->instance_backup_subdir_path);
+		if (data_dir == NULL)
+		{
+			elog(WARNING, "cannot open directory \"%s\": %s", instanceState->instance_backup_subdir_path,
+				strerror(errno));
+			goto err_proc;
+		}
+
+		/* scan the directory and list backups */
+		for (; (data_ent = fio_readdir(data_dir)) != NULL; errno = 0)
+		{
+			/* skip not-directory entries and hidden entries */
+			if (!IsDir(instanceState->instance_backup_subdir_path, data_ent->d_name, FIO_BACKUP_HOST)
+				|| data_ent->d_name[0] == '.')
+				continue;
+
+			parray_append(backup_dirs, pgut_strdup(data_ent->d_name));
+		}
+
+		if (errno)
+		{
+			elog(WARNING, "Cannot read backup root directory \"%s\": %s",
+				instanceState->instance_backup_subdir_path, strerror(errno));
+			goto err_proc;
+		}
+
+		fio_closedir(data_dir);
+		data_dir = NULL;
 	}
 
-	/* scan the directory and list backups */
 	backups = parray_new();
-	for (; (data_ent = fio_readdir(data_dir)) != NULL; errno = 0)
+	for (i = 0; i < parray_num(backup_dirs); i++)
 	{
+		const char *backup_dir_name = (const char *) parray_get(backup_dirs, i);
 		char		backup_conf_path[MAXPGPATH];
 		char		data_path[MAXPGPATH];
 		pgBackup   *backup = NULL;
 
-		/* skip not-directory entries and hidden entries */
-		if (!IsDir(instanceState->instance_backup_subdir_path, data_ent->d_name, FIO_BACKUP_HOST)
-			|| data_ent->d_name[0] == '.')
-			continue;
-
 		/* open subdirectory of specific backup */
-		join_path_components(data_path, instanceState->instance_backup_subdir_path, data_ent->d_name);
+		join_path_components(data_path, instanceState->instance_backup_subdir_path, backup_dir_name);
 
 		/* read backup information from BACKUP_CONTROL_FILE */
 		join_path_components(backup_conf_path, data_path, BACKUP_CONTROL_FILE);
-		backup = readBackupControlFile(backup_conf_path);
+		if (summary)
+			backup = catalog_summary_get_backup(summary, backup_dir_name, backup_conf_path);
+
+		if (!backup)
+		{
+			summary_changed = true;
+			n_read++;
+			backup = readBackupControlFile(backup_conf_path);
+		}
 
 		if (!backup)
 		{
 			backup = pgut_new0(pgBackup);
 			pgBackupInit(backup);
-			backup->start_time = base36dec(data_ent->d_name);
+			backup->start_time = base36dec(backup_dir_name);
 			/* XXX BACKUP_ID change it when backup_id wouldn't match start_time */
 			Assert(backup->backup_id == 0 || backup->backup_id == backup->start_time);
 			backup->backup_id = backup->start_time;
 		}
-		else if (strcmp(backup_id_of(backup), data_ent->d_name) != 0)
+		else if (strcmp(backup_id_of(backup), backup_dir_name) != 0)
 		{
 			/* TODO there is no such guarantees */
 			elog(WARNING, "backup ID in control file \"%s\" doesn't match name of the backup folder \"%s\"",
@@ -992,25 +1036,40 @@ catalog_get_backup_list(InstanceState *instanceState, time_t requested_backup_id
 		/* Initialize page header map */
 		init_header_map(backup);
 
-		/* TODO: save encoded backup id */
-		if (requested_backup_id != INVALID_BACKUP_ID
-			&& requested_backup_id != backup->start_time)
-		{
-			pgBackupFree(backup);
-			continue;
-		}
 		parray_append(backups, backup);
 	}
 
-	if (errno)
+	if (summary)
+		elog(LOG, "Read %i of %lu control files of instance '%s', others are taken from catalog summary",
+			 n_read, (unsigned long) parray_num(backups), instanceState->instance_name);
+
+	if (summary_changed)
+		catalog_summary_write(instanceState->instance_backup_subdir_path,
+							  backups, check_time, summary);
+
+	catalog_summary_free(summary);
+	summary = NULL;
+	parray_walk(backup_dirs, pfree);
+	parray_free(backup_dirs);
+	backup_dirs = NULL;
+
+	/* TODO: save encoded backup id */
+	if (requested_backup_id != INVALID_BACKUP_ID)
 	{
-		elog(WARNING, "Cannot read backup root directory \"%s\": %s",
-			instanceState->instance_backup_subdir_path, strerror(errno));
-		goto err_proc;
-	}
+		parray	   *all_backups = backups;
 
-	fio_closedir(data_dir);
-	data_dir = NULL;
+		backups = parray_new();
+		for (i = 0; i < parray_num(all_backups); i++)
+		{
+			pgBackup   *backup = (pgBackup *) parray_get(all_backups, i);
+
+			if (requested_backup_id == backup->start_time)
+				parray_append(backups, backup);
+			else
+				pgBackupFree(backup);
+		}
+		parray_free(all_backups);
+	}
 
 	parray_qsort(backups, pgBackupCompareIdDesc);
 
@@ -1036,6 +1095,10 @@ catalog_get_backup_list(InstanceState *instanceState, time_t requested_backup_id
 err_proc:
 	if (data_dir)
 		fio_closedir(data_dir);
+	if (backup_dirs)
+		parray_walk(backup_dirs, pfree);
+	parray_free(backup_dirs);
+	catalog_summary_free(summary);
 	if (backups)
 		parray_walk(backups, pgBackupFree);
 	parray_free(backups);
@@ -1047,6 +1110,9 @@ err_proc:
 
 /*
  * Get list of files in the backup from the DATABASE_FILE_LIST.
+ * Both binary and legacy text formats are supported.
+ * Files are allocated in the arena of the list, so the list
+ * should be freed with pgFileListFree().
  */
 parray *
 get_backup_filelist(pgBackup *backup, bool strict)
@@ -1057,9 +1123,25 @@ get_backup_filelist(pgBackup *backup, bool strict)
 	char     buf[BLCKSZ];
 	char     stdio_buf[STDIO_BUFSIZE];
 	pg_crc32 content_crc = 0;
+	FileListMap *map;
+	pgut_arena *arena;
 
 	join_path_components(backup_filelist_path, backup->root_dir, DATABASE_FILE_LIST);
 
+	/* check for file list stored in binary format, see filelist.c */
+	map = filelist_map_open(backup);
+	if (map)
+	{
+		if (filelist_map_verify_crc(map, backup->content_crc))
+			files = filelist_map_to_parray(map);
+		filelist_map_close(map);
+
+		if (!files)
+			elog(strict ? ERROR : WARNING, "Failed to get file list for backup %s", backup_id_of(backup));
+
+		return files;
+	}
+
 	fp = fio_open_stream(FIO_BACKUP_HOST, backup_filelist_path);
 	if (fp == NULL)
 		elog(ERROR, "cannot open \"%s\": %s", backup_filelist_path, strerror(errno));
@@ -1068,7 +1150,10 @@ get_backup_filelist(pgBackup *backup, bool strict)
 	if (!fio_is_remote(FIO_BACKUP_HOST))
 		setvbuf(fp, stdio_buf, _IOFBF, STDIO_BUFSIZE);
 
+	/* files and their strings are allocated in the arena of the list */
 	files = parray_new();
+	arena = pgut_arena_create();
+	parray_set_arena(files, arena);
 
 	INIT_CRC32C(content_crc);
 
@@ -1103,7 +1188,7 @@ get_backup_filelist(pgBackup *backup, bool strict)
 		get_control_value_str(buf, "compress_alg", compress_alg_string, sizeof(compress_alg_string), false);
 		get_control_value_int64(buf, "dbOid", &dbOid, false);
 
-		file = pgFileInit(path);
+		file = pgFileInitInArena(path, arena);
 		file->write_size = (int64) write_size;
 		file->uncompressed_size = full_size;
 		file->mode = (mode_t) mode;
@@ -1118,7 +1203,7 @@ get_backup_filelist(pgBackup *backup, bool strict)
 		 */
 		if (get_control_value_str(buf, "linked", linked, sizeof(linked), false) && linked[0])
 		{
-			file->linked = pgut_strdup(linked);
+			file->linked = pgut_arena_strdup(arena, linked);
 			canonicalize_path(file->linked);
 		}
 
@@ -1507,9 +1592,10 @@ catalog_get_timelines(InstanceState *instanceState, InstanceConfig *instance)
 	char begin_segno_str[MAXFNAMELEN];
 	char end_segno_str[MAXFNAMELEN];
 
-	/* read all xlog files that belong to this archive */
-	dir_list_file(xlog_files_list, instanceState->instance_wal_subdir_path,
-				  false, true, false, false, true, FIO_BACKUP_HOST);
+	/* read all xlog files that belong to this archive, use WAL index if any */
+	if (!wal_index_list_files(xlog_files_list, instanceState->instance_wal_subdir_path))
+		dir_list_file(xlog_files_list, instanceState->instance_wal_subdir_path,
+					  false, true, false, false, true, FIO_BACKUP_HOST);
 	parray_qsort(xlog_files_list, pgFileCompareName);
 
 	timelineinfos = parray_new();
@@ -1612,8 +1698,8 @@ catalog_get_timelines(InstanceState *instanceState, InstanceConfig *instance)
 					parray_append(tlinfo->xlog_filelist, wal_file);
 					continue;
 				}
-				/* we only expect compressed wal files with .gz suffix */
-				else if (strcmp(suffix, "gz") != 0)
+				/* we only expect compressed wal files with known suffixes */
+				else if (!IsCompressedXLogFileName(file->name))
 				{
 					elog(WARNING, "unexpected WAL file name \"%s\"", file->name);
 					continue;
@@ -1744,6 +1830,40 @@ catalog_get_timelines(InstanceState *instanceState, InstanceConfig *instance)
 		tlinfo->closest_backup = get_closest_backup(tlinfo);
 	}
 
+	/* determine range of record timestamps, if WAL segments are summarized */
+	for (i = 0; i < parray_num(timelineinfos); i++)
+	{
+		WalSegmentSummary *summaries;
+		size_t		n_summaries;
+		size_t		n;
+
+		tlinfo = parray_get(timelineinfos, i);
+		if (tlinfo->n_xlog_files == 0)
+			continue;
+
+		summaries = wal_summary_read(instanceState->instance_wal_subdir_path,
+									 tlinfo->tli, instance->xlog_seg_size,
+									 &n_summaries);
+
+		for (n = 0; n < n_summaries; n++)
+		{
+			WalSegmentSummary *summary = &summaries[n];
+
+			if (summary->segno < tlinfo->begin_segno ||
+				summary->segno > tlinfo->end_segno ||
+				summary->max_time == 0)
+				continue;
+
+			if (tlinfo->min_time == 0 ||
+				timestamptz_to_time_t(summary->min_time) < tlinfo->min_time)
+				tlinfo->min_time = timestamptz_to_time_t(summary->min_time);
+			if (timestamptz_to_time_t(summary->max_time) > tlinfo->max_time)
+				tlinfo->max_time = timestamptz_to_time_t(summary->max_time);
+		}
+
+		pg_free(summaries);
+	}
+
 	/* determine which WAL segments must be kept because of wal retention */
 	if (instance->wal_depth <= 0)
 		return timelineinfos;
@@ -2467,6 +2587,7 @@ write_backup(pgBackup *backup, bool strict)
 
 /*
  * Output the list of files to backup catalog DATABASE_FILE_LIST
+ * in binary format, see filelist.c.
  */
 void
 write_backup_filelist(pgBackup *backup, parray *files, const char *root, bool sync)
@@ -2499,11 +2620,9 @@ write_backup_filelist(pgBackup *backup, parray *files, const char *root, bool sy
 	if (sync)
 		INIT_CRC32C(backup->content_crc);
 
-	/* print each file in the list */
+	/* calculate sizes of files in the list */
 	for (i = 0; i < parray_num(files); i++)
 	{
-		int       len = 0;
-		char      line[BLCKSZ];
 		pgFile   *file = (pgFile *) parray_get(files, i);
 
 		/* Ignore disappeared file */
@@ -2531,43 +2650,11 @@ write_backup_filelist(pgBackup *backup, parray *files, const char *root, bool sy
 				uncompressed_size_on_disk += file->uncompressed_size;
 			}
 		}
-
-		len = sprintf(line, "{\"path\":\"%s\", \"size\":\"" INT64_FORMAT "\", "
-					 "\"mode\":\"%u\", \"is_datafile\":\"%u\", "
-					 "\"crc\":\"%u\", "
-					 "\"compress_alg\":\"%s\", "
-					 "\"dbOid\":\"%u\"",
-					file->rel_path, file->write_size, file->mode,
-					file->is_datafile ? 1 : 0,
-					file->crc,
-					deparse_compress_alg(file->compress_alg),
-					file->dbOid);
-
-		if (file->is_datafile)
-			len += sprintf(line+len, ",\"segno\":\"%d\"", file->segno);
-
-		if (file->linked)
-			len += sprintf(line+len, ",\"linked\":\"%s\"", file->linked);
-
-		if (file->n_blocks > 0)
-			len += sprintf(line+len, ",\"n_blocks\":\"%i\"", file->n_blocks);
-
-		if (file->n_headers > 0)
-		{
-			len += sprintf(line+len, ",\"n_headers\":\"%i\"", file->n_headers);
-			len += sprintf(line+len, ",\"hdr_crc\":\"%u\"", file->hdr_crc);
-			len += sprintf(line+len, ",\"hdr_off\":\"%llu\"", file->hdr_off);
-			len += sprintf(line+len, ",\"hdr_size\":\"%i\"", file->hdr_size);
-		}
-
-		sprintf(line+len, "}\n");
-
-		if (sync)
-			COMP_CRC32C(backup->content_crc, line, strlen(line));
-
-		fprintf(out, "%s", line);
 	}
 
+	write_filelist_binary(out, files, sync ? &backup->content_crc : NULL,
+						  control_path_temp);
+
 	if (sync)
 		FIN_CRC32C(backup->content_crc);
 
@@ -2829,6 +2916,10 @@ parse_compress_alg(const char *arg)
 
 	if (pg_strncasecmp("zlib", arg, len) == 0)
 		return ZLIB_COMPRESS;
+	else if (pg_strncasecmp("zstd", arg, len) == 0)
+		return ZSTD_COMPRESS;
+	else if (pg_strncasecmp("lz4", arg, len) == 0)
+		return LZ4_COMPRESS;
 	else if (pg_strncasecmp("none", arg, len) == 0)
 		return NONE_COMPRESS;
 	else
@@ -2847,6 +2938,10 @@ deparse_compress_alg(int alg)
 			return "none";
 		case ZLIB_COMPRESS:
 			return "zlib";
+		case ZSTD_COMPRESS:
+			return "zstd";
+		case LZ4_COMPRESS:
+			return "lz4";
 	}
 
 	return NULL;
@@ -2927,6 +3022,10 @@ pgBackupInit(pgBackup *backup)
 	backup->root_dir = NULL;
 	backup->database_dir = NULL;
 	backup->files = NULL;
+	backup->filelist_map = NULL;
+	backup->files_index = NULL;
+	backup->hdr_map.fd = -1;
+	backup->hdr_map.rfd = -1;
 	backup->note = NULL;
 	backup->content_crc = 0;
 }
@@ -353,6 +353,7 @@ typedef struct
 	const char *to_root;
 	parray	   *source_filelist;
 	parray	   *dest_filelist;
+	parray_index *dest_filelist_index;
 	XLogRecPtr	sync_lsn;
 	BackupMode	backup_mode;
 	int	thread_num;
@@ -407,8 +408,8 @@ catchup_thread_runner(void *arg)
 		if (arguments->backup_mode != BACKUP_MODE_FULL)
 		{
 			pgFile	**dest_file_tmp = NULL;
-			dest_file_tmp = (pgFile **) parray_bsearch(arguments->dest_filelist,
-											file, pgFileCompareRelPath);
+			dest_file_tmp = (pgFile **) parray_index_find(arguments->dest_filelist_index,
+														  file);
 			if (dest_file_tmp)
 			{
 				/* File exists in destination PGDATA */
@@ -475,10 +476,15 @@ catchup_multithreaded_copy(int num_threads,
 	catchup_thread_runner_arg *threads_args;
 	pthread_t	*threads;
 
+	parray_index *dest_filelist_index = NULL;
 	bool all_threads_successful = true;
 	ssize_t transfered_bytes_result = 0;
 	int	i;
 
+	if (backup_mode != BACKUP_MODE_FULL)
+		dest_filelist_index = parray_index_build(dest_filelist, pgFileHashRelPath,
+												 pgFileCompareRelPath);
+
 	/* init thread args */
 	threads_args = (catchup_thread_runner_arg *) palloc(sizeof(catchup_thread_runner_arg) * num_threads);
 	for (i = 0; i < num_threads; i++)
@@ -488,6 +494,7 @@ catchup_multithreaded_copy(int num_threads,
 			.to_root = dest_pgdata_path,
 			.source_filelist = source_filelist,
 			.dest_filelist = dest_filelist,
+			.dest_filelist_index = dest_filelist_index,
 			.sync_lsn = sync_lsn,
 			.backup_mode = backup_mode,
 			.thread_num = i + 1,
@@ -518,6 +525,7 @@ catchup_multithreaded_copy(int num_threads,
 
 	free(threads);
 	free(threads_args);
+	parray_index_free(dest_filelist_index);
 	return all_threads_successful ? transfered_bytes_result : -1;
 }
 
@@ -645,8 +653,8 @@ do_catchup(const char *source_pgdata, const char *dest_pgdata, int num_threads,
 	if (current.backup_mode != BACKUP_MODE_FULL)
 	{
 		dest_filelist = parray_new();
-		dir_list_file(dest_filelist, dest_pgdata,
-			true, true, false, backup_logs, true, FIO_LOCAL_HOST);
+		dir_list_file_parallel(dest_filelist, dest_pgdata,
+			true, true, false, backup_logs, true, num_threads);
 		filter_filelist(dest_filelist, dest_pgdata, exclude_absolute_paths_list, exclude_relative_paths_list, "Destination");
 
 		// fill dest_redo.lsn and dest_redo.tli
@@ -716,8 +724,8 @@ do_catchup(const char *source_pgdata, const char *dest_pgdata, int num_threads,
 		fio_list_dir(source_filelist, source_pgdata,
 					 true, true, false, backup_logs, true);
 	else
-		dir_list_file(source_filelist, source_pgdata,
-					  true, true, false, backup_logs, true, FIO_LOCAL_HOST);
+		dir_list_file_parallel(source_filelist, source_pgdata,
+							   true, true, false, backup_logs, true, num_threads);
 
 	//REVIEW FIXME. Let's fix that before release.
 	// TODO what if wal is not a dir (symlink to a dir)?
@@ -903,7 +911,11 @@ do_catchup(const char *source_pgdata, const char *dest_pgdata, int num_threads,
 	 */
 	if (current.backup_mode != BACKUP_MODE_FULL)
 	{
+		parray_index *source_filelist_index;
+
 		elog(INFO, "Removing redundant files in destination directory");
+		source_filelist_index = parray_index_build(source_filelist, pgFileHashRelPath,
+												   pgFileCompareRelPath);
 		parray_qsort(dest_filelist, pgFileCompareRelPathDesc);
 		for (i = 0; i < parray_num(dest_filelist); i++)
 		{
@@ -911,9 +923,7 @@ do_catchup(const char *source_pgdata, const char *dest_pgdata, int num_threads,
 			pgFile	*file = (pgFile *) parray_get(dest_filelist, i);
 			pgFile	**src_file = NULL;
 
-			//TODO optimize it and use some merge-like algorithm
-			//instead of bsearch for each file.
-			src_file = (pgFile **) parray_bsearch(source_filelist, file, pgFileCompareRelPath);
+			src_file = (pgFile **) parray_index_find(source_filelist_index, file);
 
 			if (src_file!= NULL && !(*src_file)->excluded && file->excluded)
 				(*src_file)->excluded = true;
@@ -943,6 +953,7 @@ do_catchup(const char *source_pgdata, const char *dest_pgdata, int num_threads,
 				i--;
 			}
 		}
+		parray_index_free(source_filelist_index);
 	}
 
 	/* clear file locks */
@@ -0,0 +1,423 @@
+/*-------------------------------------------------------------------------
+ *
+ * compress.c: compression providers.
+ *
+ * Every supported compression algorithm is described by a provider,
+ * which implements compression of a single buffer.  Providers are used
+ * for data file pages and for WAL segments, which are compressed as a
+ * whole when pushed into archive with algorithms other than zlib.
+ * zstd and lz4 providers are available only if PostgreSQL, which we are
+ * built against, was configured with --with-zstd and --with-lz4.
+ *
+ * Portions Copyright (c) 2015-2022, Postgres Professional
+ *
+ *-------------------------------------------------------------------------
+ */
+
+#include "pg_probackup.h"
+
+#include <zlib.h>
+#ifdef USE_ZSTD
+#include <zstd.h>
+#endif
+#ifdef USE_LZ4
+#include <lz4.h>
+#include <lz4hc.h>
+#endif
+
+typedef struct CompressProvider
+{
+	CompressAlg	alg;
+	const char *name;
+	const char *wal_suffix;		/* suffix of compressed WAL segment */
+	int			min_level;
+	int			max_level;
+
+	/* NULL if algorithm is not supported by this build */
+	int32		(*compress) (void *dst, size_t dst_size, void const *src,
+							 size_t src_size, int level, const char **errormsg);
+	int32		(*decompress) (void *dst, size_t dst_size, void const *src,
+							   size_t src_size, const char **errormsg);
+	size_t		(*compress_bound) (size_t src_size);
+} CompressProvider;
+
+/* Implementation of zlib compression method */
+static int32
+zlib_compress(void *dst, size_t dst_size, void const *src, size_t src_size,
+			  int level, const char **errormsg)
+{
+	uLongf 	compressed_size = dst_size;
+	int 	rc = compress2(dst, &compressed_size, src, src_size,
+					   level);
+
+	if (rc != Z_OK)
+	{
+		if (errormsg)
+			*errormsg = zError(rc);
+		return rc;
+	}
+	return compressed_size;
+}
+
+/* Implementation of zlib compression method */
+static int32
+zlib_decompress(void *dst, size_t dst_size, void const *src, size_t src_size,
+				const char **errormsg)
+{
+	uLongf dest_len = dst_size;
+	int 	rc = uncompress(dst, &dest_len, src, src_size);
+
+	if (rc != Z_OK)
+	{
+		if (errormsg)
+			*errormsg = zError(rc);
+		return rc;
+	}
+	return dest_len;
+}
+
+static size_t
+zlib_compress_bound(size_t src_size)
+{
+	return compressBound(src_size);
+}
+
+#ifdef USE_ZSTD
+/*
+ * Contexts are expensive to create, so each thread keeps its own ones
+ * for the whole life of the thread.
+ */
+static __thread ZSTD_CCtx *zstd_cctx = NULL;
+static __thread ZSTD_DCtx *zstd_dctx = NULL;
+
+/*
+ * Largest window, which zstd decompresses without extra parameters,
+ * it is ZSTD_WINDOWLOG_LIMIT_DEFAULT from experimental API.
+ */
+#define ZSTD_WAL_WINDOWLOG_MAX	27
+
+/* Implementation of zstd compression method */
+static int32
+zstd_compress(void *dst, size_t dst_size, void const *src, size_t src_size,
+			  int level, const char **errormsg)
+{
+	size_t		rc;
+
+	if (zstd_cctx == NULL && (zstd_cctx = ZSTD_createCCtx()) == NULL)
+	{
+		if (errormsg)
+			*errormsg = "Cannot create zstd compression context";
+		return -1;
+	}
+
+	rc = ZSTD_compressCCtx(zstd_cctx, dst, dst_size, src, src_size, level);
+	if (ZSTD_isError(rc))
+	{
+		if (errormsg)
+			*errormsg = ZSTD_getErrorName(rc);
+		return -1;
+	}
+	return rc;
+}
+
+/* Implementation of zstd compression method */
+static int32
+zstd_decompress(void *dst, size_t dst_size, void const *src, size_t src_size,
+				const char **errormsg)
+{
+	size_t		rc;
+
+	if (zstd_dctx == NULL && (zstd_dctx = ZSTD_createDCtx()) == NULL)
+	{
+		if (errormsg)
+			*errormsg = "Cannot create zstd decompression context";
+		return -1;
+	}
+
+	rc = ZSTD_decompressDCtx(zstd_dctx, dst, dst_size, src, src_size);
+	if (ZSTD_isError(rc))
+	{
+		if (errormsg)
+			*errormsg = ZSTD_getErrorName(rc);
+		return -1;
+	}
+	return rc;
+}
+
+static size_t
+zstd_compress_bound(size_t src_size)
+{
+	return ZSTD_compressBound(src_size);
+}
+
+/*
+ * Compress WAL segment with zstd.
+ * The whole segment fits into compression window and long distance
+ * matching is enabled, because WAL contains a lot of repeated data,
+ * e.g. full page images of the same pages, far from each other.
+ */
+static int32
+zstd_compress_wal(void *dst, size_t dst_size, void const *src, size_t src_size,
+				  int level, const char **errormsg)
+{
+	size_t		rc;
+	int			window_log = ZSTD_cParam_getBounds(ZSTD_c_windowLog).lowerBound;
+
+	if (zstd_cctx == NULL && (zstd_cctx = ZSTD_createCCtx()) == NULL)
+	{
+		if (errormsg)
+			*errormsg = "Cannot create zstd compression context";
+		return -1;
+	}
+
+	/* Window large enough for the whole segment, but not larger than decompression limit */
+	while (window_log < ZSTD_WAL_WINDOWLOG_MAX && ((size_t) 1 << window_log) < src_size)
+		window_log++;
+
+	ZSTD_CCtx_reset(zstd_cctx, ZSTD_reset_session_and_parameters);
+	rc = ZSTD_CCtx_setParameter(zstd_cctx, ZSTD_c_compressionLevel, level);
+	if (!ZSTD_isError(rc))
+		rc = ZSTD_CCtx_setParameter(zstd_cctx, ZSTD_c_windowLog, window_log);
+	if (!ZSTD_isError(rc))
+		rc = ZSTD_CCtx_setParameter(zstd_cctx, ZSTD_c_enableLongDistanceMatching, 1);
+	if (!ZSTD_isError(rc))
+		rc = ZSTD_compress2(zstd_cctx, dst, dst_size, src, src_size);
+
+	/* do not let WAL parameters affect compression of data pages */
+	ZSTD_CCtx_reset(zstd_cctx, ZSTD_reset_session_and_parameters);
+
+	if (ZSTD_isError(rc))
+	{
+		if (errormsg)
+			*errormsg = ZSTD_getErrorName(rc);
+		return -1;
+	}
+	return rc;
+}
+#endif
+
+#ifdef USE_LZ4
+/*
+ * Implementation of lz4 compression method.
+ * Levels above 1 are handled by high compression mode of lz4.
+ */
+static int32
+lz4_compress(void *dst, size_t dst_size, void const *src, size_t src_size,
+			 int level, const char **errormsg)
+{
+	int			rc;
+
+	if (level > 1)
+		rc = LZ4_compress_HC(src, dst, src_size, dst_size, level);
+	else
+		rc = LZ4_compress_default(src, dst, src_size, dst_size);
+
+	if (rc <= 0)
+	{
+		if (errormsg)
+			*errormsg = "lz4 compression failed";
+		return -1;
+	}
+	return rc;
+}
+
+/* Implementation of lz4 compression method */
+static int32
+lz4_decompress(void *dst, size_t dst_size, void const *src, size_t src_size,
+			   const char **errormsg)
+{
+	int			rc = LZ4_decompress_safe(src, dst, src_size, dst_size);
+
+	if (rc < 0)
+	{
+		if (errormsg)
+			*errormsg = "lz4 decompression failed, data is corrupted";
+		return -1;
+	}
+	return rc;
+}
+
+static size_t
+lz4_compress_bound(size_t src_size)
+{
+	return LZ4_compressBound(src_size);
+}
+#endif
+
+static const CompressProvider compress_providers[] =
+{
+	{ZLIB_COMPRESS, "zlib", "gz", 0, 9,
+		zlib_compress, zlib_decompress, zlib_compress_bound},
+#ifdef USE_ZSTD
+	{ZSTD_COMPRESS, "zstd", "zst", 1, 22,
+		zstd_compress, zstd_decompress, zstd_compress_bound},
+#else
+	{ZSTD_COMPRESS, "zstd", "zst", 1, 22, NULL, NULL, NULL},
+#endif
+#ifdef USE_LZ4
+	{LZ4_COMPRESS, "lz4", "lz4", 0, 12,
+		lz4_compress, lz4_decompress, lz4_compress_bound},
+#else
+	{LZ4_COMPRESS, "lz4", "lz4", 0, 12, NULL, NULL, NULL},
+#endif
+};
+
+static const CompressProvider *
+get_compress_provider(CompressAlg alg)
+{
+	int			i;
+
+	for (i = 0; i < lengthof(compress_providers); i++)
+	{
+		if (compress_providers[i].alg == alg)
+			return &compress_providers[i];
+	}
+
+	return NULL;
+}
+
+/*
+ * Compresses source into dest using algorithm. Returns the number of bytes
+ * written in the destination buffer, or -1 if compression fails.
+ */
+int32
+do_compress(void *dst, size_t dst_size, void const *src, size_t src_size,
+			CompressAlg alg, int level, const char **errormsg)
+{
+	const CompressProvider *provider = get_compress_provider(alg);
+
+	if (provider == NULL)
+		return -1;
+
+	if (provider->compress == NULL)
+	{
+		if (errormsg)
+			*errormsg = "Compression algorithm is not supported by this build";
+		return -1;
+	}
+
+	return provider->compress(dst, dst_size, src, src_size, level, errormsg);
+}
+
+/*
+ * Decompresses source into dest using algorithm. Returns the number of bytes
+ * decompressed in the destination buffer, or -1 if decompression fails.
+ */
+int32
+do_decompress(void *dst, size_t dst_size, void const *src, size_t src_size,
+			  CompressAlg alg, const char **errormsg)
+{
+	const CompressProvider *provider = get_compress_provider(alg);
+
+	if (provider == NULL)
+	{
+		if (errormsg)
+			*errormsg = "Invalid compression algorithm";
+		return -1;
+	}
+
+	if (provider->decompress == NULL)
+	{
+		if (errormsg)
+			*errormsg = "Compression algorithm is not supported by this build";
+		return -1;
+	}
+
+	return provider->decompress(dst, dst_size, src, src_size, errormsg);
+}
+
+/*
+ * Compresses WAL segment as a whole. Returns the number of bytes
+ * written in the destination buffer, or -1 if compression fails.
+ */
+int32
+do_compress_wal(void *dst, size_t dst_size, void const *src, size_t src_size,
+				CompressAlg alg, int level, const char **errormsg)
+{
+#ifdef USE_ZSTD
+	if (alg == ZSTD_COMPRESS)
+		return zstd_compress_wal(dst, dst_size, src, src_size, level, errormsg);
+#endif
+
+	return do_compress(dst, dst_size, src, src_size, alg, level, errormsg);
+}
+
+/*
+ * Returns the maximum size of src_size bytes compressed with algorithm.
+ */
+size_t
+compress_bound(CompressAlg alg, size_t src_size)
+{
+	const CompressProvider *provider = get_compress_provider(alg);
+
+	if (provider == NULL || provider->compress_bound == NULL)
+		return src_size;
+
+	return provider->compress_bound(src_size);
+}
+
+/*
+ * Check that algorithm can be used by this build of pg_backup.
+ * NONE and NOT_DEFINED are always supported.
+ */
+bool
+compress_alg_is_supported(CompressAlg alg)
+{
+	const CompressProvider *provider = get_compress_provider(alg);
+
+	return provider == NULL || provider->compress != NULL;
+}
+
+/* Get valid range of compression levels of algorithm */
+void
+compress_level_range(CompressAlg alg, int *min_level, int *max_level)
+{
+	const CompressProvider *provider = get_compress_provider(alg);
+
+	*min_level = provider ? provider->min_level : 0;
+	*max_level = provider ? provider->max_level : 9;
+}
+
+/*
+ * Get suffix of compressed WAL segment in archive.
+ * Returns NULL for uncompressed segments.
+ */
+const char *
+wal_compress_suffix(CompressAlg alg)
+{
+	const CompressProvider *provider = get_compress_provider(alg);
+
+	return provider ? provider->wal_suffix : NULL;
+}
+
+/*
+ * Get compression algorithm of WAL file by its name, such as
+ * 000000010000000000000001.zst, followed by tail, such as '.part'.
+ * Returns NOT_DEFINED_COMPRESS if name doesn't belong to compressed
+ * WAL segment.
+ */
+CompressAlg
+wal_compress_alg_by_name(const char *fname, const char *tail)
+{
+	int			i;
+	size_t		tail_len = strlen(tail);
+
+	if (strspn(fname, "0123456789ABCDEF") != XLOG_FNAME_LEN ||
+		fname[XLOG_FNAME_LEN] != '.')
+		return NOT_DEFINED_COMPRESS;
+
+	fname += XLOG_FNAME_LEN + 1;
+
+	for (i = 0; i < lengthof(compress_providers); i++)
+	{
+		const char *suffix = compress_providers[i].wal_suffix;
+		size_t		suffix_len = strlen(suffix);
+
+		if (strlen(fname) == suffix_len + tail_len &&
+			strncmp(fname, suffix, suffix_len) == 0 &&
+			strcmp(fname + suffix_len, tail) == 0)
+			return compress_providers[i].alg;
+	}
+
+	return NOT_DEFINED_COMPRESS;
+}
@@ -41,6 +41,7 @@ static void show_configure_json(ConfigOption *opt);
 #define OPTION_ARCHIVE_GROUP	"Archive parameters"
 #define OPTION_LOG_GROUP		"Logging parameters"
 #define OPTION_RETENTION_GROUP	"Retention parameters"
+#define OPTION_VALIDATION_GROUP	"Validation parameters"
 #define OPTION_COMPRESS_GROUP	"Compression parameters"
 #define OPTION_REMOTE_GROUP		"Remote access parameters"
 
@@ -203,6 +204,12 @@ ConfigOption instance_options[] =
 		&instance_config.wal_depth, SOURCE_CMD, SOURCE_DEFAULT,
 		OPTION_RETENTION_GROUP, 0, option_get_value
 	},
+	/* Validation options */
+	{
+		'U', 233, "validation-ledger-max-age",
+		&instance_config.validation_ledger_max_age, SOURCE_CMD, SOURCE_DEFAULT,
+		OPTION_VALIDATION_GROUP, OPTION_UNIT_S, option_get_value
+	},
 	/* Compression options */
 	{
 		'f', 224, "compress-algorithm",
@@ -370,6 +377,8 @@ init_config(InstanceConfig *config, const char *instance_name)
 	config->retention_window = RETENTION_WINDOW_DEFAULT;
 	config->wal_depth = 0;
 
+	config->validation_ledger_max_age = 0;
+
 	config->compress_alg = COMPRESS_ALG_DEFAULT;
 	config->compress_level = COMPRESS_LEVEL_DEFAULT;
 
@@ -525,6 +534,12 @@ readInstanceConfigFile(InstanceState *instanceState)
 			&instance->wal_depth, SOURCE_CMD, SOURCE_DEFAULT,
 			OPTION_RETENTION_GROUP, 0, option_get_value
 		},
+		/* Validation options */
+		{
+			'U', 233, "validation-ledger-max-age",
+			&instance->validation_ledger_max_age, SOURCE_CMD, SOURCE_DEFAULT,
+			OPTION_VALIDATION_GROUP, OPTION_UNIT_S, option_get_value
+		},
 		/* Compression options */
 		{
 			's', 224, "compress-algorithm",
@@ -31,86 +31,36 @@ typedef struct DataPage
 	char            data[BLCKSZ];
 } DataPage;
 
-static bool get_page_header(FILE *in, const char *fullpath, BackupPageHeader *bph,
-							pg_crc32 *crc);
-
-/* Implementation of zlib compression method */
-static int32
-zlib_compress(void *dst, size_t dst_size, void const *src, size_t src_size,
-			  int level)
-{
-	uLongf 	compressed_size = dst_size;
-	int 	rc = compress2(dst, &compressed_size, src, src_size,
-					   level);
-
-	return rc == Z_OK ? compressed_size : rc;
-}
-
-/* Implementation of zlib compression method */
-static int32
-zlib_decompress(void *dst, size_t dst_size, void const *src, size_t src_size)
+/* Copy of the destination file in one member of the parent chain */
+typedef struct RestoreSource
 {
-	uLongf dest_len = dst_size;
-	int 	rc = uncompress(dst, &dest_len, src, src_size);
-
-	return rc == Z_OK ? dest_len : rc;
-}
+	pgBackup   *backup;
+	pgFile	   *file;			/* NULL, if nothing is taken from the backup */
+	pgFile		file_buf;		/* storage for backup_lookup_file() */
+	BackupPageHeader2 *headers;
+	int			n_owned;		/* number of blocks taken from the backup,
+								 * -1 if unknown */
+} RestoreSource;
 
-/*
- * Compresses source into dest using algorithm. Returns the number of bytes
- * written in the destination buffer, or -1 if compression fails.
- */
-int32
-do_compress(void *dst, size_t dst_size, void const *src, size_t src_size,
-			CompressAlg alg, int level, const char **errormsg)
-{
-	switch (alg)
-	{
-		case NONE_COMPRESS:
-		case NOT_DEFINED_COMPRESS:
-			return -1;
-		case ZLIB_COMPRESS:
-		{
-			int32 ret;
-			ret = zlib_compress(dst, dst_size, src, src_size, level);
-			if (ret < Z_OK && errormsg)
-				*errormsg = zError(ret);
-			return ret;
-		}
-	}
-
-	return -1;
-}
+static bool get_page_header(FILE *in, const char *fullpath, BackupPageHeader *bph,
+							pg_crc32 *crc);
+static bool restored_page_is_zero(const char *data, int32 compressed_size,
+								  bool is_compressed, CompressAlg alg);
+static void restore_zero_range(FILE *out, off_t offs, off_t len,
+							   const char *to_fullpath);
+static void restore_compute_block_owners(RestoreSource *sources, int n_sources,
+										 pgFile *dest_file, datapagemap_t *map,
+										 PageState *checksum_map, XLogRecPtr shift_lsn,
+										 datapagemap_t *lsn_map,
+										 BlockNumber start_block, BlockNumber end_block);
 
-/*
- * Decompresses source into dest using algorithm. Returns the number of bytes
- * decompressed in the destination buffer, or -1 if decompression fails.
- */
-int32
-do_decompress(void *dst, size_t dst_size, void const *src, size_t src_size,
-			  CompressAlg alg, const char **errormsg)
-{
-	switch (alg)
-	{
-		case NONE_COMPRESS:
-		case NOT_DEFINED_COMPRESS:
-			if (errormsg)
-				*errormsg = "Invalid compression algorithm";
-			return -1;
-		case ZLIB_COMPRESS:
-		{
-			int32 ret;
-			ret = zlib_decompress(dst, dst_size, src, src_size);
-			if (ret < Z_OK && errormsg)
-				*errormsg = zError(ret);
-			return ret;
-		}
-	}
+#define ZLIB_MAGIC 0x78
 
-	return -1;
-}
+/* data files are scanned for incremental restore by chunks of this size */
+#define MAP_SCAN_CHUNK_BLOCKS	128
 
-#define ZLIB_MAGIC 0x78
+/* zero page is compressed by any supported algorithm to less than this */
+#define ZERO_PAGE_MAX_COMPRESSED_SIZE	512
 
 /*
  * TODO: we probably can drop it
@@ -241,6 +191,153 @@ get_checksum_errormsg(Page page, char **errormsg, BlockNumber absolute_blkno)
 			 pg_checksum_page(page, absolute_blkno));
 }
 
+/*
+ * Reader of pages of a local data file. Pages are requested one by one in
+ * ascending order, but contiguous runs of requested pages are read from disk
+ * by a single system call of up to PAGE_READER_EXTENT pages.
+ */
+#define PAGE_READER_EXTENT	64
+
+#ifndef PG_IO_ALIGN_SIZE
+#define PG_IO_ALIGN_SIZE	4096
+#endif
+
+typedef struct PageReader
+{
+	int			fd;
+	/* blocks to be requested, NULL if all blocks are requested */
+	datapagemap_t *pagemap;
+	/* blocks starting from this one are never requested */
+	BlockNumber n_blocks;
+
+	/* pages read from disk, buf is aligned for direct I/O */
+	char	   *buf_raw;
+	char	   *buf;
+	BlockNumber first_block;
+	int			n_pages;
+} PageReader;
+
+/*
+ * Open local file for reading, bypassing the page cache if --direct-io
+ * is used. Not every filesystem supports direct I/O, fall back to buffered
+ * reads in that case.
+ */
+static int
+open_local_file_ro(const char *fullpath)
+{
+	int			fd = -1;
+
+#ifdef O_DIRECT
+	if (direct_io)
+	{
+		fd = open(fullpath, O_RDONLY | PG_BINARY | O_DIRECT, 0);
+		if (fd >= 0 || errno != EINVAL)
+			return fd;
+
+		elog(VERBOSE, "Direct I/O is not supported for file \"%s\"", fullpath);
+	}
+#endif
+
+	fd = open(fullpath, O_RDONLY | PG_BINARY, 0);
+	return fd;
+}
+
+/* Allocate a buffer suitable for direct I/O */
+static char *
+alloc_aligned_buffer(size_t size, char **buf_raw)
+{
+	*buf_raw = pgut_malloc(size + PG_IO_ALIGN_SIZE);
+	return (char *) TYPEALIGN(PG_IO_ALIGN_SIZE, *buf_raw);
+}
+
+/*
+ * Open data file for reading the blocks of the pagemap, or all the blocks
+ * if pagemap is NULL. Returns false if the file cannot be opened.
+ */
+static bool
+page_reader_open(PageReader *reader, const char *fullpath,
+				 datapagemap_t *pagemap, BlockNumber n_blocks)
+{
+	reader->fd = open_local_file_ro(fullpath);
+	if (reader->fd < 0)
+		return false;
+
+	reader->pagemap = pagemap;
+	reader->n_blocks = n_blocks;
+	reader->buf = alloc_aligned_buffer(PAGE_READER_EXTENT * BLCKSZ,
+									   &reader->buf_raw);
+	reader->first_block = 0;
+	reader->n_pages = 0;
+
+	return true;
+}
+
+static void
+page_reader_close(PageReader *reader, const char *fullpath)
+{
+	if (close(reader->fd) != 0)
+		elog(ERROR, "Cannot close the source file \"%s\": %s",
+			 fullpath, strerror(errno));
+
+	pg_free(reader->buf_raw);
+	reader->fd = -1;
+}
+
+/*
+ * Read block blknum into page. Unless the page was read along with the
+ * previous ones, the run of requested blocks starting with this one is read.
+ * If reread is true, the block is read from disk anyway.
+ * Returns the number of bytes read, like fio_pread() does.
+ */
+static int
+page_reader_read(PageReader *reader, BlockNumber blknum, Page page, bool reread)
+{
+	BlockNumber	n_blocks = 1;
+	size_t		read_len = 0;
+
+	if (!reread && blknum >= reader->first_block &&
+		blknum < reader->first_block + reader->n_pages)
+	{
+		memcpy(page, reader->buf + (blknum - reader->first_block) * BLCKSZ, BLCKSZ);
+		return BLCKSZ;
+	}
+
+	if (!reread)
+	{
+		while (n_blocks < PAGE_READER_EXTENT &&
+			   blknum + n_blocks < reader->n_blocks &&
+			   (reader->pagemap == NULL ||
+				datapagemap_is_set(reader->pagemap, blknum + n_blocks)))
+			n_blocks++;
+	}
+
+	while (read_len < n_blocks * BLCKSZ)
+	{
+		ssize_t		rc = pread(reader->fd, reader->buf + read_len,
+							   n_blocks * BLCKSZ - read_len,
+							   (off_t) blknum * BLCKSZ + read_len);
+
+		if (rc < 0)
+			return rc;
+		if (rc == 0)
+			break;
+		read_len += rc;
+	}
+
+	reader->first_block = blknum;
+	reader->n_pages = read_len / BLCKSZ;
+
+	/* the block is truncated or read partially */
+	if (read_len < BLCKSZ)
+	{
+		memcpy(page, reader->buf, read_len);
+		return read_len;
+	}
+
+	memcpy(page, reader->buf, BLCKSZ);
+	return BLCKSZ;
+}
+
 /*
  * Retrieves a page taking the backup mode into account
  * and writes it into argument "page". Argument "page"
@@ -260,7 +357,7 @@ get_checksum_errormsg(Page page, char **errormsg, BlockNumber absolute_blkno)
  */
 static int32
 prepare_page(pgFile *file, XLogRecPtr prev_backup_start_lsn,
-			 BlockNumber blknum, FILE *in,
+			 BlockNumber blknum, PageReader *reader,
 			 BackupMode backup_mode,
 			 Page page, bool strict,
 			 uint32 checksum_version,
@@ -283,8 +380,12 @@ prepare_page(pgFile *file, XLogRecPtr prev_backup_start_lsn,
 	 */
 	while (!page_is_valid && try_again--)
 	{
-		/* read the block */
-		int read_len = fio_pread(in, page, blknum * BLCKSZ);
+		/*
+		 * Read the block. Do not use once read data on further attempts,
+		 * see PBCKP-150.
+		 */
+		int read_len = page_reader_read(reader, blknum, page,
+										try_again < PAGE_READ_ATTEMPTS - 1);
 
 		/* The block could have been truncated. It is fine. */
 		if (read_len == 0)
@@ -333,8 +434,6 @@ prepare_page(pgFile *file, XLogRecPtr prev_backup_start_lsn,
 					Assert(false);
 			}
 		}
-		/* avoid re-reading once buffered data, flushing on further attempts, see PBCKP-150 */
-		fflush(in);
 	}
 
 	/*
@@ -397,7 +496,7 @@ prepare_page(pgFile *file, XLogRecPtr prev_backup_start_lsn,
 /* split this function in two: compress() and backup() */
 static int
 compress_and_backup_page(pgFile *file, BlockNumber blknum,
-						FILE *in, FILE *out, pg_crc32 *crc,
+						FILE *out, pg_crc32 *crc,
 						int page_state, Page page,
 						CompressAlg calg, int clevel,
 						const char *from_fullpath, const char *to_fullpath)
@@ -807,93 +906,148 @@ backup_non_data_file(pgFile *file, pgFile *prev_file,
  * Iterate over parent backup chain and lookup given destination file in
  * filelist of every chain member starting with FULL backup.
  * Apply changed blocks to destination file from every backup in parent chain.
+ * If "sparse" is true, the destination file is known to be zero-filled up to
+ * n_blocks of dest_file (e.g. preallocated by fio_fpreallocate()), so zero
+ * pages are not written at all.  Otherwise, if "punch_holes" is true,
+ * zero pages are deallocated instead of being written.
  */
 size_t
 restore_data_file(parray *parent_chain, pgFile *dest_file, FILE *out,
 				  const char *to_fullpath, bool use_bitmap, PageState *checksum_map,
-				  XLogRecPtr shift_lsn, datapagemap_t *lsn_map, bool use_headers)
+				  XLogRecPtr shift_lsn, datapagemap_t *lsn_map, bool use_headers,
+				  bool sparse, bool punch_holes)
+{
+	return restore_data_file_range(parent_chain, dest_file, out, to_fullpath,
+								   use_bitmap ? &(dest_file->pagemap) : NULL,
+								   checksum_map, shift_lsn, lsn_map, use_headers,
+								   0, InvalidBlockNumber, sparse, punch_holes);
+}
+
+/*
+ * Same as restore_data_file(), but only blocks from start_block up to
+ * end_block (exclusive, InvalidBlockNumber means no limit) are restored.
+ * Blocks, which are already restored, are marked in the map, if it is not NULL.
+ * Several threads may restore different block ranges of the same file,
+ * each of them using its own map.
+ */
+size_t
+restore_data_file_range(parray *parent_chain, pgFile *dest_file, FILE *out,
+						const char *to_fullpath, datapagemap_t *map,
+						PageState *checksum_map, XLogRecPtr shift_lsn,
+						datapagemap_t *lsn_map, bool use_headers,
+						BlockNumber start_block, BlockNumber end_block,
+						bool sparse, bool punch_holes)
 {
 	size_t total_write_len = 0;
 	char  *in_buf = pgut_malloc(STDIO_BUFSIZE);
-	int    backup_seq = 0;
+	int    n_sources = parray_num(parent_chain);
+	RestoreSource *sources = pgut_malloc0(sizeof(RestoreSource) * Max(n_sources, 1));
+	bool   use_bitmap = map != NULL;
+	int    i;
 
 	/*
 	 * FULL -> INCR -> DEST
 	 *  2       1       0
 	 * Restore of backups of older versions cannot be optimized with bitmap
-	 * because of n_blocks
+	 * because of n_blocks, so sources are applied starting with dest backup
+	 * if bitmap is used, and starting with FULL backup otherwise.
 	 */
-	if (use_bitmap)
-		/* start with dest backup  */
-		backup_seq = 0;
-	else
-		/* start with full backup */
-		backup_seq = parray_num(parent_chain) - 1;
-
-//	for (i = parray_num(parent_chain) - 1; i >= 0; i--)
-//	for (i = 0; i < parray_num(parent_chain); i++)
-	while (backup_seq >= 0 && backup_seq < parray_num(parent_chain))
+	for (i = 0; i < n_sources; i++)
 	{
-		char     from_root[MAXPGPATH];
-		char     from_fullpath[MAXPGPATH];
-		FILE    *in = NULL;
-
-		pgFile **res_file = NULL;
-		pgFile  *tmp_file = NULL;
-
-		/* page headers */
-		BackupPageHeader2 *headers = NULL;
+		RestoreSource *src = &sources[i];
+		int		backup_seq = use_bitmap ? i : n_sources - 1 - i;
 
-		pgBackup *backup = (pgBackup *) parray_get(parent_chain, backup_seq);
-
-		if (use_bitmap)
-			backup_seq++;
-		else
-			backup_seq--;
+		src->backup = (pgBackup *) parray_get(parent_chain, backup_seq);
+		src->n_owned = -1;
 
 		/* lookup file in intermediate backup */
-		res_file = parray_bsearch(backup->files, dest_file, pgFileCompareRelPath);
-		tmp_file = (res_file) ? *res_file : NULL;
+		src->file = backup_lookup_file(src->backup, dest_file, &src->file_buf);
 
 		/* Destination file is not exists yet at this moment */
-		if (tmp_file == NULL)
+		if (src->file == NULL)
 			continue;
 
 		/*
 		 * Skip file if it haven't changed since previous backup
 		 * and thus was not backed up.
 		 */
-		if (tmp_file->write_size == BYTES_INVALID)
+		if (src->file->write_size == BYTES_INVALID)
+		{
+			src->file = NULL;
 			continue;
+		}
 
 		/* If file was truncated in intermediate backup,
 		 * it is ok not to truncate it now, because old blocks will be
 		 * overwritten by new blocks from next backup.
 		 */
-		if (tmp_file->write_size == 0)
+		if (src->file->write_size == 0)
+		{
+			src->file = NULL;
+			continue;
+		}
+
+		/* get headers for this file */
+		if (use_headers && src->file->n_headers > 0)
+		{
+			src->headers = get_data_file_headers(&(src->backup->hdr_map), src->file, true);
+
+			if (!src->headers)
+				elog(ERROR, "Failed to get page headers for file \"%s\" in backup %s",
+					 src->file->rel_path, backup_id_of(src->backup));
+		}
+	}
+
+	/*
+	 * With bitmap every block is taken from the newest backup containing it,
+	 * so find out which backups do contribute, before opening any of them.
+	 */
+	if (use_bitmap && use_headers)
+		restore_compute_block_owners(sources, n_sources, dest_file, map,
+									 checksum_map, shift_lsn, lsn_map,
+									 start_block, end_block);
+
+	for (i = 0; i < n_sources; i++)
+	{
+		RestoreSource *src = &sources[i];
+		pgBackup *backup = src->backup;
+		char     from_root[MAXPGPATH];
+		char     from_fullpath[MAXPGPATH];
+		FILE    *in = NULL;
+		bool     src_sparse;
+
+		if (src->file == NULL)
 			continue;
 
+		/*
+		 * Without bitmap zero page of newer backup must overwrite the page
+		 * restored from older one, so only the first backup may skip them.
+		 * Backups without page headers may truncate file on the fly.
+		 */
+		src_sparse = sparse && src->headers != NULL &&
+			(use_bitmap || total_write_len == 0);
+
 		/*
 		 * At this point we are sure, that something is going to be copied
 		 * Open source file.
 		 */
 		join_path_components(from_root, backup->root_dir, DATABASE_DIR);
-		join_path_components(from_fullpath, from_root, tmp_file->rel_path);
+		join_path_components(from_fullpath, from_root, src->file->rel_path);
 
 		in = fopen(from_fullpath, PG_BINARY_R);
 		if (in == NULL)
 			elog(ERROR, "Cannot open backup file \"%s\": %s", from_fullpath,
 				 strerror(errno));
 
-		/* set stdio buffering for input data file */
-		setvbuf(in, in_buf, _IOFBF, STDIO_BUFSIZE);
-
-		/* get headers for this file */
-		if (use_headers && tmp_file->n_headers > 0)
-			headers = get_data_file_headers(&(backup->hdr_map), tmp_file, true);
-
-		if (use_headers && !headers && tmp_file->n_headers > 0)
-			elog(ERROR, "Failed to get page headers for file \"%s\"", from_fullpath);
+		/*
+		 * Set stdio buffering for input data file. If only a few scattered
+		 * blocks are taken from the file, buffering would read the whole
+		 * buffer around every one of them, so read exactly the blocks.
+		 */
+		if (src->n_owned >= 0 && src->n_owned < src->file->n_headers / 4)
+			setvbuf(in, NULL, _IONBF, 0);
+		else
+			setvbuf(in, in_buf, _IOFBF, STDIO_BUFSIZE);
 
 		/*
 		 * Restore the file.
@@ -901,48 +1055,146 @@ restore_data_file(parray *parent_chain, pgFile *dest_file, FILE *out,
 		 * have BackupPageHeader with meta information, so we cannot just
 		 * copy the file from backup.
 		 */
-		total_write_len += restore_data_file_internal(in, out, tmp_file,
+		total_write_len += restore_data_file_internal(in, out, src->file,
 													  backup->program_version_num,
 													  from_fullpath, to_fullpath, dest_file->n_blocks,
-													  use_bitmap ? &(dest_file)->pagemap : NULL,
-													  checksum_map, backup->checksum_version,
+													  map, checksum_map, backup->checksum_version,
 													  /* shiftmap can be used only if backup state precedes the shift */
 													  backup->stop_lsn <= shift_lsn ? lsn_map : NULL,
-													  headers);
+													  src->headers, start_block, end_block,
+													  src_sparse, punch_holes);
 
 		if (fclose(in) != 0)
 			elog(ERROR, "Cannot close file \"%s\": %s", from_fullpath,
 				strerror(errno));
-
-		pg_free(headers);
-
-//		datapagemap_print_debug(&(dest_file)->pagemap);
 	}
+
+	for (i = 0; i < n_sources; i++)
+		pg_free(sources[i].headers);
+	pg_free(sources);
 	pg_free(in_buf);
 
 	return total_write_len;
 }
 
+/*
+ * Find out which source owns the final version of every block of the
+ * range, using page headers only. Sources are ordered from dest backup
+ * to FULL backup, as they are applied with bitmap, and the marking of
+ * blocks follows restore_data_file_internal(), so the blocks owned by
+ * a source are exactly the blocks it's going to write.
+ * Sources, which own no blocks, are reset to NULL file, so their copies
+ * of the file are not opened at all.
+ */
+static void
+restore_compute_block_owners(RestoreSource *sources, int n_sources,
+							 pgFile *dest_file, datapagemap_t *map,
+							 PageState *checksum_map, XLogRecPtr shift_lsn,
+							 datapagemap_t *lsn_map,
+							 BlockNumber start_block, BlockNumber end_block)
+{
+	datapagemap_t owned;
+	int			n_contributing = 0;
+	int			i;
+
+	/* blocks, which are already in place, are owned by nobody */
+	owned.bitmapsize = map->bitmapsize;
+	owned.bitmap = NULL;
+	if (map->bitmapsize > 0)
+	{
+		owned.bitmap = pgut_malloc(map->bitmapsize);
+		memcpy(owned.bitmap, map->bitmap, map->bitmapsize);
+	}
+
+	for (i = 0; i < n_sources; i++)
+	{
+		RestoreSource *src = &sources[i];
+		datapagemap_t *src_lsn_map;
+		int			n_hdr;
+
+		if (src->file == NULL)
+			continue;
+
+		/*
+		 * Without headers blocks of the file are unknown, so this source
+		 * and all older ones have to be read.
+		 */
+		if (src->headers == NULL)
+			break;
+
+		/* shiftmap can be used only if backup state precedes the shift */
+		src_lsn_map = src->backup->stop_lsn <= shift_lsn ? lsn_map : NULL;
+		src->n_owned = 0;
+
+		for (n_hdr = 0; n_hdr < src->file->n_headers; n_hdr++)
+		{
+			BackupPageHeader2 *hdr = &src->headers[n_hdr];
+			BlockNumber blknum = hdr->block;
+
+			if (dest_file->n_blocks > 0 && blknum >= (BlockNumber) dest_file->n_blocks)
+				break;
+			if (end_block != InvalidBlockNumber && blknum >= end_block)
+				break;
+			if (blknum < start_block)
+				continue;
+
+			if (src_lsn_map && datapagemap_is_set(src_lsn_map, blknum))
+				datapagemap_add(&owned, blknum);
+
+			if (checksum_map && checksum_map[blknum].checksum != 0 &&
+				hdr->checksum == checksum_map[blknum].checksum &&
+				hdr->lsn == checksum_map[blknum].lsn)
+				datapagemap_add(&owned, blknum);
+
+			if (datapagemap_is_set(&owned, blknum))
+				continue;
+
+			datapagemap_add(&owned, blknum);
+			src->n_owned++;
+		}
+
+		if (src->n_owned == 0)
+			src->file = NULL;
+		else
+			n_contributing++;
+	}
+
+	if (i == n_sources)
+		elog(VERBOSE, "File \"%s\" is restored from %i of %i backups",
+			 dest_file->rel_path, n_contributing, n_sources);
+
+	pg_free(owned.bitmap);
+}
+
 /* Restore block from "in" file to "out" file.
  * If "nblocks" is greater than zero, then skip restoring blocks,
  * whose position if greater than "nblocks".
+ * Blocks outside of [start_block, end_block) range are skipped too.
  * If map is NULL, then page bitmap cannot be used for restore optimization
  * Page bitmap optimize restore of incremental chains, consisting of more than one
  * backup. We restoring from newest to oldest and page, once restored, marked in map.
  * When the same page, but in older backup, encountered, we check the map, if it is
  * marked as already restored, then page is skipped.
+ * Zero pages are not written, if "sparse" is true. Otherwise, if "punch_holes"
+ * is true, runs of zero pages are zeroed by fio_fzero_range(), which
+ * deallocates their space if possible, and zero pages are written as any
+ * other page if it is false.
  */
 size_t
 restore_data_file_internal(FILE *in, FILE *out, pgFile *file, uint32 backup_version_num,
 						   const char *from_fullpath, const char *to_fullpath, int nblocks,
 						   datapagemap_t *map, PageState *checksum_map, int checksum_version,
-						   datapagemap_t *lsn_map, BackupPageHeader2 *headers)
+						   datapagemap_t *lsn_map, BackupPageHeader2 *headers,
+						   BlockNumber start_block, BlockNumber end_block,
+						   bool sparse, bool punch_holes)
 {
 	BlockNumber	blknum = 0;
 	int n_hdr = -1;
 	size_t write_len = 0;
 	off_t cur_pos_out = 0;
 	off_t cur_pos_in = 0;
+	off_t zero_start = 0;	/* run of zero pages to be zeroed at once */
+	off_t zero_len = 0;
 
 	/* should not be possible */
 	Assert(file->n_headers > 0);
@@ -1036,6 +1288,12 @@ restore_data_file_internal(FILE *in, FILE *out, pgFile *file, uint32 backup_vers
 
 			elog(VERBOSE, "Truncate file \"%s\" to block %u", to_fullpath, blknum);
 
+			if (zero_len > 0)
+			{
+				restore_zero_range(out, zero_start, zero_len, to_fullpath);
+				zero_len = 0;
+			}
+
 			/* To correctly truncate file, we must first flush STDIO buffers */
 			if (fio_fflush(out) != 0)
 				elog(ERROR, "Cannot flush file \"%s\": %s", to_fullpath, strerror(errno));
@@ -1057,6 +1315,19 @@ restore_data_file_internal(FILE *in, FILE *out, pgFile *file, uint32 backup_vers
 		if (nblocks > 0 && blknum >= nblocks)
 			break;
 
+		/* blocks are stored in ascending order, so the rest of range is done */
+		if (end_block != InvalidBlockNumber && blknum >= end_block)
+			break;
+
+		/* block belongs to another range */
+		if (blknum < start_block)
+		{
+			if (!headers && fseek(in, read_len, SEEK_CUR) != 0)
+				elog(ERROR, "Cannot seek block %u of \"%s\": %s",
+					blknum, from_fullpath, strerror(errno));
+			continue;
+		}
+
 		if (compressed_size > BLCKSZ)
 			elog(ERROR, "Size of a blknum %i exceed BLCKSZ: %i", blknum, compressed_size);
 
@@ -1125,12 +1396,40 @@ restore_data_file_internal(FILE *in, FILE *out, pgFile *file, uint32 backup_vers
 			is_compressed = true;
 		}
 
+		write_pos = blknum * BLCKSZ;
+
+		/* Zero pages do not need to be written */
+		if ((sparse || punch_holes) &&
+			restored_page_is_zero(page.data, compressed_size, is_compressed,
+								  file->compress_alg))
+		{
+			/* adjacent zero pages are zeroed by one call */
+			if (!sparse)
+			{
+				if (zero_len > 0 && zero_start + zero_len != write_pos)
+				{
+					restore_zero_range(out, zero_start, zero_len, to_fullpath);
+					/* position in file is unknown now */
+					cur_pos_out = -1;
+					zero_len = 0;
+				}
+
+				if (zero_len == 0)
+					zero_start = write_pos;
+				zero_len += BLCKSZ;
+			}
+
+			write_len += BLCKSZ;
+			if (map)
+				datapagemap_add(map, blknum);
+			continue;
+		}
+
 		/*
 		 * Seek and write the restored page.
 		 * When restoring file from FULL backup, pages are written sequentially,
 		 * so there is no need to issue fseek for every page.
 		 */
-		write_pos = blknum * BLCKSZ;
 
 		if (cur_pos_out != write_pos)
 		{
@@ -1169,10 +1468,54 @@ restore_data_file_internal(FILE *in, FILE *out, pgFile *file, uint32 backup_vers
 			datapagemap_add(map, blknum);
 	}
 
+	if (zero_len > 0)
+		restore_zero_range(out, zero_start, zero_len, to_fullpath);
+
 	elog(LOG, "Copied file \"%s\": %lu bytes", from_fullpath, write_len);
 	return write_len;
 }
 
+/*
+ * Zero range of restored file. Position in file is undefined afterwards.
+ */
+static void
+restore_zero_range(FILE *out, off_t offs, off_t len, const char *to_fullpath)
+{
+	if (fio_fzero_range(out, offs, len) != 0)
+		elog(ERROR, "Cannot zero blocks %u-%u of \"%s\": %s",
+			 (BlockNumber) (offs / BLCKSZ), (BlockNumber) ((offs + len) / BLCKSZ - 1),
+			 to_fullpath, strerror(errno));
+}
+
+/*
+ * Check if the page read from backup consists of zeros only.
+ * Compressed pages are decompressed only if they are small enough
+ * to be a compressed zero page.
+ */
+static bool
+restored_page_is_zero(const char *data, int32 compressed_size, bool is_compressed,
+					  CompressAlg alg)
+{
+	static const char zero_page[BLCKSZ];
+	char		buf[BLCKSZ];
+
+	if (is_compressed)
+	{
+		const char *errormsg = NULL;
+
+		if (compressed_size > ZERO_PAGE_MAX_COMPRESSED_SIZE)
+			return false;
+
+		/* broken page is reported when it's written */
+		if (do_decompress(buf, BLCKSZ, data, compressed_size, alg, &errormsg) != BLCKSZ)
+			return false;
+
+		data = buf;
+	}
+
+	return memcmp(data, zero_page, BLCKSZ) == 0;
+}
+
 /*
  * Copy file to backup.
  * We do not apply compression to these files, because they are small-sized.
@@ -1225,6 +1568,7 @@ restore_non_data_file(parray *parent_chain, pgBackup *dest_backup,
 	FILE		*in = NULL;
 
 	pgFile		*tmp_file = NULL;
+	pgFile		 tmp_file_buf;
 	pgBackup	*tmp_backup = NULL;
 
 	/* Check if full copy of destination file is available in destination backup */
@@ -1245,11 +1589,8 @@ restore_non_data_file(parray *parent_chain, pgBackup *dest_backup,
 		tmp_backup = dest_backup->parent_backup_link;
 		while (tmp_backup)
 		{
-			pgFile	**res_file = NULL;
-
 			/* lookup file in intermediate backup */
-			res_file =  parray_bsearch(tmp_backup->files, dest_file, pgFileCompareRelPath);
-			tmp_file = (res_file) ? *res_file : NULL;
+			tmp_file = backup_lookup_file(tmp_backup, dest_file, &tmp_file_buf);
 
 			/*
 			 * It should not be possible not to find destination file in intermediate
@@ -1345,10 +1686,11 @@ backup_non_data_file_internal(const char *from_fullpath,
 							const char *to_fullpath, pgFile *file,
 							bool missing_ok)
 {
-	FILE	*in = NULL;
+	int		 in = -1;
 	FILE	*out = NULL;
 	ssize_t  read_len = 0;
 	char	*buf = NULL;
+	char	*buf_raw = NULL;
 
 	INIT_CRC32C(file->crc);
 
@@ -1403,8 +1745,8 @@ backup_non_data_file_internal(const char *from_fullpath,
 	else
 	{
 		/* open source file for read */
-		in = fopen(from_fullpath, PG_BINARY_R);
-		if (in == NULL)
+		in = open_local_file_ro(from_fullpath);
+		if (in < 0)
 		{
 			/* maybe deleted, it's not error in case of backup */
 			if (errno == ENOENT)
@@ -1423,35 +1765,31 @@ backup_non_data_file_internal(const char *from_fullpath,
 				 strerror(errno));
 		}
 
-		/* disable stdio buffering for local input/output files to avoid triple buffering */
-		setvbuf(in, NULL, _IONBF, BUFSIZ);
+		/* disable stdio buffering for local output file to avoid triple buffering */
 		setvbuf(out, NULL, _IONBF, BUFSIZ);
 
-		/* allocate 64kB buffer */
-		buf = pgut_malloc(CHUNK_SIZE);
+		/* allocate 128kB buffer, aligned for direct I/O */
+		buf = alloc_aligned_buffer(CHUNK_SIZE, &buf_raw);
 
 		/* copy content and calc CRC */
 		for (;;)
 		{
-			read_len = fread(buf, 1, CHUNK_SIZE, in);
+			read_len = read(in, buf, CHUNK_SIZE);
 
-			if (ferror(in))
+			if (read_len < 0)
 				elog(ERROR, "Cannot read from file \"%s\": %s",
 					 from_fullpath, strerror(errno));
 
-			if (read_len > 0)
-			{
-				if (fwrite(buf, 1, read_len, out) != read_len)
-					elog(ERROR, "Cannot write to file \"%s\": %s", to_fullpath,
-						 strerror(errno));
+			if (read_len == 0)
+				break;
 
-				/* update CRC */
-				COMP_CRC32C(file->crc, buf, read_len);
-				file->read_size += read_len;
-			}
+			if (fwrite(buf, 1, read_len, out) != read_len)
+				elog(ERROR, "Cannot write to file \"%s\": %s", to_fullpath,
+					 strerror(errno));
 
-			if (feof(in))
-				break;
+			/* update CRC */
+			COMP_CRC32C(file->crc, buf, read_len);
+			file->read_size += read_len;
 		}
 	}
 
@@ -1464,13 +1802,13 @@ cleanup:
 	/* finish CRC calculation and store into pgFile */
 	FIN_CRC32C(file->crc);
 
-	if (in && fclose(in))
+	if (in >= 0 && close(in))
 		elog(ERROR, "Cannot close the file \"%s\": %s", from_fullpath, strerror(errno));
 
 	if (out && fclose(out))
 		elog(ERROR, "Cannot close the file \"%s\": %s", to_fullpath, strerror(errno));
 
-	pg_free(buf);
+	pg_free(buf_raw);
 }
 
 /*
@@ -1570,15 +1908,21 @@ bool
 check_data_file(ConnectionArgs *arguments, pgFile *file,
 				const char *from_fullpath, uint32 checksum_version)
 {
-	FILE		*in;
+	PageReader	reader;
 	BlockNumber	blknum = 0;
 	BlockNumber	nblocks = 0;
 	int			page_state;
 	char		curr_page[BLCKSZ];
 	bool		is_valid = true;
 
-	in = fopen(from_fullpath, PG_BINARY_R);
-	if (in == NULL)
+	/*
+	 * Compute expected number of blocks in the file.
+	 * NOTE This is a normal situation, if the file size has changed
+	 * since the moment we computed it.
+	 */
+	nblocks = file->size/BLCKSZ;
+
+	if (!page_reader_open(&reader, from_fullpath, NULL, nblocks))
 	{
 		/*
 		 * If file is not found, this is not en error.
@@ -1598,18 +1942,11 @@ check_data_file(ConnectionArgs *arguments, pgFile *file,
 	if (file->size % BLCKSZ != 0)
 		elog(WARNING, "File: \"%s\", invalid file size %zu", from_fullpath, file->size);
 
-	/*
-	 * Compute expected number of blocks in the file.
-	 * NOTE This is a normal situation, if the file size has changed
-	 * since the moment we computed it.
-	 */
-	nblocks = file->size/BLCKSZ;
-
 	for (blknum = 0; blknum < nblocks; blknum++)
 	{
 		PageState page_st;
 		page_state = prepare_page(file, InvalidXLogRecPtr,
-								  blknum, in, BACKUP_MODE_FULL,
+								  blknum, &reader, BACKUP_MODE_FULL,
 								  curr_page, false, checksum_version,
 								  from_fullpath, &page_st);
 
@@ -1626,7 +1963,7 @@ check_data_file(ConnectionArgs *arguments, pgFile *file,
 		}
 	}
 
-	fclose(in);
+	page_reader_close(&reader, from_fullpath);
 	return is_valid;
 }
 
@@ -1836,71 +2173,99 @@ validate_file_pages(pgFile *file, const char *fullpath, XLogRecPtr stop_lsn,
 	return is_valid;
 }
 
-/* read local data file and construct map with block checksums */
-PageState*
-get_checksum_map(const char *fullpath, uint32 checksum_version,
-							int n_blocks, XLogRecPtr dest_stop_lsn, BlockNumber segmentno)
+/*
+ * Open local data file to build a map for incremental restore.
+ * The file is truncated up to n_blocks first.
+ */
+static int
+map_scan_open(const char *fullpath, int n_blocks)
 {
-	PageState  *checksum_map = NULL;
-	FILE       *in = NULL;
-	BlockNumber blknum = 0;
-	char        read_buffer[BLCKSZ];
-	char        in_buf[STDIO_BUFSIZE];
+	int			fd = open(fullpath, O_RDWR | PG_BINARY, 0);
 
-	/* open file */
-	in = fopen(fullpath, "r+b");
-	if (!in)
+	if (fd < 0)
 		elog(ERROR, "Cannot open source file \"%s\": %s", fullpath, strerror(errno));
 
 	/* truncate up to blocks */
-	if (ftruncate(fileno(in), n_blocks * BLCKSZ) != 0)
+	if (ftruncate(fd, (off_t) n_blocks * BLCKSZ) != 0)
 		elog(ERROR, "Cannot truncate file to blknum %u \"%s\": %s",
 				n_blocks, fullpath, strerror(errno));
 
-	setvbuf(in, in_buf, _IOFBF, STDIO_BUFSIZE);
+	return fd;
+}
+
+/*
+ * Read n_pages starting with blknum into buf. Files are scanned
+ * sequentially by large chunks, MAP_SCAN_CHUNK_BLOCKS at a time.
+ */
+static void
+map_scan_read(int fd, char *buf, int n_pages, BlockNumber blknum,
+			  const char *fullpath)
+{
+	size_t		len = (size_t) n_pages * BLCKSZ;
+	size_t		done = 0;
+
+	while (done < len)
+	{
+		ssize_t		rc = read(fd, buf + done, len - done);
+
+		if (rc < 0)
+		{
+			if (errno == EINTR)
+				continue;
+			elog(ERROR, "Cannot read block %u of \"%s\": %s",
+				 blknum + (BlockNumber) (done / BLCKSZ), fullpath, strerror(errno));
+		}
+		if (rc == 0)
+			elog(ERROR, "Failed to read blknum %u from file \"%s\"",
+				 blknum + (BlockNumber) (done / BLCKSZ), fullpath);
+		done += rc;
+	}
+
+	if (interrupted || thread_interrupted)
+		elog(ERROR, "Interrupted during page reading");
+}
+
+/* read local data file and construct map with block checksums */
+PageState*
+get_checksum_map(const char *fullpath, uint32 checksum_version,
+							int n_blocks, XLogRecPtr dest_stop_lsn, BlockNumber segmentno)
+{
+	PageState  *checksum_map = NULL;
+	int         fd;
+	BlockNumber blknum = 0;
+	char       *read_buffer = pgut_malloc(MAP_SCAN_CHUNK_BLOCKS * BLCKSZ);
+
+	fd = map_scan_open(fullpath, n_blocks);
 
 	/* initialize array of checksums */
 	checksum_map = pgut_malloc(n_blocks * sizeof(PageState));
 	memset(checksum_map, 0, n_blocks * sizeof(PageState));
 
-	for (blknum = 0; blknum < n_blocks;  blknum++)
+	while (blknum < n_blocks)
 	{
-		size_t read_len = fread(read_buffer, 1, BLCKSZ, in);
-		PageState page_st;
+		int			n_pages = Min(MAP_SCAN_CHUNK_BLOCKS, n_blocks - blknum);
+		int			i;
 
-		/* report error */
-		if (ferror(in))
-			elog(ERROR, "Cannot read block %u of \"%s\": %s",
-					blknum, fullpath, strerror(errno));
+		map_scan_read(fd, read_buffer, n_pages, blknum, fullpath);
 
-		if (read_len == BLCKSZ)
+		for (i = 0; i < n_pages; i++, blknum++)
 		{
-			int rc = validate_one_page(read_buffer, segmentno + blknum,
+			PageState page_st;
+			int rc = validate_one_page(read_buffer + (size_t) i * BLCKSZ,
+									   segmentno + blknum,
 									   dest_stop_lsn, &page_st,
 									   checksum_version);
 
 			if (rc == PAGE_IS_VALID)
 			{
-//				if (checksum_version)
-//					checksum_map[blknum].checksum = ((PageHeader) read_buffer)->pd_checksum;
-//				else
-//					checksum_map[blknum].checksum = page_st.checksum;
 				checksum_map[blknum].checksum = page_st.checksum;
 				checksum_map[blknum].lsn = page_st.lsn;
 			}
 		}
-		else
-			elog(ERROR, "Failed to read blknum %u from file \"%s\"", blknum, fullpath);
-
-		if (feof(in))
-			break;
-
-		if (interrupted || thread_interrupted)
-			elog(ERROR, "Interrupted during page reading");
 	}
 
-	if (in)
-		fclose(in);
+	close(fd);
+	pg_free(read_buffer);
 
 	return checksum_map;
 }
@@ -1910,60 +2275,39 @@ datapagemap_t *
 get_lsn_map(const char *fullpath, uint32 checksum_version,
 			int n_blocks, XLogRecPtr shift_lsn, BlockNumber segmentno)
 {
-	FILE          *in = NULL;
+	int            fd;
 	BlockNumber	   blknum = 0;
-	char		   read_buffer[BLCKSZ];
-	char		   in_buf[STDIO_BUFSIZE];
+	char		  *read_buffer = pgut_malloc(MAP_SCAN_CHUNK_BLOCKS * BLCKSZ);
 	datapagemap_t *lsn_map = NULL;
 
 	Assert(shift_lsn > 0);
 
-	/* open file */
-	in = fopen(fullpath, "r+b");
-	if (!in)
-		elog(ERROR, "Cannot open source file \"%s\": %s", fullpath, strerror(errno));
-
-	/* truncate up to blocks */
-	if (ftruncate(fileno(in), n_blocks * BLCKSZ) != 0)
-		elog(ERROR, "Cannot truncate file to blknum %u \"%s\": %s",
-				n_blocks, fullpath, strerror(errno));
-
-	setvbuf(in, in_buf, _IOFBF, STDIO_BUFSIZE);
+	fd = map_scan_open(fullpath, n_blocks);
 
 	lsn_map = pgut_malloc(sizeof(datapagemap_t));
 	memset(lsn_map, 0, sizeof(datapagemap_t));
 
-	for (blknum = 0; blknum < n_blocks;  blknum++)
+	while (blknum < n_blocks)
 	{
-		size_t read_len = fread(read_buffer, 1, BLCKSZ, in);
-		PageState page_st;
+		int			n_pages = Min(MAP_SCAN_CHUNK_BLOCKS, n_blocks - blknum);
+		int			i;
 
-		/* report error */
-		if (ferror(in))
-			elog(ERROR, "Cannot read block %u of \"%s\": %s",
-					blknum, fullpath, strerror(errno));
+		map_scan_read(fd, read_buffer, n_pages, blknum, fullpath);
 
-		if (read_len == BLCKSZ)
+		for (i = 0; i < n_pages; i++, blknum++)
 		{
-			int rc = validate_one_page(read_buffer, segmentno + blknum,
+			PageState page_st;
+			int rc = validate_one_page(read_buffer + (size_t) i * BLCKSZ,
+									   segmentno + blknum,
 									   shift_lsn, &page_st, checksum_version);
 
 			if (rc == PAGE_IS_VALID)
 				datapagemap_add(lsn_map, blknum);
 		}
-		else
-			elog(ERROR, "Cannot read block %u from file \"%s\": %s",
-					blknum, fullpath, strerror(errno));
-
-		if (feof(in))
-			break;
-
-		if (interrupted || thread_interrupted)
-			elog(ERROR, "Interrupted during page reading");
 	}
 
-	if (in)
-		fclose(in);
+	close(fd);
+	pg_free(read_buffer);
 
 	if (lsn_map->bitmapsize == 0)
 	{
@@ -2043,7 +2387,7 @@ send_pages(const char *to_fullpath, const char *from_fullpath,
 		   uint32 checksum_version, bool use_pagemap, BackupPageHeader2 **headers,
 		   BackupMode backup_mode)
 {
-	FILE *in = NULL;
+	PageReader reader;
 	FILE *out = NULL;
 	off_t  cur_pos_out = 0;
 	char  curr_page[BLCKSZ];
@@ -2054,13 +2398,12 @@ send_pages(const char *to_fullpath, const char *from_fullpath,
 	BackupPageHeader2 *header = NULL;
 	parray *harray = NULL;
 
-	/* stdio buffers */
-	char *in_buf = NULL;
+	/* stdio buffer */
 	char *out_buf = NULL;
 
 	/* open source file for read */
-	in = fopen(from_fullpath, PG_BINARY_R);
-	if (in == NULL)
+	if (!page_reader_open(&reader, from_fullpath,
+						  use_pagemap ? &file->pagemap : NULL, file->n_blocks))
 	{
 		/*
 		 * If file is not found, this is not en error.
@@ -2072,23 +2415,10 @@ send_pages(const char *to_fullpath, const char *from_fullpath,
 		elog(ERROR, "Cannot open file \"%s\": %s", from_fullpath, strerror(errno));
 	}
 
-	/*
-	 * Enable stdio buffering for local input file,
-	 * unless the pagemap is involved, which
-	 * imply a lot of random access.
-	 */
-
 	if (use_pagemap)
 	{
 		iter = datapagemap_iterate(&file->pagemap);
 		datapagemap_next(iter, &blknum); /* set first block */
-
-		setvbuf(in, NULL, _IONBF, BUFSIZ);
-	}
-	else
-	{
-		in_buf = pgut_malloc(STDIO_BUFSIZE);
-		setvbuf(in, in_buf, _IOFBF, STDIO_BUFSIZE);
 	}
 
 	harray = parray_new();
@@ -2097,7 +2427,7 @@ send_pages(const char *to_fullpath, const char *from_fullpath,
 	{
 		PageState page_st;
 		int rc = prepare_page(file, prev_backup_start_lsn,
-							  blknum, in, backup_mode, curr_page,
+							  blknum, &reader, backup_mode, curr_page,
 							  true, checksum_version,
 							  from_fullpath, &page_st);
 
@@ -2120,7 +2450,7 @@ send_pages(const char *to_fullpath, const char *from_fullpath,
 
 			parray_append(harray, header);
 
-			compressed_size = compress_and_backup_page(file, blknum, in, out, &(file->crc),
+			compressed_size = compress_and_backup_page(file, blknum, out, &(file->crc),
 														rc, curr_page, calg, clevel,
 														from_fullpath, to_fullpath);
 			cur_pos_out += compressed_size + sizeof(BackupPageHeader);
@@ -2161,9 +2491,7 @@ send_pages(const char *to_fullpath, const char *from_fullpath,
 	parray_free(harray);
 
 	/* cleanup */
-	if (in && fclose(in))
-		elog(ERROR, "Cannot close the source file \"%s\": %s",
-			 to_fullpath, strerror(errno));
+	page_reader_close(&reader, from_fullpath);
 
 	/* close local output file */
 	if (out && fclose(out))
@@ -2171,7 +2499,6 @@ send_pages(const char *to_fullpath, const char *from_fullpath,
 			 to_fullpath, strerror(errno));
 
 	pg_free(iter);
-	pg_free(in_buf);
 	pg_free(out_buf);
 
 	return n_blocks_read;
@@ -2186,20 +2513,19 @@ copy_pages(const char *to_fullpath, const char *from_fullpath,
 			   uint32 checksum_version, bool use_pagemap,
 			   BackupMode backup_mode)
 {
-	FILE *in = NULL;
+	PageReader reader;
 	FILE *out = NULL;
 	char curr_page[BLCKSZ];
 	int n_blocks_read = 0;
 	BlockNumber blknum = 0;
 	datapagemap_iterator_t *iter = NULL;
 
-	/* stdio buffers */
-	char *in_buf = NULL;
+	/* stdio buffer */
 	char *out_buf = NULL;
 
 	/* open source file for read */
-	in = fopen(from_fullpath, PG_BINARY_R);
-	if (in == NULL)
+	if (!page_reader_open(&reader, from_fullpath,
+						  use_pagemap ? &file->pagemap : NULL, file->n_blocks))
 	{
 		/*
 		 * If file is not found, this is not en error.
@@ -2211,23 +2537,10 @@ copy_pages(const char *to_fullpath, const char *from_fullpath,
 		elog(ERROR, "Cannot open file \"%s\": %s", from_fullpath, strerror(errno));
 	}
 
-	/*
-	 * Enable stdio buffering for local input file,
-	 * unless the pagemap is involved, which
-	 * imply a lot of random access.
-	 */
-
 	if (use_pagemap)
 	{
 		iter = datapagemap_iterate(&file->pagemap);
 		datapagemap_next(iter, &blknum); /* set first block */
-
-		setvbuf(in, NULL, _IONBF, BUFSIZ);
-	}
-	else
-	{
-		in_buf = pgut_malloc(STDIO_BUFSIZE);
-		setvbuf(in, in_buf, _IOFBF, STDIO_BUFSIZE);
 	}
 
 	out = fio_fopen(FIO_BACKUP_HOST, to_fullpath, PG_BINARY_R "+");
@@ -2248,7 +2561,7 @@ copy_pages(const char *to_fullpath, const char *from_fullpath,
 	{
 		PageState page_st;
 		int rc = prepare_page(file, sync_lsn,
-							  blknum, in, backup_mode, curr_page,
+							  blknum, &reader, backup_mode, curr_page,
 							  true, checksum_version,
 							  from_fullpath, &page_st);
 		if (rc == PageIsTruncated)
@@ -2302,9 +2615,7 @@ copy_pages(const char *to_fullpath, const char *from_fullpath,
 	}
 
 	/* cleanup */
-	if (fclose(in))
-		elog(ERROR, "Cannot close the source file \"%s\": %s",
-			 to_fullpath, strerror(errno));
+	page_reader_close(&reader, from_fullpath);
 
 	/* close output file */
 	if (fclose(out))
@@ -2312,24 +2623,228 @@ copy_pages(const char *to_fullpath, const char *from_fullpath,
 			 to_fullpath, strerror(errno));
 
 	pg_free(iter);
-	pg_free(in_buf);
 	pg_free(out_buf);
 
 	return n_blocks_read;
 }
 
 /*
- * Attempt to open header file, read content and return as
- * array of headers.
- * TODO: some access optimizations would be great here:
- * less fseeks, buffering, descriptor sharing, etc.
+ * Cache of decompressed page headers.
+ *
+ * The same headers are often requested more than once during a single
+ * operation, e.g. merge reads headers of the full backup files to decide
+ * whether in-place merge is possible and then again to merge them.
+ * Cache is shared by all header maps and is bounded by HEADER_CACHE_SIZE,
+ * least recently used entries are evicted first.
+ */
+#define HEADER_CACHE_SIZE		(64 * 1024 * 1024)
+#define HEADER_CACHE_BUCKETS	4096
+
+typedef struct HeaderCacheEntry
+{
+	const HeaderMap *hdr_map;
+	pg_off_t	hdr_off;
+	pg_crc32	hdr_crc;
+	size_t		len;
+	BackupPageHeader2 *headers;
+
+	struct HeaderCacheEntry *hash_next;
+	struct HeaderCacheEntry *lru_prev;	/* more recently used entry */
+	struct HeaderCacheEntry *lru_next;	/* less recently used entry */
+} HeaderCacheEntry;
+
+static HeaderCacheEntry *header_cache[HEADER_CACHE_BUCKETS];
+static HeaderCacheEntry *header_cache_head = NULL;	/* most recently used */
+static HeaderCacheEntry *header_cache_tail = NULL;	/* least recently used */
+static size_t header_cache_used = 0;
+static pthread_mutex_t header_cache_mutex = PTHREAD_MUTEX_INITIALIZER;
+
+static HeaderCacheEntry **
+header_cache_bucket(const HeaderMap *hdr_map, pg_off_t hdr_off)
+{
+	uint64		h = (uint64) (uintptr_t) hdr_map ^ ((uint64) hdr_off * 0x9E3779B97F4A7C15ULL);
+
+	return &header_cache[(h >> 32) % HEADER_CACHE_BUCKETS];
+}
+
+static void
+header_cache_lru_unlink(HeaderCacheEntry *entry)
+{
+	if (entry->lru_prev)
+		entry->lru_prev->lru_next = entry->lru_next;
+	else
+		header_cache_head = entry->lru_next;
+
+	if (entry->lru_next)
+		entry->lru_next->lru_prev = entry->lru_prev;
+	else
+		header_cache_tail = entry->lru_prev;
+
+	entry->lru_prev = entry->lru_next = NULL;
+}
+
+static void
+header_cache_lru_push(HeaderCacheEntry *entry)
+{
+	entry->lru_prev = NULL;
+	entry->lru_next = header_cache_head;
+	if (header_cache_head)
+		header_cache_head->lru_prev = entry;
+	header_cache_head = entry;
+	if (!header_cache_tail)
+		header_cache_tail = entry;
+}
+
+/* Remove entry from the cache and free it. Must be called under mutex */
+static void
+header_cache_remove(HeaderCacheEntry *entry)
+{
+	HeaderCacheEntry **prev = header_cache_bucket(entry->hdr_map, entry->hdr_off);
+
+	while (*prev != entry)
+		prev = &(*prev)->hash_next;
+	*prev = entry->hash_next;
+
+	header_cache_lru_unlink(entry);
+	header_cache_used -= entry->len;
+	pg_free(entry->headers);
+	pg_free(entry);
+}
+
+/*
+ * Look for headers of the file in the cache.
+ * Return palloc'ed copy of headers or NULL if they are not cached.
+ */
+static BackupPageHeader2 *
+header_cache_get(const HeaderMap *hdr_map, pgFile *file, size_t len)
+{
+	HeaderCacheEntry *entry;
+	BackupPageHeader2 *headers = NULL;
+
+	pthread_mutex_lock(&header_cache_mutex);
+
+	for (entry = *header_cache_bucket(hdr_map, file->hdr_off); entry; entry = entry->hash_next)
+	{
+		if (entry->hdr_map == hdr_map && entry->hdr_off == file->hdr_off &&
+			entry->hdr_crc == file->hdr_crc && entry->len == len)
+		{
+			headers = pgut_malloc(len);
+			memcpy(headers, entry->headers, len);
+
+			header_cache_lru_unlink(entry);
+			header_cache_lru_push(entry);
+			break;
+		}
+	}
+
+	pthread_mutex_unlock(&header_cache_mutex);
+
+	return headers;
+}
+
+/* Put a copy of validated headers of the file into the cache */
+static void
+header_cache_put(const HeaderMap *hdr_map, pgFile *file,
+				 BackupPageHeader2 *headers, size_t len)
+{
+	HeaderCacheEntry  *entry;
+	HeaderCacheEntry  *cur;
+	HeaderCacheEntry **bucket;
+
+	if (len > HEADER_CACHE_SIZE / 4)
+		return;
+
+	entry = pgut_new(HeaderCacheEntry);
+	entry->hdr_map = hdr_map;
+	entry->hdr_off = file->hdr_off;
+	entry->hdr_crc = file->hdr_crc;
+	entry->len = len;
+	entry->headers = pgut_malloc(len);
+	memcpy(entry->headers, headers, len);
+
+	pthread_mutex_lock(&header_cache_mutex);
+
+	bucket = header_cache_bucket(hdr_map, file->hdr_off);
+
+	/* headers could have been cached by another thread meanwhile */
+	for (cur = *bucket; cur; cur = cur->hash_next)
+	{
+		if (cur->hdr_map == hdr_map && cur->hdr_off == file->hdr_off)
+		{
+			header_cache_remove(cur);
+			break;
+		}
+	}
+
+	while (header_cache_tail && header_cache_used + len > HEADER_CACHE_SIZE)
+		header_cache_remove(header_cache_tail);
+
+	entry->hash_next = *bucket;
+	*bucket = entry;
+	header_cache_lru_push(entry);
+	header_cache_used += len;
+
+	pthread_mutex_unlock(&header_cache_mutex);
+}
+
+/* Drop all cached headers of the header map */
+static void
+header_cache_forget(const HeaderMap *hdr_map)
+{
+	HeaderCacheEntry *entry;
+	HeaderCacheEntry *next;
+
+	pthread_mutex_lock(&header_cache_mutex);
+
+	for (entry = header_cache_head; entry; entry = next)
+	{
+		next = entry->lru_next;
+		if (entry->hdr_map == hdr_map)
+			header_cache_remove(entry);
+	}
+
+	pthread_mutex_unlock(&header_cache_mutex);
+}
+
+/*
+ * Get read-only descriptor of header map.
+ * Descriptor is opened once and shared by all threads, which read it
+ * with pread(), it is closed by cleanup_header_map().
+ */
+static int
+get_header_map_reader(HeaderMap *hdr_map)
+{
+	int		fd;
+	int		save_errno = 0;
+
+	pthread_mutex_lock(&(hdr_map->mutex));
+
+	if (hdr_map->rfd < 0)
+	{
+		hdr_map->rfd = open(hdr_map->path, O_RDONLY | PG_BINARY, 0);
+		save_errno = errno;
+	}
+	fd = hdr_map->rfd;
+
+	pthread_mutex_unlock(&(hdr_map->mutex));
+
+	errno = save_errno;
+	return fd;
+}
+
+/*
+ * Attempt to read headers of the file from header map and return them
+ * as array of headers.
+ * Header map is read via descriptor shared between threads, recently
+ * decompressed headers are taken from the cache.
  */
 BackupPageHeader2*
 get_data_file_headers(HeaderMap *hdr_map, pgFile *file, bool strict)
 {
 	bool     success = false;
-	FILE    *in = NULL;
+	int      fd;
 	size_t   read_len = 0;
+	size_t   done = 0;
 	pg_crc32 hdr_crc;
 	BackupPageHeader2 *headers = NULL;
 	/* header decompression */
@@ -2340,39 +2855,40 @@ get_data_file_headers(HeaderMap *hdr_map, pgFile *file, bool strict)
 	if (file->n_headers <= 0)
 		return NULL;
 
-	/* TODO: consider to make this descriptor thread-specific */
-	in = fopen(hdr_map->path, PG_BINARY_R);
-
-	if (!in)
-	{
-		elog(strict ? ERROR : WARNING, "Cannot open header file \"%s\": %s", hdr_map->path, strerror(errno));
-		return NULL;
-	}
-	/* disable buffering for header file */
-	setvbuf(in, NULL, _IONBF, 0);
-
-	if (fseeko(in, file->hdr_off, SEEK_SET))
-	{
-		elog(strict ? ERROR : WARNING, "Cannot seek to position %llu in page header map \"%s\": %s",
-			file->hdr_off, hdr_map->path, strerror(errno));
-		goto cleanup;
-	}
-
 	/*
 	 * The actual number of headers in header file is n+1, last one is a dummy header,
 	 * used for calculation of read_len for actual last header.
 	 */
 	read_len = (file->n_headers+1) * sizeof(BackupPageHeader2);
 
+	headers = header_cache_get(hdr_map, file, read_len);
+	if (headers)
+		return headers;
+
+	fd = get_header_map_reader(hdr_map);
+	if (fd < 0)
+	{
+		elog(strict ? ERROR : WARNING, "Cannot open header file \"%s\": %s", hdr_map->path, strerror(errno));
+		return NULL;
+	}
+
 	/* allocate memory for compressed headers */
 	zheaders = pgut_malloc(file->hdr_size);
 	memset(zheaders, 0, file->hdr_size);
 
-	if (fread(zheaders, 1, file->hdr_size, in) != file->hdr_size)
+	while (done < file->hdr_size)
 	{
-		elog(strict ? ERROR : WARNING, "Cannot read header file at offset: %llu len: %i \"%s\": %s",
-			file->hdr_off, file->hdr_size, hdr_map->path, strerror(errno));
-		goto cleanup;
+		ssize_t rc = pread(fd, zheaders + done, file->hdr_size - done,
+						   file->hdr_off + done);
+
+		if (rc <= 0)
+		{
+			elog(strict ? ERROR : WARNING, "Cannot read header file at offset: %llu len: %i \"%s\": %s",
+				file->hdr_off, file->hdr_size, hdr_map->path,
+				rc == 0 ? "unexpected end of file" : strerror(errno));
+			goto cleanup;
+		}
+		done += rc;
 	}
 
 	/* allocate memory for uncompressed headers */
@@ -2406,13 +2922,12 @@ get_data_file_headers(HeaderMap *hdr_map, pgFile *file, bool strict)
 		goto cleanup;
 	}
 
+	header_cache_put(hdr_map, file, headers, read_len);
 	success = true;
 
 cleanup:
 
 	pg_free(zheaders);
-	if (in && fclose(in))
-		elog(ERROR, "Cannot close file \"%s\"", hdr_map->path);
 
 	if (!success)
 	{
@@ -2423,8 +2938,46 @@ cleanup:
 	return headers;
 }
 
+/*
+ * Open header map for writing, if it is not opened yet.
+ * Only the first writer has to take the lock.
+ */
+static void
+open_header_map_writer(HeaderMap *hdr_map, const char *map_path)
+{
+	if (hdr_map->fd >= 0)
+		return;
+
+	pthread_mutex_lock(&(hdr_map->mutex));
+
+	if (hdr_map->fd < 0)
+	{
+		int		fd;
+
+		elog(LOG, "Creating page header map \"%s\"", map_path);
+
+		fd = open(map_path, O_WRONLY | O_CREAT | O_TRUNC | PG_BINARY, FILE_PERMISSION);
+		if (fd < 0)
+			elog(ERROR, "Cannot open header file \"%s\": %s",
+				 map_path, strerror(errno));
+
+		/* update file permission */
+		if (chmod(map_path, FILE_PERMISSION) == -1)
+			elog(ERROR, "Cannot change mode of \"%s\": %s", map_path,
+				 strerror(errno));
+
+		pg_write_barrier();
+		hdr_map->fd = fd;
+	}
+
+	pthread_mutex_unlock(&(hdr_map->mutex));
+}
+
 /* write headers of all blocks belonging to file to header map and
- * save its offset and size */
+ * save its offset and size.
+ * Each writer reserves its own region of header map by atomic
+ * increment of map offset, so threads do not wait for each other.
+ */
 void
 write_page_headers(BackupPageHeader2 *headers, pgFile *file, HeaderMap *hdr_map, bool is_merge)
 {
@@ -2432,6 +2985,7 @@ write_page_headers(BackupPageHeader2 *headers, pgFile *file, HeaderMap *hdr_map,
 	char   *map_path = NULL;
 	/* header compression */
 	int     z_len = 0;
+	int     done = 0;
 	char   *zheaders = NULL;
 	const char *errormsg = NULL;
 
@@ -2454,32 +3008,6 @@ write_page_headers(BackupPageHeader2 *headers, pgFile *file, HeaderMap *hdr_map,
 	z_len = do_compress(zheaders, read_len * 2, headers,
 						read_len, ZLIB_COMPRESS, 1, &errormsg);
 
-	/* writing to header map must be serialized */
-	pthread_mutex_lock(&(hdr_map->mutex)); /* what if we crash while trying to obtain mutex? */
-
-	if (!hdr_map->fp)
-	{
-		elog(LOG, "Creating page header map \"%s\"", map_path);
-
-		hdr_map->fp = fopen(map_path, PG_BINARY_A);
-		if (hdr_map->fp == NULL)
-			elog(ERROR, "Cannot open header file \"%s\": %s",
-				 map_path, strerror(errno));
-
-		/* enable buffering for header file */
-		hdr_map->buf = pgut_malloc(LARGE_CHUNK_SIZE);
-		setvbuf(hdr_map->fp, hdr_map->buf, _IOFBF, LARGE_CHUNK_SIZE);
-
-		/* update file permission */
-		if (chmod(map_path, FILE_PERMISSION) == -1)
-			elog(ERROR, "Cannot change mode of \"%s\": %s", map_path,
-				 strerror(errno));
-
-		file->hdr_off = 0;
-	}
-	else
-		file->hdr_off = hdr_map->offset;
-
 	if (z_len <= 0)
 	{
 		if (errormsg)
@@ -2490,17 +3018,25 @@ write_page_headers(BackupPageHeader2 *headers, pgFile *file, HeaderMap *hdr_map,
 				 file->rel_path, z_len);
 	}
 
+	open_header_map_writer(hdr_map, map_path);
+
+	/* reserve space in header map */
+	file->hdr_off = pg_atomic_fetch_add_u64(&(hdr_map->offset), z_len);
+
 	elog(VERBOSE, "Writing headers for file \"%s\" offset: %llu, len: %i, crc: %u",
 			file->rel_path, file->hdr_off, z_len, file->hdr_crc);
 
-	if (fwrite(zheaders, 1, z_len, hdr_map->fp) != z_len)
-		elog(ERROR, "Cannot write to file \"%s\": %s", map_path, strerror(errno));
+	while (done < z_len)
+	{
+		ssize_t rc = pwrite(hdr_map->fd, zheaders + done, z_len - done,
+							file->hdr_off + done);
 
-	file->hdr_size = z_len;	  /* save the length of compressed headers */
-	hdr_map->offset += z_len; /* update current offset in map */
+		if (rc < 0)
+			elog(ERROR, "Cannot write to file \"%s\": %s", map_path, strerror(errno));
+		done += rc;
+	}
 
-	/* End critical section */
-	pthread_mutex_unlock(&(hdr_map->mutex));
+	file->hdr_size = z_len;	  /* save the length of compressed headers */
 
 	pg_free(zheaders);
 }
@@ -2508,8 +3044,9 @@ write_page_headers(BackupPageHeader2 *headers, pgFile *file, HeaderMap *hdr_map,
 void
 init_header_map(pgBackup *backup)
 {
-	backup->hdr_map.fp = NULL;
-	backup->hdr_map.buf = NULL;
+	backup->hdr_map.fd = -1;
+	pg_atomic_init_u64(&(backup->hdr_map.offset), 0);
+	backup->hdr_map.rfd = -1;
 	join_path_components(backup->hdr_map.path, backup->root_dir, HEADER_MAP);
 	join_path_components(backup->hdr_map.path_tmp, backup->root_dir, HEADER_MAP_TMP);
 	backup->hdr_map.mutex = (pthread_mutex_t)PTHREAD_MUTEX_INITIALIZER;
@@ -2519,10 +3056,14 @@ void
 cleanup_header_map(HeaderMap *hdr_map)
 {
 	/* cleanup descriptor */
-	if (hdr_map->fp && fclose(hdr_map->fp))
+	if (hdr_map->fd >= 0 && close(hdr_map->fd))
+		elog(ERROR, "Cannot close file \"%s\"", hdr_map->path);
+	hdr_map->fd = -1;
+	pg_atomic_write_u64(&(hdr_map->offset), 0);
+
+	/* cleanup read-only descriptor and cached headers */
+	if (hdr_map->rfd >= 0 && close(hdr_map->rfd))
 		elog(ERROR, "Cannot close file \"%s\"", hdr_map->path);
-	hdr_map->fp = NULL;
-	hdr_map->offset = 0;
-	pg_free(hdr_map->buf);
-	hdr_map->buf = NULL;
+	hdr_map->rfd = -1;
+	header_cache_forget(hdr_map);
 }
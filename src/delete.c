@@ -719,17 +719,12 @@ do_retention_wal(InstanceState *instanceState, bool dry_run)
 
 /*
  * Delete backup files of the backup and update the status of the backup to
- * BACKUP_STATUS_DELETED.
- * TODO: delete files on multiple threads
+ * BACKUP_STATUS_DELETED.  Files are removed by num_threads threads.
  */
 void
 delete_backup_files(pgBackup *backup)
 {
-	size_t		i;
 	char		timestamp[100];
-	parray		*files;
-	size_t		num_files;
-	char		full_path[MAXPGPATH];
 
 	/*
 	 * If the backup was deleted already, there is nothing to do.
@@ -755,32 +750,12 @@ delete_backup_files(pgBackup *backup)
 	 */
 	write_backup_status(backup, BACKUP_STATUS_DELETING, false);
 
-	/* list files to be deleted */
-	files = parray_new();
-	dir_list_file(files, backup->root_dir, false, false, true, false, false, FIO_BACKUP_HOST);
+	if (interrupted)
+		elog(ERROR, "interrupted during delete backup");
 
-	/* delete leaf node first */
-	parray_qsort(files, pgFileCompareRelPathDesc);
-	num_files = parray_num(files);
-	for (i = 0; i < num_files; i++)
-	{
-		pgFile	   *file = (pgFile *) parray_get(files, i);
-
-		join_path_components(full_path, backup->root_dir, file->rel_path);
-
-		if (interrupted)
-			elog(ERROR, "interrupted during delete backup");
+	/* backup.control is removed last, so the status stays visible until then */
+	fio_remove_tree(FIO_BACKUP_HOST, backup->root_dir, num_threads);
 
-		if (progress)
-			elog(INFO, "Progress: (%zd/%zd). Delete file \"%s\"",
-				 i + 1, num_files, full_path);
-
-		if (fio_remove(FIO_BACKUP_HOST, full_path, false) != 0)
-			elog(ERROR, "Cannot remove file or directory \"%s\": %s", full_path, strerror(errno));
-	}
-
-	parray_walk(files, pgFileFree);
-	parray_free(files);
 	backup->status = BACKUP_STATUS_DELETED;
 
 	return;
@@ -820,6 +795,8 @@ delete_walfiles_in_tli(InstanceState *instanceState, XLogRecPtr keep_lsn, timeli
 	size_t		wal_size_actual = 0;
 	char		wal_pretty_size[20];
 	bool		purge_all = false;
+	parray	   *to_remove;
+	char	  **names;
 
 
 	/* Timeline is completely empty */
@@ -919,50 +896,69 @@ delete_walfiles_in_tli(InstanceState *instanceState, XLogRecPtr keep_lsn, timeli
 	if (dry_run)
 		return;
 
+	/* Any segment equal or greater than EndSegNo must be kept
+	 * unless it`s a 'purge all' scenario.
+	 */
+	to_remove = parray_new();
 	for (i = 0; i < parray_num(tlinfo->xlog_filelist); i++)
 	{
 		xlogFile *wal_file = (xlogFile *) parray_get(tlinfo->xlog_filelist, i);
 
-		if (interrupted)
-			elog(ERROR, "interrupted during WAL archive purge");
+		if (!purge_all && wal_file->segno >= OldestToKeepSegNo)
+			continue;
 
-		/* Any segment equal or greater than EndSegNo must be kept
-		 * unless it`s a 'purge all' scenario.
-		 */
-		if (purge_all || wal_file->segno < OldestToKeepSegNo)
+		/* save segment from purging */
+		if (wal_file->keep)
 		{
-			char wal_fullpath[MAXPGPATH];
+			elog(VERBOSE, "Retain WAL segment \"%s/%s\"",
+				 instanceState->instance_wal_subdir_path, wal_file->file.name);
+			continue;
+		}
 
-			join_path_components(wal_fullpath, instanceState->instance_wal_subdir_path, wal_file->file.name);
+		parray_append(to_remove, wal_file);
+	}
 
-			/* save segment from purging */
-			if (wal_file->keep)
-			{
-				elog(VERBOSE, "Retain WAL segment \"%s\"", wal_fullpath);
-				continue;
-			}
+	if (parray_num(to_remove) == 0)
+	{
+		parray_free(to_remove);
+		return;
+	}
 
-			/* remove segment, missing file is not considered as error condition */
-			if (fio_remove(FIO_BACKUP_HOST, wal_fullpath, true) < 0)
-			{
-				elog(ERROR, "Could not remove file \"%s\": %s",
-						wal_fullpath, strerror(errno));
-			}
-			else
-			{
-				if (wal_file->type == SEGMENT)
-					elog(VERBOSE, "Removed WAL segment \"%s\"", wal_fullpath);
-				else if (wal_file->type == TEMP_SEGMENT)
-					elog(VERBOSE, "Removed temp WAL segment \"%s\"", wal_fullpath);
-				else if (wal_file->type == PARTIAL_SEGMENT)
-					elog(VERBOSE, "Removed partial WAL segment \"%s\"", wal_fullpath);
-				else if (wal_file->type == BACKUP_HISTORY_FILE)
-					elog(VERBOSE, "Removed backup history file \"%s\"", wal_fullpath);
-			}
+	if (interrupted)
+		elog(ERROR, "interrupted during WAL archive purge");
 
-			wal_deleted = true;
-		}
+	/* Record removal in WAL index before actual removal of files */
+	wal_index_remove_files(instanceState->instance_wal_subdir_path, tlinfo->tli, to_remove);
+
+	/*
+	 * Remove segments by num_threads threads,
+	 * missing file is not considered as error condition.
+	 */
+	names = palloc(sizeof(char *) * parray_num(to_remove));
+	for (i = 0; i < parray_num(to_remove); i++)
+		names[i] = ((xlogFile *) parray_get(to_remove, i))->file.name;
+
+	fio_remove_files(FIO_BACKUP_HOST, instanceState->instance_wal_subdir_path,
+					 names, parray_num(to_remove), num_threads);
+	pfree(names);
+
+	for (i = 0; i < parray_num(to_remove); i++)
+	{
+		xlogFile *wal_file = (xlogFile *) parray_get(to_remove, i);
+		const char *wal_dir = instanceState->instance_wal_subdir_path;
+
+		if (wal_file->type == SEGMENT)
+			elog(VERBOSE, "Removed WAL segment \"%s/%s\"", wal_dir, wal_file->file.name);
+		else if (wal_file->type == TEMP_SEGMENT)
+			elog(VERBOSE, "Removed temp WAL segment \"%s/%s\"", wal_dir, wal_file->file.name);
+		else if (wal_file->type == PARTIAL_SEGMENT)
+			elog(VERBOSE, "Removed partial WAL segment \"%s/%s\"", wal_dir, wal_file->file.name);
+		else if (wal_file->type == BACKUP_HISTORY_FILE)
+			elog(VERBOSE, "Removed backup history file \"%s/%s\"", wal_dir, wal_file->file.name);
 	}
+
+	parray_free(to_remove);
+	wal_deleted = true;
 }
 
 
@@ -1003,6 +999,8 @@ do_delete_instance(InstanceState *instanceState)
 		elog(ERROR, "Can't remove \"%s\": %s", instanceState->instance_backup_subdir_path,
 			strerror(errno));
 
+	catalog_summary_remove(instanceState->instance_backup_subdir_path);
+
 	if (rmdir(instanceState->instance_wal_subdir_path) != 0)
 		elog(ERROR, "Can't remove \"%s\": %s", instanceState->instance_wal_subdir_path,
 			strerror(errno));
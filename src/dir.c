@@ -19,6 +19,7 @@
 #include "catalog/pg_tablespace.h"
 
 #include <unistd.h>
+#include <fcntl.h>
 #include <sys/stat.h>
 #include <dirent.h>
 
@@ -120,6 +121,9 @@ typedef struct TablespaceCreatedList
 
 static char dir_check_file(pgFile *file, bool backup_logs);
 
+static bool dir_list_check_entry(pgFile *file, const char *path, bool exclude,
+								 bool backup_logs, bool skip_hidden,
+								 bool *list_content);
 static void dir_list_file_internal(parray *files, pgFile *parent, const char *parent_dir,
 								   bool exclude, bool follow_symlink, bool backup_logs,
 								   bool skip_hidden, fio_location location);
@@ -159,15 +163,37 @@ pgFileNew(const char *path, const char *rel_path, bool follow_symlink, fio_locat
 
 pgFile *
 pgFileInit(const char *rel_path)
+{
+	return pgFileInitInArena(rel_path, NULL);
+}
+
+/*
+ * Same as pgFileInit(), but if arena is not NULL, the file and its path
+ * are allocated in the arena. Such files are not freed by pgFileFree(),
+ * the arena is released at once, see pgFileListFree().
+ */
+pgFile *
+pgFileInitInArena(const char *rel_path, pgut_arena *arena)
 {
 	pgFile	   *file;
 	char	   *file_name = NULL;
 
-	file = (pgFile *) pgut_malloc(sizeof(pgFile));
-	MemSet(file, 0, sizeof(pgFile));
+	if (arena)
+	{
+		file = (pgFile *) pgut_arena_alloc(arena, sizeof(pgFile));
+		MemSet(file, 0, sizeof(pgFile));
+		file->rel_path = pgut_arena_strdup(arena, rel_path);
+		file->in_arena = true;
+	}
+	else
+	{
+		file = (pgFile *) pgut_malloc(sizeof(pgFile));
+		MemSet(file, 0, sizeof(pgFile));
+		file->rel_path = pgut_strdup(rel_path);
+	}
 
-	file->rel_path = pgut_strdup(rel_path);
 	canonicalize_path(file->rel_path);
+	file->rel_path_hash = pgHashRelPath(file->rel_path);
 
 	/* Get file name from the path */
 	file_name = last_dir_separator(file->rel_path);
@@ -324,12 +350,31 @@ pgFileFree(void *file)
 
 	file_ptr = (pgFile *) file;
 
+	/* released together with the arena */
+	if (file_ptr->in_arena)
+		return;
+
 	pfree(file_ptr->linked);
 	pfree(file_ptr->rel_path);
 
 	pfree(file);
 }
 
+/*
+ * Free list of files. If files are allocated in the arena of the list,
+ * there is no need to walk the list.
+ */
+void
+pgFileListFree(parray *files)
+{
+	if (files == NULL)
+		return;
+
+	if (parray_get_arena(files) == NULL)
+		parray_walk(files, pgFileFree);
+	parray_free(files);
+}
+
 /* Compare two pgFile with their path in ascending order of ASCII code. */
 int
 pgFileMapComparePath(const void *f1, const void *f2)
@@ -380,6 +425,37 @@ pgFileCompareRelPath(const void *f1, const void *f2)
 	return strcmp(f1p->rel_path, f2p->rel_path);
 }
 
+/* Hash of relative path (FNV-1a), used for lookups of pgFile by rel_path */
+uint32
+pgHashRelPath(const char *rel_path)
+{
+	uint32		hash = 2166136261u;
+	const unsigned char *p;
+
+	for (p = (const unsigned char *) rel_path; *p; p++)
+	{
+		hash ^= *p;
+		hash *= 16777619u;
+	}
+
+	return hash;
+}
+
+/*
+ * Hash pgFile by its relative path. Use it with parray_index_build() along
+ * with pgFileCompareRelPath() to find files by rel_path in constant time.
+ */
+uint32
+pgFileHashRelPath(const void *f)
+{
+	pgFile	   *fp = *(pgFile **) f;
+
+	if (fp->rel_path_hash != 0)
+		return fp->rel_path_hash;
+
+	return pgHashRelPath(fp->rel_path);
+}
+
 /* Compare two pgFile with their rel_path in descending order of ASCII code. */
 int
 pgFileCompareRelPathDesc(const void *f1, const void *f2)
@@ -649,6 +725,57 @@ dir_check_file(pgFile *file, bool backup_logs)
 	return CHECK_TRUE;
 }
 
+/*
+ * Check the entry of directory listing.  Returns false and frees the file,
+ * if the entry should not be listed.  *list_content is set to true, if the
+ * entry is a directory, whose content should be listed too.
+ */
+static bool
+dir_list_check_entry(pgFile *file, const char *path, bool exclude,
+					 bool backup_logs, bool skip_hidden, bool *list_content)
+{
+	*list_content = false;
+
+	/* skip hidden files and directories */
+	if (skip_hidden && file->name[0] == '.')
+	{
+		elog(WARNING, "Skip hidden file: '%s'", path);
+		pgFileFree(file);
+		return false;
+	}
+
+	/*
+	 * Add only files, directories and links. Skip sockets and other
+	 * unexpected file formats.
+	 */
+	if (!S_ISDIR(file->mode) && !S_ISREG(file->mode))
+	{
+		elog(WARNING, "Skip '%s': unexpected file format", path);
+		pgFileFree(file);
+		return false;
+	}
+
+	if (exclude)
+	{
+		char		check_res = dir_check_file(file, backup_logs);
+
+		if (check_res == CHECK_FALSE)
+		{
+			/* Skip */
+			pgFileFree(file);
+			return false;
+		}
+		else if (check_res == CHECK_EXCLUDE_FALSE)
+		{
+			/* We add the directory itself which content was excluded */
+			return true;
+		}
+	}
+
+	*list_content = S_ISDIR(file->mode);
+	return true;
+}
+
 /*
  * List files in parent->path directory.  If "exclude" is true do not add into
  * "files" files from pgdata_exclude_files and directories from
@@ -686,7 +813,7 @@ dir_list_file_internal(parray *files, pgFile *parent, const char *parent_dir,
 		pgFile	   *file;
 		char		child[MAXPGPATH];
 		char		rel_child[MAXPGPATH];
-		char		check_res;
+		bool		list_content;
 
 		join_path_components(child, parent_dir, dent->d_name);
 		join_path_components(rel_child, parent->rel_path, dent->d_name);
@@ -703,61 +830,689 @@ dir_list_file_internal(parray *files, pgFile *parent, const char *parent_dir,
 			continue;
 		}
 
-		/* skip hidden files and directories */
-		if (skip_hidden && file->name[0] == '.')
-		{
-			elog(WARNING, "Skip hidden file: '%s'", child);
-			pgFileFree(file);
+		if (!dir_list_check_entry(file, child, exclude, backup_logs,
+								  skip_hidden, &list_content))
 			continue;
-		}
+
+		parray_append(files, file);
 
 		/*
-		 * Add only files, directories and links. Skip sockets and other
-		 * unexpected file formats.
+		 * If the entry is a directory call dir_list_file_internal()
+		 * recursively.
 		 */
-		if (!S_ISDIR(file->mode) && !S_ISREG(file->mode))
+		if (list_content)
+			dir_list_file_internal(files, file, child, exclude, follow_symlink,
+								   backup_logs, skip_hidden, location);
+	}
+
+	if (errno && errno != ENOENT)
+	{
+		int			errno_tmp = errno;
+		fio_closedir(dir);
+		elog(ERROR, "Cannot read directory \"%s\": %s",
+				parent_dir, strerror(errno_tmp));
+	}
+	fio_closedir(dir);
+}
+
+/*
+ * State of parallel directory listing. Directories to be listed are kept
+ * in a queue, every thread takes a directory from the queue, lists it and
+ * puts its subdirectories into the queue. Thus tablespaces and database
+ * directories are listed by different threads.
+ */
+typedef struct
+{
+	pthread_mutex_t mutex;
+	pthread_cond_t cond;
+	parray	   *queue;			/* pgFile of directories to list */
+	int			n_busy;			/* threads listing a directory now */
+	bool		failed;
+	char		errmsg[MAXPGPATH * 2];
+
+	const char *root;
+	bool		exclude;
+	bool		follow_symlink;
+	bool		backup_logs;
+	bool		skip_hidden;
+} dir_list_state;
+
+typedef struct
+{
+	dir_list_state *state;
+	parray	   *files;			/* entries listed by the thread */
+} dir_list_arg;
+
+static void dir_list_set_error(dir_list_state *state, const char *fmt, ...)
+	pg_attribute_printf(2, 3);
+
+/*
+ * Report error of listing thread. Worker threads do not throw errors,
+ * the error is thrown by the main thread after the workers are stopped.
+ */
+static void
+dir_list_set_error(dir_list_state *state, const char *fmt, ...)
+{
+	va_list		args;
+
+	pthread_mutex_lock(&state->mutex);
+	if (!state->failed)
+	{
+		va_start(args, fmt);
+		vsnprintf(state->errmsg, sizeof(state->errmsg), fmt, args);
+		va_end(args);
+		state->failed = true;
+	}
+	pthread_cond_broadcast(&state->cond);
+	pthread_mutex_unlock(&state->mutex);
+}
+
+/*
+ * List the single directory. Entries are stat'ed relative to the directory
+ * descriptor, so the path is not resolved again for every entry.
+ * Subdirectories to be listed are added to subdirs.
+ */
+static bool
+dir_list_one_dir(dir_list_state *state, pgFile *parent, parray *files,
+				 parray *subdirs)
+{
+	char		parent_dir[MAXPGPATH];
+	DIR		   *dir;
+	int			dir_fd;
+	struct dirent *dent;
+
+	join_path_components(parent_dir, state->root, parent->rel_path);
+
+	dir = opendir(parent_dir);
+	if (dir == NULL)
+	{
+		/* Maybe the directory was removed */
+		if (errno == ENOENT)
+			return true;
+		dir_list_set_error(state, "Cannot open directory \"%s\": %s",
+						   parent_dir, strerror(errno));
+		return false;
+	}
+	dir_fd = dirfd(dir);
+
+	errno = 0;
+	while ((dent = readdir(dir)))
+	{
+		pgFile	   *file;
+		struct stat st;
+		char		child[MAXPGPATH];
+		char		rel_child[MAXPGPATH];
+		bool		list_content;
+
+		/* Skip entries point current dir or parent dir */
+		if (strcmp(dent->d_name, ".") == 0 || strcmp(dent->d_name, "..") == 0)
+			continue;
+
+		join_path_components(child, parent_dir, dent->d_name);
+
+		if (fstatat(dir_fd, dent->d_name, &st,
+					state->follow_symlink ? 0 : AT_SYMLINK_NOFOLLOW) < 0)
 		{
-			elog(WARNING, "Skip '%s': unexpected file format", child);
+			/* file not found is not an error case */
+			if (errno == ENOENT)
+			{
+				errno = 0;
+				continue;
+			}
+			dir_list_set_error(state, "cannot stat file \"%s\": %s",
+							   child, strerror(errno));
+			closedir(dir);
+			return false;
+		}
+
+		join_path_components(rel_child, parent->rel_path, dent->d_name);
+
+		file = pgFileInit(rel_child);
+		file->size = st.st_size;
+		file->mode = st.st_mode;
+		file->mtime = st.st_mtime;
+
+		if (dir_list_check_entry(file, child, state->exclude, state->backup_logs,
+								 state->skip_hidden, &list_content))
+		{
+			parray_append(files, file);
+			if (list_content)
+				parray_append(subdirs, file);
+		}
+		errno = 0;
+	}
+
+	if (errno && errno != ENOENT)
+	{
+		dir_list_set_error(state, "Cannot read directory \"%s\": %s",
+						   parent_dir, strerror(errno));
+		closedir(dir);
+		return false;
+	}
+	closedir(dir);
+
+	return true;
+}
+
+static void *
+dir_list_worker(void *arg)
+{
+	dir_list_arg *list_arg = (dir_list_arg *) arg;
+	dir_list_state *state = list_arg->state;
+	parray	   *subdirs = parray_new();
+
+	pthread_mutex_lock(&state->mutex);
+	for (;;)
+	{
+		pgFile	   *dir;
+		bool		ok;
+
+		while (parray_num(state->queue) == 0 && state->n_busy > 0 &&
+			   !state->failed)
+			pthread_cond_wait(&state->cond, &state->mutex);
+
+		/* the queue is empty and nobody can fill it, we are done */
+		if (parray_num(state->queue) == 0 || state->failed)
+			break;
+
+		dir = (pgFile *) parray_remove(state->queue,
+									   parray_num(state->queue) - 1);
+		state->n_busy++;
+		pthread_mutex_unlock(&state->mutex);
+
+		if (interrupted || thread_interrupted)
+		{
+			dir_list_set_error(state, "Interrupted during directory listing");
+			ok = false;
+		}
+		else
+			ok = dir_list_one_dir(state, dir, list_arg->files, subdirs);
+
+		pthread_mutex_lock(&state->mutex);
+		state->n_busy--;
+		while (parray_num(subdirs) > 0)
+		{
+			dir = (pgFile *) parray_remove(subdirs, parray_num(subdirs) - 1);
+			if (ok)
+				parray_append(state->queue, dir);
+		}
+		pthread_cond_broadcast(&state->cond);
+	}
+	pthread_cond_broadcast(&state->cond);
+	pthread_mutex_unlock(&state->mutex);
+
+	parray_free(subdirs);
+	return NULL;
+}
+
+/*
+ * Parallel version of dir_list_file() for local directory.  Directories are
+ * listed by n_threads threads, listed files are sorted by relative path,
+ * so directory always precedes its content.
+ */
+void
+dir_list_file_parallel(parray *files, const char *root, bool exclude,
+					   bool follow_symlink, bool add_root, bool backup_logs,
+					   bool skip_hidden, int n_threads)
+{
+	pgFile	   *file;
+	dir_list_state state;
+	dir_list_arg *thread_args;
+	pthread_t  *threads;
+	parray	   *listed;
+	int			i;
+
+	if (n_threads <= 1)
+	{
+		dir_list_file(files, root, exclude, follow_symlink, add_root,
+					  backup_logs, skip_hidden, FIO_LOCAL_HOST);
+		return;
+	}
+
+	file = pgFileNew(root, "", follow_symlink, FIO_LOCAL_HOST);
+	if (file == NULL)
+		return;
+
+	if (!S_ISDIR(file->mode))
+	{
+		elog(WARNING, "Skip \"%s\": unexpected file format", root);
+		return;
+	}
+
+	memset(&state, 0, sizeof(state));
+	pthread_mutex_init(&state.mutex, NULL);
+	pthread_cond_init(&state.cond, NULL);
+	state.queue = parray_new();
+	state.root = root;
+	state.exclude = exclude;
+	state.follow_symlink = follow_symlink;
+	state.backup_logs = backup_logs;
+	state.skip_hidden = skip_hidden;
+
+	parray_append(state.queue, file);
+
+	threads = (pthread_t *) palloc(sizeof(pthread_t) * n_threads);
+	thread_args = (dir_list_arg *) palloc(sizeof(dir_list_arg) * n_threads);
+
+	for (i = 0; i < n_threads; i++)
+	{
+		thread_args[i].state = &state;
+		thread_args[i].files = parray_new();
+		pthread_create(&threads[i], NULL, dir_list_worker, &thread_args[i]);
+	}
+
+	listed = parray_new();
+	if (add_root)
+		parray_append(listed, file);
+
+	for (i = 0; i < n_threads; i++)
+	{
+		pthread_join(threads[i], NULL);
+		parray_concat(listed, thread_args[i].files);
+		parray_free(thread_args[i].files);
+	}
+
+	pthread_cond_destroy(&state.cond);
+	pthread_mutex_destroy(&state.mutex);
+	parray_free(state.queue);
+	pfree(threads);
+	pfree(thread_args);
+
+	if (state.failed)
+	{
+		parray_walk(listed, pgFileFree);
+		parray_free(listed);
+		if (!add_root)
 			pgFileFree(file);
+		elog(ERROR, "%s", state.errmsg);
+	}
+
+	elog(LOG, "Listed %lu entries in \"%s\" by %i threads",
+		 (unsigned long) parray_num(listed), root, n_threads);
+
+	parray_qsort(listed, pgFileCompareRelPath);
+	parray_concat(files, listed);
+	parray_free(listed);
+
+	if (!add_root)
+		pgFileFree(file);
+}
+
+/*
+ * Parallel removal of a directory tree.  As in dir_list_file_parallel(),
+ * directories are put in a queue and handed out to threads.  Every thread
+ * removes files of its directory by unlinkat() relative to the directory
+ * descriptor and puts subdirectories into the queue.  Directories are
+ * removed after all files are gone, the deepest first.  Files of the root
+ * directory itself are removed last, so the tree, which was not removed
+ * completely, keeps its top-level files such as backup.control.
+ */
+typedef struct
+{
+	pthread_mutex_t mutex;
+	pthread_cond_t cond;
+	parray	   *queue;			/* relative paths of directories to clean */
+	parray	   *dirs;			/* all found directories, parents first */
+	int			n_busy;			/* threads cleaning a directory now */
+	bool		failed;
+	char		errmsg[MAXPGPATH * 2];
+
+	const char *root;
+	int			root_fd;
+} dir_remove_state;
+
+typedef struct
+{
+	dir_remove_state *state;
+	char	  **names;
+	size_t		n_names;
+	int			thread_num;
+	int			n_threads;
+} dir_remove_files_arg;
+
+static void dir_remove_set_error(dir_remove_state *state, const char *fmt, ...)
+	pg_attribute_printf(2, 3);
+
+/* Remember the first error of removal threads */
+static void
+dir_remove_set_error(dir_remove_state *state, const char *fmt, ...)
+{
+	va_list		args;
+
+	pthread_mutex_lock(&state->mutex);
+	if (!state->failed)
+	{
+		va_start(args, fmt);
+		vsnprintf(state->errmsg, sizeof(state->errmsg), fmt, args);
+		va_end(args);
+		state->failed = true;
+	}
+	pthread_cond_broadcast(&state->cond);
+	pthread_mutex_unlock(&state->mutex);
+}
+
+/*
+ * Remove files of the single directory.  Names are read first and removed
+ * afterwards, since removal of entries during readdir() is not reliable on
+ * some network filesystems.  Subdirectories are added to subdirs, if
+ * subdirs is NULL, then they are skipped.
+ */
+static bool
+dir_remove_one_dir(dir_remove_state *state, const char *rel_dir,
+				   bool remove_files, parray *subdirs)
+{
+	DIR		   *dir;
+	int			dir_fd;
+	struct dirent *dent;
+	parray	   *files = parray_new();
+	bool		ok = true;
+	size_t		i;
+
+	dir_fd = openat(state->root_fd, rel_dir[0] ? rel_dir : ".",
+					O_RDONLY | O_DIRECTORY | O_NOFOLLOW);
+	if (dir_fd < 0 || (dir = fdopendir(dir_fd)) == NULL)
+	{
+		int			save_errno = errno;
+
+		if (dir_fd >= 0)
+			close(dir_fd);
+		parray_free(files);
+		/* Maybe the directory was removed */
+		if (save_errno == ENOENT)
+			return true;
+		dir_remove_set_error(state, "Cannot open directory \"%s/%s\": %s",
+							 state->root, rel_dir, strerror(save_errno));
+		return false;
+	}
+
+	errno = 0;
+	while ((dent = readdir(dir)))
+	{
+		bool		is_dir = dent->d_type == DT_DIR;
+
+		/* Skip entries point current dir or parent dir */
+		if (strcmp(dent->d_name, ".") == 0 || strcmp(dent->d_name, "..") == 0)
 			continue;
+
+		if (dent->d_type == DT_UNKNOWN)
+		{
+			struct stat st;
+
+			if (fstatat(dir_fd, dent->d_name, &st, AT_SYMLINK_NOFOLLOW) == 0)
+				is_dir = S_ISDIR(st.st_mode);
 		}
 
-		if (exclude)
+		if (is_dir)
 		{
-			check_res = dir_check_file(file, backup_logs);
-			if (check_res == CHECK_FALSE)
+			char		rel_child[MAXPGPATH];
+
+			if (subdirs)
 			{
-				/* Skip */
-				pgFileFree(file);
-				continue;
+				join_path_components(rel_child, rel_dir, dent->d_name);
+				parray_append(subdirs, pgut_strdup(rel_child));
 			}
-			else if (check_res == CHECK_EXCLUDE_FALSE)
+		}
+		else if (remove_files)
+			parray_append(files, pgut_strdup(dent->d_name));
+		errno = 0;
+	}
+
+	if (errno && errno != ENOENT)
+	{
+		dir_remove_set_error(state, "Cannot read directory \"%s/%s\": %s",
+							 state->root, rel_dir, strerror(errno));
+		ok = false;
+	}
+
+	for (i = 0; ok && i < parray_num(files); i++)
+	{
+		const char *name = (const char *) parray_get(files, i);
+
+		if (interrupted || thread_interrupted)
+		{
+			dir_remove_set_error(state, "Interrupted during directory removal");
+			ok = false;
+		}
+		else if (unlinkat(dir_fd, name, 0) < 0 && errno != ENOENT)
+		{
+			dir_remove_set_error(state, "Cannot remove file \"%s/%s%s%s\": %s",
+								 state->root, rel_dir, rel_dir[0] ? "/" : "",
+								 name, strerror(errno));
+			ok = false;
+		}
+	}
+
+	closedir(dir);
+	parray_walk(files, pfree);
+	parray_free(files);
+
+	return ok;
+}
+
+static void *
+dir_remove_worker(void *arg)
+{
+	dir_remove_state *state = (dir_remove_state *) arg;
+	parray	   *subdirs = parray_new();
+
+	pthread_mutex_lock(&state->mutex);
+	for (;;)
+	{
+		char	   *rel_dir;
+		bool		ok;
+
+		while (parray_num(state->queue) == 0 && state->n_busy > 0 &&
+			   !state->failed)
+			pthread_cond_wait(&state->cond, &state->mutex);
+
+		/* the queue is empty and nobody can fill it, we are done */
+		if (parray_num(state->queue) == 0 || state->failed)
+			break;
+
+		rel_dir = (char *) parray_remove(state->queue,
+										 parray_num(state->queue) - 1);
+		state->n_busy++;
+		pthread_mutex_unlock(&state->mutex);
+
+		if (interrupted || thread_interrupted)
+		{
+			dir_remove_set_error(state, "Interrupted during directory removal");
+			ok = false;
+		}
+		else
+		{
+			/* files of the root are removed at the very end */
+			ok = dir_remove_one_dir(state, rel_dir, rel_dir[0] != '\0', subdirs);
+		}
+
+		pthread_mutex_lock(&state->mutex);
+		state->n_busy--;
+		while (parray_num(subdirs) > 0)
+		{
+			rel_dir = (char *) parray_remove(subdirs, parray_num(subdirs) - 1);
+			if (ok)
 			{
-				/* We add the directory itself which content was excluded */
-				parray_append(files, file);
-				continue;
+				parray_append(state->queue, rel_dir);
+				parray_append(state->dirs, rel_dir);
 			}
+			else
+				pfree(rel_dir);
 		}
+		pthread_cond_broadcast(&state->cond);
+	}
+	pthread_cond_broadcast(&state->cond);
+	pthread_mutex_unlock(&state->mutex);
 
-		parray_append(files, file);
+	parray_free(subdirs);
+	return NULL;
+}
 
-		/*
-		 * If the entry is a directory call dir_list_file_internal()
-		 * recursively.
-		 */
-		if (S_ISDIR(file->mode))
-			dir_list_file_internal(files, file, child, exclude, follow_symlink,
-								   backup_logs, skip_hidden, location);
+/*
+ * Remove local directory root with all its content by n_threads threads.
+ * Symbolic links are removed, not followed.  Missing directory is not
+ * an error.  Errors are not thrown, so the function can be used by the
+ * remote agent, on failure the message is put into errmsg.
+ */
+bool
+dir_remove_tree(const char *root, int n_threads, char *errmsg, size_t errmsg_len)
+{
+	dir_remove_state state;
+	pthread_t  *threads;
+	int			i;
+	size_t		j;
+
+	memset(&state, 0, sizeof(state));
+	state.root = root;
+	state.root_fd = open(root, O_RDONLY | O_DIRECTORY);
+	if (state.root_fd < 0)
+	{
+		if (errno == ENOENT)
+			return true;
+		snprintf(errmsg, errmsg_len, "Cannot open directory \"%s\": %s",
+				 root, strerror(errno));
+		return false;
 	}
 
-	if (errno && errno != ENOENT)
+	pthread_mutex_init(&state.mutex, NULL);
+	pthread_cond_init(&state.cond, NULL);
+	state.queue = parray_new();
+	state.dirs = parray_new();
+	parray_append(state.queue, "");
+
+	if (n_threads <= 1)
+		dir_remove_worker(&state);
+	else
 	{
-		int			errno_tmp = errno;
-		fio_closedir(dir);
-		elog(ERROR, "Cannot read directory \"%s\": %s",
-				parent_dir, strerror(errno_tmp));
+		threads = (pthread_t *) palloc(sizeof(pthread_t) * n_threads);
+		for (i = 0; i < n_threads; i++)
+			pthread_create(&threads[i], NULL, dir_remove_worker, &state);
+		for (i = 0; i < n_threads; i++)
+			pthread_join(threads[i], NULL);
+		pfree(threads);
 	}
-	fio_closedir(dir);
+
+	/* children were found after their parents, so remove them in reverse */
+	for (j = parray_num(state.dirs); j > 0 && !state.failed; j--)
+	{
+		const char *rel_dir = (const char *) parray_get(state.dirs, j - 1);
+
+		if (unlinkat(state.root_fd, rel_dir, AT_REMOVEDIR) < 0 && errno != ENOENT)
+			dir_remove_set_error(&state, "Cannot remove directory \"%s/%s\": %s",
+								 root, rel_dir, strerror(errno));
+	}
+
+	if (!state.failed)
+		dir_remove_one_dir(&state, "", true, NULL);
+
+	close(state.root_fd);
+
+	if (!state.failed && rmdir(root) < 0 && errno != ENOENT)
+		dir_remove_set_error(&state, "Cannot remove directory \"%s\": %s",
+							 root, strerror(errno));
+
+	pthread_cond_destroy(&state.cond);
+	pthread_mutex_destroy(&state.mutex);
+	parray_free(state.queue);
+	parray_walk(state.dirs, pfree);
+	parray_free(state.dirs);
+
+	if (state.failed)
+		snprintf(errmsg, errmsg_len, "%s", state.errmsg);
+
+	return !state.failed;
+}
+
+static void *
+dir_remove_files_worker(void *arg)
+{
+	dir_remove_files_arg *files_arg = (dir_remove_files_arg *) arg;
+	dir_remove_state *state = files_arg->state;
+	size_t		i;
+
+	for (i = files_arg->thread_num; i < files_arg->n_names; i += files_arg->n_threads)
+	{
+		const char *name = files_arg->names[i];
+
+		if (interrupted || thread_interrupted)
+		{
+			dir_remove_set_error(state, "Interrupted during file removal");
+			break;
+		}
+
+		if (unlinkat(state->root_fd, name, 0) < 0 && errno != ENOENT)
+		{
+			dir_remove_set_error(state, "Cannot remove file \"%s/%s\": %s",
+								 state->root, name, strerror(errno));
+			break;
+		}
+	}
+
+	return NULL;
+}
+
+/*
+ * Remove files of local directory dir by n_threads threads, names are
+ * relative to dir.  Missing files are not an error.  As dir_remove_tree(),
+ * the function puts error message into errmsg instead of throwing it.
+ */
+bool
+dir_remove_files(const char *dir, char **names, size_t n_names, int n_threads,
+				 char *errmsg, size_t errmsg_len)
+{
+	dir_remove_state state;
+	dir_remove_files_arg *thread_args;
+	pthread_t  *threads;
+	int			i;
+
+	if (n_names == 0)
+		return true;
+
+	memset(&state, 0, sizeof(state));
+	state.root = dir;
+	state.root_fd = open(dir, O_RDONLY | O_DIRECTORY);
+	if (state.root_fd < 0)
+	{
+		snprintf(errmsg, errmsg_len, "Cannot open directory \"%s\": %s",
+				 dir, strerror(errno));
+		return false;
+	}
+
+	pthread_mutex_init(&state.mutex, NULL);
+	pthread_cond_init(&state.cond, NULL);
+
+	n_threads = Max(Min((size_t) n_threads, n_names), 1);
+	thread_args = (dir_remove_files_arg *) palloc(sizeof(dir_remove_files_arg) * n_threads);
+	threads = (pthread_t *) palloc(sizeof(pthread_t) * n_threads);
+
+	for (i = 0; i < n_threads; i++)
+	{
+		thread_args[i].state = &state;
+		thread_args[i].names = names;
+		thread_args[i].n_names = n_names;
+		thread_args[i].thread_num = i;
+		thread_args[i].n_threads = n_threads;
+	}
+
+	if (n_threads == 1)
+		dir_remove_files_worker(&thread_args[0]);
+	else
+	{
+		for (i = 0; i < n_threads; i++)
+			pthread_create(&threads[i], NULL, dir_remove_files_worker, &thread_args[i]);
+		for (i = 0; i < n_threads; i++)
+			pthread_join(threads[i], NULL);
+	}
+
+	close(state.root_fd);
+	pthread_cond_destroy(&state.cond);
+	pthread_mutex_destroy(&state.mutex);
+	pfree(thread_args);
+	pfree(threads);
+
+	if (state.failed)
+		snprintf(errmsg, errmsg_len, "%s", state.errmsg);
+
+	return !state.failed;
 }
 
 /*
@@ -871,6 +1626,7 @@ create_data_directories(parray *dest_files, const char *data_dir, const char *ba
 	parray		*links = NULL;
 	mode_t		pg_tablespace_mode = DIR_PERMISSION;
 	char		to_path[MAXPGPATH];
+	fio_batch  *batch;
 
 	if (waldir_path && !dir_is_empty(waldir_path, location))
 	{
@@ -926,6 +1682,12 @@ create_data_directories(parray *dest_files, const char *data_dir, const char *ba
 
 	elog(LOG, "Restore directories and symlinks...");
 
+	/*
+	 * Directories are created in batches, the batch must be waited for
+	 * before any other request, e.g. symlink creation.
+	 */
+	batch = fio_batch_begin(location);
+
 	/* create directories */
 	for (i = 0; i < parray_num(dest_files); i++)
 	{
@@ -945,7 +1707,8 @@ create_data_directories(parray *dest_files, const char *data_dir, const char *ba
 				waldir_path, to_path);
 
 			/* create tablespace directory from waldir_path*/
-			fio_mkdir(location, waldir_path, pg_tablespace_mode, false);
+			fio_batch_mkdir(batch, waldir_path, pg_tablespace_mode, false, NULL);
+			fio_batch_wait(batch);
 
 			/* create link to linked_path */
 			if (fio_symlink(location, waldir_path, to_path, incremental) < 0)
@@ -987,7 +1750,8 @@ create_data_directories(parray *dest_files, const char *data_dir, const char *ba
 							 linked_path, to_path);
 
 					/* create tablespace directory */
-					fio_mkdir(location, linked_path, pg_tablespace_mode, false);
+					fio_batch_mkdir(batch, linked_path, pg_tablespace_mode, false, NULL);
+					fio_batch_wait(batch);
 
 					/* create link to linked_path */
 					if (fio_symlink(location, linked_path, to_path, incremental) < 0)
@@ -1005,8 +1769,9 @@ create_data_directories(parray *dest_files, const char *data_dir, const char *ba
 		join_path_components(to_path, data_dir, dir->rel_path);
 
 		// TODO check exit code
-		fio_mkdir(location, to_path, dir->mode, false);
+		fio_batch_mkdir(batch, to_path, dir->mode, false, NULL);
 	}
+	fio_batch_end(batch);
 
 	if (extract_tablespaces)
 	{
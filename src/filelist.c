@@ -0,0 +1,679 @@
+/*-------------------------------------------------------------------------
+ *
+ * filelist.c: binary backup file list (DATABASE_FILE_LIST).
+ *
+ * The file list of a backup is stored in a compact binary format:
+ *
+ *   FileListHeader
+ *   FileListEntry[n_files]     fixed-size records in the order of writing
+ *   uint32[n_files]            index of entries, sorted by rel_path
+ *   char[strings_size]         string table with zero-terminated paths
+ *
+ * All offsets are relative to the beginning of the file, so it can be
+ * mapped into memory and single files can be looked up by rel_path
+ * without materializing the whole list of pgFile structures.
+ * File lists of backups taken by older versions are stored as text,
+ * one JSON-like line per file, and are still handled by get_backup_filelist().
+ *
+ * Portions Copyright (c) 2015-2022, Postgres Professional
+ *
+ *-------------------------------------------------------------------------
+ */
+
+#include "pg_probackup.h"
+
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+
+#include "utils/file.h"
+
+#define FILELIST_MAGIC			"PBKFLST"
+#define FILELIST_MAGIC_LEN		8
+#define FILELIST_FORMAT_VERSION	1
+
+/* Special value of string offset, used when string is absent */
+#define FILELIST_NO_STRING		PG_UINT32_MAX
+
+typedef struct FileListHeader
+{
+	char		magic[FILELIST_MAGIC_LEN];
+	uint32		version;
+	uint32		n_files;
+	uint32		entry_size;		/* sizeof(FileListEntry) of the writer */
+	uint32		reserved;
+	uint64		entries_off;
+	uint64		index_off;
+	uint64		strings_off;
+	uint64		strings_size;
+} FileListHeader;
+
+typedef struct FileListEntry
+{
+	int64		write_size;
+	int64		uncompressed_size;
+	uint64		hdr_off;
+	uint32		mode;
+	uint32		crc;
+	uint32		dbOid;
+	int32		segno;
+	int32		n_blocks;
+	int32		n_headers;
+	uint32		hdr_crc;
+	int32		hdr_size;
+	uint32		path_off;		/* offset of rel_path in string table */
+	uint32		linked_off;		/* offset of linked path or FILELIST_NO_STRING */
+	uint8		is_datafile;
+	uint8		compress_alg;
+	uint16		reserved1;
+	uint32		reserved2;
+} FileListEntry;
+
+typedef struct FileListHashSlot
+{
+	uint32		hash;
+	uint32		entry;			/* entry number plus one, 0 if empty */
+} FileListHashSlot;
+
+struct FileListMap
+{
+	char		path[MAXPGPATH];
+	char	   *data;
+	size_t		size;
+	bool		is_mmap;		/* data is mapped, otherwise malloc'd */
+
+	const FileListHeader *hdr;
+	const char *entries;
+	const uint32 *index;
+	const char *strings;
+
+	/* hash index of entries by rel_path, see filelist_map_build_hash() */
+	FileListHashSlot *hash_slots;
+	uint32		hash_mask;
+};
+
+typedef struct FileListSortItem
+{
+	const char *rel_path;
+	uint32		entry;
+} FileListSortItem;
+
+static int
+filelist_sort_item_cmp(const void *a, const void *b)
+{
+	return strcmp(((const FileListSortItem *) a)->rel_path,
+				  ((const FileListSortItem *) b)->rel_path);
+}
+
+static void
+filelist_write(FILE *out, const void *data, size_t len,
+			   pg_crc32 *crc, const char *path)
+{
+	if (len == 0)
+		return;
+
+	if (fwrite(data, 1, len, out) != len)
+		elog(ERROR, "Cannot write file list \"%s\": %s",
+			 path, strerror(errno));
+
+	if (crc)
+		COMP_CRC32C(*crc, data, len);
+}
+
+/*
+ * Write files into "out" in binary format.
+ * Files with write_size FILE_NOT_FOUND are skipped.
+ * If "crc" is not NULL, it is updated with every written byte.
+ */
+void
+write_filelist_binary(FILE *out, parray *files, pg_crc32 *crc, const char *path)
+{
+	FileListHeader hdr;
+	FileListSortItem *items;
+	uint32		n_files = 0;
+	uint64		strings_size = 0;
+	size_t		i;
+	static const char zeroes[MAXIMUM_ALIGNOF] = {0};
+
+	items = pgut_malloc(sizeof(FileListSortItem) * Max(parray_num(files), 1));
+
+	/* collect files to be written and calculate size of string table */
+	for (i = 0; i < parray_num(files); i++)
+	{
+		pgFile	   *file = (pgFile *) parray_get(files, i);
+
+		/* Ignore disappeared file */
+		if (file->write_size == FILE_NOT_FOUND)
+			continue;
+
+		items[n_files].rel_path = file->rel_path;
+		items[n_files].entry = n_files;
+		n_files++;
+
+		strings_size += strlen(file->rel_path) + 1;
+		if (file->linked)
+			strings_size += strlen(file->linked) + 1;
+	}
+
+	if (strings_size >= FILELIST_NO_STRING)
+		elog(ERROR, "Cannot write file list \"%s\": string table is too large", path);
+
+	MemSet(&hdr, 0, sizeof(hdr));
+	memcpy(hdr.magic, FILELIST_MAGIC, FILELIST_MAGIC_LEN);
+	hdr.version = FILELIST_FORMAT_VERSION;
+	hdr.n_files = n_files;
+	hdr.entry_size = sizeof(FileListEntry);
+	hdr.entries_off = MAXALIGN(sizeof(FileListHeader));
+	hdr.index_off = hdr.entries_off + (uint64) n_files * sizeof(FileListEntry);
+	hdr.strings_off = MAXALIGN(hdr.index_off + (uint64) n_files * sizeof(uint32));
+	hdr.strings_size = strings_size;
+
+	filelist_write(out, &hdr, sizeof(hdr), crc, path);
+	filelist_write(out, zeroes, hdr.entries_off - sizeof(hdr), crc, path);
+
+	/* entries, strings are laid out in the same order */
+	strings_size = 0;
+	for (i = 0; i < parray_num(files); i++)
+	{
+		pgFile	   *file = (pgFile *) parray_get(files, i);
+		FileListEntry entry;
+
+		if (file->write_size == FILE_NOT_FOUND)
+			continue;
+
+		MemSet(&entry, 0, sizeof(entry));
+		entry.write_size = file->write_size;
+		entry.uncompressed_size = file->uncompressed_size;
+		entry.mode = file->mode;
+		entry.is_datafile = file->is_datafile ? 1 : 0;
+		entry.crc = file->crc;
+		entry.compress_alg = (uint8) file->compress_alg;
+		entry.dbOid = file->dbOid;
+		entry.segno = file->is_datafile ? file->segno : 0;
+		entry.n_blocks = file->n_blocks > 0 ? file->n_blocks : 0;
+
+		if (file->n_headers > 0)
+		{
+			entry.n_headers = file->n_headers;
+			entry.hdr_crc = file->hdr_crc;
+			entry.hdr_off = file->hdr_off;
+			entry.hdr_size = file->hdr_size;
+		}
+
+		entry.path_off = (uint32) strings_size;
+		strings_size += strlen(file->rel_path) + 1;
+
+		if (file->linked)
+		{
+			entry.linked_off = (uint32) strings_size;
+			strings_size += strlen(file->linked) + 1;
+		}
+		else
+			entry.linked_off = FILELIST_NO_STRING;
+
+		filelist_write(out, &entry, sizeof(entry), crc, path);
+	}
+
+	/* path index */
+	qsort(items, n_files, sizeof(FileListSortItem), filelist_sort_item_cmp);
+	for (i = 0; i < n_files; i++)
+		filelist_write(out, &items[i].entry, sizeof(uint32), crc, path);
+
+	filelist_write(out, zeroes,
+				   hdr.strings_off - (hdr.index_off + (uint64) n_files * sizeof(uint32)),
+				   crc, path);
+
+	/* string table */
+	for (i = 0; i < parray_num(files); i++)
+	{
+		pgFile	   *file = (pgFile *) parray_get(files, i);
+
+		if (file->write_size == FILE_NOT_FOUND)
+			continue;
+
+		filelist_write(out, file->rel_path, strlen(file->rel_path) + 1, crc, path);
+		if (file->linked)
+			filelist_write(out, file->linked, strlen(file->linked) + 1, crc, path);
+	}
+
+	pg_free(items);
+}
+
+/*
+ * Check if the file list content starts with binary format magic.
+ */
+bool
+filelist_is_binary(const char *data, size_t size)
+{
+	return size >= FILELIST_MAGIC_LEN &&
+		memcmp(data, FILELIST_MAGIC, FILELIST_MAGIC_LEN) == 0;
+}
+
+/* Sanity checks of the header, throw ERROR in case of inconsistency */
+static void
+filelist_map_check(FileListMap *map)
+{
+	const FileListHeader *hdr = (const FileListHeader *) map->data;
+
+	if (map->size < sizeof(FileListHeader))
+		elog(ERROR, "File list \"%s\" is truncated", map->path);
+
+	if (hdr->version > FILELIST_FORMAT_VERSION)
+		elog(ERROR, "File list \"%s\" has unsupported format version %u, "
+			 "maximum supported version is %u",
+			 map->path, hdr->version, FILELIST_FORMAT_VERSION);
+
+	if (hdr->entry_size < sizeof(FileListEntry) ||
+		hdr->entries_off + (uint64) hdr->n_files * hdr->entry_size > map->size ||
+		hdr->index_off + (uint64) hdr->n_files * sizeof(uint32) > map->size ||
+		hdr->strings_off + hdr->strings_size > map->size ||
+		(hdr->strings_size > 0 &&
+		 map->data[hdr->strings_off + hdr->strings_size - 1] != '\0'))
+		elog(ERROR, "File list \"%s\" is corrupted", map->path);
+
+	map->hdr = hdr;
+	map->entries = map->data + hdr->entries_off;
+	map->index = (const uint32 *) (map->data + hdr->index_off);
+	map->strings = map->data + hdr->strings_off;
+}
+
+/*
+ * Open file list of the backup for lookups.
+ * Local file list is mapped into memory, remote one is read.
+ * Returns NULL if file list is stored in legacy text format,
+ * caller should fall back to parsing it line by line in this case.
+ */
+FileListMap *
+filelist_map_open(pgBackup *backup)
+{
+	FileListMap *map = pgut_new0(FileListMap);
+	char		magic[FILELIST_MAGIC_LEN];
+
+	join_path_components(map->path, backup->root_dir, DATABASE_FILE_LIST);
+
+	if (fio_is_remote(FIO_BACKUP_HOST))
+	{
+		FILE	   *fp;
+		size_t		allocated = BLCKSZ;
+		size_t		read_len;
+
+		fp = fio_open_stream(FIO_BACKUP_HOST, map->path);
+		if (fp == NULL)
+			elog(ERROR, "Cannot open \"%s\": %s", map->path, strerror(errno));
+
+		map->data = pgut_malloc(allocated);
+		while ((read_len = fread(map->data + map->size, 1,
+								 allocated - map->size, fp)) > 0)
+		{
+			map->size += read_len;
+			if (map->size == allocated)
+			{
+				allocated *= 2;
+				map->data = pgut_realloc(map->data, allocated);
+			}
+		}
+
+		if (ferror(fp))
+			elog(ERROR, "Cannot read \"%s\": %s", map->path, strerror(errno));
+		fio_close_stream(fp);
+
+		if (!filelist_is_binary(map->data, map->size))
+		{
+			filelist_map_close(map);
+			return NULL;
+		}
+	}
+	else
+	{
+		int			fd;
+		struct stat st;
+
+		fd = open(map->path, O_RDONLY | PG_BINARY, 0);
+		if (fd < 0)
+			elog(ERROR, "Cannot open \"%s\": %s", map->path, strerror(errno));
+
+		if (read(fd, magic, sizeof(magic)) != sizeof(magic) ||
+			!filelist_is_binary(magic, sizeof(magic)))
+		{
+			close(fd);
+			pg_free(map);
+			return NULL;
+		}
+
+		if (fstat(fd, &st) < 0)
+			elog(ERROR, "Cannot stat \"%s\": %s", map->path, strerror(errno));
+
+		map->size = st.st_size;
+		map->data = mmap(NULL, map->size, PROT_READ, MAP_SHARED, fd, 0);
+		if (map->data == MAP_FAILED)
+			elog(ERROR, "Cannot map \"%s\" into memory: %s",
+				 map->path, strerror(errno));
+		map->is_mmap = true;
+		close(fd);
+	}
+
+	filelist_map_check(map);
+
+	return map;
+}
+
+/*
+ * Compare CRC of the file list content with the one, stored in
+ * backup.control. Zero "expected_crc" means that it is unknown.
+ */
+bool
+filelist_map_verify_crc(FileListMap *map, pg_crc32 expected_crc)
+{
+	pg_crc32	content_crc;
+
+	if (expected_crc == 0)
+		return true;
+
+	INIT_CRC32C(content_crc);
+	COMP_CRC32C(content_crc, map->data, map->size);
+	FIN_CRC32C(content_crc);
+
+	if (content_crc != expected_crc)
+	{
+		elog(WARNING, "Invalid CRC of backup control file '%s': %u. Expected: %u",
+			 map->path, content_crc, expected_crc);
+		return false;
+	}
+
+	return true;
+}
+
+void
+filelist_map_close(FileListMap *map)
+{
+	if (map == NULL)
+		return;
+
+	if (map->is_mmap)
+	{
+		if (munmap(map->data, map->size) != 0)
+			elog(WARNING, "Cannot unmap file list \"%s\": %s",
+				 map->path, strerror(errno));
+	}
+	else
+		pg_free(map->data);
+
+	pg_free(map->hash_slots);
+	pg_free(map);
+}
+
+size_t
+filelist_map_num(FileListMap *map)
+{
+	return map->hdr->n_files;
+}
+
+static const char *
+filelist_map_string(FileListMap *map, uint32 off)
+{
+	if (off >= map->hdr->strings_size)
+		elog(ERROR, "File list \"%s\" is corrupted", map->path);
+
+	return map->strings + off;
+}
+
+static const FileListEntry *
+filelist_map_entry(FileListMap *map, uint32 entry_no)
+{
+	if (entry_no >= map->hdr->n_files)
+		elog(ERROR, "File list \"%s\" is corrupted", map->path);
+
+	return (const FileListEntry *) (map->entries +
+									(size_t) entry_no * map->hdr->entry_size);
+}
+
+/*
+ * Fill "file" with attributes of n-th entry of the file list.
+ * String members of "file" point into the map, so "file" must
+ * not be freed with pgFileFree() and must not outlive the map.
+ */
+void
+filelist_map_get(FileListMap *map, size_t n, pgFile *file)
+{
+	const FileListEntry *entry = filelist_map_entry(map, (uint32) n);
+	char	   *file_name;
+
+	MemSet(file, 0, sizeof(pgFile));
+
+	file->rel_path = (char *) filelist_map_string(map, entry->path_off);
+	file_name = last_dir_separator(file->rel_path);
+	file->name = file_name ? file_name + 1 : file->rel_path;
+
+	if (entry->linked_off != FILELIST_NO_STRING)
+		file->linked = (char *) filelist_map_string(map, entry->linked_off);
+
+	file->write_size = entry->write_size;
+	file->uncompressed_size = entry->uncompressed_size;
+	file->mode = (mode_t) entry->mode;
+	file->is_datafile = entry->is_datafile != 0;
+	file->crc = entry->crc;
+	file->compress_alg = (CompressAlg) entry->compress_alg;
+	file->dbOid = entry->dbOid;
+	file->segno = entry->segno;
+	file->n_blocks = entry->n_blocks > 0 ? entry->n_blocks : BLOCKNUM_INVALID;
+	file->n_headers = entry->n_headers;
+	file->hdr_crc = entry->hdr_crc;
+	file->hdr_off = entry->hdr_off;
+	file->hdr_size = entry->hdr_size;
+
+	if (!file->is_datafile)
+		file->size = file->uncompressed_size;
+
+	if (S_ISREG(file->mode))
+		set_forkname(file);
+}
+
+/*
+ * Build in-memory hash index of entries, so lookups do not need
+ * to binary search the sorted path index.
+ */
+static void
+filelist_map_build_hash(FileListMap *map)
+{
+	size_t		n_slots = 16;
+	uint32		i;
+
+	while (n_slots < (size_t) map->hdr->n_files * 2)
+		n_slots <<= 1;
+
+	map->hash_mask = (uint32) (n_slots - 1);
+	map->hash_slots = pgut_malloc0(sizeof(FileListHashSlot) * n_slots);
+
+	for (i = 0; i < map->hdr->n_files; i++)
+	{
+		const FileListEntry *entry = filelist_map_entry(map, i);
+		uint32		hash = pgHashRelPath(filelist_map_string(map, entry->path_off));
+		uint32		slot = hash & map->hash_mask;
+
+		while (map->hash_slots[slot].entry != 0)
+			slot = (slot + 1) & map->hash_mask;
+
+		map->hash_slots[slot].hash = hash;
+		map->hash_slots[slot].entry = i + 1;
+	}
+}
+
+/*
+ * Find file with the same relative path as "key".  Hash index is used
+ * if it's built, sorted path index otherwise.
+ * Returns false if there is no such file in the list.
+ */
+bool
+filelist_map_lookup(FileListMap *map, pgFile *key, pgFile *file)
+{
+	const char *rel_path = key->rel_path;
+	int64		low = 0;
+	int64		high = (int64) map->hdr->n_files - 1;
+
+	if (map->hash_slots)
+	{
+		uint32		hash = pgFileHashRelPath(&key);
+		uint32		slot = hash & map->hash_mask;
+
+		for (; map->hash_slots[slot].entry != 0; slot = (slot + 1) & map->hash_mask)
+		{
+			uint32		entry_no = map->hash_slots[slot].entry - 1;
+
+			if (map->hash_slots[slot].hash == hash &&
+				strcmp(rel_path, filelist_map_string(map,
+													 filelist_map_entry(map, entry_no)->path_off)) == 0)
+			{
+				filelist_map_get(map, entry_no, file);
+				return true;
+			}
+		}
+		return false;
+	}
+
+	while (low <= high)
+	{
+		int64		mid = low + (high - low) / 2;
+		uint32		entry_no = map->index[mid];
+		const FileListEntry *entry = filelist_map_entry(map, entry_no);
+		int			cmp;
+
+		cmp = strcmp(rel_path, filelist_map_string(map, entry->path_off));
+
+		if (cmp == 0)
+		{
+			filelist_map_get(map, entry_no, file);
+			return true;
+		}
+		else if (cmp < 0)
+			high = mid - 1;
+		else
+			low = mid + 1;
+	}
+
+	return false;
+}
+
+/*
+ * Build list of pgFile from the map.
+ * Unlike filelist_map_get(), files and their strings are copied into
+ * the arena of the list, so the map can be closed afterwards.
+ * The list should be freed with pgFileListFree().
+ */
+parray *
+filelist_map_to_parray(FileListMap *map)
+{
+	parray	   *files = parray_new();
+	pgut_arena *arena = pgut_arena_create();
+	size_t		i;
+
+	parray_set_arena(files, arena);
+	parray_expand(files, Max(filelist_map_num(map), 1));
+
+	for (i = 0; i < filelist_map_num(map); i++)
+	{
+		pgFile		tmp;
+		pgFile	   *file;
+
+		filelist_map_get(map, i, &tmp);
+
+		/* copy attributes, but keep strings allocated by pgFileInitInArena() */
+		file = pgFileInitInArena(tmp.rel_path, arena);
+		tmp.rel_path = file->rel_path;
+		tmp.rel_path_hash = file->rel_path_hash;
+		tmp.name = file->name;
+		tmp.in_arena = file->in_arena;
+		memcpy(file, &tmp, sizeof(pgFile));
+
+		if (tmp.linked)
+		{
+			file->linked = pgut_arena_strdup(arena, tmp.linked);
+			canonicalize_path(file->linked);
+		}
+
+		parray_append(files, file);
+	}
+
+	return files;
+}
+
+/*
+ * Find file with the same relative path as "key" in the file list of
+ * the backup. If backup->files is populated, it must be sorted with
+ * pgFileCompareRelPath, backup->files_index is used if it's built.
+ * Otherwise backup->filelist_map is used and the result is stored into "buf".
+ */
+pgFile *
+backup_lookup_file(pgBackup *backup, pgFile *key, pgFile *buf)
+{
+	if (backup->files)
+	{
+		pgFile	  **res_file;
+
+		if (backup->files_index)
+			res_file = parray_index_find(backup->files_index, key);
+		else
+			res_file = parray_bsearch(backup->files, key, pgFileCompareRelPath);
+
+		return res_file ? *res_file : NULL;
+	}
+
+	if (backup->filelist_map)
+		return filelist_map_lookup(backup->filelist_map, key, buf) ? buf : NULL;
+
+	elog(ERROR, "File list of backup %s is not loaded", backup_id_of(backup));
+	return NULL;				/* keep compiler quiet */
+}
+
+/*
+ * Make file list of the backup available for backup_lookup_file().
+ * Binary file list is only mapped, legacy text one is loaded and sorted.
+ */
+void
+backup_open_filelist(pgBackup *backup, bool strict)
+{
+	backup->files = NULL;
+	backup->filelist_map = filelist_map_open(backup);
+
+	if (backup->filelist_map == NULL)
+	{
+		backup->files = get_backup_filelist(backup, strict);
+		if (backup->files)
+		{
+			parray_qsort(backup->files, pgFileCompareRelPath);
+			backup->files_index = parray_index_build(backup->files, pgFileHashRelPath,
+													 pgFileCompareRelPath);
+		}
+		return;
+	}
+
+	if (!filelist_map_verify_crc(backup->filelist_map, backup->content_crc))
+	{
+		filelist_map_close(backup->filelist_map);
+		backup->filelist_map = NULL;
+		elog(strict ? ERROR : WARNING, "Failed to get file list for backup %s",
+			 backup_id_of(backup));
+		return;
+	}
+
+	filelist_map_build_hash(backup->filelist_map);
+}
+
+/*
+ * Release the file list, opened by backup_open_filelist()
+ * or loaded by get_backup_filelist().
+ */
+void
+backup_close_filelist(pgBackup *backup)
+{
+	parray_index_free(backup->files_index);
+	backup->files_index = NULL;
+
+	if (backup->files)
+	{
+		pgFileListFree(backup->files);
+		backup->files = NULL;
+	}
+
+	filelist_map_close(backup->filelist_map);
+	backup->filelist_map = NULL;
+}
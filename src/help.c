@@ -30,6 +30,7 @@ static void help_checkdb(void);
 static void help_help(void);
 static void help_version(void);
 static void help_catchup(void);
+static void help_rebuild_wal_index(void);
 
 void
 help_print_version(void)
@@ -66,6 +67,7 @@ help_command(ProbackupSubcmd const subcmd)
 		&help_help,
 		&help_version,
 		&help_catchup,
+		&help_rebuild_wal_index,
 	};
 
 	Assert((int)subcmd < sizeof(help_functions) / sizeof(help_functions[0]));
@@ -96,6 +98,7 @@ help_pg_backup(void)
 	printf(_("                 [--retention-redundancy=retention-redundancy]\n"));
 	printf(_("                 [--retention-window=retention-window]\n"));
 	printf(_("                 [--wal-depth=wal-depth]\n"));
+	printf(_("                 [--validation-ledger-max-age=max-age]\n"));
 	printf(_("                 [--compress-algorithm=compress-algorithm]\n"));
 	printf(_("                 [--compress-level=compress-level]\n"));
 	printf(_("                 [--archive-timeout=timeout]\n"));
@@ -121,7 +124,7 @@ help_pg_backup(void)
 	printf(_("                 [--stream [-S slot-name] [--temp-slot]]\n"));
 	printf(_("                 [--backup-pg-log] [-j num-threads] [--progress]\n"));
 	printf(_("                 [--no-validate] [--skip-block-validation]\n"));
-	printf(_("                 [--no-sync]\n"));
+	printf(_("                 [--no-sync] [--direct-io]\n"));
 	printf(_("                 [--log-level-console=log-level-console]\n"));
 	printf(_("                 [--log-level-file=log-level-file]\n"));
 	printf(_("                 [--log-format-console=log-format-console]\n"));
@@ -161,10 +164,12 @@ help_pg_backup(void)
 	printf(_("                 [--primary-conninfo=primary_conninfo]\n"));
 	printf(_("                 [-S | --primary-slot-name=slotname]\n"));
 	printf(_("                 [--no-validate] [--skip-block-validation]\n"));
+	printf(_("                 [--full-validation]\n"));
 	printf(_("                 [-T OLDDIR=NEWDIR] [--progress]\n"));
 	printf(_("                 [--no-sync]\n"));
 	printf(_("                 [-X WALDIR | --waldir=WALDIR]\n"));
 	printf(_("                 [-I | --incremental-mode=none|checksum|lsn]\n"));
+	printf(_("                 [--punch-holes]\n"));
 	printf(_("                 [--db-include | --db-exclude]\n"));
 	printf(_("                 [--remote-proto] [--remote-host]\n"));
 	printf(_("                 [--remote-port] [--remote-path] [--remote-user]\n"));
@@ -179,7 +184,7 @@ help_pg_backup(void)
 	printf(_("                  |--recovery-target-lsn=lsn [--recovery-target-inclusive=boolean]]\n"));
 	printf(_("                 [--recovery-target-timeline=timeline]\n"));
 	printf(_("                 [--recovery-target-name=target-name]\n"));
-	printf(_("                 [--skip-block-validation]\n"));
+	printf(_("                 [--skip-block-validation] [--full-validation]\n"));
 	printf(_("                 [--help]\n"));
 
 	printf(_("\n  %s checkdb [-B backup-path] [--instance=instance_name]\n"), PROGRAM_NAME);
@@ -219,9 +224,15 @@ help_pg_backup(void)
 	printf(_("                 --instance=instance_name\n"));
 	printf(_("                 [--help]\n"));
 
+	printf(_("\n  %s rebuild-wal-index -B backup-path\n"), PROGRAM_NAME);
+	printf(_("                 --instance=instance_name\n"));
+	printf(_("                 [--no-sync]\n"));
+	printf(_("                 [--help]\n"));
+
 	printf(_("\n  %s archive-push -B backup-path --instance=instance_name\n"), PROGRAM_NAME);
 	printf(_("                 --wal-file-name=wal-file-name\n"));
 	printf(_("                 [--wal-file-path=wal-file-path]\n"));
+	printf(_("                 [--archive-socket=socket-path] [--daemon]\n"));
 	printf(_("                 [-j num-threads] [--batch-size=batch_size]\n"));
 	printf(_("                 [--archive-timeout=timeout]\n"));
 	printf(_("                 [--no-ready-rename] [--no-sync]\n"));
@@ -237,7 +248,7 @@ help_pg_backup(void)
 	printf(_("                 --wal-file-path=wal-file-path\n"));
 	printf(_("                 --wal-file-name=wal-file-name\n"));
 	printf(_("                 [-j num-threads] [--batch-size=batch_size]\n"));
-	printf(_("                 [--no-validate-wal]\n"));
+	printf(_("                 [--no-validate-wal] [--background-prefetch]\n"));
 	printf(_("                 [--remote-proto] [--remote-host]\n"));
 	printf(_("                 [--remote-port] [--remote-path] [--remote-user]\n"));
 	printf(_("                 [--ssh-options]\n"));
@@ -295,7 +306,7 @@ help_backup(void)
 	printf(_("                 [--stream [-S slot-name] [--temp-slot]]\n"));
 	printf(_("                 [--backup-pg-log] [-j num-threads] [--progress]\n"));
 	printf(_("                 [--no-validate] [--skip-block-validation]\n"));
-	printf(_("                 [--no-sync]\n"));
+	printf(_("                 [--no-sync] [--direct-io]\n"));
 	printf(_("                 [--log-level-console=log-level-console]\n"));
 	printf(_("                 [--log-level-file=log-level-file]\n"));
 	printf(_("                 [--log-format-console=log-format-console]\n"));
@@ -334,6 +345,7 @@ help_backup(void)
 	printf(_("      --no-validate                disable validation after backup\n"));
 	printf(_("      --skip-block-validation      set to validate only file-level checksum\n"));
 	printf(_("      --no-sync                    do not sync backed up files to disk\n"));
+	printf(_("      --direct-io                  read files bypassing the page cache\n"));
 	printf(_("      --note=text                  add note to backup\n"));
 	printf(_("                                   (example: --note='backup before app update to v13.1')\n"));
 
@@ -389,9 +401,9 @@ help_backup(void)
 	printf(_("\n  Compression options:\n"));
 	printf(_("      --compress                   alias for --compress-algorithm='zlib' and --compress-level=1\n"));
 	printf(_("      --compress-algorithm=compress-algorithm\n"));
-	printf(_("                                   available options: 'zlib', 'none' (default: none)\n"));
+	printf(_("                                   available options: 'zlib', 'zstd', 'lz4', 'none' (default: none)\n"));
 	printf(_("      --compress-level=compress-level\n"));
-	printf(_("                                   level of compression [0-9] (default: 1)\n"));
+	printf(_("                                   level of compression [0-9], [1-22] for zstd, [0-12] for lz4 (default: 1)\n"));
 
 	printf(_("\n  Archive options:\n"));
 	printf(_("      --archive-timeout=timeout    wait timeout for WAL segment archiving (default: 5min)\n"));
@@ -423,9 +435,11 @@ help_restore(void)
 	printf(_("                 [-D pgdata-path] [-i backup-id] [-j num-threads]\n"));
 	printf(_("                 [--progress] [--force] [--no-sync]\n"));
 	printf(_("                 [--no-validate] [--skip-block-validation]\n"));
+	printf(_("                 [--full-validation]\n"));
 	printf(_("                 [-T OLDDIR=NEWDIR]\n"));
 	printf(_("                 [-X WALDIR | --waldir=WALDIR]\n"));
 	printf(_("                 [-I | --incremental-mode=none|checksum|lsn]\n"));
+	printf(_("                 [--punch-holes]\n"));
 	printf(_("                 [--db-include dbname | --db-exclude dbname]\n"));
 	printf(_("                 [--recovery-target-time=time|--recovery-target-xid=xid\n"));
 	printf(_("                  |--recovery-target-lsn=lsn [--recovery-target-inclusive=boolean]]\n"));
@@ -455,6 +469,7 @@ help_restore(void)
 	printf(_("      --no-sync                    do not sync restored files to disk\n"));
 	printf(_("      --no-validate                disable backup validation during restore\n"));
 	printf(_("      --skip-block-validation      set to validate only file-level checksum\n"));
+	printf(_("      --full-validation            validate all files, ignore the validation ledger\n"));
 
 	printf(_("  -T, --tablespace-mapping=OLDDIR=NEWDIR\n"));
 	printf(_("                                   relocate the tablespace from directory OLDDIR to NEWDIR\n"));
@@ -467,6 +482,8 @@ help_restore(void)
 	printf(_("  -I, --incremental-mode=none|checksum|lsn\n"));
 	printf(_("                                   reuse valid pages available in PGDATA if they have not changed\n"));
 	printf(_("                                   (default: none)\n"));
+	printf(_("      --punch-holes                deallocate zero pages of existing files instead of\n"));
+	printf(_("                                   writing them\n"));
 
 	printf(_("\n  Partial restore options:\n"));
 	printf(_("      --db-include dbname          restore only specified databases\n"));
@@ -551,7 +568,7 @@ help_validate(void)
 	printf(_("                  |--recovery-target-lsn=lsn [--recovery-target-inclusive=boolean]]\n"));
 	printf(_("                 [--recovery-target-timeline=timeline]\n"));
 	printf(_("                 [--recovery-target-name=target-name]\n"));
-	printf(_("                 [--skip-block-validation]\n\n"));
+	printf(_("                 [--skip-block-validation] [--full-validation]\n\n"));
 
 	printf(_("  -B, --backup-path=backup-path    location of the backup storage area\n"));
 	printf(_("      --instance=instance_name     name of the instance\n"));
@@ -569,6 +586,7 @@ help_validate(void)
 	printf(_("      --recovery-target-name=target-name\n"));
 	printf(_("                                   the named restore point to which recovery will proceed\n"));
 	printf(_("      --skip-block-validation      set to validate only file-level checksum\n"));
+	printf(_("      --full-validation            validate all files, ignore the validation ledger\n"));
 
 	printf(_("\n  Logging options:\n"));
 	printf(_("      --log-level-console=log-level-console\n"));
@@ -823,6 +841,7 @@ help_set_config(void)
 	printf(_("                 [--retention-redundancy=retention-redundancy]\n"));
 	printf(_("                 [--retention-window=retention-window]\n"));
 	printf(_("                 [--wal-depth=wal-depth]\n"));
+	printf(_("                 [--validation-ledger-max-age=max-age]\n"));
 	printf(_("                 [--compress-algorithm=compress-algorithm]\n"));
 	printf(_("                 [--compress-level=compress-level]\n"));
 	printf(_("                 [--archive-timeout=timeout]\n"));
@@ -868,12 +887,18 @@ help_set_config(void)
 	printf(_("      --wal-depth=wal-depth        number of latest valid backups with ability to perform\n"));
 	printf(_("                                   the point in time recovery;  disables; (default: 0)\n"));
 
+	printf(_("\n  Validation options:\n"));
+	printf(_("      --validation-ledger-max-age=max-age\n"));
+	printf(_("                                   do not reread unchanged files validated within this\n"));
+	printf(_("                                   time; 0 disables; (default: 0)\n"));
+	printf(_("                                   available units: 'ms', 's', 'min', 'h', 'd' (default: s)\n"));
+
 	printf(_("\n  Compression options:\n"));
 	printf(_("      --compress                   alias for --compress-algorithm='zlib' and --compress-level=1\n"));
 	printf(_("      --compress-algorithm=compress-algorithm\n"));
-	printf(_("                                   available options: 'zlib','none' (default: 'none')\n"));
+	printf(_("                                   available options: 'zlib', 'zstd', 'lz4', 'none' (default: 'none')\n"));
 	printf(_("      --compress-level=compress-level\n"));
-	printf(_("                                   level of compression [0-9] (default: 1)\n"));
+	printf(_("                                   level of compression [0-9], [1-22] for zstd, [0-12] for lz4 (default: 1)\n"));
 
 	printf(_("\n  Archive options:\n"));
 	printf(_("      --archive-timeout=timeout    wait timeout for WAL segment archiving (default: 5min)\n"));
@@ -946,12 +971,24 @@ help_del_instance(void)
 	printf(_("      --instance=instance_name     name of the instance to delete\n\n"));
 }
 
+static void
+help_rebuild_wal_index(void)
+{
+	printf(_("\n%s rebuild-wal-index -B backup-path --instance=instance_name\n"), PROGRAM_NAME);
+	printf(_("                 [--no-sync]\n\n"));
+
+	printf(_("  -B, --backup-path=backup-path    location of the backup storage area\n"));
+	printf(_("      --instance=instance_name     name of the instance\n"));
+	printf(_("      --no-sync                    do not sync WAL index files to disk\n\n"));
+}
+
 static void
 help_archive_push(void)
 {
 	printf(_("\n%s archive-push -B backup-path --instance=instance_name\n"), PROGRAM_NAME);
 	printf(_("                 --wal-file-name=wal-file-name\n"));
 	printf(_("                 [--wal-file-path=wal-file-path]\n"));
+	printf(_("                 [--archive-socket=socket-path] [--daemon]\n"));
 	printf(_("                 [-j num-threads] [--batch-size=batch_size]\n"));
 	printf(_("                 [--archive-timeout=timeout]\n"));
 	printf(_("                 [--no-ready-rename] [--no-sync]\n"));
@@ -968,6 +1005,10 @@ help_archive_push(void)
 	printf(_("                                   name of the file to copy into WAL archive\n"));
 	printf(_("      --wal-file-path=wal-file-path\n"));
 	printf(_("                                   relative destination path of the WAL archive\n"));
+	printf(_("      --archive-socket=socket-path\n"));
+	printf(_("                                   socket of archive-push daemon, if it is running\n"));
+	printf(_("                                   the file is pushed by the daemon\n"));
+	printf(_("      --daemon                     run as daemon pushing WAL files as they are ready\n"));
 	printf(_("  -j, --threads=NUM                number of parallel threads\n"));
 	printf(_("      --batch-size=NUM             number of files to be copied\n"));
 	printf(_("      --archive-timeout=timeout    wait timeout before discarding stale temp file(default: 5min)\n"));
@@ -978,9 +1019,9 @@ help_archive_push(void)
 	printf(_("\n  Compression options:\n"));
 	printf(_("      --compress                   alias for --compress-algorithm='zlib' and --compress-level=1\n"));
 	printf(_("      --compress-algorithm=compress-algorithm\n"));
-	printf(_("                                   available options: 'zlib','none' (default: 'none')\n"));
+	printf(_("                                   available options: 'zlib', 'zstd', 'lz4', 'none' (default: 'none')\n"));
 	printf(_("      --compress-level=compress-level\n"));
-	printf(_("                                   level of compression [0-9] (default: 1)\n"));
+	printf(_("                                   level of compression [0-9], [1-22] for zstd, [0-12] for lz4 (default: 1)\n"));
 
 	printf(_("\n  Remote options:\n"));
 	printf(_("      --remote-proto=protocol      remote protocol to use\n"));
@@ -1001,7 +1042,7 @@ help_archive_get(void)
 	printf(_("                 --wal-file-name=wal-file-name\n"));
 	printf(_("                 [--wal-file-path=wal-file-path]\n"));
 	printf(_("                 [-j num-threads] [--batch-size=batch_size]\n"));
-	printf(_("                 [--no-validate-wal]\n"));
+	printf(_("                 [--no-validate-wal] [--background-prefetch]\n"));
 	printf(_("                 [--remote-proto] [--remote-host]\n"));
 	printf(_("                 [--remote-port] [--remote-path] [--remote-user]\n"));
 	printf(_("                 [--ssh-options]\n\n"));
@@ -1016,6 +1057,7 @@ help_archive_get(void)
 	printf(_("      --batch-size=NUM             number of files to be prefetched\n"));
 	printf(_("      --prefetch-dir=path          location of the store area for prefetched WAL files\n"));
 	printf(_("      --no-validate-wal            skip validation of prefetched WAL file before using it\n"));
+	printf(_("      --background-prefetch        keep prefetching WAL files in background between calls\n"));
 
 	printf(_("\n  Remote options:\n"));
 	printf(_("      --remote-proto=protocol      remote protocol to use\n"));
@@ -29,6 +29,8 @@ typedef struct
 	bool        use_bitmap;
 	bool        is_retry;
 	bool        no_sync;
+	FileScheduler *scheduler;
+	int			thread_num;
 
 	/*
 	 * Return value from the thread.
@@ -38,12 +40,34 @@ typedef struct
 } merge_files_arg;
 
 
+/*
+ * Source of page images for spliced merge of a data file:
+ * chain member, which has the newest version of some blocks.
+ */
+typedef struct MergeSource
+{
+	pgBackup   *backup;
+	pgFile	   *file;
+	pgFile		file_buf;
+	BackupPageHeader2 *headers;
+	bool		recompress;		/* compression differs from destination backup */
+
+	FILE	   *in;
+	char	   *in_buf;
+	off_t		cur_pos;
+	char		fullpath[MAXPGPATH];
+} MergeSource;
+
 static void *merge_files(void *arg);
 static void
 merge_data_file(parray *parent_chain, pgBackup *full_backup,
 				pgBackup *dest_backup, pgFile *dest_file,
 				pgFile *tmp_file, const char *to_root, bool use_bitmap,
-				bool is_retry, bool no_sync);
+				bool program_version_match, bool is_retry, bool no_sync);
+static bool
+merge_data_file_splice(parray *parent_chain, pgBackup *full_backup,
+					   pgBackup *dest_backup, pgFile *dest_file,
+					   pgFile *tmp_file, const char *to_fullpath_tmp);
 
 static void
 merge_non_data_file(parray *parent_chain, pgBackup *full_backup,
@@ -437,6 +461,7 @@ merge_chain(InstanceState *instanceState,
 
 	pthread_t	*threads = NULL;
 	merge_files_arg *threads_args = NULL;
+	FileScheduler *scheduler = NULL;
 	time_t		merge_time;
 	bool		merge_isok = true;
 	/* for fancy reporting */
@@ -553,8 +578,19 @@ merge_chain(InstanceState *instanceState,
 	{
 		pgBackup   *backup = (pgBackup *) parray_get(parent_chain, i);
 
-		backup->files = get_backup_filelist(backup, true);
-		parray_qsort(backup->files, pgFileCompareRelPath);
+		/*
+		 * File lists of intermediate backups are only used to lookup
+		 * destination files, so binary ones are mapped instead of being loaded.
+		 */
+		if (backup == full_backup || backup == dest_backup)
+		{
+			backup->files = get_backup_filelist(backup, true);
+			parray_qsort(backup->files, pgFileCompareRelPath);
+			backup->files_index = parray_index_build(backup->files, pgFileHashRelPath,
+													 pgFileCompareRelPath);
+		}
+		else
+			backup_open_filelist(backup, true);
 
 		/* Set MERGING status for every member of the chain */
 		if (backup->backup_mode == BACKUP_MODE_FULL)
@@ -578,13 +614,26 @@ merge_chain(InstanceState *instanceState,
 	create_data_directories(dest_backup->files, full_database_dir,
 							dest_backup->root_dir, false, false, FIO_BACKUP_HOST, NULL);
 
-	/* Setup threads */
+	/* Directories were created before, so they go to the final filelist as they are */
+	result_filelist = parray_new();
 	for (i = 0; i < parray_num(dest_backup->files); i++)
 	{
 		pgFile	   *file = (pgFile *) parray_get(dest_backup->files, i);
-		pg_atomic_init_flag(&file->lock);
+		pgFile	   *tmp_file;
+
+		if (!S_ISDIR(file->mode))
+			continue;
+
+		tmp_file = pgFileInit(file->rel_path);
+		tmp_file->mode = file->mode;
+		tmp_file->is_datafile = file->is_datafile;
+		tmp_file->dbOid = file->dbOid;
+		parray_append(result_filelist, tmp_file);
 	}
 
+	/* Largest files go first for load balancing */
+	scheduler = scheduler_init(dest_backup->files, num_threads, 0);
+
 	threads = (pthread_t *) palloc(sizeof(pthread_t) * num_threads);
 	threads_args = (merge_files_arg *) palloc(sizeof(merge_files_arg) * num_threads);
 
@@ -604,6 +653,8 @@ merge_chain(InstanceState *instanceState,
 		arg->use_bitmap = use_bitmap;
 		arg->is_retry = is_retry;
 		arg->no_sync = no_sync;
+		arg->scheduler = scheduler;
+		arg->thread_num = i + 1;
 		/* By default there are some error */
 		arg->ret = 1;
 
@@ -613,7 +664,6 @@ merge_chain(InstanceState *instanceState,
 	}
 
 	/* Wait threads */
-	result_filelist = parray_new();
 	for (i = 0; i < num_threads; i++)
 	{
 		pthread_join(threads[i], NULL);
@@ -632,6 +682,9 @@ merge_chain(InstanceState *instanceState,
 	pretty_time_interval(difftime(end_time, merge_time),
 						 pretty_time, lengthof(pretty_time));
 
+	scheduler_report(scheduler);
+	scheduler_free(scheduler);
+
 	if (merge_isok)
 		elog(INFO, "Backup files are successfully merged, time elapsed: %s",
 				pretty_time);
@@ -640,7 +693,7 @@ merge_chain(InstanceState *instanceState,
 				pretty_time);
 
 	/* If temp header map is open, then close it and make rename */
-	if (full_backup->hdr_map.fp)
+	if (full_backup->hdr_map.fd >= 0)
 	{
 		cleanup_header_map(&(full_backup->hdr_map));
 
@@ -721,13 +774,20 @@ merge_chain(InstanceState *instanceState,
 	/* Delete FULL backup files, that do not exists in destination backup
 	 * Both arrays must be sorted in in reversed order to delete from leaf
 	 */
+	parray_index_free(dest_backup->files_index);
+	parray_index_free(full_backup->files_index);
+	dest_backup->files_index = NULL;
+	full_backup->files_index = NULL;
+
 	parray_qsort(dest_backup->files, pgFileCompareRelPathDesc);
 	parray_qsort(full_backup->files, pgFileCompareRelPathDesc);
+	dest_backup->files_index = parray_index_build(dest_backup->files, pgFileHashRelPath,
+												  pgFileCompareRelPath);
 	for (i = 0; i < parray_num(full_backup->files); i++)
 	{
 		pgFile	   *full_file = (pgFile *) parray_get(full_backup->files, i);
 
-		if (parray_bsearch(dest_backup->files, full_file, pgFileCompareRelPathDesc) == NULL)
+		if (parray_index_find(dest_backup->files_index, full_file) == NULL)
 		{
 			char		full_file_path[MAXPGPATH];
 
@@ -836,11 +896,7 @@ merge_rename:
 	{
 		pgBackup   *backup = (pgBackup *) parray_get(parent_chain, i);
 
-		if (backup->files)
-		{
-			parray_walk(backup->files, pgFileFree);
-			parray_free(backup->files);
-		}
+		backup_close_filelist(backup);
 	}
 }
 
@@ -851,12 +907,14 @@ static void *
 merge_files(void *arg)
 {
 	int		i;
+	FileTask   *task;
 	merge_files_arg *arguments = (merge_files_arg *) arg;
-	size_t n_files = parray_num(arguments->dest_backup->files);
+	size_t n_tasks = scheduler_num_tasks(arguments->scheduler);
 
-	for (i = 0; i < n_files; i++)
+	/* Directories were created before */
+	while ((task = scheduler_next_task(arguments->scheduler, arguments->thread_num)) != NULL)
 	{
-		pgFile	   *dest_file = (pgFile *) parray_get(arguments->dest_backup->files, i);
+		pgFile	   *dest_file = task->file;
 		pgFile	   *tmp_file;
 		bool		in_place = false; /* keep file as it is */
 
@@ -864,20 +922,14 @@ merge_files(void *arg)
 		if (interrupted || thread_interrupted)
 			elog(ERROR, "Interrupted during merge");
 
-		if (!pg_atomic_test_set_flag(&dest_file->lock))
-			continue;
-
 		tmp_file = pgFileInit(dest_file->rel_path);
 		tmp_file->mode = dest_file->mode;
 		tmp_file->is_datafile = dest_file->is_datafile;
 		tmp_file->dbOid = dest_file->dbOid;
 
-		/* Directories were created before */
-		if (S_ISDIR(dest_file->mode))
-			goto done;
-
-		elog(progress ? INFO : LOG, "Progress: (%d/%lu). Merging file \"%s\"",
-			i + 1, n_files, dest_file->rel_path);
+		elog(progress ? INFO : LOG, "Progress: (%lu/%lu). Merging file \"%s\"",
+			(unsigned long) scheduler_task_num(arguments->scheduler, task),
+			(unsigned long) n_tasks, dest_file->rel_path);
 
 		if (dest_file->is_datafile)
 			tmp_file->segno = dest_file->segno;
@@ -921,8 +973,9 @@ merge_files(void *arg)
 			 * 1 PAGE; file, size 100501
 			 * 2 FULL; file, size 100500
 			 *
-			 * Case 4 (good candidate for future optimization):
-			 * in this case in place merge is impossible:
+			 * Case 4:
+			 * in this case in place merge is impossible,
+			 * but the file from backup 1 is copied as is:
 			 * 0 PAGE; file, size BYTES_INVALID
 			 * 1 PAGE; file, size 100501
 			 * 2 FULL; file, not exists yet
@@ -932,14 +985,13 @@ merge_files(void *arg)
 
 			for (i = parray_num(arguments->parent_chain) - 1; i >= 0; i--)
 			{
-				pgFile	   **res_file = NULL;
 				pgFile	   *file = NULL;
+				pgFile		file_buf;
 
 				pgBackup   *backup = (pgBackup *) parray_get(arguments->parent_chain, i);
 
 				/* lookup file in intermediate backup */
-				res_file =  parray_bsearch(backup->files, dest_file, pgFileCompareRelPath);
-				file = (res_file) ? *res_file : NULL;
+				file = backup_lookup_file(backup, dest_file, &file_buf);
 
 				/* Destination file is not exists yet,
 				 * in-place merge is impossible
@@ -970,11 +1022,7 @@ merge_files(void *arg)
 		 */
 		if (in_place)
 		{
-			pgFile	   **res_file = NULL;
-			pgFile	   *file = NULL;
-			res_file = parray_bsearch(arguments->full_backup->files, dest_file,
-										pgFileCompareRelPath);
-			file = (res_file) ? *res_file : NULL;
+			pgFile	   *file = backup_lookup_file(arguments->full_backup, dest_file, NULL);
 
 			/* If file didn`t changed in any way, then in-place merge is possible */
 			if (file &&
@@ -1023,6 +1071,7 @@ merge_files(void *arg)
 							dest_file, tmp_file,
 							arguments->full_database_dir,
 							arguments->use_bitmap,
+							arguments->program_version_match,
 							arguments->is_retry,
 							arguments->no_sync);
 		else
@@ -1043,33 +1092,40 @@ done:
 	return NULL;
 }
 
-/* Merge is usually happens as usual backup/restore via temp files, unless
- * file didn`t changed since FULL backup AND full a dest backup have the
- * same compression algorithm. In this case file can be left as it is.
+/* Merge is usually happens by splicing page images from the chain members
+ * into temp file, see merge_data_file_splice().
+ * If it is impossible, file is merged as usual backup/restore via temp files.
+ * If file didn`t changed since FULL backup AND full a dest backup have the
+ * same compression algorithm, then file is left as it is (see merge_files()).
  */
 void
 merge_data_file(parray *parent_chain, pgBackup *full_backup,
 				pgBackup *dest_backup, pgFile *dest_file, pgFile *tmp_file,
-				const char *full_database_dir, bool use_bitmap, bool is_retry,
-				bool no_sync)
+				const char *full_database_dir, bool use_bitmap,
+				bool program_version_match, bool is_retry, bool no_sync)
 {
 	FILE   *out = NULL;
-	char   *buffer = pgut_malloc(STDIO_BUFSIZE);
+	char   *buffer = NULL;
 	char    to_fullpath[MAXPGPATH];
 	char    to_fullpath_tmp1[MAXPGPATH]; /* used for restore */
 	char    to_fullpath_tmp2[MAXPGPATH]; /* used for backup */
 
-	/* The next possible optimization is copying "as is" the file
-	 * from intermediate incremental backup, that didn`t changed in
-	 * subsequent incremental backups. TODO.
-	 */
-
 	/* set fullpath of destination file and temp files */
 	join_path_components(to_fullpath, full_database_dir, tmp_file->rel_path);
 	snprintf(to_fullpath_tmp1, MAXPGPATH, "%s_tmp1", to_fullpath);
 	snprintf(to_fullpath_tmp2, MAXPGPATH, "%s_tmp2", to_fullpath);
 
+	/*
+	 * Page header maps cannot be trusted when retrying merge,
+	 * and storage format of old backups may differ from the current one.
+	 */
+	if (program_version_match && !is_retry &&
+		merge_data_file_splice(parent_chain, full_backup, dest_backup,
+							   dest_file, tmp_file, to_fullpath_tmp2))
+		goto sync;
+
 	/* open temp file */
+	buffer = pgut_malloc(STDIO_BUFSIZE);
 	out = fopen(to_fullpath_tmp1, PG_BINARY_W);
 	if (out == NULL)
 		elog(ERROR, "Cannot open merge target file \"%s\": %s",
@@ -1080,7 +1136,7 @@ merge_data_file(parray *parent_chain, pgBackup *full_backup,
 	tmp_file->size = restore_data_file(parent_chain, dest_file, out, to_fullpath_tmp1,
 									   use_bitmap, NULL, InvalidXLogRecPtr, NULL,
 									   /* when retrying merge header map cannot be trusted */
-									   is_retry ? false : true);
+									   is_retry ? false : true, false, false);
 	if (fclose(out) != 0)
 		elog(ERROR, "Cannot close file \"%s\": %s",
 			 to_fullpath_tmp1, strerror(errno));
@@ -1109,6 +1165,7 @@ merge_data_file(parray *parent_chain, pgBackup *full_backup,
 	/* sanity */
 	Assert(tmp_file->n_blocks == dest_file->n_blocks);
 
+sync:
 	/* sync second temp file to disk */
 	if (!no_sync && fio_sync(FIO_BACKUP_HOST, to_fullpath_tmp2) != 0)
 		elog(ERROR, "Cannot sync merge temp file \"%s\": %s",
@@ -1123,6 +1180,325 @@ merge_data_file(parray *parent_chain, pgBackup *full_backup,
 	unlink(to_fullpath_tmp1);
 }
 
+/*
+ * Build merged data file by splicing page images stored in the chain.
+ *
+ * Every block of destination file is taken from the newest chain member,
+ * which has it, according to the page header maps. Page image together with
+ * its BackupPageHeader is copied into temp file as it is, without
+ * decompression, unless compression algorithm or level of the chain member
+ * differs from destination backup. In the latter case page is recompressed.
+ * If all blocks come from a single chain member, its file is just copied.
+ *
+ * Return false, if file cannot be merged this way: some chain member
+ * has no page header map or some block is missing in the chain.
+ * Nothing is written in this case.
+ */
+static bool
+merge_data_file_splice(parray *parent_chain, pgBackup *full_backup,
+					   pgBackup *dest_backup, pgFile *dest_file,
+					   pgFile *tmp_file, const char *to_fullpath_tmp)
+{
+	int			i;
+	int			n_sources = 0;
+	MergeSource *sources = NULL;
+	int		   *block_source = NULL;	/* chain member for every block */
+	int		   *block_header = NULL;	/* and its header in that member */
+	BlockNumber	n_blocks;
+	BlockNumber	n_found = 0;
+	BlockNumber	blknum;
+	BackupPageHeader2 *headers = NULL;
+	FILE	   *out = NULL;
+	char	   *out_buf = NULL;
+	off_t		cur_pos_out = 0;
+	bool		success = false;
+
+	if (dest_file->n_blocks <= 0)
+		return false;
+
+	n_blocks = dest_file->n_blocks;
+
+	sources = pgut_malloc0(sizeof(MergeSource) * parray_num(parent_chain));
+	block_source = pgut_malloc(sizeof(int) * n_blocks);
+	block_header = pgut_malloc(sizeof(int) * n_blocks);
+
+	for (blknum = 0; blknum < n_blocks; blknum++)
+		block_source[blknum] = -1;
+
+	/* Newest chain members go first */
+	for (i = 0; i < parray_num(parent_chain) && n_found < n_blocks; i++)
+	{
+		pgBackup   *backup = (pgBackup *) parray_get(parent_chain, i);
+		MergeSource *src = &sources[n_sources];
+		BlockNumber	n_taken = 0;
+		int			n_hdr;
+
+		src->file = backup_lookup_file(backup, dest_file, &src->file_buf);
+
+		/* file is missing, unchanged or truncated in this backup */
+		if (src->file == NULL ||
+			src->file->write_size == BYTES_INVALID ||
+			src->file->write_size == 0)
+			continue;
+
+		/* backups of older versions have no page header map */
+		if (src->file->n_headers <= 0)
+		{
+			elog(VERBOSE, "File \"%s\" in backup %s has no page headers, splicing is impossible",
+				 dest_file->rel_path, backup_id_of(backup));
+			goto cleanup;
+		}
+
+		src->headers = get_data_file_headers(&(backup->hdr_map), src->file, true);
+		if (!src->headers)
+			elog(ERROR, "Failed to get page headers for file \"%s\" in backup %s",
+				 dest_file->rel_path, backup_id_of(backup));
+
+		for (n_hdr = 0; n_hdr < src->file->n_headers; n_hdr++)
+		{
+			BlockNumber	block = src->headers[n_hdr].block;
+
+			/* blocks beyond the end of destination file are truncated */
+			if (block >= n_blocks || block_source[block] >= 0)
+				continue;
+
+			block_source[block] = n_sources;
+			block_header[block] = n_hdr;
+			n_taken++;
+		}
+
+		/* every block of this member is overwritten by newer ones */
+		if (n_taken == 0)
+		{
+			pg_free(src->headers);
+			src->headers = NULL;
+			continue;
+		}
+
+		n_found += n_taken;
+
+		src->backup = backup;
+		src->recompress = src->file->compress_alg != dest_backup->compress_alg ||
+			(dest_backup->compress_alg != NONE_COMPRESS &&
+			 backup->compress_level != dest_backup->compress_level);
+		n_sources++;
+	}
+
+	if (n_found < n_blocks)
+	{
+		elog(VERBOSE, "Some blocks of file \"%s\" are missing in the chain, splicing is impossible",
+			 dest_file->rel_path);
+		goto cleanup;
+	}
+
+	for (i = 0; i < n_sources; i++)
+	{
+		MergeSource *src = &sources[i];
+		char		database_dir[MAXPGPATH];
+
+		join_path_components(database_dir, src->backup->root_dir, DATABASE_DIR);
+		join_path_components(src->fullpath, database_dir, src->file->rel_path);
+
+		src->in = fopen(src->fullpath, PG_BINARY_R);
+		if (src->in == NULL)
+			elog(ERROR, "Cannot open backup file \"%s\": %s", src->fullpath,
+				 strerror(errno));
+
+		src->in_buf = pgut_malloc(STDIO_BUFSIZE);
+		setvbuf(src->in, src->in_buf, _IOFBF, STDIO_BUFSIZE);
+	}
+
+	out = fopen(to_fullpath_tmp, PG_BINARY_W);
+	if (out == NULL)
+		elog(ERROR, "Cannot open merge target file \"%s\": %s",
+			 to_fullpath_tmp, strerror(errno));
+
+	out_buf = pgut_malloc(STDIO_BUFSIZE);
+	setvbuf(out, out_buf, _IOFBF, STDIO_BUFSIZE);
+
+	tmp_file->compress_alg = dest_backup->compress_alg;
+	tmp_file->write_size = 0;
+	tmp_file->uncompressed_size = 0;
+
+	/*
+	 * The whole file comes from a single chain member with the same
+	 * compression, so it is copied as is, along with its page headers.
+	 * This is the case for files, which were created or rewritten
+	 * in intermediate backup and didn`t changed after that.
+	 */
+	if (n_sources == 1 && !sources[0].recompress &&
+		sources[0].file->n_headers == n_blocks &&
+		sources[0].headers[n_blocks].pos == sources[0].file->write_size)
+	{
+		MergeSource *src = &sources[0];
+		off_t		 len = src->headers[n_blocks].pos;
+		char		 buf[STDIO_BUFSIZE];
+
+		elog(VERBOSE, "Copying file \"%s\" as is from backup %s",
+			 dest_file->rel_path, backup_id_of(src->backup));
+
+		while (cur_pos_out < len)
+		{
+			size_t		read_len = Min(sizeof(buf), len - cur_pos_out);
+
+			if (interrupted || thread_interrupted)
+				elog(ERROR, "Interrupted during merge");
+
+			if (fread(buf, 1, read_len, src->in) != read_len)
+				elog(ERROR, "Cannot read backup file \"%s\": %s", src->fullpath,
+					 ferror(src->in) ? strerror(errno) : "unexpected end of file");
+
+			if (fwrite(buf, 1, read_len, out) != read_len)
+				elog(ERROR, "Cannot write to file \"%s\": %s", to_fullpath_tmp,
+					 strerror(errno));
+
+			cur_pos_out += read_len;
+		}
+
+		headers = pgut_malloc((n_blocks + 1) * sizeof(BackupPageHeader2));
+		memcpy(headers, src->headers, (n_blocks + 1) * sizeof(BackupPageHeader2));
+
+		tmp_file->crc = src->file->crc;
+		tmp_file->write_size = len;
+		tmp_file->uncompressed_size = (int64) n_blocks * BLCKSZ;
+		goto done;
+	}
+
+	headers = pgut_malloc0((n_blocks + 1) * sizeof(BackupPageHeader2));
+	INIT_CRC32C(tmp_file->crc);
+
+	for (blknum = 0; blknum < n_blocks; blknum++)
+	{
+		MergeSource *src = &sources[block_source[blknum]];
+		BackupPageHeader2 *hdr = &src->headers[block_header[blknum]];
+		/* page header and payload are read together */
+		size_t		read_len = (hdr + 1)->pos - hdr->pos;
+		char		page[sizeof(BackupPageHeader) + BLCKSZ];
+		char		zpage[sizeof(BackupPageHeader) + BLCKSZ * 2];
+		char	   *write_buf = page;
+		size_t		write_len = read_len;
+
+		if (interrupted || thread_interrupted)
+			elog(ERROR, "Interrupted during merge");
+
+		if (read_len <= sizeof(BackupPageHeader) || read_len > sizeof(page))
+			elog(ERROR, "Invalid size %zu of block %u in backup file \"%s\"",
+				 read_len, blknum, src->fullpath);
+
+		if (src->cur_pos != hdr->pos)
+		{
+			if (fseek(src->in, hdr->pos, SEEK_SET) != 0)
+				elog(ERROR, "Cannot seek to offset %u of \"%s\": %s",
+					 hdr->pos, src->fullpath, strerror(errno));
+		}
+
+		if (fread(page, 1, read_len, src->in) != read_len)
+			elog(ERROR, "Cannot read block %u of \"%s\": %s",
+				 blknum, src->fullpath,
+				 ferror(src->in) ? strerror(errno) : "unexpected end of file");
+
+		src->cur_pos = hdr->pos + read_len;
+
+		if (src->recompress)
+		{
+			BackupPageHeader *bph = (BackupPageHeader *) zpage;
+			char		raw_page[BLCKSZ];
+			char	   *payload = page + sizeof(BackupPageHeader);
+			int32		payload_size = read_len - sizeof(BackupPageHeader);
+			int32		compressed_size;
+			const char *errormsg = NULL;
+
+			if (payload_size != BLCKSZ)
+			{
+				int32		rc = do_decompress(raw_page, BLCKSZ, payload, payload_size,
+											   src->file->compress_alg, &errormsg);
+
+				if (rc != BLCKSZ)
+					elog(ERROR, "An error occured during decompressing block %u of file \"%s\": %s",
+						 blknum, src->fullpath,
+						 errormsg ? errormsg : "invalid page size");
+				payload = raw_page;
+			}
+
+			compressed_size = do_compress(zpage + sizeof(BackupPageHeader),
+										  BLCKSZ * 2, payload, BLCKSZ,
+										  dest_backup->compress_alg,
+										  dest_backup->compress_level, &errormsg);
+
+			/* compression didn`t worked */
+			if (compressed_size <= 0 || compressed_size >= BLCKSZ)
+			{
+				memcpy(zpage + sizeof(BackupPageHeader), payload, BLCKSZ);
+				compressed_size = BLCKSZ;
+			}
+
+			bph->block = blknum;
+			bph->compressed_size = compressed_size;
+			write_buf = zpage;
+			write_len = compressed_size + sizeof(BackupPageHeader);
+		}
+
+		headers[blknum] = (BackupPageHeader2){
+			.block = blknum,
+			.pos = cur_pos_out,
+			.lsn = hdr->lsn,
+			.checksum = hdr->checksum,
+		};
+
+		COMP_CRC32C(tmp_file->crc, write_buf, write_len);
+
+		if (fwrite(write_buf, 1, write_len, out) != write_len)
+			elog(ERROR, "Cannot write block %u of \"%s\": %s",
+				 blknum, to_fullpath_tmp, strerror(errno));
+
+		cur_pos_out += write_len;
+		tmp_file->write_size += write_len;
+		tmp_file->uncompressed_size += BLCKSZ;
+	}
+
+	/* dummy header for calculation of the last page length */
+	headers[n_blocks] = (BackupPageHeader2){.pos = cur_pos_out};
+	FIN_CRC32C(tmp_file->crc);
+
+done:
+	if (fclose(out) != 0)
+		elog(ERROR, "Cannot close file \"%s\": %s",
+			 to_fullpath_tmp, strerror(errno));
+
+	tmp_file->size = (int64) n_blocks * BLCKSZ;
+	tmp_file->read_size = tmp_file->size;
+	tmp_file->n_blocks = n_blocks;
+	tmp_file->n_headers = n_blocks;
+
+	write_page_headers(headers, tmp_file, &(full_backup->hdr_map), true);
+
+	elog(LOG, "Spliced file \"%s\" from %i backups: %lu bytes",
+		 dest_file->rel_path, n_sources, (unsigned long) tmp_file->write_size);
+
+	success = true;
+
+cleanup:
+	for (i = 0; i < parray_num(parent_chain); i++)
+	{
+		MergeSource *src = &sources[i];
+
+		if (src->in && fclose(src->in) != 0)
+			elog(ERROR, "Cannot close file \"%s\": %s", src->fullpath,
+				 strerror(errno));
+
+		pg_free(src->in_buf);
+		pg_free(src->headers);
+	}
+
+	pg_free(sources);
+	pg_free(block_source);
+	pg_free(block_header);
+	pg_free(headers);
+	pg_free(out_buf);
+
+	return success;
+}
+
 /*
  * For every destionation file lookup the newest file in chain and copy it.
  */
@@ -1137,6 +1513,7 @@ merge_non_data_file(parray *parent_chain, pgBackup *full_backup,
 	char	from_fullpath[MAXPGPATH];
 	pgBackup *from_backup = NULL;
 	pgFile *from_file = NULL;
+	pgFile  from_file_buf;
 
 	join_path_components(to_fullpath, full_database_dir, dest_file->rel_path);
 	snprintf(to_fullpath_tmp, MAXPGPATH, "%s_tmp", to_fullpath);
@@ -1150,12 +1527,10 @@ merge_non_data_file(parray *parent_chain, pgBackup *full_backup,
 	 */
 	for (i = 0; i < parray_num(parent_chain); i++)
 	{
-		pgFile	   **res_file = NULL;
 		from_backup = (pgBackup *) parray_get(parent_chain, i);
 
 		/* lookup file in intermediate backup */
-		res_file =  parray_bsearch(from_backup->files, dest_file, pgFileCompareRelPath);
-		from_file = (res_file) ? *res_file : NULL;
+		from_file = backup_lookup_file(from_backup, dest_file, &from_file_buf);
 
 		/*
 		 * It should not be possible not to find source file in intermediate
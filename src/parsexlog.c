@@ -91,6 +91,30 @@ typedef struct XLogRecTarget
 	XLogRecPtr	rec_lsn;
 } XLogRecTarget;
 
+/*
+ * Reference to a block of the main fork found in WAL. RelFileNode is stored
+ * as an array of Oids, because names of its fields differ between versions.
+ */
+typedef struct BlockChange
+{
+	Oid			rnode[3];
+	BlockNumber blkno;
+} BlockChange;
+
+/*
+ * Block changes collected by a parser thread without any locking. They are
+ * sorted and deduplicated when the buffer is full and once at the end.
+ */
+typedef struct BlockChangeBuffer
+{
+	BlockChange *items;
+	size_t		num;
+	size_t		size;
+} BlockChangeBuffer;
+
+/* Initial number of block changes in a buffer */
+#define BLOCK_CHANGES_INIT_SIZE		(64 * 1024)
+
 typedef struct XLogReaderData
 {
 	int			thread_num;
@@ -110,6 +134,16 @@ typedef struct XLogReaderData
 
 	gzFile		 gz_xlogfile;
 	char		 gz_xlogpath[MAXPGPATH];
+
+	/* WAL segment compressed as a whole is decompressed into memory */
+	char	   *xlogbuf;
+	size_t		xlogbuf_size;
+
+	/* prefetch buffer xlogbuf belongs to, if the segment was read ahead */
+	struct WalSegmentSlot *prefetch_slot;
+
+	/* blocks changed by records read by the thread */
+	BlockChangeBuffer block_changes;
 } XLogReaderData;
 
 /* Function to process a WAL record */
@@ -143,6 +177,57 @@ typedef struct
 	int			ret;
 } xlog_thread_arg;
 
+/*
+ * WAL segments are read ahead of the parser threads by separate prefetch
+ * threads into a bounded ring of buffers, so reading and decompression of
+ * upcoming segments overlaps with parsing of the current ones.
+ */
+typedef enum WalSegmentState
+{
+	WAL_SEGMENT_EMPTY,
+	WAL_SEGMENT_LOADING,
+	WAL_SEGMENT_READY
+} WalSegmentState;
+
+typedef struct WalSegmentSlot
+{
+	XLogSegNo	segno;
+	WalSegmentState state;
+	/* number of parser threads reading the segment */
+	int			refcount;
+	/* the segment was taken by a parser thread, the slot can be reused */
+	bool		used;
+
+	char	   *buf;
+	size_t		size;
+	char		path[MAXPGPATH];
+} WalSegmentSlot;
+
+typedef struct WalPrefetch
+{
+	TimeLineID	tli;
+	/* next segment to read ahead */
+	XLogSegNo	next_segno;
+	/* last segment to read ahead, 0 means up to the first absent segment */
+	XLogSegNo	end_segno;
+	/* the latest segment taken by parser threads */
+	XLogSegNo	max_used_segno;
+	bool		stop;
+
+	int			n_slots;
+	WalSegmentSlot *slots;
+
+	/* segments read ahead and segments parser threads had to read themselves */
+	uint32		n_prefetched;
+	uint32		n_missed;
+
+	pthread_mutex_t mutex;
+	pthread_cond_t cond;
+} WalPrefetch;
+
+/* Prefetch buffers are not used if they take more memory than this */
+#define WAL_PREFETCH_MAX_MEMORY		((size_t) 1024 * 1024 * 1024)
+
 static XLogRecord* WalReadRecord(XLogReaderState *xlogreader, XLogRecPtr startpoint, char **errormsg);
 static XLogReaderState* WalReaderAllocate(uint32 wal_seg_size, XLogReaderData *reader_data);
 
@@ -176,12 +261,38 @@ static void *XLogThreadWorker(void *arg);
 static void CleanupXLogPageRead(XLogReaderState *xlogreader);
 static void PrintXLogCorruptionMsg(XLogReaderData *reader_data, int elevel);
 
+static WalPrefetch *WalPrefetchStart(TimeLineID tli, XLogSegNo start_segno,
+									 XLogSegNo end_segno, int n_slots,
+									 int n_threads, pthread_t **threads);
+static void WalPrefetchStop(WalPrefetch *prefetch, int n_threads,
+							pthread_t *threads);
+static void *WalPrefetchWorker(void *arg);
+static bool WalPrefetchGet(WalPrefetch *prefetch, XLogReaderData *reader_data);
+static void WalPrefetchRelease(WalPrefetch *prefetch, XLogReaderData *reader_data);
+
 static void extractPageInfo(XLogReaderState *record,
 							XLogReaderData *reader_data, bool *stop_reading);
 static void validateXLogRecord(XLogReaderState *record,
 							   XLogReaderData *reader_data, bool *stop_reading);
 static bool getRecordTimestamp(XLogReaderState *record, TimestampTz *recordXtime);
 
+static XLogRecPtr skip_wal_by_summary(const char *archivedir, TimeLineID tli,
+									  uint32 wal_seg_size, XLogRecPtr startpoint,
+									  time_t target_time, TransactionId target_xid,
+									  XLogRecPtr target_lsn, XLogRecTarget *last_rec);
+static bool read_recovery_info_from_summary(const char *archivedir, TimeLineID tli,
+											uint32 wal_seg_size, XLogRecPtr start_lsn,
+											XLogRecPtr stop_lsn, time_t *recovery_time,
+											bool *found);
+static bool wal_segment_exists(const char *wal_dir, TimeLineID tli,
+							   XLogSegNo segno, uint32 wal_seg_size);
+
+static void block_changes_add(BlockChangeBuffer *buf, RelFileNode rnode,
+							  BlockNumber blkno);
+static void block_changes_append(BlockChangeBuffer *dst, BlockChangeBuffer *src);
+static void block_changes_compact(BlockChangeBuffer *buf);
+static void block_changes_apply(BlockChangeBuffer *buf);
+
 static XLogSegNo segno_start = 0;
 /* Segment number where target record is located */
 static XLogSegNo segno_target = 0;
@@ -192,9 +303,15 @@ static uint32 segnum_read = 0;
 /* Number of detected corrupted or absent segments */
 static uint32 segnum_corrupted = 0;
 static pthread_mutex_t wal_segment_mutex = PTHREAD_MUTEX_INITIALIZER;
+/* InitXLogPageRead() sets static variables, so segments are summarized one by one */
+static pthread_mutex_t wal_summary_mutex = PTHREAD_MUTEX_INITIALIZER;
+/* Read ahead of WAL segments, used only by RunXLogThreads() */
+static WalPrefetch *wal_prefetch = NULL;
+/* Block changes collected by all threads for extractPageMap() */
+static BlockChangeBuffer wal_block_changes = {NULL, 0, 0};
 
 /* copied from timestamp.c */
-static pg_time_t
+pg_time_t
 timestamptz_to_time_t(TimestampTz t)
 {
 	pg_time_t	result;
@@ -352,6 +469,13 @@ extractPageMap(const char *archivedir, uint32 wal_seg_size,
 		pg_free(interval_list);
 	}
 
+	/* All WAL is parsed, now set the blocks in pagemaps */
+	if (extract_isok)
+		block_changes_apply(&wal_block_changes);
+
+	pg_free(wal_block_changes.items);
+	memset(&wal_block_changes, 0, sizeof(BlockChangeBuffer));
+
 	return extract_isok;
 }
 
@@ -403,6 +527,7 @@ validate_wal(pgBackup *backup, const char *archivedir,
 			 XLogRecPtr target_lsn, TimeLineID tli, uint32 wal_seg_size)
 {
 	XLogRecTarget last_rec;
+	XLogRecPtr	startpoint = backup->stop_lsn;
 	char		last_timestamp[100],
 				target_timestamp[100];
 	bool		all_wal = false;
@@ -478,9 +603,14 @@ validate_wal(pgBackup *backup, const char *archivedir,
 		|| (XRecOffIsValid(target_lsn) && last_rec.rec_lsn >= target_lsn))
 		all_wal = true;
 
+	if (!all_wal)
+		startpoint = skip_wal_by_summary(archivedir, tli, wal_seg_size,
+										 backup->stop_lsn, target_time,
+										 target_xid, target_lsn, &last_rec);
+
 	all_wal = all_wal ||
 		RunXLogThreads(archivedir, target_time, target_xid, target_lsn,
-					   tli, wal_seg_size, backup->stop_lsn,
+					   tli, wal_seg_size, startpoint,
 					   InvalidXLogRecPtr, true, validateXLogRecord, &last_rec, true);
 	if (last_rec.rec_time > 0)
 		time2iso(last_timestamp, lengthof(last_timestamp),
@@ -515,6 +645,144 @@ validate_wal(pgBackup *backup, const char *archivedir,
 	}
 }
 
+/*
+ * Check if the summary shows that the segment may contain the record, which
+ * satisfies recovery target. The conditions are the same as in
+ * validateXLogRecord().
+ */
+static bool
+wal_summary_may_satisfy(const WalSegmentSummary *summary, time_t target_time,
+						TransactionId target_xid, XLogRecPtr target_lsn)
+{
+	/* we don't know anything about the record crossing into the segment */
+	if (summary->flags & WAL_SUMMARY_PARTIAL)
+		return true;
+
+	if (TransactionIdIsValid(target_xid) && summary->min_xid != 0 &&
+		(uint64) target_xid >= summary->min_xid &&
+		(uint64) target_xid <= summary->max_xid)
+		return true;
+
+	if (target_time != 0 && summary->max_time != 0 &&
+		timestamptz_to_time_t(summary->max_time) >= target_time)
+		return true;
+
+	if (XRecOffIsValid(target_lsn) && summary->last_lsn >= target_lsn)
+		return true;
+
+	return false;
+}
+
+/*
+ * Skip WAL segments, which cannot contain the recovery target according to
+ * their summaries, so only the segments which may contain it are read.
+ * Skipped segments are only checked to be present in the archive.
+ * Returns the point to start reading WAL from, last_rec is advanced
+ * to the last record of skipped segments.
+ *
+ * Segment, in which no record starts, has no summary, so the record
+ * crossing into the first unsummarized segment is read too.
+ */
+static XLogRecPtr
+skip_wal_by_summary(const char *archivedir, TimeLineID tli,
+					uint32 wal_seg_size, XLogRecPtr startpoint,
+					time_t target_time, TransactionId target_xid,
+					XLogRecPtr target_lsn, XLogRecTarget *last_rec)
+{
+	WalSegmentSummary *summaries;
+	size_t		n_summaries;
+	XLogSegNo	start_segno;
+	XLogSegNo	segno;
+	XLogRecPtr	result = InvalidXLogRecPtr;
+	XLogRecPtr	last_skipped_lsn = InvalidXLogRecPtr;
+
+	summaries = wal_summary_read(archivedir, tli, wal_seg_size, &n_summaries);
+	if (summaries == NULL)
+		return startpoint;
+
+	GetXLogSegNo(startpoint, start_segno, wal_seg_size);
+
+	for (segno = start_segno;; segno++)
+	{
+		WalSegmentSummary *summary;
+
+		summary = wal_summary_find(summaries, n_summaries, segno);
+
+		/* the segment must be read, if nothing is known about it */
+		if (summary == NULL)
+			break;
+
+		if (wal_summary_may_satisfy(summary, target_time, target_xid, target_lsn))
+		{
+			/* the first record may start in one of the previous segments */
+			GetXLogSegNo(summary->start_lsn, segno, wal_seg_size);
+			GetXLogRecPtr(segno, 0, wal_seg_size, result);
+			break;
+		}
+
+		/* let the reader complain about the absent segment */
+		if (!wal_segment_exists(archivedir, tli, segno, wal_seg_size))
+			break;
+
+		if (summary->last_time != 0)
+			last_rec->rec_time = summary->last_time;
+		if (summary->last_xid != 0)
+			last_rec->rec_xid = (TransactionId) summary->last_xid;
+		last_rec->rec_lsn = summary->last_lsn;
+		last_skipped_lsn = summary->last_lsn;
+	}
+
+	pg_free(summaries);
+
+	if (segno <= start_segno)
+		return startpoint;
+
+	elog(INFO, "According to WAL summary, recovery target is not located in "
+		 UINT64_FORMAT " WAL segments on timeline %i, they are not read",
+		 segno - start_segno, tli);
+
+	/*
+	 * Nothing is known about the segment: start from the last skipped
+	 * record, it may continue into the segment and satisfy the target.
+	 */
+	if (XLogRecPtrIsInvalid(result))
+	{
+		if (XRecOffIsValid(last_skipped_lsn))
+			result = last_skipped_lsn;
+		else
+			GetXLogRecPtr(segno - 1, 0, wal_seg_size, result);
+	}
+
+	return result;
+}
+
+/* Check if WAL segment is present in the directory, possibly compressed */
+static bool
+wal_segment_exists(const char *wal_dir, TimeLineID tli, XLogSegNo segno,
+				   uint32 wal_seg_size)
+{
+	char		xlogfname[MAXFNAMELEN];
+	char		path[MAXPGPATH];
+	CompressAlg	algs[] = {ZLIB_COMPRESS, ZSTD_COMPRESS, LZ4_COMPRESS};
+	int			i;
+
+	GetXLogFileName(xlogfname, tli, segno, wal_seg_size);
+	join_path_components(path, wal_dir, xlogfname);
+
+	if (fileExists(path, FIO_LOCAL_HOST))
+		return true;
+
+	for (i = 0; i < lengthof(algs); i++)
+	{
+		snprintf(path, MAXPGPATH, "%s/%s.%s", wal_dir, xlogfname,
+				 wal_compress_suffix(algs[i]));
+		if (fileExists(path, FIO_LOCAL_HOST))
+			return true;
+	}
+
+	return false;
+}
+
 /*
  * Read from archived WAL segments latest recovery time and xid. All necessary
  * segments present at archive folder. We waited **stop_lsn** in
@@ -538,6 +806,10 @@ read_recovery_info(const char *archivedir, TimeLineID tli, uint32 wal_seg_size,
 		elog(ERROR, "Invalid stop_lsn value %X/%X",
 			 (uint32) (stop_lsn >> 32), (uint32) (stop_lsn));
 
+	if (read_recovery_info_from_summary(archivedir, tli, wal_seg_size,
+										start_lsn, stop_lsn, recovery_time, &res))
+		return res;
+
 	xlogreader = InitXLogPageRead(&reader_data, archivedir, tli, wal_seg_size,
 								  false, true, true);
 
@@ -593,6 +865,68 @@ cleanup:
 	return res;
 }
 
+/*
+ * Find the timestamp of the latest record between start_lsn and stop_lsn
+ * using summaries of WAL segments, the same way read_recovery_info() does.
+ * Returns false if summaries are not enough to find it, otherwise *found
+ * is set to true if the timestamp is found.
+ */
+static bool
+read_recovery_info_from_summary(const char *archivedir, TimeLineID tli,
+								uint32 wal_seg_size, XLogRecPtr start_lsn,
+								XLogRecPtr stop_lsn, time_t *recovery_time,
+								bool *found)
+{
+	WalSegmentSummary *summaries;
+	size_t		n_summaries;
+	XLogSegNo	segno;
+	bool		res = false;
+
+	summaries = wal_summary_read(archivedir, tli, wal_seg_size, &n_summaries);
+	if (summaries == NULL)
+		return false;
+
+	GetXLogSegNo(stop_lsn, segno, wal_seg_size);
+
+	for (;; segno--)
+	{
+		WalSegmentSummary *summary;
+
+		summary = wal_summary_find(summaries, n_summaries, segno);
+		if (summary == NULL)
+			break;
+
+		if (summary->first_time_lsn != InvalidXLogRecPtr &&
+			summary->first_time_lsn <= stop_lsn)
+		{
+			/* stop_lsn is between records with timestamp, they must be read */
+			if (summary->last_time_lsn > stop_lsn)
+				break;
+
+			*found = summary->last_time_lsn >= start_lsn;
+			if (*found)
+				*recovery_time = timestamptz_to_time_t(summary->last_time);
+			res = true;
+			break;
+		}
+
+		if (summary->flags & WAL_SUMMARY_PARTIAL)
+			break;
+
+		/* all records from start_lsn are checked */
+		if ((!XLogRecPtrIsInvalid(summary->start_lsn) &&
+			 summary->start_lsn <= start_lsn) || segno == 0)
+		{
+			*found = false;
+			res = true;
+			break;
+		}
+	}
+
+	pg_free(summaries);
+	return res;
+}
+
 /*
  * Check if there is a WAL segment file in 'archivedir' which contains
  * 'target_lsn'.
@@ -998,6 +1332,15 @@ SimpleXLogPageRead(XLogReaderState *xlogreader, XLogRecPtr targetPagePtr,
 
 	GetXLogSegNo(targetPagePtr, reader_data->xlogsegno, wal_seg_size);
 
+	/* Try to use the segment read ahead by prefetch threads */
+	if (!reader_data->xlogexists && wal_prefetch != NULL &&
+		WalPrefetchGet(wal_prefetch, reader_data))
+	{
+		elog(LOG, "Thread [%d]: Using prefetched WAL segment \"%s\"",
+			 reader_data->thread_num, reader_data->xlogpath);
+		reader_data->xlogexists = true;
+	}
+
 	/* Try to switch to the next WAL segment */
 	if (!reader_data->xlogexists)
 	{
@@ -1057,6 +1400,36 @@ SimpleXLogPageRead(XLogReaderState *xlogreader, XLogRecPtr targetPagePtr,
 				return -1;
 			}
 		}
+		/* Try to open WAL segment compressed with zstd or lz4 */
+		else
+		{
+			CompressAlg	algs[] = {ZSTD_COMPRESS, LZ4_COMPRESS};
+			int			i;
+
+			for (i = 0; i < lengthof(algs); i++)
+			{
+				char		path[MAXPGPATH];
+				int			rc;
+
+				snprintf(path, MAXPGPATH, "%s/%s.%s", wal_archivedir, xlogfname,
+						 wal_compress_suffix(algs[i]));
+
+				rc = read_compressed_wal_file(path, FIO_LOCAL_HOST, algs[i], wal_seg_size,
+											  &reader_data->xlogbuf,
+											  &reader_data->xlogbuf_size);
+				if (rc == FILE_MISSING)
+					continue;
+
+				elog(LOG, "Thread [%d]: Opening compressed WAL segment \"%s\"",
+					 reader_data->thread_num, path);
+
+				snprintf(reader_data->xlogpath, MAXPGPATH, "%s", path);
+				reader_data->xlogexists = true;
+				if (rc != SEND_OK)
+					return -1;
+				break;
+			}
+		}
 		/* Exit without error if WAL segment doesn't exist */
 		if (!reader_data->xlogexists)
 			return -1;
@@ -1097,6 +1470,18 @@ SimpleXLogPageRead(XLogReaderState *xlogreader, XLogRecPtr targetPagePtr,
 			return -1;
 		}
 	}
+	else if (reader_data->xlogbuf != NULL)
+	{
+		if (targetPageOff + XLOG_BLCKSZ > reader_data->xlogbuf_size)
+		{
+			elog(WARNING, "Thread [%d]: Could not read from WAL segment \"%s\": "
+				 "unexpected end of file",
+				 reader_data->thread_num, reader_data->xlogpath);
+			return -1;
+		}
+
+		memcpy(readBuf, reader_data->xlogbuf + targetPageOff, XLOG_BLCKSZ);
+	}
 	else
 	{
 		if (fio_gzseek(reader_data->gz_xlogfile, (z_off_t) targetPageOff, SEEK_SET) == -1)
@@ -1179,9 +1564,12 @@ RunXLogThreads(const char *archivedir, time_t target_time,
 			   XLogRecTarget *last_rec, bool inclusive_endpoint)
 {
 	pthread_t  *threads;
+	pthread_t  *prefetch_threads = NULL;
 	xlog_thread_arg *thread_args;
 	int			i;
 	int			threads_need = 0;
+	int			prefetch_slots;
+	int			prefetch_threads_num;
 	XLogSegNo	endSegNo = 0;
 	bool		result = true;
 
@@ -1262,6 +1650,23 @@ RunXLogThreads(const char *archivedir, time_t target_time,
 
 	/* Run threads */
 	thread_interrupted = false;
+
+	/*
+	 * Start reading segments ahead of the parser threads. Every parser thread
+	 * holds one buffer at most, the rest are filled by prefetch threads.
+	 * Short ranges need less threads than requested, size the ring after
+	 * the number of threads actually started.
+	 */
+	prefetch_slots = threads_need * 2;
+	prefetch_threads_num = Max(1, (threads_need + 1) / 2);
+	if ((size_t) prefetch_slots * segment_size <= WAL_PREFETCH_MAX_MEMORY)
+		wal_prefetch = WalPrefetchStart(tli, segno_start, endSegNo,
+										prefetch_slots, prefetch_threads_num,
+										&prefetch_threads);
+	else
+		elog(LOG, "WAL segments are too large to be read ahead by %i threads",
+			 threads_need);
+
 	for (i = 0; i < threads_need; i++)
 	{
 		elog(VERBOSE, "Start WAL reader thread: %d", i + 1);
@@ -1274,6 +1679,15 @@ RunXLogThreads(const char *archivedir, time_t target_time,
 		pthread_join(threads[i], NULL);
 		if (thread_args[i].ret == 1)
 			result = false;
+
+		block_changes_append(&wal_block_changes,
+							 &thread_args[i].reader_data.block_changes);
+	}
+
+	if (wal_prefetch)
+	{
+		WalPrefetchStop(wal_prefetch, prefetch_threads_num, prefetch_threads);
+		wal_prefetch = NULL;
 	}
 	thread_interrupted = false;
 
@@ -1714,10 +2128,361 @@ CleanupXLogPageRead(XLogReaderState *xlogreader)
 		fio_gzclose(reader_data->gz_xlogfile);
 		reader_data->gz_xlogfile = NULL;
 	}
+	else if (reader_data->prefetch_slot != NULL)
+	{
+		/* the buffer belongs to the prefetch ring, just give it back */
+		WalPrefetchRelease(wal_prefetch, reader_data);
+		reader_data->xlogbuf = NULL;
+		reader_data->xlogbuf_size = 0;
+	}
+	else if (reader_data->xlogbuf != NULL)
+	{
+		pg_free(reader_data->xlogbuf);
+		reader_data->xlogbuf = NULL;
+		reader_data->xlogbuf_size = 0;
+	}
 	reader_data->prev_page_off = 0;
 	reader_data->xlogexists = false;
 }
 
+/*
+ * Start threads reading WAL segments from start_segno up to end_segno ahead
+ * of the parser threads.
+ */
+static WalPrefetch *
+WalPrefetchStart(TimeLineID tli, XLogSegNo start_segno, XLogSegNo end_segno,
+				 int n_slots, int n_threads, pthread_t **threads)
+{
+	WalPrefetch *prefetch = pgut_malloc0(sizeof(WalPrefetch));
+	int			i;
+
+	prefetch->tli = tli;
+	prefetch->next_segno = start_segno;
+	prefetch->end_segno = end_segno;
+	prefetch->n_slots = n_slots;
+	prefetch->slots = pgut_malloc0(sizeof(WalSegmentSlot) * n_slots);
+	for (i = 0; i < n_slots; i++)
+		prefetch->slots[i].buf = pgut_malloc(wal_seg_size);
+
+	pthread_mutex_init(&prefetch->mutex, NULL);
+	pthread_cond_init(&prefetch->cond, NULL);
+
+	*threads = (pthread_t *) pgut_malloc(sizeof(pthread_t) * n_threads);
+	for (i = 0; i < n_threads; i++)
+	{
+		elog(VERBOSE, "Start WAL prefetch thread: %d", i + 1);
+		pthread_create(&(*threads)[i], NULL, WalPrefetchWorker, prefetch);
+	}
+
+	return prefetch;
+}
+
+/*
+ * Stop prefetch threads and release the buffers.
+ */
+static void
+WalPrefetchStop(WalPrefetch *prefetch, int n_threads, pthread_t *threads)
+{
+	int			i;
+
+	pthread_mutex_lock(&prefetch->mutex);
+	prefetch->stop = true;
+	pthread_cond_broadcast(&prefetch->cond);
+	pthread_mutex_unlock(&prefetch->mutex);
+
+	for (i = 0; i < n_threads; i++)
+		pthread_join(threads[i], NULL);
+
+	elog(LOG, "WAL segments read ahead: %u, read by parser threads: %u",
+		 prefetch->n_prefetched, prefetch->n_missed);
+
+	for (i = 0; i < prefetch->n_slots; i++)
+		pg_free(prefetch->slots[i].buf);
+	pg_free(prefetch->slots);
+	pg_free(threads);
+
+	pthread_mutex_destroy(&prefetch->mutex);
+	pthread_cond_destroy(&prefetch->cond);
+	pg_free(prefetch);
+}
+
+/*
+ * Find a slot to read the next segment into. Slots which were never taken
+ * by parser threads are not reused, the oldest segments are evicted first.
+ * The latest taken segment is kept, because the thread switching to it after
+ * reading a continuation record opens it once again.
+ * Must be called with the mutex held.
+ */
+static WalSegmentSlot *
+WalPrefetchFreeSlot(WalPrefetch *prefetch)
+{
+	WalSegmentSlot *result = NULL;
+	int			i;
+
+	for (i = 0; i < prefetch->n_slots; i++)
+	{
+		WalSegmentSlot *slot = &prefetch->slots[i];
+
+		if (slot->state == WAL_SEGMENT_EMPTY)
+			return slot;
+
+		if (slot->state == WAL_SEGMENT_READY && slot->used &&
+			slot->refcount == 0 && slot->segno < prefetch->max_used_segno &&
+			(result == NULL || slot->segno < result->segno))
+			result = slot;
+	}
+
+	return result;
+}
+
+/*
+ * Read the whole WAL segment of the slot into its buffer. The segment may be
+ * plain, partial or compressed.
+ */
+static int
+WalPrefetchLoad(WalPrefetch *prefetch, WalSegmentSlot *slot)
+{
+	char		xlogfname[MAXFNAMELEN];
+	char		path[MAXPGPATH];
+	char		partial_path[MAXPGPATH];
+	CompressAlg	algs[] = {ZSTD_COMPRESS, LZ4_COMPRESS};
+	int			i;
+
+	GetXLogFileName(xlogfname, prefetch->tli, slot->segno, wal_seg_size);
+	join_path_components(path, wal_archivedir, xlogfname);
+	snprintf(partial_path, MAXPGPATH, "%s.partial", path);
+
+	if (!fileExists(path, FIO_LOCAL_HOST) &&
+		fileExists(partial_path, FIO_LOCAL_HOST))
+		strncpy(path, partial_path, MAXPGPATH);
+
+	slot->size = 0;
+
+	if (fileExists(path, FIO_LOCAL_HOST))
+	{
+		int			fd = fio_open(FIO_LOCAL_HOST, path, O_RDONLY | PG_BINARY);
+
+		if (fd < 0)
+			return OPEN_FAILED;
+
+		while (slot->size < wal_seg_size)
+		{
+			ssize_t		len = fio_read(fd, slot->buf + slot->size,
+									   wal_seg_size - slot->size);
+
+			if (len < 0)
+			{
+				fio_close(fd);
+				return READ_FAILED;
+			}
+			if (len == 0)
+				break;
+			slot->size += len;
+		}
+		fio_close(fd);
+	}
+	else
+	{
+		char		gz_path[MAXPGPATH];
+
+		snprintf(gz_path, MAXPGPATH, "%s.gz", path);
+
+		if (fileExists(gz_path, FIO_LOCAL_HOST))
+		{
+			gzFile		gz = fio_gzopen(FIO_LOCAL_HOST, gz_path, "rb", -1);
+
+			if (gz == NULL)
+				return OPEN_FAILED;
+
+			while (slot->size < wal_seg_size)
+			{
+				int			len = fio_gzread(gz, slot->buf + slot->size,
+											 wal_seg_size - slot->size);
+
+				if (len < 0)
+				{
+					fio_gzclose(gz);
+					return READ_FAILED;
+				}
+				if (len == 0)
+					break;
+				slot->size += len;
+			}
+			fio_gzclose(gz);
+			strncpy(path, gz_path, MAXPGPATH);
+		}
+		else
+		{
+			for (i = 0; i < lengthof(algs); i++)
+			{
+				char	   *content;
+				int			rc;
+
+				snprintf(path, MAXPGPATH, "%s/%s.%s", wal_archivedir, xlogfname,
+						 wal_compress_suffix(algs[i]));
+
+				rc = read_compressed_wal_file(path, FIO_LOCAL_HOST, algs[i],
+											  wal_seg_size, &content, &slot->size);
+				if (rc == FILE_MISSING)
+					continue;
+				if (rc != SEND_OK)
+					return rc;
+
+				pg_free(slot->buf);
+				slot->buf = content;
+				break;
+			}
+
+			if (i == lengthof(algs))
+				return FILE_MISSING;
+		}
+	}
+
+	strncpy(slot->path, path, MAXPGPATH);
+	return SEND_OK;
+}
+
+/*
+ * WAL prefetch worker. Reads segments one by one into free slots until
+ * the end of the range or the first absent segment.
+ */
+static void *
+WalPrefetchWorker(void *arg)
+{
+	WalPrefetch *prefetch = (WalPrefetch *) arg;
+
+	for (;;)
+	{
+		WalSegmentSlot *slot = NULL;
+		int			rc;
+
+		pthread_mutex_lock(&prefetch->mutex);
+		while (!prefetch->stop)
+		{
+			if (prefetch->end_segno != 0 &&
+				prefetch->next_segno > prefetch->end_segno)
+				break;
+
+			slot = WalPrefetchFreeSlot(prefetch);
+			if (slot)
+				break;
+
+			pthread_cond_wait(&prefetch->cond, &prefetch->mutex);
+		}
+
+		if (slot == NULL || prefetch->stop)
+		{
+			pthread_mutex_unlock(&prefetch->mutex);
+			break;
+		}
+
+		slot->segno = prefetch->next_segno++;
+		slot->state = WAL_SEGMENT_LOADING;
+		slot->refcount = 0;
+		slot->used = false;
+		pthread_mutex_unlock(&prefetch->mutex);
+
+		if (interrupted || thread_interrupted)
+			rc = READ_FAILED;
+		else
+			rc = WalPrefetchLoad(prefetch, slot);
+
+		pthread_mutex_lock(&prefetch->mutex);
+		if (rc == SEND_OK)
+			slot->state = WAL_SEGMENT_READY;
+		else
+		{
+			/*
+			 * Parser thread will read the segment by itself and report
+			 * the error if there is any. Do not read past the absent segment.
+			 */
+			slot->state = WAL_SEGMENT_EMPTY;
+			prefetch->stop = true;
+		}
+		pthread_cond_broadcast(&prefetch->cond);
+		pthread_mutex_unlock(&prefetch->mutex);
+	}
+
+	return NULL;
+}
+
+/*
+ * Take the segment of the reader from the prefetch ring, waiting for it if
+ * it is being read. Returns false if the segment wasn't read ahead.
+ */
+static bool
+WalPrefetchGet(WalPrefetch *prefetch, XLogReaderData *reader_data)
+{
+	XLogSegNo	segno = reader_data->xlogsegno;
+	WalSegmentSlot *slot = NULL;
+	int			i;
+
+	if (reader_data->tli != prefetch->tli)
+		return false;
+
+	pthread_mutex_lock(&prefetch->mutex);
+
+	for (i = 0; i < prefetch->n_slots; i++)
+	{
+		if (prefetch->slots[i].state != WAL_SEGMENT_EMPTY &&
+			prefetch->slots[i].segno == segno)
+		{
+			slot = &prefetch->slots[i];
+			break;
+		}
+	}
+
+	/*
+	 * The segment is not going to be read ahead. Parser threads are ahead
+	 * of prefetching, so there is no point in reading segments before this one.
+	 */
+	if (slot == NULL)
+	{
+		if (segno >= prefetch->next_segno)
+			prefetch->next_segno = segno + 1;
+		prefetch->n_missed++;
+		pthread_mutex_unlock(&prefetch->mutex);
+		return false;
+	}
+
+	while (slot->segno == segno && slot->state == WAL_SEGMENT_LOADING)
+		pthread_cond_wait(&prefetch->cond, &prefetch->mutex);
+
+	if (slot->segno != segno || slot->state != WAL_SEGMENT_READY)
+	{
+		prefetch->n_missed++;
+		pthread_mutex_unlock(&prefetch->mutex);
+		return false;
+	}
+
+	slot->refcount++;
+	slot->used = true;
+	if (segno > prefetch->max_used_segno)
+		prefetch->max_used_segno = segno;
+	prefetch->n_prefetched++;
+
+	reader_data->prefetch_slot = slot;
+	reader_data->xlogbuf = slot->buf;
+	reader_data->xlogbuf_size = slot->size;
+	strncpy(reader_data->xlogpath, slot->path, MAXPGPATH);
+
+	pthread_mutex_unlock(&prefetch->mutex);
+	return true;
+}
+
+/*
+ * Give the segment back to the prefetch ring.
+ */
+static void
+WalPrefetchRelease(WalPrefetch *prefetch, XLogReaderData *reader_data)
+{
+	pthread_mutex_lock(&prefetch->mutex);
+	reader_data->prefetch_slot->refcount--;
+	reader_data->prefetch_slot = NULL;
+	pthread_cond_broadcast(&prefetch->cond);
+	pthread_mutex_unlock(&prefetch->mutex);
+}
+
 static void
 PrintXLogCorruptionMsg(XLogReaderData *reader_data, int elevel)
 {
@@ -1730,7 +2495,7 @@ PrintXLogCorruptionMsg(XLogReaderData *reader_data, int elevel)
 		if (!reader_data->xlogexists)
 			elog(elevel, "Thread [%d]: WAL segment \"%s\" is absent",
 				 reader_data->thread_num, reader_data->xlogpath);
-		else if (reader_data->xlogfile != -1)
+		else if (reader_data->xlogfile != -1 || reader_data->xlogbuf != NULL)
 			elog(elevel, "Thread [%d]: Possible WAL corruption. "
 						 "Error has occured during reading WAL segment \"%s\"",
 				 reader_data->thread_num, reader_data->xlogpath);
@@ -1841,10 +2606,185 @@ extractPageInfo(XLogReaderState *record, XLogReaderData *reader_data,
 		if (forknum != MAIN_FORKNUM)
 			continue;
 
-		process_block_change(forknum, rnode, blkno);
+		block_changes_add(&reader_data->block_changes, rnode, blkno);
 	}
 }
 
+/*
+ * Add a block change to the buffer. When the buffer is full, it is compacted,
+ * and enlarged only if there are not so many duplicates in it.
+ */
+static void
+block_changes_add(BlockChangeBuffer *buf, RelFileNode rnode, BlockNumber blkno)
+{
+	BlockChange *item;
+
+	StaticAssertStmt(sizeof(RelFileNode) == sizeof(item->rnode),
+					 "RelFileNode is expected to consist of three Oids");
+
+	if (buf->num == buf->size)
+	{
+		block_changes_compact(buf);
+
+		if (buf->size == 0 || buf->num > buf->size / 2)
+		{
+			buf->size = buf->size == 0 ? BLOCK_CHANGES_INIT_SIZE : buf->size * 2;
+			buf->items = pgut_realloc(buf->items, sizeof(BlockChange) * buf->size);
+		}
+	}
+
+	item = &buf->items[buf->num++];
+	memcpy(item->rnode, &rnode, sizeof(item->rnode));
+	item->blkno = blkno;
+}
+
+/*
+ * Move block changes of src to the end of dst.
+ */
+static void
+block_changes_append(BlockChangeBuffer *dst, BlockChangeBuffer *src)
+{
+	if (src->num == 0)
+	{
+		/* nothing to move */
+	}
+	else if (dst->items == NULL)
+	{
+		*dst = *src;
+		src->items = NULL;
+	}
+	else
+	{
+		if (dst->size < dst->num + src->num)
+		{
+			dst->size = dst->num + src->num;
+			dst->items = pgut_realloc(dst->items, sizeof(BlockChange) * dst->size);
+		}
+		memcpy(dst->items + dst->num, src->items, sizeof(BlockChange) * src->num);
+		dst->num += src->num;
+	}
+
+	pg_free(src->items);
+	memset(src, 0, sizeof(BlockChangeBuffer));
+}
+
+/* Get the n-th byte of the sort key, the least significant byte first */
+static inline uint8
+block_change_key_byte(const BlockChange *item, int n)
+{
+	uint32		word;
+
+	if (n < 4)
+		word = item->blkno;
+	else
+		word = item->rnode[2 - (n - 4) / 4];
+
+	return (word >> ((n % 4) * 8)) & 0xFF;
+}
+
+/*
+ * Sort block changes by relation and block number using LSD radix sort and
+ * remove duplicates. Passes over bytes having the same value in all items,
+ * like the high bytes of tablespace Oids, are skipped.
+ */
+static void
+block_changes_compact(BlockChangeBuffer *buf)
+{
+	size_t		(*counts)[256];
+	BlockChange *src = buf->items;
+	BlockChange *dst;
+	size_t		i;
+	size_t		j;
+	int			n;
+
+	if (buf->num < 2)
+		return;
+
+	counts = pgut_malloc0(sizeof(size_t[256]) * sizeof(BlockChange));
+	for (i = 0; i < buf->num; i++)
+	{
+		for (n = 0; n < sizeof(BlockChange); n++)
+			counts[n][block_change_key_byte(&src[i], n)]++;
+	}
+
+	dst = pgut_malloc(sizeof(BlockChange) * buf->num);
+	for (n = 0; n < sizeof(BlockChange); n++)
+	{
+		size_t		offset = 0;
+		BlockChange *tmp;
+
+		if (counts[n][block_change_key_byte(&src[0], n)] == buf->num)
+			continue;
+
+		for (j = 0; j < 256; j++)
+		{
+			size_t		count = counts[n][j];
+
+			counts[n][j] = offset;
+			offset += count;
+		}
+
+		for (i = 0; i < buf->num; i++)
+			dst[counts[n][block_change_key_byte(&src[i], n)]++] = src[i];
+
+		tmp = src;
+		src = dst;
+		dst = tmp;
+	}
+
+	/* Remove duplicates, src contains sorted items now */
+	j = 0;
+	for (i = 1; i < buf->num; i++)
+	{
+		if (memcmp(&src[i], &src[j], sizeof(BlockChange)) != 0)
+			src[++j] = src[i];
+	}
+	buf->num = j + 1;
+
+	pg_free(dst);
+	pg_free(counts);
+	buf->items = src;
+}
+
+/*
+ * Add collected block changes to the pagemaps of files.
+ */
+static void
+block_changes_apply(BlockChangeBuffer *buf)
+{
+	BlockNumber *blknos;
+	size_t		i = 0;
+
+	block_changes_compact(buf);
+
+	elog(LOG, "Found %lu changed blocks in WAL", (unsigned long) buf->num);
+
+	blknos = pgut_malloc(sizeof(BlockNumber) * RELSEG_SIZE);
+	while (i < buf->num)
+	{
+		BlockChange *first = &buf->items[i];
+		BlockNumber	segno = first->blkno / RELSEG_SIZE;
+		RelFileNode	rnode;
+		int			n_blknos = 0;
+
+		/* Collect blocks of the same relation segment */
+		for (; i < buf->num; i++)
+		{
+			BlockChange *item = &buf->items[i];
+
+			if (memcmp(item->rnode, first->rnode, sizeof(first->rnode)) != 0 ||
+				item->blkno / RELSEG_SIZE != segno)
+				break;
+
+			blknos[n_blknos++] = item->blkno % RELSEG_SIZE;
+		}
+
+		memcpy(&rnode, first->rnode, sizeof(rnode));
+		process_block_changes(MAIN_FORKNUM, rnode, segno, blknos, n_blknos);
+	}
+	pg_free(blknos);
+}
+
 /*
  * Check the current read WAL record during validation.
  */
@@ -1902,29 +2842,186 @@ getRecordTimestamp(XLogReaderState *record, TimestampTz *recordXtime)
 	return false;
 }
 
-bool validate_wal_segment(TimeLineID tli, XLogSegNo segno, const char *prefetch_dir, uint32 wal_seg_size)
+/*
+ * Validate WAL segments from first_segno to last_segno inclusive. The record
+ * crossing into the segment following last_segno is validated as well, so
+ * that segment must be present in the directory too.
+ *
+ * Segments are read by num_threads threads, each thread reads its own
+ * segment and the record crossing the boundary of the segment is read by
+ * the thread of the segment, where the record starts.
+ */
+bool
+validate_wal_segments(TimeLineID tli, XLogSegNo first_segno, XLogSegNo last_segno,
+					  const char *wal_dir, uint32 wal_seg_size)
 {
-	XLogRecPtr startpoint;
-	XLogRecPtr endpoint;
+	XLogRecPtr	startpoint;
+	XLogRecPtr	endpoint;
 
-	bool rc;
-	int tmp_num_threads = num_threads;
-	num_threads = 1;
+	GetXLogRecPtr(first_segno, 0, wal_seg_size, startpoint);
+	GetXLogRecPtr(last_segno + 1, 0, wal_seg_size, endpoint);
 
-	/* calculate startpoint and endpoint */
-	GetXLogRecPtr(segno, 0, wal_seg_size, startpoint);
-	GetXLogRecPtr(segno+1, 0, wal_seg_size, endpoint);
+	return RunXLogThreads(wal_dir, 0, InvalidTransactionId,
+						  InvalidXLogRecPtr, tli, wal_seg_size,
+						  startpoint, endpoint, false, NULL, NULL, true);
+}
 
-	/* disable multi-threading */
-	num_threads = 1;
+bool
+validate_wal_segment(TimeLineID tli, XLogSegNo segno, const char *wal_dir, uint32 wal_seg_size)
+{
+	return validate_wal_segments(tli, segno, segno, wal_dir, wal_seg_size);
+}
 
-	rc = RunXLogThreads(prefetch_dir, 0, InvalidTransactionId,
-						InvalidXLogRecPtr, tli, wal_seg_size,
-						startpoint, endpoint, false, NULL, NULL, true);
+/* Account WAL record, which has just been read, in the segment summary */
+static void
+wal_summary_add_record(WalSegmentSummary *summary, XLogReaderState *xlogreader)
+{
+	XLogRecPtr	lsn = xlogreader->ReadRecPtr;
+	TransactionId xid = XLogRecGetXid(xlogreader);
+	TimestampTz	rec_time;
+
+	if (XLogRecPtrIsInvalid(summary->start_lsn))
+		summary->start_lsn = lsn;
+	summary->last_lsn = lsn;
+
+	if (getRecordTimestamp(xlogreader, &rec_time))
+	{
+		if (XLogRecPtrIsInvalid(summary->first_time_lsn))
+		{
+			summary->first_time_lsn = lsn;
+			summary->min_time = rec_time;
+			summary->max_time = rec_time;
+		}
+		summary->min_time = Min(summary->min_time, rec_time);
+		summary->max_time = Max(summary->max_time, rec_time);
+		summary->last_time_lsn = lsn;
+		summary->last_time = rec_time;
+	}
 
-	num_threads = tmp_num_threads;
+	if (TransactionIdIsValid(xid))
+	{
+		if (summary->min_xid == 0)
+		{
+			summary->min_xid = xid;
+			summary->max_xid = xid;
+		}
+		summary->min_xid = Min(summary->min_xid, (uint64) xid);
+		summary->max_xid = Max(summary->max_xid, (uint64) xid);
+		summary->last_xid = xid;
+	}
+}
 
-	return rc;
+/*
+ * Build summary of WAL records ending in the segment. The record crossing
+ * into the segment is read from the previous segment, if it is present in
+ * wal_dir, otherwise the summary is marked as partial. The record crossing
+ * out of the segment is left to the summary of the next segment.
+ * Returns false if the segment cannot be read.
+ */
+bool
+summarize_wal_segment(const char *wal_dir, TimeLineID tli, XLogSegNo segno,
+					  uint32 wal_seg_size, WalSegmentSummary *summary)
+{
+	XLogReaderState *xlogreader;
+	XLogReaderData reader_data;
+	XLogRecPtr	seg_start;
+	XLogRecPtr	seg_end;
+	XLogRecPtr	found;
+	XLogRecPtr	startpoint;
+	XLogRecord *record;
+	char	   *errormsg;
+	bool		res = false;
+
+	MemSet(summary, 0, sizeof(WalSegmentSummary));
+	summary->segno = segno;
+
+	if (segno == 0)
+		return false;
+
+	GetXLogRecPtr(segno, 0, wal_seg_size, seg_start);
+	GetXLogRecPtr(segno + 1, 0, wal_seg_size, seg_end);
+
+	pthread_mutex_lock(&wal_summary_mutex);
+
+	xlogreader = InitXLogPageRead(&reader_data, wal_dir, tli, wal_seg_size,
+								  false, false, true);
+
+#if PG_VERSION_NUM >= 130000
+	XLogBeginRead(xlogreader, seg_start);
+#endif
+
+	found = XLogFindNextRecord(xlogreader, seg_start);
+	if (XLogRecPtrIsInvalid(found) || found >= seg_end)
+		goto cleanup;
+
+	startpoint = found;
+#if PG_VERSION_NUM >= 130000
+	XLogBeginRead(xlogreader, found);
+#endif
+
+	/* Some record crosses into the segment, it is the previous one of the first record */
+	if (found != seg_start + SizeOfXLogLongPHD)
+	{
+		XLogRecPtr	prev_lsn;
+
+		record = WalReadRecord(xlogreader, found, &errormsg);
+		if (record == NULL)
+			goto cleanup;
+		prev_lsn = record->xl_prev;
+
+#if PG_VERSION_NUM >= 130000
+		XLogBeginRead(xlogreader, prev_lsn);
+#endif
+		record = WalReadRecord(xlogreader, prev_lsn, &errormsg);
+
+		if (record != NULL && xlogreader->EndRecPtr <= found)
+		{
+			wal_summary_add_record(summary, xlogreader);
+			startpoint = InvalidXLogRecPtr;
+		}
+		else
+		{
+			elog(LOG, "Cannot read WAL record at %X/%X, which crosses into segment " UINT64_FORMAT,
+				 (uint32) (prev_lsn >> 32), (uint32) (prev_lsn), segno);
+			summary->flags |= WAL_SUMMARY_PARTIAL;
+			summary->start_lsn = prev_lsn;
+#if PG_VERSION_NUM >= 130000
+			XLogBeginRead(xlogreader, found);
+#endif
+		}
+	}
+
+	for (;;)
+	{
+		record = WalReadRecord(xlogreader, startpoint, &errormsg);
+
+		/*
+		 * The record crossing out of the segment cannot be read, if the next
+		 * segment is absent. It doesn't belong to the segment anyway.
+		 */
+		if (record == NULL)
+		{
+			res = reader_data.xlogsegno > segno;
+			break;
+		}
+
+		if (xlogreader->EndRecPtr > seg_end)
+		{
+			res = true;
+			break;
+		}
+
+		wal_summary_add_record(summary, xlogreader);
+		startpoint = InvalidXLogRecPtr;
+	}
+
+cleanup:
+	CleanupXLogPageRead(xlogreader);
+	XLogReaderFree(xlogreader);
+
+	pthread_mutex_unlock(&wal_summary_mutex);
+
+	return res;
 }
 
 static XLogRecord* WalReadRecord(XLogReaderState *xlogreader, XLogRecPtr startpoint, char **errormsg)
@@ -86,6 +86,7 @@ bool perm_slot = false;
 /* backup options */
 bool         backup_logs = false;
 bool         smooth_checkpoint;
+bool         direct_io = false;
 bool         remote_agent = false;
 static char *backup_note = NULL;
 /* catchup options */
@@ -103,6 +104,7 @@ static char		   *target_name = NULL;
 static char		   *target_action = NULL;
 
 static char *primary_conninfo = NULL;
+static bool punch_holes = false;
 
 static pgRecoveryTarget *recovery_target_options = NULL;
 static pgRestoreParams *restore_params = NULL;
@@ -113,6 +115,7 @@ bool no_validate = false;
 IncrRestoreMode incremental_mode = INCR_NONE;
 
 bool skip_block_validation = false;
+bool full_validation = false;
 
 /* array for datnames, provided via db-include and db-exclude */
 static parray *datname_exclude_list = NULL;
@@ -150,11 +153,14 @@ static char *wal_file_path;
 static char *wal_file_name;
 static bool file_overwrite = false;
 static bool no_ready_rename = false;
+static bool archive_daemon = false;
+static char *archive_socket;
 static char archive_push_xlog_dir[MAXPGPATH] = "";
 
 /* archive get options */
 static char *prefetch_dir;
 bool no_validate_wal = false;
+static bool background_prefetch = false;
 
 /* show options */
 ShowFormat show_format = SHOW_PLAIN;
@@ -210,6 +216,7 @@ static ConfigOption cmd_options[] =
 	{ 'b', 184, "merge-expired",	&merge_expired,		SOURCE_CMD_STRICT },
 	{ 'b', 185, "dry-run",			&dry_run,			SOURCE_CMD_STRICT },
 	{ 's', 238, "note",				&backup_note,		SOURCE_CMD_STRICT },
+	{ 'b', 186, "direct-io",		&direct_io,			SOURCE_CMD_STRICT },
 	/* catchup options */
 	{ 's', 239, "source-pgdata",		&catchup_source_pgdata,	SOURCE_CMD_STRICT },
 	{ 's', 240, "destination-pgdata",	&catchup_destination_pgdata,	SOURCE_CMD_STRICT },
@@ -226,12 +233,14 @@ static ConfigOption cmd_options[] =
 	{ 's', 142, "recovery-target-action", &target_action,	SOURCE_CMD_STRICT },
 	{ 'b', 143, "no-validate",		&no_validate,		SOURCE_CMD_STRICT },
 	{ 'b', 154, "skip-block-validation", &skip_block_validation,	SOURCE_CMD_STRICT },
+	{ 'b', 187, "full-validation",	&full_validation,	SOURCE_CMD_STRICT },
 	{ 'f', 158, "db-include", 		opt_datname_include_list, SOURCE_CMD_STRICT },
 	{ 'f', 159, "db-exclude", 		opt_datname_exclude_list, SOURCE_CMD_STRICT },
 	{ 'b', 'R', "restore-as-replica", &restore_as_replica,	SOURCE_CMD_STRICT },
 	{ 's', 160, "primary-conninfo",	&primary_conninfo,	SOURCE_CMD_STRICT },
 	{ 's', 'S', "primary-slot-name",&replication_slot,	SOURCE_CMD_STRICT },
 	{ 'f', 'I', "incremental-mode", opt_incr_restore_mode,	SOURCE_CMD_STRICT },
+	{ 'b', 188, "punch-holes",		&punch_holes,		SOURCE_CMD_STRICT },
 	{ 's', 'X', "waldir",		&gl_waldir_path,	SOURCE_CMD_STRICT },
 	/* checkdb options */
 	{ 'b', 195, "amcheck",			&need_amcheck,		SOURCE_CMD_STRICT },
@@ -257,9 +266,12 @@ static ConfigOption cmd_options[] =
 	{ 'b', 152, "overwrite",		&file_overwrite,	SOURCE_CMD_STRICT },
 	{ 'b', 153, "no-ready-rename",	&no_ready_rename,	SOURCE_CMD_STRICT },
 	{ 'i', 162, "batch-size",		&batch_size,		SOURCE_CMD_STRICT },
+	{ 'b', 155, "daemon",			&archive_daemon,	SOURCE_CMD_STRICT },
+	{ 's', 156, "archive-socket",	&archive_socket,	SOURCE_CMD_STRICT },
 	/* archive-get options */
 	{ 's', 163, "prefetch-dir",		&prefetch_dir,		SOURCE_CMD_STRICT },
 	{ 'b', 164, "no-validate-wal",	&no_validate_wal,	SOURCE_CMD_STRICT },
+	{ 'b', 161, "background-prefetch",	&background_prefetch,	SOURCE_CMD_STRICT },
 	/* show options */
 	{ 'f', 165, "format",			opt_show_format,	SOURCE_CMD_STRICT },
 	{ 'b', 166, "archive",			&show_archive,		SOURCE_CMD_STRICT },
@@ -443,6 +455,28 @@ main(int argc, char *argv[])
 	/* set location based on cmdline options only */
 	setMyLocation(backup_subcmd);
 
+	if (archive_socket != NULL)
+	{
+		canonicalize_path(archive_socket);
+		if (!is_absolute_path(archive_socket))
+			elog(ERROR, "--archive-socket must be an absolute path");
+	}
+
+	/*
+	 * If archive-push daemon is running, archive_command just passes
+	 * WAL file name to it. There is no need to read the configuration
+	 * or to connect to the backup host. If the daemon cannot push the file,
+	 * push it as usual.
+	 */
+	if (backup_subcmd == ARCHIVE_PUSH_CMD && archive_socket != NULL && !archive_daemon)
+	{
+		if (wal_file_name == NULL)
+			elog(ERROR, "Required parameter is not specified: --wal-file-name %%f");
+
+		if (archive_push_via_daemon(archive_socket, wal_file_name))
+			return 0;
+	}
+
 	/* ===== catalogState ======*/
 	if (backup_path == NULL)
 	{
@@ -726,6 +760,7 @@ main(int argc, char *argv[])
 
 		restore_params->primary_slot_name = replication_slot;
 		restore_params->skip_block_validation = skip_block_validation;
+		restore_params->punch_holes = punch_holes;
 		restore_params->partial_db_list = NULL;
 		restore_params->partial_restore_type = NONE;
 		restore_params->primary_conninfo = primary_conninfo;
@@ -814,7 +849,25 @@ main(int argc, char *argv[])
 		elog(ERROR, "You cannot specify \"--no-validate\" option with the \"%s\" command",
 			get_subcmd_name(backup_subcmd));
 
-	if (backup_subcmd == ARCHIVE_PUSH_CMD)
+	if (backup_subcmd == ARCHIVE_PUSH_CMD && archive_daemon)
+	{
+		uint64	system_id;
+
+		if (archive_socket == NULL)
+			elog(ERROR, "Required parameter is not specified: --archive-socket");
+
+		if (instance_config.pgdata == NULL)
+			elog(ERROR, "Cannot read pg_backup.conf for this instance");
+
+		join_path_components(archive_push_xlog_dir, instance_config.pgdata, XLOGDIR);
+
+		system_id = get_system_identifier(FIO_DB_HOST, instance_config.pgdata, false);
+		if (system_id != instance_config.system_identifier)
+			elog(ERROR, "Refuse to start archive-push daemon. Instance parameters mismatch."
+						"Instance '%s' should have SYSTEM_ID = " UINT64_FORMAT " instead of " UINT64_FORMAT,
+					instanceState->instance_name, instance_config.system_identifier, system_id);
+	}
+	else if (backup_subcmd == ARCHIVE_PUSH_CMD)
 	{
 		/* Check archive-push parameters and construct archive_push_xlog_dir
 		 *
@@ -923,17 +976,24 @@ main(int argc, char *argv[])
 	switch (backup_subcmd)
 	{
 		case ARCHIVE_PUSH_CMD:
-			do_archive_push(instanceState, &instance_config, archive_push_xlog_dir, wal_file_name,
-							batch_size, file_overwrite, no_sync, no_ready_rename);
+			if (archive_daemon)
+				do_archive_push_daemon(instanceState, &instance_config, archive_push_xlog_dir,
+									   archive_socket, file_overwrite, no_sync, no_ready_rename);
+			else
+				do_archive_push(instanceState, &instance_config, archive_push_xlog_dir, wal_file_name,
+								batch_size, file_overwrite, no_sync, no_ready_rename);
 			break;
 		case ARCHIVE_GET_CMD:
 			do_archive_get(instanceState, &instance_config, prefetch_dir,
-						   wal_file_path, wal_file_name, batch_size, !no_validate_wal);
+						   wal_file_path, wal_file_name, batch_size, !no_validate_wal,
+						   background_prefetch);
 			break;
 		case ADD_INSTANCE_CMD:
 			return do_add_instance(instanceState, &instance_config);
 		case DELETE_INSTANCE_CMD:
 			return do_delete_instance(instanceState);
+		case REBUILD_WAL_INDEX_CMD:
+			return do_rebuild_wal_index(instanceState, no_sync);
 		case INIT_CMD:
 			return do_init(catalogState);
 		case BACKUP_CMD:
@@ -1087,6 +1147,9 @@ opt_show_format(ConfigOption *opt, const char *arg)
 static void
 compress_init(ProbackupSubcmd const subcmd)
 {
+	int			min_level;
+	int			max_level;
+
 	/* Default algorithm is zlib */
 	if (compress_shortcut)
 		instance_config.compress_alg = ZLIB_COMPRESS;
@@ -1099,8 +1162,15 @@ compress_init(ProbackupSubcmd const subcmd)
 												"compress-algorithm option");
 	}
 
-	if (instance_config.compress_level < 0 || instance_config.compress_level > 9)
-		elog(ERROR, "--compress-level value must be in the range from 0 to 9");
+	if ((subcmd == BACKUP_CMD || subcmd == ARCHIVE_PUSH_CMD) &&
+		!compress_alg_is_supported(instance_config.compress_alg))
+		elog(ERROR, "This build of %s doesn't support \"%s\" compression algorithm",
+			 PROGRAM_NAME, deparse_compress_alg(instance_config.compress_alg));
+
+	compress_level_range(instance_config.compress_alg, &min_level, &max_level);
+	if (instance_config.compress_level < min_level || instance_config.compress_level > max_level)
+		elog(ERROR, "--compress-level value must be in the range from %d to %d",
+			 min_level, max_level);
 
 	if (instance_config.compress_alg == ZLIB_COMPRESS && instance_config.compress_level == 0)
 		elog(WARNING, "Compression level 0 will lead to data bloat!");
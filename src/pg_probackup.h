@@ -69,12 +69,14 @@ extern const char  *PROGRAM_EMAIL;
 #define BACKUP_LOCK_FILE		"backup.pid"
 #define BACKUP_RO_LOCK_FILE		"backup_ro.pid"
 #define DATABASE_FILE_LIST		"backup_content.control"
+#define VALIDATION_LEDGER_FILE	"validation_ledger"
 #define PG_BACKUP_LABEL_FILE	"backup_label"
 #define PG_TABLESPACE_MAP_FILE	"tablespace_map"
 #define RELMAPPER_FILENAME		"pg_filenode.map"
 #define DATABASE_MAP			"database_map"
 #define HEADER_MAP  			"page_header_map"
 #define HEADER_MAP_TMP  		"page_header_map_tmp"
+#define WAL_INDEX_DIR			"index"
 
 /* default replication slot names */
 #define DEFAULT_TEMP_SLOT_NAME	 "pg_backup_slot";
@@ -192,6 +194,8 @@ typedef enum CompressAlg
 	NOT_DEFINED_COMPRESS = 0,
 	NONE_COMPRESS,
 	ZLIB_COMPRESS,
+	ZSTD_COMPRESS,
+	LZ4_COMPRESS,
 } CompressAlg;
 
 typedef enum ForkName
@@ -209,8 +213,13 @@ typedef enum ForkName
 /* Information about single file (or dir) in backup */
 typedef struct pgFile
 {
-	char   *name;			/* file or directory name */
-	mode_t	mode;			/* protection (file type and permission) */
+	/*
+	 * Fields are grouped by their alignment to avoid padding, catalogs of
+	 * million files keep a million of these in memory.
+	 */
+	char   *name;			/* file or directory name, points into rel_path */
+	char   *rel_path;		/* relative path of the file */
+	char   *linked;			/* path of the linked file */
 	size_t	size;			/* size of the file */
 	time_t  mtime;			/* file st_mtime attribute, can be used only
 								during backup */
@@ -219,33 +228,37 @@ typedef struct pgFile
 	int64	write_size;		/* size of the backed-up file. BYTES_INVALID means
 							   that the file existed but was not backed up
 							   because not modified since last backup. */
+							/* we need int64 here to store '-1' value */
 	size_t	uncompressed_size;	/* size of the backed-up file before compression
 								 * and adding block headers.
 								 */
-							/* we need int64 here to store '-1' value */
+	datapagemap_t	pagemap;			/* bitmap of pages updated since previous backup
+										   may take up to 16kB per file */
+	/* Coordinates in header map */
+	pg_off_t hdr_off;       /* offset in header map */
+	int      n_headers;		/* number of blocks in the data file in backup */
+	pg_crc32 hdr_crc;		/* CRC value of header file: name_hdr */
+	int      hdr_size;      /* length of headers */
+
+	mode_t	mode;			/* protection (file type and permission) */
 	pg_crc32 crc;			/* CRC value of the file, regular file only */
-	char   *rel_path;		/* relative path of the file */
-	char   *linked;			/* path of the linked file */
-	bool	is_datafile;	/* true if the file is PostgreSQL data file */
+	uint32	rel_path_hash;	/* hash of rel_path set by pgFileInit(), 0 if unknown */
 	Oid		tblspcOid;		/* tblspcOid extracted from path, if applicable */
 	Oid		dbOid;			/* dbOid extracted from path, if applicable */
 	Oid		relOid;			/* relOid extracted from path, if applicable */
 	ForkName   forkName;	/* forkName extracted from path, if applicable */
 	int		segno;			/* Segment number for ptrack */
 	int		n_blocks;		/* number of blocks in the data file in data directory */
-	bool	exists_in_prev;		/* Mark files, both data and regular, that exists in previous backup */
 	CompressAlg		compress_alg;		/* compression algorithm applied to the file */
 	volatile 		pg_atomic_flag lock;/* lock for synchronization of parallel threads  */
-	datapagemap_t	pagemap;			/* bitmap of pages updated since previous backup
-										   may take up to 16kB per file */
+
+	bool	is_datafile;	/* true if the file is PostgreSQL data file */
+	bool	exists_in_prev;		/* Mark files, both data and regular, that exists in previous backup */
 	bool			pagemap_isabsent;	/* Used to mark files with unknown state of pagemap,
 										 * i.e. datafiles without _ptrack */
-	/* Coordinates in header map */
-	int      n_headers;		/* number of blocks in the data file in backup */
-	pg_crc32 hdr_crc;		/* CRC value of header file: name_hdr */
-	pg_off_t hdr_off;       /* offset in header map */
-	int      hdr_size;      /* length of headers */
 	bool	excluded;	/* excluded via --exclude-path option */
+	bool	in_arena;	/* allocated in the arena of the file list,
+						 * see pgFileInitInArena() */
 } pgFile;
 
 typedef struct page_map_entry
@@ -255,6 +268,18 @@ typedef struct page_map_entry
 	size_t		 pagemapsize;
 } page_map_entry;
 
+/* Piece of work for a worker thread, see scheduler.c */
+typedef struct FileTask
+{
+	pgFile	   *file;
+	int64		size;			/* estimated amount of work in bytes */
+	bool		is_part;		/* only a block range of data file */
+	BlockNumber	start_block;
+	BlockNumber	end_block;		/* InvalidBlockNumber if range is open-ended */
+} FileTask;
+
+typedef struct FileScheduler FileScheduler;
+
 /* Special values of datapagemap_t bitmapsize */
 #define PageBitmapIsEmpty 0		/* Used to mark unchanged datafiles */
 
@@ -305,8 +330,10 @@ typedef enum ShowFormat
 #define PROGRAM_VERSION_NUM	20511
 
 /* update when remote agent API or behaviour changes */
-#define AGENT_PROTOCOL_VERSION		"2.6.0"
-#define AGENT_PROTOCOL_VERSION_NUM	20600
+#define AGENT_PROTOCOL_VERSION		"2.7.5"
+#define AGENT_PROTOCOL_VERSION_NUM	20705
+/* oldest agent protocol we can talk to, newer requests are not sent to it */
+#define AGENT_PROTOCOL_VERSION_MIN_NUM	20600
 
 /* update only when changing storage format */
 #define STORAGE_FORMAT_VERSION		"2.4.4"
@@ -364,6 +391,9 @@ typedef struct InstanceConfig
 	uint32		retention_window;
 	uint32		wal_depth;
 
+	/* Files validated earlier are trusted for this time (in seconds), 0 disables */
+	uint64		validation_ledger_max_age;
+
 	CompressAlg	compress_alg;
 	int			compress_level;
 
@@ -396,15 +426,19 @@ typedef struct HeaderMap
 {
 	char     path[MAXPGPATH];
 	char     path_tmp[MAXPGPATH]; /* used only in merge */
-	FILE    *fp;                  /* used only for writing */
-	char    *buf;                 /* buffer */
-	pg_off_t offset;              /* current position in fp */
+	int      fd;                  /* used only for writing */
+	pg_atomic_uint64 offset;      /* end of space reserved by writers */
+	int      rfd;                 /* used only for reading, shared by threads */
 	pthread_mutex_t mutex;
 
 } HeaderMap;
 
 typedef struct pgBackup pgBackup;
 
+/* memory-mapped binary file list of a backup, see filelist.c */
+typedef struct FileListMap FileListMap;
+typedef struct CatalogSummary CatalogSummary;
+
 /* Information about single backup stored in backup.conf */
 struct pgBackup
 {
@@ -478,6 +512,10 @@ struct pgBackup
 									   backup_path/instance_name/backup_id/database */
 	parray			*files;			/* list of files belonging to this backup
 									 * must be populated explicitly */
+	FileListMap		*filelist_map;	/* mapped file list, used for lookups
+									 * instead of 'files' when set */
+	parray_index	*files_index;	/* hash index of 'files' by rel_path,
+									 * NULL if it's not built */
 	char			*note;
 
 	pg_crc32         content_crc;
@@ -518,6 +556,7 @@ typedef struct pgRestoreParams
 	//TODO maybe somehow add restore_as_replica as one of RecoverySettingsModes
 	RecoverySettingsMode recovery_settings_mode;
 	bool	skip_block_validation; //Start using it
+	bool	punch_holes;	/* deallocate zero pages of existing files */
 	const char *restore_command;
 	const char *primary_slot_name;
 	const char *primary_conninfo;
@@ -555,10 +594,12 @@ typedef struct
 
 	parray	   *files_list;
 	parray	   *prev_filelist;
+	parray_index *prev_filelist_index;
 	XLogRecPtr	prev_start_lsn;
 
 	int			thread_num;
 	HeaderMap   *hdr_map;
+	FileScheduler *scheduler;
 
 	/*
 	 * Return value from the thread.
@@ -593,6 +634,8 @@ struct timelineInfo {
 	pgBackup *oldest_backup; /* link to oldest backup on timeline */
 	XLogRecPtr anchor_lsn; /* LSN belonging to the oldest segno to keep for 'wal-depth' */
 	TimeLineID anchor_tli;	/* timeline of anchor_lsn */
+	time_t	min_time;		/* range of record timestamps according to */
+	time_t	max_time;		/* WAL summary, 0 if unknown */
 };
 
 typedef struct xlogInterval
@@ -601,6 +644,29 @@ typedef struct xlogInterval
 	XLogSegNo end_segno;
 } xlogInterval;
 
+/*
+ * Summary of WAL records ending in the WAL segment. The record, which crosses
+ * the segment boundary, belongs to the segment it ends in.
+ */
+typedef struct WalSegmentSummary
+{
+	XLogSegNo	segno;
+	uint32		flags;
+	XLogRecPtr	start_lsn;		/* start of the first record */
+	XLogRecPtr	last_lsn;		/* start of the last record */
+	XLogRecPtr	first_time_lsn;	/* first record with timestamp, 0 if none */
+	XLogRecPtr	last_time_lsn;	/* last record with timestamp, 0 if none */
+	TimestampTz	last_time;		/* timestamp of the last_time_lsn record */
+	TimestampTz	min_time;
+	TimestampTz	max_time;
+	uint64		min_xid;		/* range of record xids, 0 if none */
+	uint64		max_xid;
+	uint64		last_xid;		/* xid of the last record having one */
+} WalSegmentSummary;
+
+/* the record crossing into the segment could not be read */
+#define WAL_SUMMARY_PARTIAL		0x01
+
 typedef struct lsnInterval
 {
 	TimeLineID tli;
@@ -665,9 +731,7 @@ typedef struct StopBackupCallbackParams
 	sscanf(data, "%X/%X", xlogid, xrecoff)
 
 #define IsCompressedXLogFileName(fname) \
-	(strlen(fname) == XLOG_FNAME_LEN + strlen(".gz") &&			\
-	 strspn(fname, "0123456789ABCDEF") == XLOG_FNAME_LEN &&		\
-	 strcmp((fname) + XLOG_FNAME_LEN, ".gz") == 0)
+	(wal_compress_alg_by_name(fname, "") != NOT_DEFINED_COMPRESS)
 
 #define WalSegmentOffset(xlogptr, wal_segsz_bytes) \
 	XLogSegmentOffset(xlogptr, wal_segsz_bytes)
@@ -691,9 +755,7 @@ typedef struct StopBackupCallbackParams
 		XLogFromFileName(fname, tli, logSegNo, wal_segsz_bytes)
 
 #define IsPartialCompressXLogFileName(fname)	\
-	(strlen(fname) == XLOG_FNAME_LEN + strlen(".gz.partial") && \
-	 strspn(fname, "0123456789ABCDEF") == XLOG_FNAME_LEN &&		\
-	 strcmp((fname) + XLOG_FNAME_LEN, ".gz.partial") == 0)
+	(wal_compress_alg_by_name(fname, ".partial") != NOT_DEFINED_COMPRESS)
 
 #define IsTempXLogFileName(fname)	\
 	(strlen(fname) == XLOG_FNAME_LEN + strlen(".part") &&	\
@@ -701,9 +763,7 @@ typedef struct StopBackupCallbackParams
 	 strcmp((fname) + XLOG_FNAME_LEN, ".part") == 0)
 
 #define IsTempCompressXLogFileName(fname)	\
-	(strlen(fname) == XLOG_FNAME_LEN + strlen(".gz.part") && \
-	 strspn(fname, "0123456789ABCDEF") == XLOG_FNAME_LEN &&		\
-	 strcmp((fname) + XLOG_FNAME_LEN, ".gz.part") == 0)
+	(wal_compress_alg_by_name(fname, ".part") != NOT_DEFINED_COMPRESS)
 
 #define IsSshProtocol() (instance_config.remote.host && strcmp(instance_config.remote.proto, "ssh") == 0)
 
@@ -721,6 +781,7 @@ extern bool perm_slot;
 
 /* backup options */
 extern bool		smooth_checkpoint;
+extern bool		direct_io;
 
 /* remote probackup options */
 extern bool remote_agent;
@@ -765,6 +826,9 @@ extern ShowFormat show_format;
 extern bool heapallindexed;
 extern bool skip_block_validation;
 
+/* validate options */
+extern bool full_validation;
+
 /* current settings */
 extern pgBackup current;
 
@@ -778,8 +842,8 @@ extern void do_checkdb(bool need_amcheck, ConnectionOptions conn_opt,
 				  char *pgdata);
 extern BackupMode parse_backup_mode(const char *value);
 extern const char *deparse_backup_mode(BackupMode mode);
-extern void process_block_change(ForkNumber forknum, RelFileNode rnode,
-								 BlockNumber blkno);
+extern void process_block_changes(ForkNumber forknum, RelFileNode rnode,
+								  int segno, BlockNumber *blknos, int n_blknos);
 
 /* in catchup.c */
 extern int do_catchup(const char *source_pgdata, const char *dest_pgdata, int num_threads, bool sync_dest_files,
@@ -829,8 +893,15 @@ extern int do_add_instance(InstanceState *instanceState, InstanceConfig *instanc
 extern void do_archive_push(InstanceState *instanceState, InstanceConfig *instance, char *pg_xlog_dir,
 						   char *wal_file_name, int batch_size, bool overwrite,
 						   bool no_sync, bool no_ready_rename);
+extern void do_archive_push_daemon(InstanceState *instanceState, InstanceConfig *instance,
+								   char *pg_xlog_dir, const char *socket_path,
+								   bool overwrite, bool no_sync, bool no_ready_rename);
+extern bool archive_push_via_daemon(const char *socket_path, const char *wal_file_name);
 extern void do_archive_get(InstanceState *instanceState, InstanceConfig *instance, const char *prefetch_dir_arg, char *wal_file_path,
-						   char *wal_file_name, int batch_size, bool validate_wal);
+						   char *wal_file_name, int batch_size, bool validate_wal,
+						   bool background_prefetch);
+extern int read_compressed_wal_file(const char *path, fio_location location, CompressAlg alg,
+									size_t max_size, char **content, size_t *content_size);
 
 /* in configure.c */
 extern void do_show_config(void);
@@ -852,6 +923,33 @@ extern int do_delete_instance(InstanceState *instanceState);
 extern void do_delete_status(InstanceState *instanceState, 
 					InstanceConfig *instance_config, const char *status);
 
+/* in summary.c */
+extern CatalogSummary *catalog_summary_open(const char *instance_backup_dir);
+extern void catalog_summary_free(CatalogSummary *summary);
+extern parray *catalog_summary_backup_dirs(CatalogSummary *summary,
+										   const char *instance_backup_dir);
+extern pgBackup *catalog_summary_get_backup(CatalogSummary *summary,
+											const char *backup_dir_name,
+											const char *control_path);
+extern void catalog_summary_write(const char *instance_backup_dir, parray *backups,
+								  time_t check_time, CatalogSummary *prev);
+extern void catalog_summary_remove(const char *instance_backup_dir);
+
+/* in walindex.c */
+extern int do_rebuild_wal_index(InstanceState *instanceState, bool no_sync);
+extern bool wal_index_list_files(parray *files, const char *archive_dir);
+extern bool wal_index_add_file(const char *archive_dir, const char *file_name,
+							   pg_crc32 crc, bool no_sync);
+extern void wal_summary_add(const char *archive_dir, TimeLineID tli,
+							const WalSegmentSummary *summary,
+							uint32 wal_seg_size, bool no_sync);
+extern WalSegmentSummary *wal_summary_read(const char *archive_dir, TimeLineID tli,
+										   uint32 wal_seg_size, size_t *n_summaries);
+extern WalSegmentSummary *wal_summary_find(WalSegmentSummary *summaries,
+										   size_t n_summaries, XLogSegNo segno);
+extern void wal_index_remove_files(const char *archive_dir, TimeLineID tli,
+								   parray *xlog_files);
+
 /* in fetch.c */
 extern char *slurpFile(fio_location location,
 					   const char *datadir,
@@ -918,6 +1016,21 @@ extern void pgBackupWriteControl(FILE *out, pgBackup *backup, bool utc);
 extern void write_backup_filelist(pgBackup *backup, parray *files,
 								  const char *root, bool sync);
 
+/* in filelist.c */
+extern void write_filelist_binary(FILE *out, parray *files, pg_crc32 *crc,
+								  const char *path);
+extern bool filelist_is_binary(const char *data, size_t size);
+extern FileListMap *filelist_map_open(pgBackup *backup);
+extern bool filelist_map_verify_crc(FileListMap *map, pg_crc32 expected_crc);
+extern void filelist_map_close(FileListMap *map);
+extern size_t filelist_map_num(FileListMap *map);
+extern void filelist_map_get(FileListMap *map, size_t n, pgFile *file);
+extern bool filelist_map_lookup(FileListMap *map, pgFile *key, pgFile *file);
+extern parray *filelist_map_to_parray(FileListMap *map);
+extern pgFile *backup_lookup_file(pgBackup *backup, pgFile *key, pgFile *buf);
+extern void backup_open_filelist(pgBackup *backup, bool strict);
+extern void backup_close_filelist(pgBackup *backup);
+
 
 extern void pgBackupCreateDir(pgBackup *backup, const char *backup_instance_path);
 extern void pgNodeInit(PGNodeInfo *node);
@@ -954,6 +1067,13 @@ extern bool get_control_value_str(const char *str, const char *name,
 extern void dir_list_file(parray *files, const char *root, bool exclude,
 						  bool follow_symlink, bool add_root, bool backup_logs,
 						  bool skip_hidden, fio_location location);
+extern void dir_list_file_parallel(parray *files, const char *root, bool exclude,
+								   bool follow_symlink, bool add_root, bool backup_logs,
+								   bool skip_hidden, int n_threads);
+extern bool dir_remove_tree(const char *root, int n_threads,
+							char *errmsg, size_t errmsg_len);
+extern bool dir_remove_files(const char *dir, char **names, size_t n_names,
+							 int n_threads, char *errmsg, size_t errmsg_len);
 
 extern const char *get_tablespace_mapping(const char *dir);
 extern void create_data_directories(parray *dest_files,
@@ -983,7 +1103,9 @@ extern bool fileExists(const char *path, fio_location location);
 extern pgFile *pgFileNew(const char *path, const char *rel_path,
 						 bool follow_symlink, fio_location location);
 extern pgFile *pgFileInit(const char *rel_path);
+extern pgFile *pgFileInitInArena(const char *rel_path, pgut_arena *arena);
 extern void pgFileFree(void *file);
+extern void pgFileListFree(parray *files);
 
 extern pg_crc32 pgFileGetCRC32C(const char *file_path, bool missing_ok);
 extern pg_crc32 pgFileGetCRC32Cgz(const char *file_path, bool missing_ok);
@@ -993,6 +1115,8 @@ extern int pgFileCompareName(const void *f1, const void *f2);
 extern int pgFileCompareNameWithString(const void *f1, const void *f2);
 extern int pgFileCompareRelPathWithString(const void *f1, const void *f2);
 extern int pgFileCompareRelPath(const void *f1, const void *f2);
+extern uint32 pgHashRelPath(const char *rel_path);
+extern uint32 pgFileHashRelPath(const void *f);
 extern int pgFileCompareRelPathDesc(const void *f1, const void *f2);
 extern int pgFileCompareLinked(const void *f1, const void *f2);
 extern int pgFileCompareSize(const void *f1, const void *f2);
@@ -1003,6 +1127,29 @@ extern int pgCompareOid(const void *f1, const void *f2);
 extern void pfilearray_clear_locks(parray *file_list);
 extern bool set_forkname(pgFile *file);
 
+/* in scheduler.c */
+extern bool scheduler_splits_file(pgFile *file, BlockNumber split_blocks);
+extern FileScheduler *scheduler_init(parray *files, int n_threads, BlockNumber split_blocks);
+extern FileTask *scheduler_next_task(FileScheduler *sched, int thread_num);
+extern size_t scheduler_task_num(FileScheduler *sched, FileTask *task);
+extern size_t scheduler_num_tasks(FileScheduler *sched);
+extern FileTask *scheduler_get_task(FileScheduler *sched, size_t n);
+extern void scheduler_report(FileScheduler *sched);
+extern void scheduler_free(FileScheduler *sched);
+
+/* in compress.c */
+extern int32  do_compress(void* dst, size_t dst_size, void const* src, size_t src_size,
+						  CompressAlg alg, int level, const char **errormsg);
+extern int32  do_decompress(void* dst, size_t dst_size, void const* src, size_t src_size,
+							CompressAlg alg, const char **errormsg);
+extern int32  do_compress_wal(void* dst, size_t dst_size, void const* src, size_t src_size,
+							  CompressAlg alg, int level, const char **errormsg);
+extern size_t compress_bound(CompressAlg alg, size_t src_size);
+extern bool compress_alg_is_supported(CompressAlg alg);
+extern void compress_level_range(CompressAlg alg, int *min_level, int *max_level);
+extern const char *wal_compress_suffix(CompressAlg alg);
+extern CompressAlg wal_compress_alg_by_name(const char *fname, const char *tail);
+
 /* in data.c */
 extern bool check_data_file(ConnectionArgs *arguments, pgFile *file,
 							const char *from_fullpath, uint32 checksum_version);
@@ -1026,11 +1173,20 @@ extern void backup_non_data_file_internal(const char *from_fullpath,
 
 extern size_t restore_data_file(parray *parent_chain, pgFile *dest_file, FILE *out,
 								const char *to_fullpath, bool use_bitmap, PageState *checksum_map,
-								XLogRecPtr shift_lsn, datapagemap_t *lsn_map, bool use_headers);
+								XLogRecPtr shift_lsn, datapagemap_t *lsn_map, bool use_headers,
+								bool sparse, bool punch_holes);
+extern size_t restore_data_file_range(parray *parent_chain, pgFile *dest_file, FILE *out,
+									  const char *to_fullpath, datapagemap_t *map,
+									  PageState *checksum_map, XLogRecPtr shift_lsn,
+									  datapagemap_t *lsn_map, bool use_headers,
+									  BlockNumber start_block, BlockNumber end_block,
+									  bool sparse, bool punch_holes);
 extern size_t restore_data_file_internal(FILE *in, FILE *out, pgFile *file, uint32 backup_version_num,
 										 const char *from_fullpath, const char *to_fullpath, int nblocks,
 										 datapagemap_t *map, PageState *checksum_map, int checksum_version,
-										 datapagemap_t *lsn_map, BackupPageHeader2 *headers);
+										 datapagemap_t *lsn_map, BackupPageHeader2 *headers,
+										 BlockNumber start_block, BlockNumber end_block,
+										 bool sparse, bool punch_holes);
 extern size_t restore_non_data_file(parray *parent_chain, pgBackup *dest_backup,
 									pgFile *dest_file, FILE *out, const char *to_fullpath,
 									bool already_exists);
@@ -1060,7 +1216,14 @@ extern void validate_wal(pgBackup *backup, const char *archivedir,
 						 XLogRecPtr target_lsn, TimeLineID tli,
 						 uint32 seg_size);
 extern bool validate_wal_segment(TimeLineID tli, XLogSegNo segno,
-								 const char *prefetch_dir, uint32 wal_seg_size);
+								 const char *wal_dir, uint32 wal_seg_size);
+extern bool validate_wal_segments(TimeLineID tli, XLogSegNo first_segno,
+								  XLogSegNo last_segno, const char *wal_dir,
+								  uint32 wal_seg_size);
+extern pg_time_t timestamptz_to_time_t(TimestampTz t);
+extern bool summarize_wal_segment(const char *wal_dir, TimeLineID tli,
+								  XLogSegNo segno, uint32 wal_seg_size,
+								  WalSegmentSummary *summary);
 extern bool read_recovery_info(const char *archivedir, TimeLineID tli,
 							   uint32 seg_size,
 							   XLogRecPtr start_lsn, XLogRecPtr stop_lsn,
@@ -1106,10 +1269,6 @@ extern uint32 parse_program_version(const char *program_version);
 extern char* parse_program_version_new(uint32 program_version);
 extern char* parse_server_version_new(uint32 server_version);
 extern bool   parse_page(Page page, XLogRecPtr *lsn);
-extern int32  do_compress(void* dst, size_t dst_size, void const* src, size_t src_size,
-						  CompressAlg alg, int level, const char **errormsg);
-extern int32  do_decompress(void* dst, size_t dst_size, void const* src, size_t src_size,
-							CompressAlg alg, const char **errormsg);
 
 extern void pretty_size(int64 size, char *buf, size_t len);
 extern void pretty_time_interval(double time, char *buf, size_t len);
@@ -17,9 +17,64 @@
 
 #include "utils/thread.h"
 
+/*
+ * Data files larger than this are restored by several threads,
+ * every thread restores its own range of blocks.
+ */
+#define RESTORE_SPLIT_BLOCKS	(RELSEG_SIZE / 8)
+
+/*
+ * Incremental restore needs checksum or LSN map of every data file, which
+ * already exists in PGDATA. Maps are computed by separate threads ahead of
+ * restore threads, in the order the scheduler hands out files, so restore
+ * threads mostly find the map of their file ready and only write pages.
+ * Error in prescan thread aborts the restore, the same as error in restore
+ * thread does.
+ */
+typedef enum
+{
+	MAP_PENDING,				/* nobody computes the map yet */
+	MAP_IN_PROGRESS,			/* prescan thread computes the map */
+	MAP_READY,					/* map is computed, but not taken */
+	MAP_TAKEN					/* restore thread took the map */
+} RestoreMapState;
+
+typedef struct RestoreMapSlot
+{
+	struct RestoreMapPrescan *prescan;
+	pgFile	   *file;
+	RestoreMapState state;
+	PageState  *checksum_map;
+	datapagemap_t *lsn_map;
+} RestoreMapSlot;
+
+typedef struct RestoreMapPrescan
+{
+	pthread_mutex_t lock;
+	pthread_cond_t cond;
+
+	/* slots in scheduler order and sorted by file for lookup */
+	RestoreMapSlot *slots;
+	RestoreMapSlot **slots_by_file;
+	size_t		n_slots;
+	size_t		next_slot;		/* next slot for prescan threads */
+
+	/* prescan threads do not run too far ahead of restore threads */
+	int			n_ready;
+	int			max_ready;
+	bool		stop;			/* restore is finished or prescan failed */
+
+	const char *to_root;
+	IncrRestoreMode incremental_mode;
+	uint32		checksum_version;
+	XLogRecPtr	dest_stop_lsn;
+	XLogRecPtr	shift_lsn;
+} RestoreMapPrescan;
+
 typedef struct
 {
 	parray	   *pgdata_files;
+	parray_index *pgdata_files_index;
 	parray	   *dest_files;
 	pgBackup   *dest_backup;
 	parray	   *parent_chain;
@@ -29,6 +84,10 @@ typedef struct
 	bool        use_bitmap;
 	IncrRestoreMode        incremental_mode;
 	XLogRecPtr  shift_lsn;    /* used only in LSN incremental_mode */
+	bool		punch_holes;
+	FileScheduler *scheduler;
+	RestoreMapPrescan *prescan;	/* NULL if restore is not incremental */
+	int			thread_num;
 
 	/*
 	 * Return value from the thread.
@@ -56,6 +115,16 @@ static void create_recovery_conf(InstanceState *instanceState, time_t backup_id,
 								 pgBackup *backup,
 								 pgRestoreParams *params);
 static void *restore_files(void *arg);
+static RestoreMapPrescan *map_prescan_init(FileScheduler *scheduler,
+										   parray_index *pgdata_files_index,
+										   parray *dbOid_exclude_list,
+										   pgBackup *dest_backup,
+										   pgRestoreParams *params,
+										   const char *to_root);
+static void *map_prescan_worker(void *arg);
+static void map_prescan_get(RestoreMapPrescan *prescan, pgFile *file,
+							PageState **checksum_map, datapagemap_t **lsn_map);
+static void map_prescan_free(RestoreMapPrescan *prescan);
 static void set_orphan_status(parray *backups, pgBackup *parent_backup);
 
 static void restore_chain(pgBackup *dest_backup, parray *parent_chain,
@@ -683,10 +752,15 @@ restore_chain(pgBackup *dest_backup, parray *parent_chain,
 	int			i;
 	char		timestamp[100];
 	parray      *pgdata_files = NULL;
+	parray_index *pgdata_files_index = NULL;
 	parray		*dest_files = NULL;
 	/* arrays with meta info for multi threaded backup */
 	pthread_t  *threads;
 	restore_files_arg *threads_args;
+	FileScheduler *scheduler;
+	RestoreMapPrescan *prescan = NULL;
+	pthread_t  *prescan_threads = NULL;
+	BlockNumber	split_blocks = 0;
 	bool		restore_isok = true;
 	bool        use_bitmap = true;
 
@@ -734,18 +808,25 @@ restore_chain(pgBackup *dest_backup, parray *parent_chain,
 				"XLOG_BLCKSZ(%d) is not compatible(%d expected)",
 				backup->wal_block_size, XLOG_BLCKSZ);
 
-		/* populate backup filelist */
+		/*
+		 * Populate backup filelist. File lists of intermediate backups
+		 * are only used to lookup destination files, so binary ones
+		 * are mapped instead of being loaded.
+		 */
 		if (backup->start_time != dest_backup->start_time)
-			backup->files = get_backup_filelist(backup, true);
+			backup_open_filelist(backup, true);
 		else
+		{
 			backup->files = dest_files;
 
-		/*
-		 * this sorting is important, because we rely on it to find
-		 * destination file in intermediate backups file lists
-		 * using bsearch.
-		 */
-		parray_qsort(backup->files, pgFileCompareRelPath);
+			/*
+			 * this sorting is important, because we rely on it to find
+			 * destination file in backup file list using bsearch.
+			 */
+			parray_qsort(backup->files, pgFileCompareRelPath);
+			backup->files_index = parray_index_build(backup->files, pgFileHashRelPath,
+													 pgFileCompareRelPath);
+		}
 	}
 
 	/* There is no point in bitmap restore, when restoring a single FULL backup,
@@ -775,9 +856,6 @@ restore_chain(pgBackup *dest_backup, parray *parent_chain,
 			total_bytes += 4096;
 	}
 
-	/* setup threads */
-	pfilearray_clear_locks(dest_files);
-
 	/* Get list of files in destination directory and remove redundant files */
 	if (params->incremental_mode != INCR_NONE || cleanup_pgdata)
 	{
@@ -813,7 +891,7 @@ restore_chain(pgBackup *dest_backup, parray *parent_chain,
 			bool     redundant = true;
 			pgFile	*file = (pgFile *) parray_get(pgdata_files, i);
 
-			if (parray_bsearch(dest_backup->files, file, pgFileCompareRelPath))
+			if (backup_lookup_file(dest_backup, file, NULL))
 				redundant = false;
 
 			/* pg_filenode.map are always restored, because it's crc cannot be trusted */
@@ -859,6 +937,67 @@ restore_chain(pgBackup *dest_backup, parray *parent_chain,
 		elog(INFO, "Redundant files are removed, time elapsed: %s", pretty_time);
 	}
 
+	/*
+	 * Large data files can be restored by several threads at once,
+	 * unless restore is incremental, because then the content of
+	 * destination file must be examined first, or unless some backup
+	 * is too old to have page headers in separate storage.
+	 */
+	if (num_threads > 1 && params->incremental_mode == INCR_NONE)
+	{
+		split_blocks = RESTORE_SPLIT_BLOCKS;
+
+		for (i = 0; i < parray_num(parent_chain); i++)
+		{
+			pgBackup   *backup = (pgBackup *) parray_get(parent_chain, i);
+
+			if (backup->program_version_num < 20400)
+				split_blocks = 0;
+		}
+	}
+
+	/* Largest files go first for load balancing */
+	scheduler = scheduler_init(dest_files, num_threads, split_blocks);
+
+	/*
+	 * Threads restoring block ranges of the same file cannot decide
+	 * who creates it, so create such files in advance.
+	 */
+	for (i = 0; split_blocks > 0 && i < parray_num(dest_files); i++)
+	{
+		char		to_fullpath[MAXPGPATH];
+		FILE	   *out;
+		pgFile	   *dest_file = (pgFile *) parray_get(dest_files, i);
+
+		if (!scheduler_splits_file(dest_file, split_blocks))
+			continue;
+
+		/* files of excluded databases are created empty by restore threads */
+		if (dbOid_exclude_list &&
+			parray_bsearch(dbOid_exclude_list, &dest_file->dbOid, pgCompareOid))
+			continue;
+
+		join_path_components(to_fullpath, pgdata_path, dest_file->rel_path);
+
+		out = fio_fopen(FIO_DB_HOST, to_fullpath, PG_BINARY_W);
+		if (out == NULL)
+			elog(ERROR, "Cannot open restore target file \"%s\": %s",
+				 to_fullpath, strerror(errno));
+
+		if (fio_chmod(FIO_DB_HOST, to_fullpath, dest_file->mode) == -1)
+			elog(ERROR, "Cannot change mode of \"%s\": %s", to_fullpath,
+				 strerror(errno));
+
+		/* ranges are written in arbitrary order, so allocate the file at once */
+		if (fio_fpreallocate(out, (off_t) dest_file->n_blocks * BLCKSZ) != 0)
+			elog(ERROR, "Cannot preallocate file \"%s\": %s", to_fullpath,
+				 strerror(errno));
+
+		if (fio_fclose(out) != 0)
+			elog(ERROR, "Cannot close file \"%s\": %s", to_fullpath,
+				 strerror(errno));
+	}
+
 	/*
 	 * Close ssh connection belonging to the main thread
 	 * to avoid the possibility of been killed for idleness
@@ -878,6 +1017,29 @@ restore_chain(pgBackup *dest_backup, parray *parent_chain,
 	time(&start_time);
 	thread_interrupted = false;
 
+	if (pgdata_files)
+		pgdata_files_index = parray_index_build(pgdata_files, pgFileHashRelPath,
+												pgFileCompareRelPath);
+
+	/*
+	 * Reading existing data files to compute checksum or LSN maps takes
+	 * a lot of time in incremental restore, do it in separate threads
+	 * ahead of restore threads.
+	 */
+	if (params->incremental_mode != INCR_NONE && pgdata_files_index)
+	{
+		prescan = map_prescan_init(scheduler, pgdata_files_index,
+								   dbOid_exclude_list, dest_backup,
+								   params, pgdata_path);
+
+		if (prescan->n_slots > 0)
+		{
+			prescan_threads = (pthread_t *) palloc(sizeof(pthread_t) * num_threads);
+			for (i = 0; i < num_threads; i++)
+				pthread_create(&prescan_threads[i], NULL, map_prescan_worker, prescan);
+		}
+	}
+
 	/* Restore files into target directory */
 	for (i = 0; i < num_threads; i++)
 	{
@@ -885,6 +1047,7 @@ restore_chain(pgBackup *dest_backup, parray *parent_chain,
 
 		arg->dest_files = dest_files;
 		arg->pgdata_files = pgdata_files;
+		arg->pgdata_files_index = pgdata_files_index;
 		arg->dest_backup = dest_backup;
 		arg->parent_chain = parent_chain;
 		arg->dbOid_exclude_list = dbOid_exclude_list;
@@ -892,6 +1055,10 @@ restore_chain(pgBackup *dest_backup, parray *parent_chain,
 		arg->use_bitmap = use_bitmap;
 		arg->incremental_mode = params->incremental_mode;
 		arg->shift_lsn = params->shift_lsn;
+		arg->punch_holes = params->punch_holes;
+		arg->scheduler = scheduler;
+		arg->prescan = prescan;
+		arg->thread_num = i + 1;
 		threads_args[i].restored_bytes = 0;
 		/* By default there are some error */
 		threads_args[i].ret = 1;
@@ -912,11 +1079,31 @@ restore_chain(pgBackup *dest_backup, parray *parent_chain,
 		total_bytes += threads_args[i].restored_bytes;
 	}
 
+	if (prescan)
+	{
+		/* restore threads may have failed, do not let prescan threads wait */
+		pthread_mutex_lock(&prescan->lock);
+		prescan->stop = true;
+		pthread_cond_broadcast(&prescan->cond);
+		pthread_mutex_unlock(&prescan->lock);
+
+		if (prescan_threads)
+		{
+			for (i = 0; i < num_threads; i++)
+				pthread_join(prescan_threads[i], NULL);
+			pg_free(prescan_threads);
+		}
+		map_prescan_free(prescan);
+	}
+
 	time(&end_time);
 	pretty_time_interval(difftime(end_time, start_time),
 						 pretty_time, lengthof(pretty_time));
 	pretty_size(total_bytes, pretty_total_bytes, lengthof(pretty_total_bytes));
 
+	scheduler_report(scheduler);
+	scheduler_free(scheduler);
+
 	if (restore_isok)
 	{
 		elog(INFO, "Backup files are restored. Transfered bytes: %s, time elapsed: %s",
@@ -941,9 +1128,16 @@ restore_chain(pgBackup *dest_backup, parray *parent_chain,
 		elog(WARNING, "Restored files are not synced to disk");
 	else
 	{
+		fio_batch  *batch;
+		int		   *sync_errno;
+
 		elog(INFO, "Syncing restored files to disk");
 		time(&start_time);
 
+		/* send sync requests in batches, results are checked afterwards */
+		sync_errno = palloc0(sizeof(int) * parray_num(dest_files));
+		batch = fio_batch_begin(FIO_DB_HOST);
+
 		for (i = 0; i < parray_num(dest_files); i++)
 		{
 			char		to_fullpath[MAXPGPATH];
@@ -959,10 +1153,23 @@ restore_chain(pgBackup *dest_backup, parray *parent_chain,
 				continue;
 			join_path_components(to_fullpath, pgdata_path, dest_file->rel_path);
 
-			/* TODO: write test for case: file to be synced is missing */
-			if (fio_sync(FIO_DB_HOST, to_fullpath) != 0)
-				elog(ERROR, "Failed to sync file \"%s\": %s", to_fullpath, strerror(errno));
+			fio_batch_sync(batch, to_fullpath, &sync_errno[i]);
+		}
+		fio_batch_end(batch);
+
+		/* TODO: write test for case: file to be synced is missing */
+		for (i = 0; i < parray_num(dest_files); i++)
+		{
+			char		to_fullpath[MAXPGPATH];
+			pgFile	   *dest_file = (pgFile *) parray_get(dest_files, i);
+
+			if (sync_errno[i] == 0)
+				continue;
+
+			join_path_components(to_fullpath, pgdata_path, dest_file->rel_path);
+			elog(ERROR, "Failed to sync file \"%s\": %s", to_fullpath, strerror(sync_errno[i]));
 		}
+		pfree(sync_errno);
 
 		time(&end_time);
 		pretty_time_interval(difftime(end_time, start_time),
@@ -974,6 +1181,7 @@ restore_chain(pgBackup *dest_backup, parray *parent_chain,
 	pfree(threads);
 	pfree(threads_args);
 
+	parray_index_free(pgdata_files_index);
 	if (pgdata_files)
 	{
 		parray_walk(pgdata_files, pgFileFree);
@@ -984,8 +1192,7 @@ restore_chain(pgBackup *dest_backup, parray *parent_chain,
 	{
 		pgBackup   *backup = (pgBackup *) parray_get(parent_chain, i);
 
-		parray_walk(backup->files, pgFileFree);
-		parray_free(backup->files);
+		backup_close_filelist(backup);
 	}
 }
 
@@ -995,37 +1202,38 @@ restore_chain(pgBackup *dest_backup, parray *parent_chain,
 static void *
 restore_files(void *arg)
 {
-	int         i;
-	uint64      n_files;
+	FileTask   *task;
+	size_t      n_tasks;
 	char        to_fullpath[MAXPGPATH];
 	FILE       *out = NULL;
 	char       *out_buf = pgut_malloc(STDIO_BUFSIZE);
 
 	restore_files_arg *arguments = (restore_files_arg *) arg;
 
-	n_files = (unsigned long) parray_num(arguments->dest_files);
+	n_tasks = scheduler_num_tasks(arguments->scheduler);
 
-	for (i = 0; i < parray_num(arguments->dest_files); i++)
+	/* Directories were created before */
+	while ((task = scheduler_next_task(arguments->scheduler, arguments->thread_num)) != NULL)
 	{
 		bool     already_exists = false;
 		PageState      *checksum_map = NULL; /* it should take ~1.5MB at most */
 		datapagemap_t  *lsn_map = NULL;      /* it should take 16kB at most */
+		datapagemap_t   part_map = {NULL, 0}; /* restored blocks of the range */
 		char           *errmsg = NULL;       /* remote agent error message */
-		pgFile	*dest_file = (pgFile *) parray_get(arguments->dest_files, i);
-
-		/* Directories were created before */
-		if (S_ISDIR(dest_file->mode))
-			continue;
-
-		if (!pg_atomic_test_set_flag(&dest_file->lock))
-			continue;
+		pgFile	*dest_file = task->file;
 
 		/* check for interrupt */
 		if (interrupted || thread_interrupted)
 			elog(ERROR, "Interrupted during restore");
 
-		elog(progress ? INFO : LOG, "Progress: (%d/%lu). Restore file \"%s\"",
-			 i + 1, n_files, dest_file->rel_path);
+		if (task->is_part)
+			elog(progress ? INFO : LOG, "Progress: (%lu/%lu). Restore blocks from %u of file \"%s\"",
+				 (unsigned long) scheduler_task_num(arguments->scheduler, task),
+				 (unsigned long) n_tasks, task->start_block, dest_file->rel_path);
+		else
+			elog(progress ? INFO : LOG, "Progress: (%lu/%lu). Restore file \"%s\"",
+				 (unsigned long) scheduler_task_num(arguments->scheduler, task),
+				 (unsigned long) n_tasks, dest_file->rel_path);
 
 		/* Only files from pgdata can be skipped by partial restore */
 		if (arguments->dbOid_exclude_list)
@@ -1038,8 +1246,9 @@ restore_files(void *arg)
 				 * We cannot simply skip the file, because it may lead to
 				 * failure during WAL redo; hence, create empty file.
 				 */
-				create_empty_file(FIO_BACKUP_HOST,
-					  arguments->to_root, FIO_DB_HOST, dest_file);
+				if (task->start_block == 0)
+					create_empty_file(FIO_BACKUP_HOST,
+						  arguments->to_root, FIO_DB_HOST, dest_file);
 
 				elog(LOG, "Skip file due to partial restore: \"%s\"",
 						dest_file->rel_path);
@@ -1065,7 +1274,7 @@ restore_files(void *arg)
 		join_path_components(to_fullpath, arguments->to_root, dest_file->rel_path);
 
 		if (arguments->incremental_mode != INCR_NONE &&
-			parray_bsearch(arguments->pgdata_files, dest_file, pgFileCompareRelPathDesc))
+			parray_index_find(arguments->pgdata_files_index, dest_file))
 		{
 			already_exists = true;
 		}
@@ -1080,28 +1289,21 @@ restore_files(void *arg)
 			dest_file->is_datafile &&
 			dest_file->n_blocks > 0)
 		{
-			if (arguments->incremental_mode == INCR_LSN)
-			{
-				lsn_map = fio_get_lsn_map(FIO_DB_HOST, to_fullpath,
-								arguments->dest_backup->checksum_version,
-								dest_file->n_blocks, arguments->shift_lsn,
-								dest_file->segno * RELSEG_SIZE);
-			}
-			else if (arguments->incremental_mode == INCR_CHECKSUM)
-			{
-				checksum_map = fio_get_checksum_map(FIO_DB_HOST, to_fullpath,
-													arguments->dest_backup->checksum_version,
-													dest_file->n_blocks, arguments->dest_backup->stop_lsn,
-													dest_file->segno * RELSEG_SIZE);
-			}
+			/* map is usually computed in advance by prescan threads */
+			map_prescan_get(arguments->prescan, dest_file,
+							&checksum_map, &lsn_map);
 		}
 
 		/*
+		 * File restored by ranges is already created, open it
+		 * for writing without truncation.
 		 * Open dest file and truncate it to zero, if destination
 		 * file already exists and dest file size is zero, or
 		 * if file do not exist
 		 */
-		if ((already_exists && dest_file->write_size == 0) || !already_exists)
+		if (task->is_part)
+			out = fio_fopen(FIO_DB_HOST, to_fullpath, PG_BINARY_R "+");
+		else if ((already_exists && dest_file->write_size == 0) || !already_exists)
 			out = fio_fopen(FIO_DB_HOST, to_fullpath, PG_BINARY_W);
 		/*
 		 * If file already exists and dest size is not zero,
@@ -1115,7 +1317,8 @@ restore_files(void *arg)
 				 to_fullpath, strerror(errno));
 
 		/* update file permission */
-		if (fio_chmod(FIO_DB_HOST, to_fullpath, dest_file->mode) == -1)
+		if (!task->is_part &&
+			fio_chmod(FIO_DB_HOST, to_fullpath, dest_file->mode) == -1)
 			elog(ERROR, "Cannot change mode of \"%s\": %s", to_fullpath,
 				 strerror(errno));
 
@@ -1131,14 +1334,36 @@ restore_files(void *arg)
 		/* Restore destination file */
 		if (dest_file->is_datafile)
 		{
+			/*
+			 * New file is allocated in advance to avoid fragmentation,
+			 * then zero pages may be left unwritten.
+			 * Files restored by ranges are allocated by the main thread.
+			 */
+			bool	sparse = (task->is_part || !already_exists) &&
+				dest_file->n_blocks > 0;
+
 			/* enable stdio buffering for local destination data file */
 			if (!fio_is_remote_file(out))
 				setvbuf(out, out_buf, _IOFBF, STDIO_BUFSIZE);
+
+			if (sparse && !task->is_part &&
+				fio_fpreallocate(out, (off_t) dest_file->n_blocks * BLCKSZ) != 0)
+				elog(ERROR, "Cannot preallocate file \"%s\": %s", to_fullpath,
+					 strerror(errno));
 			/* Destination file is data file */
-			arguments->restored_bytes += restore_data_file(arguments->parent_chain,
-														   dest_file, out, to_fullpath,
-														   arguments->use_bitmap, checksum_map,
-														   arguments->shift_lsn, lsn_map, true);
+			if (task->is_part)
+				arguments->restored_bytes += restore_data_file_range(arguments->parent_chain,
+																	 dest_file, out, to_fullpath,
+																	 arguments->use_bitmap ? &part_map : NULL,
+																	 NULL, InvalidXLogRecPtr, NULL, true,
+																	 task->start_block, task->end_block,
+																	 sparse, arguments->punch_holes);
+			else
+				arguments->restored_bytes += restore_data_file(arguments->parent_chain,
+															   dest_file, out, to_fullpath,
+															   arguments->use_bitmap, checksum_map,
+															   arguments->shift_lsn, lsn_map, true,
+															   sparse, arguments->punch_holes);
 		}
 		else
 		{
@@ -1162,7 +1387,10 @@ done:
 				 strerror(errno));
 
 		/* free pagemap used for restore optimization */
-		pg_free(dest_file->pagemap.bitmap);
+		if (task->is_part)
+			pg_free(part_map.bitmap);
+		else
+			pg_free(dest_file->pagemap.bitmap);
 
 		if (lsn_map)
 			pg_free(lsn_map->bitmap);
@@ -1182,6 +1410,249 @@ done:
 	return NULL;
 }
 
+/*
+ * Compute checksum or LSN map of the destination file for incremental restore.
+ */
+static void
+map_prescan_compute(RestoreMapPrescan *prescan, pgFile *file,
+					PageState **checksum_map, datapagemap_t **lsn_map)
+{
+	char		to_fullpath[MAXPGPATH];
+
+	join_path_components(to_fullpath, prescan->to_root, file->rel_path);
+
+	if (prescan->incremental_mode == INCR_LSN)
+		*lsn_map = fio_get_lsn_map(FIO_DB_HOST, to_fullpath,
+								   prescan->checksum_version,
+								   file->n_blocks, prescan->shift_lsn,
+								   file->segno * RELSEG_SIZE);
+	else if (prescan->incremental_mode == INCR_CHECKSUM)
+		*checksum_map = fio_get_checksum_map(FIO_DB_HOST, to_fullpath,
+											 prescan->checksum_version,
+											 file->n_blocks, prescan->dest_stop_lsn,
+											 file->segno * RELSEG_SIZE);
+}
+
+static int
+map_slot_compare_file(const void *a, const void *b)
+{
+	const RestoreMapSlot *slot1 = *(RestoreMapSlot * const *) a;
+	const RestoreMapSlot *slot2 = *(RestoreMapSlot * const *) b;
+
+	if (slot1->file == slot2->file)
+		return 0;
+	return slot1->file < slot2->file ? -1 : 1;
+}
+
+/*
+ * Prepare a slot for every file, which is going to need a map, in the order
+ * files are handed out to restore threads. Conditions must match the ones
+ * in restore_files().
+ */
+static RestoreMapPrescan *
+map_prescan_init(FileScheduler *scheduler, parray_index *pgdata_files_index,
+				 parray *dbOid_exclude_list, pgBackup *dest_backup,
+				 pgRestoreParams *params, const char *to_root)
+{
+	RestoreMapPrescan *prescan = pgut_new0(RestoreMapPrescan);
+	size_t		n_tasks = scheduler_num_tasks(scheduler);
+	size_t		i;
+
+	pthread_mutex_init(&prescan->lock, NULL);
+	pthread_cond_init(&prescan->cond, NULL);
+
+	prescan->slots = pgut_malloc0(sizeof(RestoreMapSlot) * Max(n_tasks, 1));
+	prescan->slots_by_file = pgut_malloc(sizeof(RestoreMapSlot *) * Max(n_tasks, 1));
+	prescan->max_ready = 2 * num_threads;
+	prescan->to_root = to_root;
+	prescan->incremental_mode = params->incremental_mode;
+	prescan->checksum_version = dest_backup->checksum_version;
+	prescan->dest_stop_lsn = dest_backup->stop_lsn;
+	prescan->shift_lsn = params->shift_lsn;
+
+	for (i = 0; i < n_tasks; i++)
+	{
+		FileTask   *task = scheduler_get_task(scheduler, i);
+		pgFile	   *file = task->file;
+		RestoreMapSlot *slot;
+
+		if (task->is_part || !file->is_datafile || file->n_blocks <= 0)
+			continue;
+
+		if (dbOid_exclude_list &&
+			parray_bsearch(dbOid_exclude_list, &file->dbOid, pgCompareOid))
+			continue;
+
+		if (!parray_index_find(pgdata_files_index, file))
+			continue;
+
+		slot = &prescan->slots[prescan->n_slots];
+		slot->prescan = prescan;
+		slot->file = file;
+		slot->state = MAP_PENDING;
+		prescan->slots_by_file[prescan->n_slots++] = slot;
+	}
+
+	qsort(prescan->slots_by_file, prescan->n_slots, sizeof(RestoreMapSlot *),
+		  map_slot_compare_file);
+
+	return prescan;
+}
+
+/*
+ * Prescan thread exits on error: wake up restore threads waiting for
+ * its map, so they notice the interrupt, and drop the agent connection.
+ */
+static void
+map_prescan_abort(void *arg)
+{
+	RestoreMapPrescan *prescan = (RestoreMapPrescan *) arg;
+
+	pthread_mutex_lock(&prescan->lock);
+	prescan->stop = true;
+	pthread_cond_broadcast(&prescan->cond);
+	pthread_mutex_unlock(&prescan->lock);
+
+	fio_disconnect_on_error();
+}
+
+/* Prescan thread */
+static void *
+map_prescan_worker(void *arg)
+{
+	RestoreMapPrescan *prescan = (RestoreMapPrescan *) arg;
+
+	pthread_cleanup_push(map_prescan_abort, prescan);
+
+	for (;;)
+	{
+		RestoreMapSlot *slot = NULL;
+		PageState  *checksum_map = NULL;
+		datapagemap_t *lsn_map = NULL;
+
+		pthread_mutex_lock(&prescan->lock);
+		while (!prescan->stop && prescan->next_slot < prescan->n_slots)
+		{
+			/* skip slots, which restore threads took themselves */
+			if (prescan->slots[prescan->next_slot].state != MAP_PENDING)
+			{
+				prescan->next_slot++;
+				continue;
+			}
+
+			if (prescan->n_ready < prescan->max_ready)
+			{
+				slot = &prescan->slots[prescan->next_slot++];
+				slot->state = MAP_IN_PROGRESS;
+				prescan->n_ready++;
+				break;
+			}
+
+			pthread_cond_wait(&prescan->cond, &prescan->lock);
+		}
+		pthread_mutex_unlock(&prescan->lock);
+
+		if (slot == NULL)
+			break;
+
+		map_prescan_compute(prescan, slot->file, &checksum_map, &lsn_map);
+
+		pthread_mutex_lock(&prescan->lock);
+		slot->checksum_map = checksum_map;
+		slot->lsn_map = lsn_map;
+		slot->state = MAP_READY;
+		pthread_cond_broadcast(&prescan->cond);
+		pthread_mutex_unlock(&prescan->lock);
+	}
+
+	pthread_cleanup_pop(0);
+
+	/* ssh connection to longer needed */
+	fio_disconnect();
+
+	return NULL;
+}
+
+/*
+ * Get map of the file for restore thread. Wait if prescan thread is
+ * computing it right now, compute the map in place if prescan threads
+ * have not got to the file yet.
+ */
+static void
+map_prescan_get(RestoreMapPrescan *prescan, pgFile *file,
+				PageState **checksum_map, datapagemap_t **lsn_map)
+{
+	RestoreMapSlot key;
+	RestoreMapSlot *key_ptr = &key;
+	RestoreMapSlot **found;
+	RestoreMapSlot *slot;
+
+	key.file = file;
+	found = bsearch(&key_ptr, prescan->slots_by_file, prescan->n_slots,
+					sizeof(RestoreMapSlot *), map_slot_compare_file);
+
+	if (found == NULL)
+	{
+		map_prescan_compute(prescan, file, checksum_map, lsn_map);
+		return;
+	}
+	slot = *found;
+
+	pthread_mutex_lock(&prescan->lock);
+	while (slot->state == MAP_IN_PROGRESS && !prescan->stop)
+		pthread_cond_wait(&prescan->cond, &prescan->lock);
+
+	/* prescan thread computing the map has failed */
+	if (slot->state == MAP_IN_PROGRESS)
+	{
+		pthread_mutex_unlock(&prescan->lock);
+		elog(ERROR, "Interrupted during restore");
+	}
+
+	if (slot->state == MAP_READY)
+	{
+		*checksum_map = slot->checksum_map;
+		*lsn_map = slot->lsn_map;
+		slot->checksum_map = NULL;
+		slot->lsn_map = NULL;
+		slot->state = MAP_TAKEN;
+		prescan->n_ready--;
+		pthread_cond_broadcast(&prescan->cond);
+		pthread_mutex_unlock(&prescan->lock);
+		return;
+	}
+
+	/* prescan threads are behind */
+	slot->state = MAP_TAKEN;
+	pthread_cond_broadcast(&prescan->cond);
+	pthread_mutex_unlock(&prescan->lock);
+
+	map_prescan_compute(prescan, file, checksum_map, lsn_map);
+}
+
+/* Stop prescan threads and release maps, which were not taken */
+static void
+map_prescan_free(RestoreMapPrescan *prescan)
+{
+	size_t		i;
+
+	for (i = 0; i < prescan->n_slots; i++)
+	{
+		RestoreMapSlot *slot = &prescan->slots[i];
+
+		pg_free(slot->checksum_map);
+		if (slot->lsn_map)
+			pg_free(slot->lsn_map->bitmap);
+		pg_free(slot->lsn_map);
+	}
+
+	pthread_mutex_destroy(&prescan->lock);
+	pthread_cond_destroy(&prescan->cond);
+	pg_free(prescan->slots);
+	pg_free(prescan->slots_by_file);
+	pg_free(prescan);
+}
+
 /*
  * Create recovery.conf (postgresql.auto.conf in case of PG12)
  * with given recovery target parameters
@@ -1990,11 +2461,7 @@ get_dbOid_exclude_list(pgBackup *backup, parray *datname_list,
 					backup_id_of(backup));
 
 	/* clean backup filelist */
-	if (files)
-	{
-		parray_walk(files, pgFileFree);
-		parray_free(files);
-	}
+	pgFileListFree(files);
 
 	/* sort dbOid array in ASC order */
 	parray_qsort(dbOid_exclude_list, pgCompareOid);
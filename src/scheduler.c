@@ -0,0 +1,300 @@
+/*-------------------------------------------------------------------------
+ *
+ * scheduler.c: distribution of files between worker threads.
+ *
+ * Files are processed largest first, so the biggest ones do not end up
+ * being picked at the very end and leave a single thread working alone.
+ * Small files are grouped into chunks to reduce contention on the shared
+ * cursor.  Large data files may be split into block ranges, if the caller
+ * can process such ranges independently.
+ *
+ * Portions Copyright (c) 2015-2022, Postgres Professional
+ *
+ *-------------------------------------------------------------------------
+ */
+
+#include "pg_probackup.h"
+
+#include "portability/instr_time.h"
+
+/* tasks are grouped into chunks of about this size */
+#define SCHEDULER_CHUNK_SIZE	(8 * 1024 * 1024)
+/* but there is no point in chunks of too many files */
+#define SCHEDULER_CHUNK_FILES	64
+
+typedef struct FileSchedulerThread
+{
+	size_t		next_task;		/* next task of the current chunk */
+	size_t		end_task;		/* end of the current chunk */
+	FileTask   *cur_task;		/* task being processed */
+	instr_time	task_start;
+
+	uint32		n_tasks;
+	int64		n_bytes;
+	double		busy_time;
+	double		finish_time;
+} FileSchedulerThread;
+
+struct FileScheduler
+{
+	FileTask   *tasks;
+	size_t		n_tasks;
+
+	/* the first task of every chunk, the last element is n_tasks */
+	size_t	   *chunks;
+	size_t		n_chunks;
+	pg_atomic_uint32 next_chunk;
+
+	int			n_threads;
+	FileSchedulerThread *threads;
+	instr_time	start_time;
+};
+
+static int
+FileTaskCompareSizeDesc(const void *t1, const void *t2)
+{
+	const FileTask *task1 = (const FileTask *) t1;
+	const FileTask *task2 = (const FileTask *) t2;
+
+	if (task1->size != task2->size)
+		return task1->size > task2->size ? -1 : 1;
+
+	/* keep parts of the same file together and ordered */
+	if (task1->file != task2->file)
+		return strcmp(task1->file->rel_path, task2->file->rel_path);
+
+	if (task1->start_block != task2->start_block)
+		return task1->start_block < task2->start_block ? -1 : 1;
+
+	return 0;
+}
+
+/*
+ * Check if data file is divided into block ranges of split_blocks size.
+ */
+bool
+scheduler_splits_file(pgFile *file, BlockNumber split_blocks)
+{
+	return split_blocks > 0 && file->is_datafile && !S_ISDIR(file->mode) &&
+		file->n_blocks > 0 && (BlockNumber) file->n_blocks > split_blocks;
+}
+
+/*
+ * Create a scheduler for regular files of the list, directories are skipped.
+ * If split_blocks is greater than zero, then data files larger than
+ * split_blocks are divided into block ranges of this size, every range
+ * is a separate task.
+ */
+FileScheduler *
+scheduler_init(parray *files, int n_threads, BlockNumber split_blocks)
+{
+	FileScheduler *sched = palloc0(sizeof(FileScheduler));
+	size_t		max_tasks = 0;
+	size_t		i;
+	int64		chunk_size = 0;
+
+	for (i = 0; i < parray_num(files); i++)
+	{
+		pgFile	   *file = (pgFile *) parray_get(files, i);
+
+		if (S_ISDIR(file->mode))
+			continue;
+
+		if (scheduler_splits_file(file, split_blocks))
+			max_tasks += (file->n_blocks + split_blocks - 1) / split_blocks;
+		else
+			max_tasks++;
+	}
+
+	sched->tasks = palloc0(sizeof(FileTask) * Max(max_tasks, 1));
+
+	for (i = 0; i < parray_num(files); i++)
+	{
+		pgFile	   *file = (pgFile *) parray_get(files, i);
+		FileTask   *task;
+
+		if (S_ISDIR(file->mode))
+			continue;
+
+		if (scheduler_splits_file(file, split_blocks))
+		{
+			BlockNumber	start_block;
+
+			for (start_block = 0; start_block < file->n_blocks; start_block += split_blocks)
+			{
+				task = &sched->tasks[sched->n_tasks++];
+
+				task->file = file;
+				task->is_part = true;
+				task->start_block = start_block;
+				/* the last range is open-ended */
+				if (file->n_blocks - start_block > split_blocks)
+					task->end_block = start_block + split_blocks;
+				else
+					task->end_block = InvalidBlockNumber;
+				task->size = (int64) Min(split_blocks, file->n_blocks - start_block) * BLCKSZ;
+			}
+			continue;
+		}
+
+		task = &sched->tasks[sched->n_tasks++];
+
+		task->file = file;
+		task->is_part = false;
+		task->start_block = 0;
+		task->end_block = InvalidBlockNumber;
+		task->size = file->size;
+	}
+
+	qsort(sched->tasks, sched->n_tasks, sizeof(FileTask), FileTaskCompareSizeDesc);
+
+	/* Group tasks into chunks, large files are handed out one by one */
+	sched->chunks = palloc(sizeof(size_t) * (sched->n_tasks + 1));
+	for (i = 0; i < sched->n_tasks; i++)
+	{
+		int64		size = Max(sched->tasks[i].size, 0);
+
+		if (i == 0 ||
+			chunk_size + size > SCHEDULER_CHUNK_SIZE ||
+			i - sched->chunks[sched->n_chunks - 1] >= SCHEDULER_CHUNK_FILES)
+		{
+			sched->chunks[sched->n_chunks++] = i;
+			chunk_size = 0;
+		}
+		chunk_size += size;
+	}
+	sched->chunks[sched->n_chunks] = sched->n_tasks;
+
+	pg_atomic_init_u32(&sched->next_chunk, 0);
+
+	sched->n_threads = n_threads;
+	sched->threads = palloc0(sizeof(FileSchedulerThread) * n_threads);
+	INSTR_TIME_SET_CURRENT(sched->start_time);
+
+	elog(LOG, "Scheduled %lu tasks in %lu chunks for %i threads",
+		 (unsigned long) sched->n_tasks, (unsigned long) sched->n_chunks, n_threads);
+
+	return sched;
+}
+
+/*
+ * Get the next task for the thread (thread_num is 1-based).
+ * The previous task of the thread is considered to be done.
+ * Returns NULL when there is nothing left to do.
+ */
+FileTask *
+scheduler_next_task(FileScheduler *sched, int thread_num)
+{
+	FileSchedulerThread *thread = &sched->threads[thread_num - 1];
+	instr_time	now;
+
+	INSTR_TIME_SET_CURRENT(now);
+
+	/* account the previous task */
+	if (thread->cur_task)
+	{
+		instr_time	elapsed = now;
+
+		INSTR_TIME_SUBTRACT(elapsed, thread->task_start);
+		thread->busy_time += INSTR_TIME_GET_DOUBLE(elapsed);
+		thread->n_tasks++;
+		thread->n_bytes += Max(thread->cur_task->size, 0);
+		thread->cur_task = NULL;
+	}
+
+	/* current chunk is exhausted, grab the next one */
+	if (thread->next_task >= thread->end_task)
+	{
+		uint32		chunk = pg_atomic_fetch_add_u32(&sched->next_chunk, 1);
+
+		if (chunk >= sched->n_chunks)
+		{
+			instr_time	elapsed = now;
+
+			INSTR_TIME_SUBTRACT(elapsed, sched->start_time);
+			thread->finish_time = INSTR_TIME_GET_DOUBLE(elapsed);
+			return NULL;
+		}
+
+		thread->next_task = sched->chunks[chunk];
+		thread->end_task = sched->chunks[chunk + 1];
+	}
+
+	thread->cur_task = &sched->tasks[thread->next_task++];
+	thread->task_start = now;
+
+	return thread->cur_task;
+}
+
+/* Number of the task among all tasks, starting with 1. Used for progress reporting */
+size_t
+scheduler_task_num(FileScheduler *sched, FileTask *task)
+{
+	return task - sched->tasks + 1;
+}
+
+size_t
+scheduler_num_tasks(FileScheduler *sched)
+{
+	return sched->n_tasks;
+}
+
+/*
+ * Get n-th task (0-based) in the order tasks are handed out to threads.
+ * Allows to prepare something for the tasks ahead of worker threads.
+ */
+FileTask *
+scheduler_get_task(FileScheduler *sched, size_t n)
+{
+	Assert(n < sched->n_tasks);
+	return &sched->tasks[n];
+}
+
+/*
+ * Report utilization of every thread, so it is possible to see
+ * how long the tail of the slowest thread was.
+ */
+void
+scheduler_report(FileScheduler *sched)
+{
+	int			i;
+	double		first_finish = 0;
+	double		last_finish = 0;
+	char		pretty_bytes[20];
+	char		pretty_busy[20];
+	char		pretty_tail[20];
+
+	for (i = 0; i < sched->n_threads; i++)
+	{
+		FileSchedulerThread *thread = &sched->threads[i];
+
+		if (i == 0 || thread->finish_time < first_finish)
+			first_finish = thread->finish_time;
+		if (thread->finish_time > last_finish)
+			last_finish = thread->finish_time;
+	}
+
+	for (i = 0; i < sched->n_threads; i++)
+	{
+		FileSchedulerThread *thread = &sched->threads[i];
+
+		pretty_size(thread->n_bytes, pretty_bytes, lengthof(pretty_bytes));
+		pretty_time_interval(thread->busy_time, pretty_busy, lengthof(pretty_busy));
+
+		elog(LOG, "Thread [%d]: tasks: %u, size: %s, busy: %s, utilization: %.f%%",
+			 i + 1, thread->n_tasks, pretty_bytes, pretty_busy,
+			 last_finish > 0 ? thread->busy_time / last_finish * 100 : 100);
+	}
+
+	pretty_time_interval(last_finish - first_finish, pretty_tail, lengthof(pretty_tail));
+	elog(LOG, "Threads finished within %s of each other", pretty_tail);
+}
+
+void
+scheduler_free(FileScheduler *sched)
+{
+	pg_free(sched->tasks);
+	pg_free(sched->chunks);
+	pg_free(sched->threads);
+	pg_free(sched);
+}
@@ -1104,6 +1104,17 @@ show_archive_json(const char *instance_name, uint32 xlog_seg_size,
 
 		json_add_value(buf, "closest-backup-id", tmp_buf, json_level, true);
 
+		if (tlinfo->max_time > 0)
+		{
+			char		timestamp[100];
+
+			time2iso(timestamp, lengthof(timestamp), tlinfo->min_time, false);
+			json_add_value(buf, "min-recovery-time", timestamp, json_level, true);
+
+			time2iso(timestamp, lengthof(timestamp), tlinfo->max_time, false);
+			json_add_value(buf, "max-recovery-time", timestamp, json_level, true);
+		}
+
 		if (tlinfo->lost_segments == NULL)
 			json_add_value(buf, "status", "OK", json_level, true);
 		else
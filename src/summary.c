@@ -0,0 +1,635 @@
+/*-------------------------------------------------------------------------
+ *
+ * summary.c: summary of the backup catalog of an instance.
+ *
+ * Listing of backups requires reading and parsing of backup.control
+ * of every backup, which is the main cost of read-only commands, such as
+ * show, in catalogs with thousands of backups.  Summary contains the
+ * content of all control files of the instance in binary format, so it
+ * can be loaded with a single read:
+ *
+ *   CatalogSummaryHeader
+ *   CatalogSummaryEntry[n_backups]   sorted by backup directory name
+ *   char[strings_size]               zero-terminated strings
+ *
+ * Summary is only a cache, control files remain the source of truth.
+ * It is rebuilt by readers, when something has changed, and it is trusted
+ * as follows:
+ * - the list of backup directories is taken from the summary, if mtime
+ *   of the instance directory is the same as it was when the summary
+ *   was built;
+ * - cached content of control file is used, if the file has the same
+ *   inode, size, mtime and ctime.  So changes made by other tools or
+ *   by older versions are noticed too.
+ * Timestamps of a file system have coarse granularity, so a file modified
+ * shortly before or after it was checked may keep the same mtime.  Like
+ * in git index, such "racy" files and directories are never trusted.
+ *
+ * Every rewrite of the summary increments its generation.  Builder doesn't
+ * replace the summary, if its generation was changed by a concurrent
+ * process meanwhile.
+ *
+ * Summary of instance is stored in the backups directory of the catalog,
+ * next to the instance directory, so it doesn't change mtime of the
+ * latter and doesn't mix with backup directories.
+ *
+ * Portions Copyright (c) 2015-2022, Postgres Professional
+ *
+ *-------------------------------------------------------------------------
+ */
+
+#include "pg_probackup.h"
+
+#include <sys/stat.h>
+#include <unistd.h>
+
+#include "pqexpbuffer.h"
+#include "utils/file.h"
+
+#define SUMMARY_MAGIC			"PBKSUMM"
+#define SUMMARY_MAGIC_LEN		8
+#define SUMMARY_FORMAT_VERSION	1
+
+/* Special value of string offset, used when string is absent */
+#define SUMMARY_NO_STRING		PG_UINT32_MAX
+
+/* file or directory modified less than this number of seconds ago is racy */
+#define SUMMARY_RACY_INTERVAL	2
+
+/* entry flags */
+#define SUMMARY_NO_CONTROL		0x01	/* control file is missing or invalid */
+
+typedef struct CatalogSummaryHeader
+{
+	char		magic[SUMMARY_MAGIC_LEN];
+	uint32		version;
+	uint32		entry_size;		/* sizeof(CatalogSummaryEntry) of the writer */
+	uint32		n_backups;
+	uint32		crc;			/* CRC32C of the file, computed with zero crc */
+	uint64		generation;
+	int64		check_time;		/* when the instance directory was checked */
+	int64		dir_mtime;
+	uint64		dir_ino;
+	uint64		strings_size;
+} CatalogSummaryHeader;
+
+typedef struct CatalogSummaryEntry
+{
+	/* state of control file, which content is cached */
+	int64		ctl_mtime;
+	int64		ctl_ctime;
+	int64		ctl_size;
+	uint64		ctl_ino;
+
+	int64		start_time;
+	int64		merge_time;
+	int64		end_time;
+	int64		recovery_time;
+	int64		expire_time;
+	int64		parent_backup;
+	int64		merge_dest_backup;
+	uint64		start_lsn;
+	uint64		stop_lsn;
+	uint64		recovery_xid;
+	int64		data_bytes;
+	int64		wal_bytes;
+	int64		uncompressed_bytes;
+	int64		pgdata_bytes;
+	uint32		tli;
+	uint32		backup_mode;
+	uint32		status;
+	uint32		compress_alg;
+	int32		compress_level;
+	uint32		block_size;
+	uint32		wal_block_size;
+	uint32		checksum_version;
+	uint32		content_crc;
+
+	/* offsets in string table */
+	uint32		dir_off;		/* name of backup directory */
+	uint32		program_version_off;
+	uint32		server_version_off;
+	uint32		conninfo_off;
+	uint32		note_off;
+
+	uint8		stream;
+	uint8		from_replica;
+	uint8		flags;
+	uint8		reserved;
+} CatalogSummaryEntry;
+
+struct CatalogSummary
+{
+	char		path[MAXPGPATH];
+	char	   *data;
+	size_t		size;
+
+	const CatalogSummaryHeader *hdr;
+	const CatalogSummaryEntry *entries;
+	const char *strings;
+};
+
+/*
+ * Summary of instance "name" is ".name.summary" in the parent directory
+ * of the instance directory.
+ */
+static void
+catalog_summary_path(char *path, const char *instance_backup_dir)
+{
+	char		parent[MAXPGPATH];
+	char		name[MAXPGPATH];
+
+	strlcpy(parent, instance_backup_dir, MAXPGPATH);
+	canonicalize_path(parent);
+	strlcpy(name, last_dir_separator(parent) ? last_dir_separator(parent) + 1 : parent,
+			MAXPGPATH);
+	get_parent_directory(parent);
+
+	snprintf(path, MAXPGPATH, "%s/.%s.summary", parent, name);
+}
+
+static bool
+is_racy(time_t mtime, time_t check_time)
+{
+	return mtime + SUMMARY_RACY_INTERVAL > check_time;
+}
+
+static const char *
+summary_string(CatalogSummary *summary, uint32 off)
+{
+	if (off == SUMMARY_NO_STRING || off >= summary->hdr->strings_size)
+		return NULL;
+	return summary->strings + off;
+}
+
+static pg_crc32
+summary_crc(const char *data, size_t size)
+{
+	CatalogSummaryHeader hdr;
+	pg_crc32	crc;
+
+	memcpy(&hdr, data, sizeof(hdr));
+	hdr.crc = 0;
+
+	INIT_CRC32C(crc);
+	COMP_CRC32C(crc, &hdr, sizeof(hdr));
+	COMP_CRC32C(crc, data + sizeof(hdr), size - sizeof(hdr));
+	FIN_CRC32C(crc);
+
+	return crc;
+}
+
+/*
+ * Load summary of the instance.
+ * Returns NULL if summary doesn't exist or cannot be used.
+ */
+CatalogSummary *
+catalog_summary_open(const char *instance_backup_dir)
+{
+	CatalogSummary *summary;
+	const CatalogSummaryHeader *hdr;
+	struct stat	st;
+	int			fd;
+	size_t		done = 0;
+
+	/* catalog on remote host is accessed as is */
+	if (fio_is_remote(FIO_BACKUP_HOST))
+		return NULL;
+
+	summary = pgut_new0(CatalogSummary);
+	catalog_summary_path(summary->path, instance_backup_dir);
+
+	fd = open(summary->path, O_RDONLY | PG_BINARY, 0);
+	if (fd < 0)
+	{
+		if (errno != ENOENT)
+			elog(LOG, "Cannot open catalog summary \"%s\": %s",
+				 summary->path, strerror(errno));
+		pg_free(summary);
+		return NULL;
+	}
+
+	if (fstat(fd, &st) != 0 || st.st_size < sizeof(CatalogSummaryHeader))
+	{
+		close(fd);
+		pg_free(summary);
+		return NULL;
+	}
+
+	summary->size = st.st_size;
+	summary->data = pgut_malloc(summary->size);
+
+	while (done < summary->size)
+	{
+		ssize_t		rc = read(fd, summary->data + done, summary->size - done);
+
+		if (rc <= 0)
+			break;
+		done += rc;
+	}
+	close(fd);
+
+	hdr = (const CatalogSummaryHeader *) summary->data;
+
+	if (done != summary->size ||
+		memcmp(hdr->magic, SUMMARY_MAGIC, SUMMARY_MAGIC_LEN) != 0 ||
+		hdr->version != SUMMARY_FORMAT_VERSION ||
+		hdr->entry_size != sizeof(CatalogSummaryEntry) ||
+		sizeof(CatalogSummaryHeader) + (uint64) hdr->n_backups * hdr->entry_size +
+			hdr->strings_size != summary->size ||
+		hdr->crc != summary_crc(summary->data, summary->size))
+	{
+		elog(LOG, "Catalog summary \"%s\" is invalid, ignore it", summary->path);
+		catalog_summary_free(summary);
+		return NULL;
+	}
+
+	summary->hdr = hdr;
+	summary->entries = (const CatalogSummaryEntry *) (summary->data + sizeof(CatalogSummaryHeader));
+	summary->strings = (const char *) (summary->entries + hdr->n_backups);
+
+	return summary;
+}
+
+void
+catalog_summary_free(CatalogSummary *summary)
+{
+	if (summary == NULL)
+		return;
+
+	pg_free(summary->data);
+	pg_free(summary);
+}
+
+/*
+ * Get names of backup directories from the summary, if the instance
+ * directory is not changed since the summary was built.
+ * Returns NULL otherwise, then directory must be read.
+ */
+parray *
+catalog_summary_backup_dirs(CatalogSummary *summary, const char *instance_backup_dir)
+{
+	struct stat	st;
+	parray	   *dirs;
+	uint32		i;
+
+	if (stat(instance_backup_dir, &st) != 0 ||
+		st.st_mtime != summary->hdr->dir_mtime ||
+		(uint64) st.st_ino != summary->hdr->dir_ino ||
+		is_racy(summary->hdr->dir_mtime, summary->hdr->check_time))
+		return NULL;
+
+	dirs = parray_new();
+	for (i = 0; i < summary->hdr->n_backups; i++)
+	{
+		const char *name = summary_string(summary, summary->entries[i].dir_off);
+
+		if (name == NULL)
+		{
+			parray_walk(dirs, pfree);
+			parray_free(dirs);
+			return NULL;
+		}
+		parray_append(dirs, pgut_strdup(name));
+	}
+
+	return dirs;
+}
+
+static int
+summary_entry_cmp_name(const void *key, const void *elem, void *arg)
+{
+	CatalogSummary *summary = (CatalogSummary *) arg;
+	const char *name = summary_string(summary, ((const CatalogSummaryEntry *) elem)->dir_off);
+
+	return strcmp((const char *) key, name ? name : "");
+}
+
+/*
+ * Get backup from the summary, if cached content of its control file
+ * is still valid.  Returns NULL, if control file must be read.
+ * Backup, which had no control file, is returned as INVALID stub,
+ * until the control file appears.
+ */
+pgBackup *
+catalog_summary_get_backup(CatalogSummary *summary, const char *backup_dir_name,
+						   const char *control_path)
+{
+	const CatalogSummaryEntry *entry = NULL;
+	pgBackup   *backup;
+	struct stat	st;
+	const char *str;
+	size_t		lo = 0;
+	size_t		hi = summary->hdr->n_backups;
+
+	/* entries are sorted by name */
+	while (lo < hi)
+	{
+		size_t		mid = (lo + hi) / 2;
+		int			cmp = summary_entry_cmp_name(backup_dir_name,
+												 &summary->entries[mid], summary);
+
+		if (cmp == 0)
+		{
+			entry = &summary->entries[mid];
+			break;
+		}
+		else if (cmp < 0)
+			hi = mid;
+		else
+			lo = mid + 1;
+	}
+
+	if (entry == NULL)
+		return NULL;
+
+	if (entry->flags & SUMMARY_NO_CONTROL)
+	{
+		if (stat(control_path, &st) == 0 || errno != ENOENT)
+			return NULL;
+
+		elog(WARNING, "Control file \"%s\" doesn't exist", control_path);
+
+		backup = pgut_new0(pgBackup);
+		pgBackupInit(backup);
+		backup->start_time = base36dec(backup_dir_name);
+		backup->backup_id = backup->start_time;
+		return backup;
+	}
+
+	if (stat(control_path, &st) != 0 ||
+		st.st_mtime != entry->ctl_mtime ||
+		st.st_ctime != entry->ctl_ctime ||
+		st.st_size != entry->ctl_size ||
+		(uint64) st.st_ino != entry->ctl_ino ||
+		is_racy(entry->ctl_ctime, summary->hdr->check_time))
+		return NULL;
+
+	backup = pgut_new0(pgBackup);
+	pgBackupInit(backup);
+
+	backup->start_time = (time_t) entry->start_time;
+	backup->backup_id = backup->start_time;
+	backup->merge_time = (time_t) entry->merge_time;
+	backup->end_time = (time_t) entry->end_time;
+	backup->recovery_time = (time_t) entry->recovery_time;
+	backup->expire_time = (time_t) entry->expire_time;
+	backup->parent_backup = (time_t) entry->parent_backup;
+	backup->merge_dest_backup = (time_t) entry->merge_dest_backup;
+	backup->start_lsn = entry->start_lsn;
+	backup->stop_lsn = entry->stop_lsn;
+	backup->recovery_xid = (TransactionId) entry->recovery_xid;
+	backup->data_bytes = entry->data_bytes;
+	backup->wal_bytes = entry->wal_bytes;
+	backup->uncompressed_bytes = entry->uncompressed_bytes;
+	backup->pgdata_bytes = entry->pgdata_bytes;
+	backup->tli = entry->tli;
+	backup->backup_mode = (BackupMode) entry->backup_mode;
+	backup->status = (BackupStatus) entry->status;
+	backup->compress_alg = (CompressAlg) entry->compress_alg;
+	backup->compress_level = entry->compress_level;
+	backup->block_size = entry->block_size;
+	backup->wal_block_size = entry->wal_block_size;
+	backup->checksum_version = entry->checksum_version;
+	backup->content_crc = entry->content_crc;
+	backup->stream = entry->stream != 0;
+	backup->from_replica = entry->from_replica != 0;
+
+	if ((str = summary_string(summary, entry->program_version_off)) != NULL)
+	{
+		strlcpy(backup->program_version, str, sizeof(backup->program_version));
+		backup->program_version_num = parse_program_version(backup->program_version);
+	}
+	if ((str = summary_string(summary, entry->server_version_off)) != NULL)
+	{
+		strlcpy(backup->server_version, str, sizeof(backup->server_version));
+		backup->server_version_num = parse_server_version(backup->server_version);
+	}
+	if ((str = summary_string(summary, entry->conninfo_off)) != NULL)
+		backup->primary_conninfo = pgut_strdup(str);
+	if ((str = summary_string(summary, entry->note_off)) != NULL)
+		backup->note = pgut_strdup(str);
+
+	return backup;
+}
+
+typedef struct SummaryItem
+{
+	const char *name;
+	pgBackup   *backup;
+} SummaryItem;
+
+static int
+summary_item_cmp(const void *a, const void *b)
+{
+	return strcmp(((const SummaryItem *) a)->name, ((const SummaryItem *) b)->name);
+}
+
+static uint32
+summary_add_string(PQExpBuffer strings, const char *str)
+{
+	uint32		off;
+
+	if (str == NULL)
+		return SUMMARY_NO_STRING;
+
+	off = strings->len;
+	appendBinaryPQExpBuffer(strings, str, strlen(str) + 1);
+	return off;
+}
+
+/*
+ * Build the summary of the instance from the list of all its backups.
+ * check_time is the moment before the instance directory was listed and
+ * control files were read.  Summary is not written, if it was rewritten by
+ * someone else after "prev" summary was loaded.  Errors are not fatal,
+ * summary is just a cache.
+ */
+void
+catalog_summary_write(const char *instance_backup_dir, parray *backups,
+					  time_t check_time, CatalogSummary *prev)
+{
+	char		path[MAXPGPATH];
+	char		path_tmp[MAXPGPATH];
+	CatalogSummaryHeader hdr;
+	CatalogSummaryEntry *entries;
+	SummaryItem *items;
+	PQExpBufferData strings;
+	struct stat	st;
+	size_t		n = parray_num(backups);
+	size_t		i;
+	FILE	   *out;
+	bool		ok;
+	pg_crc32	crc;
+
+	if (fio_is_remote(FIO_BACKUP_HOST))
+		return;
+
+	if (stat(instance_backup_dir, &st) != 0)
+		return;
+
+	catalog_summary_path(path, instance_backup_dir);
+	snprintf(path_tmp, MAXPGPATH, "%s.tmp.%d", path, (int) getpid());
+
+	MemSet(&hdr, 0, sizeof(hdr));
+	memcpy(hdr.magic, SUMMARY_MAGIC, SUMMARY_MAGIC_LEN);
+	hdr.version = SUMMARY_FORMAT_VERSION;
+	hdr.entry_size = sizeof(CatalogSummaryEntry);
+	hdr.n_backups = n;
+	hdr.generation = prev ? prev->hdr->generation + 1 : 1;
+	hdr.check_time = check_time;
+	hdr.dir_mtime = st.st_mtime;
+	hdr.dir_ino = st.st_ino;
+
+	items = pgut_malloc(sizeof(SummaryItem) * Max(n, 1));
+	for (i = 0; i < n; i++)
+	{
+		pgBackup   *backup = (pgBackup *) parray_get(backups, i);
+
+		items[i].name = last_dir_separator(backup->root_dir) + 1;
+		items[i].backup = backup;
+	}
+	qsort(items, n, sizeof(SummaryItem), summary_item_cmp);
+
+	initPQExpBuffer(&strings);
+	entries = pgut_malloc(sizeof(CatalogSummaryEntry) * Max(n, 1));
+
+	for (i = 0; i < n; i++)
+	{
+		CatalogSummaryEntry *entry = &entries[i];
+		pgBackup   *backup = items[i].backup;
+		char		control_path[MAXPGPATH];
+
+		MemSet(entry, 0, sizeof(CatalogSummaryEntry));
+		entry->dir_off = summary_add_string(&strings, items[i].name);
+
+		/*
+		 * Control file may have been changed after it was read, but then
+		 * its mtime is racy and it will not be trusted.
+		 */
+		join_path_components(control_path, backup->root_dir, BACKUP_CONTROL_FILE);
+		if (backup->status == BACKUP_STATUS_INVALID ||
+			stat(control_path, &st) != 0)
+		{
+			entry->flags = SUMMARY_NO_CONTROL;
+			entry->program_version_off = SUMMARY_NO_STRING;
+			entry->server_version_off = SUMMARY_NO_STRING;
+			entry->conninfo_off = SUMMARY_NO_STRING;
+			entry->note_off = SUMMARY_NO_STRING;
+			continue;
+		}
+
+		entry->ctl_mtime = st.st_mtime;
+		entry->ctl_ctime = st.st_ctime;
+		entry->ctl_size = st.st_size;
+		entry->ctl_ino = st.st_ino;
+
+		entry->start_time = backup->start_time;
+		entry->merge_time = backup->merge_time;
+		entry->end_time = backup->end_time;
+		entry->recovery_time = backup->recovery_time;
+		entry->expire_time = backup->expire_time;
+		entry->parent_backup = backup->parent_backup;
+		entry->merge_dest_backup = backup->merge_dest_backup;
+		entry->start_lsn = backup->start_lsn;
+		entry->stop_lsn = backup->stop_lsn;
+		entry->recovery_xid = backup->recovery_xid;
+		entry->data_bytes = backup->data_bytes;
+		entry->wal_bytes = backup->wal_bytes;
+		entry->uncompressed_bytes = backup->uncompressed_bytes;
+		entry->pgdata_bytes = backup->pgdata_bytes;
+		entry->tli = backup->tli;
+		entry->backup_mode = backup->backup_mode;
+		entry->status = backup->status;
+		entry->compress_alg = backup->compress_alg;
+		entry->compress_level = backup->compress_level;
+		entry->block_size = backup->block_size;
+		entry->wal_block_size = backup->wal_block_size;
+		entry->checksum_version = backup->checksum_version;
+		entry->content_crc = backup->content_crc;
+		entry->stream = backup->stream;
+		entry->from_replica = backup->from_replica;
+
+		entry->program_version_off = summary_add_string(&strings,
+			backup->program_version[0] ? backup->program_version : NULL);
+		entry->server_version_off = summary_add_string(&strings,
+			backup->server_version[0] ? backup->server_version : NULL);
+		entry->conninfo_off = summary_add_string(&strings, backup->primary_conninfo);
+		entry->note_off = summary_add_string(&strings, backup->note);
+	}
+
+	hdr.strings_size = strings.len;
+
+	/* CRC is computed over the header with zero crc field */
+	INIT_CRC32C(crc);
+	COMP_CRC32C(crc, &hdr, sizeof(hdr));
+	COMP_CRC32C(crc, entries, sizeof(CatalogSummaryEntry) * n);
+	COMP_CRC32C(crc, strings.data, strings.len);
+	FIN_CRC32C(crc);
+	hdr.crc = crc;
+
+	out = fopen(path_tmp, PG_BINARY_W);
+	if (out == NULL)
+	{
+		elog(LOG, "Cannot open catalog summary \"%s\": %s", path_tmp, strerror(errno));
+		goto cleanup;
+	}
+
+	if (chmod(path_tmp, FILE_PERMISSION) == -1)
+		elog(LOG, "Cannot change mode of \"%s\": %s", path_tmp, strerror(errno));
+
+	ok = fwrite(&hdr, sizeof(hdr), 1, out) == 1 &&
+		(n == 0 || fwrite(entries, sizeof(CatalogSummaryEntry), n, out) == n) &&
+		(strings.len == 0 || fwrite(strings.data, strings.len, 1, out) == 1);
+
+	if (fclose(out) != 0 || !ok)
+	{
+		elog(LOG, "Cannot write catalog summary \"%s\": %s", path_tmp, strerror(errno));
+		unlink(path_tmp);
+		goto cleanup;
+	}
+
+	/* the summary was rebuilt concurrently, keep that version */
+	if (prev)
+	{
+		CatalogSummary *cur = catalog_summary_open(instance_backup_dir);
+
+		if (cur && cur->hdr->generation != prev->hdr->generation)
+		{
+			elog(LOG, "Catalog summary \"%s\" was changed concurrently", path);
+			catalog_summary_free(cur);
+			unlink(path_tmp);
+			goto cleanup;
+		}
+		catalog_summary_free(cur);
+	}
+
+	if (rename(path_tmp, path) != 0)
+	{
+		elog(LOG, "Cannot rename file \"%s\" to \"%s\": %s",
+			 path_tmp, path, strerror(errno));
+		unlink(path_tmp);
+		goto cleanup;
+	}
+
+	elog(LOG, "Catalog summary \"%s\" is written, backups: %lu, generation: " UINT64_FORMAT,
+		 path, (unsigned long) n, hdr.generation);
+
+cleanup:
+	termPQExpBuffer(&strings);
+	pg_free(entries);
+	pg_free(items);
+}
+
+/* Remove summary of the instance, used when instance is deleted */
+void
+catalog_summary_remove(const char *instance_backup_dir)
+{
+	char		path[MAXPGPATH];
+
+	catalog_summary_path(path, instance_backup_dir);
+
+	if (unlink(path) != 0 && errno != ENOENT)
+		elog(WARNING, "Cannot remove catalog summary \"%s\": %s",
+			 path, strerror(errno));
+}
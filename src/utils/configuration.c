@@ -113,6 +113,7 @@ static const char * const subcmd_names[] =
 	"help",
 	"version",
 	"catchup",
+	"rebuild-wal-index",
 };
 
 ProbackupSubcmd
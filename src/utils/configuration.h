@@ -40,6 +40,7 @@ typedef enum ProbackupSubcmd
 	HELP_CMD,
 	VERSION_CMD,
 	CATCHUP_CMD,
+	REBUILD_WAL_INDEX_CMD,
 } ProbackupSubcmd;
 
 typedef enum OptionSource
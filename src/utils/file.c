@@ -1,6 +1,8 @@
 #include <stdio.h>
 #include <unistd.h>
+#include <fcntl.h>
 #include <sys/stat.h>
+#include <sys/file.h>
 #include <signal.h>
 
 #include "pg_probackup.h"
@@ -16,6 +18,7 @@ static __thread void* fio_stdin_buffer;
 static __thread int fio_stdout = 0;
 static __thread int fio_stdin = 0;
 static __thread int fio_stderr = 0;
+static __thread int fio_agent_version = 0;
 static char *async_errormsg = NULL;
 
 fio_location MyLocation;
@@ -205,9 +208,43 @@ fio_get_agent_version(void)
 	IO_CHECK(fio_write_all(fio_stdout, &hdr, sizeof(hdr)), sizeof(hdr));
 	IO_CHECK(fio_read_all(fio_stdin, &hdr, sizeof(hdr)), sizeof(hdr));
 
+	fio_agent_version = hdr.arg;
 	return hdr.arg;
 }
 
+/* Set protocol version of the agent current thread is connected to */
+void
+fio_set_agent_version(int version)
+{
+	fio_agent_version = version;
+}
+
+/*
+ * Switch remote agent of current thread into multiplexer mode and
+ * start the shared SSH session on top of its connection.
+ * Current thread is disconnected from the agent afterwards.
+ */
+fio_mux *
+fio_switch_to_mux(pid_t ssh_pid)
+{
+	fio_header hdr = {
+		.cop = FIO_MUX,
+		.handle = -1,
+		.size = 0,
+		.arg = 0,
+	};
+	fio_mux *mux;
+
+	IO_CHECK(fio_write_all(fio_stdout, &hdr, sizeof(hdr)), sizeof(hdr));
+	IO_CHECK(fio_read_all(fio_stdin, &hdr, sizeof(hdr)), sizeof(hdr));
+	Assert(hdr.cop == FIO_MUX);
+
+	mux = fio_mux_start(fio_stdin, fio_stdout, fio_stderr, ssh_pid);
+	fio_redirect(0, 0, 0);
+
+	return mux;
+}
+
 /* Open input stream. Remote file is fetched to the in-memory buffer and then accessed through Linux fmemopen */
 FILE*
 fio_open_stream(fio_location location, const char* path)
@@ -417,6 +454,26 @@ fio_disconnect(void)
 	}
 }
 
+/*
+ * Drop connection of current thread to remote agent, when the thread exits
+ * on error.  Unlike fio_disconnect(), no messages are exchanged, the
+ * connection may be broken already.  Agent exits on end of its input.
+ */
+void
+fio_disconnect_on_error(void)
+{
+	if (fio_stdin)
+	{
+		close(fio_stdin);
+		close(fio_stdout);
+		close(fio_stderr);
+		fio_stdin = 0;
+		fio_stdout = 0;
+		fio_stderr = 0;
+		wait_ssh();
+	}
+}
+
 /* Open stdio file */
 FILE*
 fio_fopen(fio_location location, const char* path, const char* mode)
@@ -602,6 +659,247 @@ fio_truncate(int fd, off_t size)
 	}
 }
 
+/*
+ * Apply or remove advisory lock on an open file, see flock(2).
+ * Agents older than FIO_FLOCK_AGENT_VERSION_NUM do not know FIO_FLOCK,
+ * then -1 is returned with errno set to ENOTSUP.
+ */
+#define FIO_FLOCK_AGENT_VERSION_NUM	20705
+
+int
+fio_flock(int fd, int operation)
+{
+	if (fio_is_remote_fd(fd))
+	{
+		fio_header hdr = {
+			.cop = FIO_FLOCK,
+			.handle = fd & ~FIO_PIPE_MARKER,
+			.size = 0,
+			.arg = operation,
+		};
+
+		if (fio_agent_version < FIO_FLOCK_AGENT_VERSION_NUM)
+		{
+			errno = ENOTSUP;
+			return -1;
+		}
+
+		IO_CHECK(fio_write_all(fio_stdout, &hdr, sizeof(hdr)), sizeof(hdr));
+
+		/* Wait for response */
+		IO_CHECK(fio_read_all(fio_stdin, &hdr, sizeof(hdr)), sizeof(hdr));
+		Assert(hdr.cop == FIO_FLOCK);
+
+		if (hdr.arg != 0)
+		{
+			errno = hdr.arg;
+			return -1;
+		}
+
+		return 0;
+	}
+	else
+	{
+		return flock(fd, operation);
+	}
+}
+
+/*
+ * Preallocation and zeroing of file ranges.
+ *
+ * Agents older than FIO_FALLOCATE_AGENT_VERSION_NUM do not know
+ * FIO_FALLOCATE, then file is extended by truncate and ranges are
+ * zeroed by writing zeros.  Agents older than FIO_ZERO_RANGE_AGENT_VERSION_NUM
+ * do not extend file, when zeroing a range past its end, so ranges
+ * are zeroed by writing zeros for them too.
+ */
+#define FIO_FALLOCATE_AGENT_VERSION_NUM	20702
+#define FIO_ZERO_RANGE_AGENT_VERSION_NUM	20704
+
+#define FIO_FALLOCATE_PREALLOCATE	0
+#define FIO_FALLOCATE_ZERO_RANGE	1
+
+typedef struct
+{
+	int64		offs;
+	int64		len;
+} fio_fallocate_request;
+
+/*
+ * Allocate space for the file of "size" bytes, extending it if needed.
+ * Where preallocation is not supported, the file is only extended,
+ * so the rest of it is sparse.
+ */
+static int
+fio_preallocate_local(int fd, off_t size)
+{
+	struct stat st;
+
+#ifdef FALLOC_FL_PUNCH_HOLE
+	if (fallocate(fd, 0, 0, size) == 0)
+		return 0;
+	if (errno != EOPNOTSUPP && errno != ENOSYS)
+		return -1;
+#endif
+
+	if (fstat(fd, &st) < 0)
+		return -1;
+	if (st.st_size >= size)
+		return 0;
+
+	return ftruncate(fd, size);
+}
+
+/*
+ * Fill "len" bytes of file at "offs" with zeros. The space is deallocated
+ * if filesystem supports punching holes, otherwise zeros are written.
+ * If the range ends past the end of file, file is extended.
+ * Current position in file is not changed.
+ */
+static int
+fio_zero_range_local(int fd, off_t offs, off_t len)
+{
+	static const char zero_buf[BLCKSZ];
+	struct stat st;
+
+	if (fstat(fd, &st) < 0)
+		return -1;
+
+	/* punching a hole never extends file, so extend it by truncate */
+	if (offs + len > st.st_size)
+	{
+		if (ftruncate(fd, offs + len) < 0)
+			return -1;
+
+		/* extended part reads as zeros already */
+		len = st.st_size - offs;
+		if (len <= 0)
+			return 0;
+	}
+
+#ifdef FALLOC_FL_PUNCH_HOLE
+	if (fallocate(fd, FALLOC_FL_PUNCH_HOLE | FALLOC_FL_KEEP_SIZE, offs, len) == 0)
+		return 0;
+	if (errno != EOPNOTSUPP && errno != ENOSYS)
+		return -1;
+#endif
+
+	while (len > 0)
+	{
+		ssize_t		rc = pwrite(fd, zero_buf, Min(len, BLCKSZ), offs);
+
+		if (rc < 0)
+		{
+			if (errno == EINTR)
+				continue;
+			return -1;
+		}
+		offs += rc;
+		len -= rc;
+	}
+
+	return 0;
+}
+
+static int
+fio_fallocate(int fd, int mode, off_t offs, off_t len)
+{
+	fio_header hdr = {
+		.cop = FIO_FALLOCATE,
+		.handle = fd & ~FIO_PIPE_MARKER,
+		.size = sizeof(fio_fallocate_request),
+		.arg = mode,
+	};
+	fio_fallocate_request req = {
+		.offs = offs,
+		.len = len,
+	};
+
+	IO_CHECK(fio_write_all(fio_stdout, &hdr, sizeof(hdr)), sizeof(hdr));
+	IO_CHECK(fio_write_all(fio_stdout, &req, sizeof(req)), sizeof(req));
+
+	return 0;
+}
+
+/* fallocate is asynchronous */
+static void
+fio_fallocate_impl(int fd, int mode, fio_fallocate_request *req)
+{
+	int			rc;
+
+	/* Quick exit for tainted agent */
+	if (async_errormsg)
+		return;
+
+	if (mode == FIO_FALLOCATE_PREALLOCATE)
+		rc = fio_preallocate_local(fd, req->len);
+	else
+		rc = fio_zero_range_local(fd, req->offs, req->len);
+
+	if (rc < 0)
+	{
+		async_errormsg = pgut_malloc(ERRMSG_MAX_LEN);
+		snprintf(async_errormsg, ERRMSG_MAX_LEN, "%s", strerror(errno));
+	}
+}
+
+/*
+ * Allocate space for stdio file of "size" bytes, extending it if needed.
+ * Used for files, which are going to be written at random positions,
+ * to avoid fragmentation. Unwritten parts of the file read as zeros.
+ */
+int
+fio_fpreallocate(FILE* f, off_t size)
+{
+	if (fio_is_remote_file(f))
+	{
+		if (fio_agent_version < FIO_FALLOCATE_AGENT_VERSION_NUM)
+			return fio_truncate(fio_fileno(f), size);
+
+		return fio_fallocate(fio_fileno(f), FIO_FALLOCATE_PREALLOCATE, 0, size);
+	}
+
+	if (fflush(f) != 0)
+		return -1;
+
+	return fio_preallocate_local(fileno(f), size);
+}
+
+/*
+ * Fill "len" bytes of stdio file at "offs" with zeros, deallocating
+ * the space if possible. Position in file is undefined afterwards.
+ */
+int
+fio_fzero_range(FILE* f, off_t offs, off_t len)
+{
+	if (fio_is_remote_file(f))
+	{
+		int			fd = fio_fileno(f);
+
+		if (fio_agent_version >= FIO_ZERO_RANGE_AGENT_VERSION_NUM)
+			return fio_fallocate(fd, FIO_FALLOCATE_ZERO_RANGE, offs, len);
+
+		if (fio_seek(fd, offs) < 0)
+			return -1;
+
+		while (len > 0)
+		{
+			char		zero_buf[BLCKSZ] = {0};
+			size_t		size = Min(len, BLCKSZ);
+
+			if (fio_write_async(fd, zero_buf, size) != size)
+				return -1;
+			len -= size;
+		}
+		return 0;
+	}
+
+	if (fflush(f) != 0)
+		return -1;
+
+	return fio_zero_range_local(fileno(f), offs, len);
+}
+
 
 /*
  * Read file from specified location.
@@ -1514,6 +1812,564 @@ fio_chmod(fio_location location, const char* path, int mode)
 	}
 }
 
+/*
+ * Batched requests.
+ *
+ * Sync, remove and mkdir requests of a batch are packed into a single
+ * FIO_BATCH message, every request carries its own id in the handle field.
+ * The agent executes requests of the message in order and sends back all
+ * results in a single reply, tagged with the same ids.  Several messages
+ * may be in flight at once: the client waits for replies only when the
+ * total size of expected replies gets close to FIO_BATCH_WINDOW, which is
+ * well below the pipe capacity, so the agent never blocks on a full pipe
+ * while the client is still sending requests.
+ *
+ * Results are delivered to the locations passed by the caller, they are
+ * valid after fio_batch_wait() or fio_batch_end().
+ *
+ * Agents older than FIO_BATCH_AGENT_VERSION_NUM do not know FIO_BATCH,
+ * in this case, as well as for local locations, requests are executed
+ * immediately.
+ *
+ * There are no batched stat requests: remote directories are listed by
+ * the agent itself, see fio_list_dir(), so stat of many remote files
+ * doesn't take a round trip per file.
+ */
+#define FIO_BATCH_AGENT_VERSION_NUM	20700
+/* expected size of replies in flight */
+#define FIO_BATCH_WINDOW			(32 * 1024)
+/* flush the message when its reply grows beyond this size */
+#define FIO_BATCH_MESSAGE_REPLY		(FIO_BATCH_WINDOW / 4)
+/* strict flag of FIO_MKDIR request in FIO_BATCH message */
+#define FIO_BATCH_MKDIR_STRICT		0x80000000
+
+struct fio_batch
+{
+	bool		remote;
+	fio_location location;
+
+	/* message being built */
+	char	   *buf;
+	size_t		buf_len;
+	size_t		buf_size;
+	uint32		n_requests;
+	size_t		reply_size;
+
+	/* result locations, indexed by request id */
+	int		  **results;
+	uint32		n_slots;
+	uint32		max_slots;
+
+	/* messages sent, but not answered yet */
+	uint32		n_in_flight;
+	size_t		in_flight_size;
+};
+
+/* Read reply for the oldest message in flight and store its results */
+static void
+fio_batch_receive(fio_batch *batch)
+{
+	fio_header	hdr;
+	char	   *reply;
+	size_t		offs = 0;
+	uint32		i;
+
+	IO_CHECK(fio_read_all(fio_stdin, &hdr, sizeof(hdr)), sizeof(hdr));
+	if (hdr.cop != FIO_BATCH)
+		elog(ERROR, "Unexpected reply to batch request: %u", hdr.cop);
+
+	reply = pgut_malloc(Max(hdr.size, 1));
+	IO_CHECK(fio_read_all(fio_stdin, reply, hdr.size), hdr.size);
+
+	for (i = 0; i < hdr.arg; i++)
+	{
+		fio_header	res;
+
+		memcpy(&res, reply + offs, sizeof(res));
+		offs += sizeof(res) + res.size;
+
+		if (res.handle >= batch->n_slots)
+			elog(ERROR, "Unexpected request id in batch reply: %u", res.handle);
+
+		if (batch->results[res.handle])
+			*batch->results[res.handle] = res.arg;
+	}
+
+	batch->n_in_flight--;
+	batch->in_flight_size -= sizeof(hdr) + hdr.size;
+	pg_free(reply);
+}
+
+/* Send the message being built, the reply is received later */
+static void
+fio_batch_send(fio_batch *batch)
+{
+	fio_header	hdr = {
+		.cop = FIO_BATCH,
+		.handle = -1,
+		.size = batch->buf_len,
+		.arg = batch->n_requests,
+	};
+
+	if (batch->n_requests == 0)
+		return;
+
+	/* make room for the reply in the window */
+	while (batch->n_in_flight > 0 &&
+		   batch->in_flight_size + sizeof(hdr) + batch->reply_size > FIO_BATCH_WINDOW)
+		fio_batch_receive(batch);
+
+	IO_CHECK(fio_write_all(fio_stdout, &hdr, sizeof(hdr)), sizeof(hdr));
+	IO_CHECK(fio_write_all(fio_stdout, batch->buf, batch->buf_len), batch->buf_len);
+
+	batch->n_in_flight++;
+	batch->in_flight_size += sizeof(hdr) + batch->reply_size;
+
+	batch->buf_len = 0;
+	batch->n_requests = 0;
+	batch->reply_size = 0;
+}
+
+/* Append request to the message, send the message if it is big enough */
+static void
+fio_batch_add(fio_batch *batch, fio_operations cop, const char *path, unsigned arg,
+			  int *result)
+{
+	fio_header	hdr = {
+		.cop = cop,
+		.handle = batch->n_slots,
+		.size = strlen(path) + 1,
+		.arg = arg,
+	};
+
+	if (batch->n_slots == batch->max_slots)
+	{
+		batch->max_slots = batch->max_slots * 2;
+		batch->results = pgut_realloc(batch->results, sizeof(int *) * batch->max_slots);
+	}
+	batch->results[batch->n_slots++] = result;
+
+	if (batch->buf_len + sizeof(hdr) + hdr.size > batch->buf_size)
+	{
+		batch->buf_size = Max(batch->buf_size * 2, batch->buf_len + sizeof(hdr) + hdr.size);
+		batch->buf = pgut_realloc(batch->buf, batch->buf_size);
+	}
+	memcpy(batch->buf + batch->buf_len, &hdr, sizeof(hdr));
+	memcpy(batch->buf + batch->buf_len + sizeof(hdr), path, hdr.size);
+	batch->buf_len += sizeof(hdr) + hdr.size;
+
+	batch->n_requests++;
+	batch->reply_size += sizeof(hdr);
+
+	if (batch->reply_size >= FIO_BATCH_MESSAGE_REPLY)
+		fio_batch_send(batch);
+}
+
+/* Start a batch of requests to the specified location */
+fio_batch *
+fio_batch_begin(fio_location location)
+{
+	fio_batch  *batch = pgut_new0(fio_batch);
+
+	batch->location = location;
+	batch->remote = fio_is_remote(location) &&
+		fio_agent_version >= FIO_BATCH_AGENT_VERSION_NUM;
+
+	if (batch->remote)
+	{
+		batch->buf_size = 16 * 1024;
+		batch->buf = pgut_malloc(batch->buf_size);
+		batch->max_slots = 1024;
+		batch->results = pgut_malloc(sizeof(int *) * batch->max_slots);
+	}
+
+	return batch;
+}
+
+/*
+ * Sync file to disk.
+ * *result is set to 0 on success or to errno, the same for other requests.
+ */
+void
+fio_batch_sync(fio_batch *batch, const char *path, int *result)
+{
+	if (batch->remote)
+		fio_batch_add(batch, FIO_SYNC, path, 0, result);
+	else
+	{
+		int			rc = fio_sync(batch->location, path);
+
+		if (result)
+			*result = rc < 0 ? errno : 0;
+	}
+}
+
+/* Remove file or directory, if missing_ok, then ignore ENOENT error */
+void
+fio_batch_remove(fio_batch *batch, const char *path, bool missing_ok, int *result)
+{
+	if (batch->remote)
+		fio_batch_add(batch, FIO_REMOVE, path, missing_ok ? 1 : 0, result);
+	else
+	{
+		int			rc = fio_remove(batch->location, path, missing_ok);
+
+		if (result)
+			*result = rc < 0 ? errno : 0;
+	}
+}
+
+/* Create directory, see dir_create_dir() */
+void
+fio_batch_mkdir(fio_batch *batch, const char *path, int mode, bool strict, int *result)
+{
+	if (batch->remote)
+		fio_batch_add(batch, FIO_MKDIR, path,
+					  (mode & ~FIO_BATCH_MKDIR_STRICT) | (strict ? FIO_BATCH_MKDIR_STRICT : 0),
+					  result);
+	else
+	{
+		int			rc = fio_mkdir(batch->location, path, mode, strict);
+
+		if (result)
+			*result = rc < 0 ? errno : 0;
+	}
+}
+
+/*
+ * Wait for results of all requests of the batch.
+ * Batch can be used for new requests afterwards.
+ */
+void
+fio_batch_wait(fio_batch *batch)
+{
+	if (!batch->remote)
+		return;
+
+	fio_batch_send(batch);
+	while (batch->n_in_flight > 0)
+		fio_batch_receive(batch);
+
+	batch->n_slots = 0;
+}
+
+/* Wait for results of all requests and free the batch */
+void
+fio_batch_end(fio_batch *batch)
+{
+	fio_batch_wait(batch);
+
+	pg_free(batch->buf);
+	pg_free(batch->results);
+	pg_free(batch);
+}
+
+/* Execute requests of FIO_BATCH message and send back their results */
+static void
+fio_batch_impl(int out, char *buf, size_t size, uint32 n_requests)
+{
+	fio_header	hdr = {
+		.cop = FIO_BATCH,
+		.handle = -1,
+		.size = 0,
+		.arg = n_requests,
+	};
+	char	   *reply;
+	size_t		offs = 0;
+	uint32		i;
+
+	reply = pgut_malloc(Max(n_requests * sizeof(fio_header), 1));
+
+	for (i = 0; i < n_requests && offs + sizeof(fio_header) <= size; i++)
+	{
+		fio_header	req;
+		const char *path;
+		int			rc = 0;
+
+		memcpy(&req, buf + offs, sizeof(req));
+		path = buf + offs + sizeof(req);
+		offs += sizeof(req) + req.size;
+
+		errno = 0;
+		switch (req.cop)
+		{
+			case FIO_SYNC:
+				rc = fio_sync(FIO_LOCAL_HOST, path);
+				break;
+			case FIO_REMOVE:
+				rc = fio_remove(FIO_LOCAL_HOST, path, req.arg == 1);
+				break;
+			case FIO_MKDIR:
+				rc = dir_create_dir(path, req.arg & ~FIO_BATCH_MKDIR_STRICT,
+									(req.arg & FIO_BATCH_MKDIR_STRICT) != 0);
+				break;
+			default:
+				rc = -1;
+				errno = EINVAL;
+		}
+
+		req.arg = rc < 0 ? (errno ? errno : EIO) : 0;
+		req.size = 0;
+
+		memcpy(reply + hdr.size, &req, sizeof(req));
+		hdr.size += sizeof(req);
+	}
+	hdr.arg = i;
+
+	IO_CHECK(fio_write_all(out, &hdr, sizeof(hdr)), sizeof(hdr));
+	IO_CHECK(fio_write_all(out, reply, hdr.size), hdr.size);
+
+	pg_free(reply);
+}
+
+/*
+ * Removal of directory trees and of many files in the same directory.
+ *
+ * The remote agent does the whole job on a single FIO_REMOVE_TREE or
+ * FIO_REMOVE_FILES request by n_threads threads and replies with an error
+ * message if it fails.  Agents older than FIO_REMOVE_TREE_AGENT_VERSION_NUM
+ * do not know these requests, then files are removed one by one by batches.
+ */
+#define FIO_REMOVE_TREE_AGENT_VERSION_NUM	20703
+
+/* Throw error sent by the agent in reply to removal request */
+static void
+fio_remove_receive(fio_operations cop)
+{
+	fio_header	hdr;
+	char		errmsg[MAXPGPATH * 2];
+
+	IO_CHECK(fio_read_all(fio_stdin, &hdr, sizeof(hdr)), sizeof(hdr));
+	if (hdr.cop != cop)
+		elog(ERROR, "Unexpected reply to remove request: %u", hdr.cop);
+
+	if (hdr.size > 0)
+	{
+		if (hdr.size > sizeof(errmsg))
+			elog(ERROR, "Too long error message in reply to remove request: %u", hdr.size);
+		IO_CHECK(fio_read_all(fio_stdin, errmsg, hdr.size), hdr.size);
+		errmsg[hdr.size - 1] = '\0';
+	}
+
+	if (hdr.arg != 0)
+		elog(ERROR, "%s", hdr.size > 0 ? errmsg : "Remote agent failed to remove files");
+}
+
+static void
+fio_remove_reply(int out, fio_operations cop, bool ok, const char *errmsg)
+{
+	fio_header	hdr = {
+		.cop = cop,
+		.handle = -1,
+		.size = ok ? 0 : strlen(errmsg) + 1,
+		.arg = ok ? 0 : 1,
+	};
+
+	IO_CHECK(fio_write_all(out, &hdr, sizeof(hdr)), sizeof(hdr));
+	if (hdr.size > 0)
+		IO_CHECK(fio_write_all(out, errmsg, hdr.size), hdr.size);
+}
+
+/*
+ * Remove directory root with all its content, missing root is not an error.
+ * Local directory is removed by dir_remove_tree().
+ */
+void
+fio_remove_tree(fio_location location, const char *root, int n_threads)
+{
+	char		errmsg[MAXPGPATH * 2];
+
+	if (!fio_is_remote(location))
+	{
+		if (!dir_remove_tree(root, n_threads, errmsg, sizeof(errmsg)))
+			elog(ERROR, "%s", errmsg);
+	}
+	else if (fio_agent_version >= FIO_REMOVE_TREE_AGENT_VERSION_NUM)
+	{
+		fio_header	hdr = {
+			.cop = FIO_REMOVE_TREE,
+			.handle = -1,
+			.size = strlen(root) + 1,
+			.arg = n_threads,
+		};
+
+		IO_CHECK(fio_write_all(fio_stdout, &hdr, sizeof(hdr)), sizeof(hdr));
+		IO_CHECK(fio_write_all(fio_stdout, root, hdr.size), hdr.size);
+
+		fio_remove_receive(FIO_REMOVE_TREE);
+	}
+	else
+	{
+		parray	   *files = parray_new();
+		fio_batch  *batch;
+		int		   *remove_errno;
+		char		full_path[MAXPGPATH];
+		size_t		i;
+
+		dir_list_file(files, root, false, false, true, false, false, location);
+
+		/* delete leaf node first */
+		parray_qsort(files, pgFileCompareRelPathDesc);
+
+		remove_errno = palloc0(sizeof(int) * Max(parray_num(files), 1));
+		batch = fio_batch_begin(location);
+
+		for (i = 0; i < parray_num(files); i++)
+		{
+			pgFile	   *file = (pgFile *) parray_get(files, i);
+
+			if (interrupted)
+				elog(ERROR, "Interrupted during directory removal");
+
+			join_path_components(full_path, root, file->rel_path);
+			fio_batch_remove(batch, full_path, false, &remove_errno[i]);
+		}
+		fio_batch_end(batch);
+
+		for (i = 0; i < parray_num(files); i++)
+		{
+			pgFile	   *file = (pgFile *) parray_get(files, i);
+
+			if (remove_errno[i] == 0)
+				continue;
+
+			join_path_components(full_path, root, file->rel_path);
+			elog(ERROR, "Cannot remove file or directory \"%s\": %s",
+				 full_path, strerror(remove_errno[i]));
+		}
+
+		pfree(remove_errno);
+		pgFileListFree(files);
+	}
+}
+
+static void
+fio_remove_tree_impl(int out, char *buf, int n_threads)
+{
+	char		errmsg[MAXPGPATH * 2];
+	bool		ok = dir_remove_tree(buf, n_threads, errmsg, sizeof(errmsg));
+
+	fio_remove_reply(out, FIO_REMOVE_TREE, ok, errmsg);
+}
+
+/*
+ * Remove files of directory dir, names are relative to dir.
+ * Missing files are not an error.  Local files are removed by
+ * dir_remove_files().
+ */
+void
+fio_remove_files(fio_location location, const char *dir, char **names,
+				 size_t n_names, int n_threads)
+{
+	char		errmsg[MAXPGPATH * 2];
+	size_t		i;
+
+	if (n_names == 0)
+		return;
+
+	if (!fio_is_remote(location))
+	{
+		if (!dir_remove_files(dir, names, n_names, n_threads, errmsg, sizeof(errmsg)))
+			elog(ERROR, "%s", errmsg);
+	}
+	else if (fio_agent_version >= FIO_REMOVE_TREE_AGENT_VERSION_NUM)
+	{
+		fio_header	hdr = {
+			.cop = FIO_REMOVE_FILES,
+			.handle = n_names,
+			.size = strlen(dir) + 1,
+			.arg = n_threads,
+		};
+		char	   *buf;
+		size_t		offs;
+
+		for (i = 0; i < n_names; i++)
+			hdr.size += strlen(names[i]) + 1;
+
+		/* dir and names are sent as a sequence of null-terminated strings */
+		buf = pgut_malloc(hdr.size);
+		offs = strlen(dir) + 1;
+		memcpy(buf, dir, offs);
+		for (i = 0; i < n_names; i++)
+		{
+			size_t		len = strlen(names[i]) + 1;
+
+			memcpy(buf + offs, names[i], len);
+			offs += len;
+		}
+
+		IO_CHECK(fio_write_all(fio_stdout, &hdr, sizeof(hdr)), sizeof(hdr));
+		IO_CHECK(fio_write_all(fio_stdout, buf, hdr.size), hdr.size);
+		pg_free(buf);
+
+		fio_remove_receive(FIO_REMOVE_FILES);
+	}
+	else
+	{
+		fio_batch  *batch = fio_batch_begin(location);
+		int		   *remove_errno = palloc0(sizeof(int) * n_names);
+		char		full_path[MAXPGPATH];
+
+		for (i = 0; i < n_names; i++)
+		{
+			if (interrupted)
+				elog(ERROR, "Interrupted during file removal");
+
+			join_path_components(full_path, dir, names[i]);
+			fio_batch_remove(batch, full_path, true, &remove_errno[i]);
+		}
+		fio_batch_end(batch);
+
+		for (i = 0; i < n_names; i++)
+		{
+			if (remove_errno[i] == 0)
+				continue;
+
+			join_path_components(full_path, dir, names[i]);
+			elog(ERROR, "Cannot remove file \"%s\": %s",
+				 full_path, strerror(remove_errno[i]));
+		}
+		pfree(remove_errno);
+	}
+}
+
+static void
+fio_remove_files_impl(int out, char *buf, size_t size, size_t n_names, int n_threads)
+{
+	char		errmsg[MAXPGPATH * 2];
+	char	  **names = pgut_malloc(sizeof(char *) * Max(n_names, 1));
+	size_t		offs = 0;
+	size_t		i;
+	bool		ok = true;
+
+	/* every string must be terminated within the message */
+	if (memchr(buf, '\0', size) == NULL)
+	{
+		snprintf(errmsg, sizeof(errmsg), "Malformed remove request");
+		ok = false;
+	}
+	else
+		offs = strlen(buf) + 1;
+
+	for (i = 0; ok && i < n_names; i++)
+	{
+		if (offs >= size || memchr(buf + offs, '\0', size - offs) == NULL)
+		{
+			snprintf(errmsg, sizeof(errmsg), "Malformed remove request for directory \"%s\"", buf);
+			ok = false;
+			break;
+		}
+		names[i] = buf + offs;
+		offs += strlen(names[i]) + 1;
+	}
+
+	if (ok)
+		ok = dir_remove_files(buf, names, n_names, n_threads, errmsg, sizeof(errmsg));
+
+	pg_free(names);
+	fio_remove_reply(out, FIO_REMOVE_FILES, ok, errmsg);
+}
+
 #define ZLIB_BUFFER_SIZE     (64*1024)
 #define MAX_WBITS            15 /* 32K LZ77 window */
 #define DEF_MEM_LEVEL        8
@@ -2823,11 +3679,15 @@ cleanup:
 	return;
 }
 
-/* Compile the array of files located on remote machine in directory root */
+/*
+ * Compile the array of files located on remote machine in directory root.
+ * The agent lists the directory by n_threads threads, agents older than
+ * 2.7.1 ignore it and list by a single thread.
+ */
 static void
 fio_list_dir_internal(parray *files, const char *root, bool exclude,
 								  bool follow_symlink, bool add_root, bool backup_logs,
-								  bool skip_hidden)
+								  bool skip_hidden, int n_threads)
 {
 	fio_header hdr;
 	fio_list_dir_request req;
@@ -2843,6 +3703,7 @@ fio_list_dir_internal(parray *files, const char *root, bool exclude,
 
 	hdr.cop = FIO_LIST_DIR;
 	hdr.size = sizeof(req);
+	hdr.arg = n_threads;
 
 	IO_CHECK(fio_write_all(fio_stdout, &hdr, sizeof(hdr)), sizeof(hdr));
 	IO_CHECK(fio_write_all(fio_stdout, &req, hdr.size), hdr.size);
@@ -2915,7 +3776,7 @@ fio_list_dir_internal(parray *files, const char *root, bool exclude,
  * TODO: replace FIO_SEND_FILE and FIO_SEND_FILE_EOF with dedicated messages
  */
 static void
-fio_list_dir_impl(int out, char* buf)
+fio_list_dir_impl(int out, char* buf, int n_threads)
 {
 	int i;
 	fio_header hdr;
@@ -2930,9 +3791,9 @@ fio_list_dir_impl(int out, char* buf)
 	 */
 	instance_config.logger.log_level_console = ERROR;
 
-	dir_list_file(file_files, req->path, req->exclude, req->follow_symlink,
-				  req->add_root, req->backup_logs, req->skip_hidden,
-				  FIO_LOCAL_HOST);
+	dir_list_file_parallel(file_files, req->path, req->exclude, req->follow_symlink,
+						   req->add_root, req->backup_logs, req->skip_hidden,
+						   n_threads);
 
 	/* send information about files to the main process */
 	for (i = 0; i < parray_num(file_files); i++)
@@ -2977,7 +3838,7 @@ fio_list_dir_impl(int out, char* buf)
 	IO_CHECK(fio_write_all(out, &hdr, sizeof(hdr)), sizeof(hdr));
 }
 
-/* Wrapper for directory listing */
+/* Wrapper for directory listing, directories are listed by num_threads threads */
 void
 fio_list_dir(parray *files, const char *root, bool exclude,
 				  bool follow_symlink, bool add_root, bool backup_logs,
@@ -2985,10 +3846,10 @@ fio_list_dir(parray *files, const char *root, bool exclude,
 {
 	if (fio_is_remote(FIO_DB_HOST))
 		fio_list_dir_internal(files, root, exclude, follow_symlink, add_root,
-							  backup_logs, skip_hidden);
+							  backup_logs, skip_hidden, num_threads);
 	else
-		dir_list_file(files, root, exclude, follow_symlink, add_root,
-					  backup_logs, skip_hidden, FIO_LOCAL_HOST);
+		dir_list_file_parallel(files, root, exclude, follow_symlink, add_root,
+							   backup_logs, skip_hidden, num_threads);
 }
 
 PageState *
@@ -3359,8 +4220,16 @@ fio_communicate(int in, int out)
 		  case FIO_TRUNCATE: /* Truncate file */
 			SYS_CHECK(ftruncate(fd[hdr.handle], hdr.arg));
 			break;
+		  case FIO_FLOCK: /* Apply or remove advisory lock on file */
+			hdr.size = 0;
+			hdr.arg = flock(fd[hdr.handle], hdr.arg) < 0 ? errno : 0;
+			IO_CHECK(fio_write_all(out, &hdr, sizeof(hdr)), sizeof(hdr));
+			break;
+		  case FIO_FALLOCATE: /* Preallocate or zero range of file */
+			fio_fallocate_impl(fd[hdr.handle], hdr.arg, (fio_fallocate_request *) buf);
+			break;
 		  case FIO_LIST_DIR:
-			fio_list_dir_impl(out, buf);
+			fio_list_dir_impl(out, buf, hdr.arg);
 			break;
 		  case FIO_SEND_PAGES:
 			/* buf contain fio_send_request header and bitmap. */
@@ -3410,6 +4279,21 @@ fio_communicate(int in, int out)
 		  case FIO_GET_ASYNC_ERROR:
 			fio_get_async_error_impl(out);
 			break;
+		  case FIO_BATCH:
+			fio_batch_impl(out, buf, hdr.size, hdr.arg);
+			break;
+		  case FIO_REMOVE_TREE: /* Remove directory with all its content */
+			fio_remove_tree_impl(out, buf, hdr.arg);
+			break;
+		  case FIO_REMOVE_FILES: /* Remove files of directory */
+			fio_remove_files_impl(out, buf, hdr.size, hdr.handle, hdr.arg);
+			break;
+		  case FIO_MUX:
+			/* serve channels of the client until the end of session */
+			IO_CHECK(fio_write_all(out, &hdr, sizeof(hdr)), sizeof(hdr));
+			free(buf);
+			fio_mux_agent(in, out);
+			return;
 		  case FIO_READLINK: /* Read content of a symbolic link */
 			{
 				/*
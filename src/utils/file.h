@@ -53,7 +53,18 @@ typedef enum
 	FIO_CHECK_POSTMASTER,
 	FIO_GET_ASYNC_ERROR,
 	FIO_WRITE_ASYNC,
-	FIO_READLINK
+	FIO_READLINK,
+	/* several sync/remove/mkdir requests in one message */
+	FIO_BATCH,
+	/* switch agent into multiplexer mode, see mux.c */
+	FIO_MUX,
+	/* preallocate or zero a range of file, see fio_fpreallocate() */
+	FIO_FALLOCATE,
+	/* remove directory tree or files of directory, see fio_remove_tree() */
+	FIO_REMOVE_TREE,
+	FIO_REMOVE_FILES,
+	/* advisory file lock, see fio_flock() */
+	FIO_FLOCK
 } fio_operations;
 
 typedef struct
@@ -87,7 +98,20 @@ extern bool    fio_is_remote_simple(fio_location location);
 
 extern void    fio_communicate(int in, int out);
 extern void    fio_disconnect(void);
+extern void    fio_disconnect_on_error(void);
 extern int     fio_get_agent_version(void);
+extern void    fio_set_agent_version(int version);
+
+/* oldest agent protocol supporting shared SSH session */
+#define FIO_MUX_AGENT_VERSION_NUM 20700
+
+typedef struct fio_mux fio_mux;
+
+extern fio_mux *fio_switch_to_mux(pid_t ssh_pid);
+/* in mux.c */
+extern fio_mux *fio_mux_start(int in, int out, int err, pid_t ssh_pid);
+extern bool    fio_mux_open_channel(fio_mux *mux, int *in, int *out, int *err);
+extern void    fio_mux_agent(int in, int out);
 
 #define FIO_FDMAX 64
 #define FIO_PIPE_MARKER 0x40000000
@@ -113,6 +137,7 @@ extern int     fio_flush(int fd);
 extern int     fio_seek(int fd, off_t offs);
 extern int     fio_fstat(int fd, struct stat* st);
 extern int     fio_truncate(int fd, off_t size);
+extern int     fio_flock(int fd, int operation);
 extern int     fio_close(int fd);
 
 /* FILE-style functions */
@@ -127,6 +152,8 @@ extern int     fio_fprintf(FILE* f, const char* arg, ...) pg_attribute_printf(2,
 extern int     fio_fflush(FILE* f);
 extern int     fio_fseek(FILE* f, off_t offs);
 extern int     fio_ftruncate(FILE* f, off_t size);
+extern int     fio_fpreallocate(FILE* f, off_t size);
+extern int     fio_fzero_range(FILE* f, off_t offs, off_t len);
 extern int     fio_fclose(FILE* f);
 extern int     fio_ffstat(FILE* f, struct stat* st);
 
@@ -159,6 +186,18 @@ extern int     fio_mkdir(fio_location location, const char* path, int mode, bool
 extern int     fio_chmod(fio_location location, const char* path, int mode);
 extern int     fio_access(fio_location location, const char* path, int mode);
 extern int     fio_stat(fio_location location, const char* path, struct stat* st, bool follow_symlinks);
+
+typedef struct fio_batch fio_batch;
+
+extern fio_batch *fio_batch_begin(fio_location location);
+extern void    fio_batch_sync(fio_batch *batch, const char *path, int *result);
+extern void    fio_batch_remove(fio_batch *batch, const char *path, bool missing_ok, int *result);
+extern void    fio_batch_mkdir(fio_batch *batch, const char *path, int mode, bool strict, int *result);
+extern void    fio_batch_wait(fio_batch *batch);
+extern void    fio_batch_end(fio_batch *batch);
+extern void    fio_remove_tree(fio_location location, const char *root, int n_threads);
+extern void    fio_remove_files(fio_location location, const char *dir, char **names,
+								size_t n_names, int n_threads);
 extern bool    fio_is_same_file(fio_location location, const char* filename1, const char* filename2, bool follow_symlink);
 extern ssize_t fio_readlink(fio_location location, const char *path, char *value, size_t valsiz);
 extern pid_t   fio_check_postmaster(fio_location location, const char *pgdata);
@@ -0,0 +1,658 @@
+/*-------------------------------------------------------------------------
+ *
+ * mux.c: multiplexing of remote agent connections over one SSH session.
+ *
+ * Every thread talking to the remote host needs its own agent connection.
+ * Instead of launching a separate SSH process per thread, the client starts
+ * one SSH session, switches the agent at the other side into the multiplexer
+ * mode with FIO_MUX request and then opens a logical channel per thread.
+ *
+ * At the client side a relay thread moves data between the SSH pipes and
+ * local socket pairs, one socket pair per channel, so a thread uses its
+ * channel exactly like a direct connection to the agent.  At the agent side
+ * a separate agent process is forked for every channel, and the relay loop
+ * of the multiplexing agent moves data between the SSH pipes and these
+ * processes.  Standard error of a channel process is forwarded to the client
+ * before the channel is closed, so agent error messages are reported just
+ * like with direct connections.
+ *
+ * Data is sent over the SSH session in frames tagged with the channel id.
+ * Relay loops never block: when too much data is queued for a channel, the
+ * relay stops reading the SSH session until the channel catches up.
+ *
+ * Portions Copyright (c) 2015-2022, Postgres Professional
+ *
+ *-------------------------------------------------------------------------
+ */
+
+#include <fcntl.h>
+#include <poll.h>
+#include <signal.h>
+#include <sys/socket.h>
+#include <sys/wait.h>
+#include <unistd.h>
+
+#include "pg_probackup.h"
+
+#include "file.h"
+
+/* amount of data read from a descriptor at once */
+#define MUX_READ_SIZE		(64 * 1024)
+/* queued data limit, above it the relay stops reading new data */
+#define MUX_MAX_QUEUED		(1024 * 1024)
+
+typedef enum
+{
+	MUX_OPEN,		/* open channel, client to agent */
+	MUX_DATA,		/* channel data */
+	MUX_STDERR,		/* standard error of channel process, agent to client */
+	MUX_CLOSE		/* channel is closed by the sender */
+} fio_mux_frame_type;
+
+typedef struct
+{
+	uint32		channel;
+	uint32		type;
+	uint32		size;
+} fio_mux_frame;
+
+typedef struct
+{
+	char	   *data;
+	size_t		pos;			/* consumed bytes */
+	size_t		len;			/* stored bytes */
+	size_t		size;			/* allocated bytes */
+} MuxBuffer;
+
+typedef struct
+{
+	uint32		id;
+	/* relay side of the channel socket */
+	int			fd;
+	/*
+	 * Client: write end of stderr pipe of the channel.
+	 * Agent: read end of stderr pipe of the channel process.
+	 */
+	int			err_fd;
+	pid_t		pid;			/* agent: channel process */
+	bool		opened;			/* client: MUX_OPEN frame is queued */
+	bool		closing;		/* closed by the other side, flushing out */
+	MuxBuffer	out;			/* data to be written to fd */
+} MuxChannel;
+
+struct fio_mux
+{
+	bool		agent;
+	int			in;				/* SSH session input */
+	int			out;			/* SSH session output */
+	MuxBuffer	trunk_in;
+	MuxBuffer	trunk_out;
+
+	MuxChannel *channels;
+	int			n_channels;
+	int			max_channels;
+
+	/* client only */
+	pthread_mutex_t lock;
+	int			wakeup[2];		/* pipe to wake up the relay thread */
+	int			err;			/* SSH stderr */
+	pid_t		ssh_pid;
+	uint32		next_id;
+	bool		broken;
+};
+
+static void
+mux_set_nonblock(int fd)
+{
+	int			flags = fcntl(fd, F_GETFL);
+
+	if (flags < 0 || fcntl(fd, F_SETFL, flags | O_NONBLOCK) < 0)
+		elog(ERROR, "Cannot set non-blocking mode: %s", strerror(errno));
+}
+
+static size_t
+mux_buffer_pending(MuxBuffer *buf)
+{
+	return buf->len - buf->pos;
+}
+
+static void
+mux_buffer_append(MuxBuffer *buf, const void *data, size_t size)
+{
+	/* reclaim consumed space before growing the buffer */
+	if (buf->pos > 0 && buf->len + size > buf->size)
+	{
+		memmove(buf->data, buf->data + buf->pos, buf->len - buf->pos);
+		buf->len -= buf->pos;
+		buf->pos = 0;
+	}
+
+	if (buf->len + size > buf->size)
+	{
+		buf->size = Max(buf->size * 2, buf->len + size);
+		buf->data = pgut_realloc(buf->data, buf->size);
+	}
+
+	memcpy(buf->data + buf->len, data, size);
+	buf->len += size;
+}
+
+static void
+mux_buffer_consume(MuxBuffer *buf, size_t size)
+{
+	buf->pos += size;
+	if (buf->pos == buf->len)
+		buf->pos = buf->len = 0;
+}
+
+static void
+mux_send_frame(fio_mux *mux, uint32 channel, fio_mux_frame_type type,
+			   const void *data, size_t size)
+{
+	fio_mux_frame frame = {
+		.channel = channel,
+		.type = type,
+		.size = size,
+	};
+
+	mux_buffer_append(&mux->trunk_out, &frame, sizeof(frame));
+	if (size > 0)
+		mux_buffer_append(&mux->trunk_out, data, size);
+}
+
+static int
+mux_find_channel(fio_mux *mux, uint32 id)
+{
+	int			i;
+
+	for (i = 0; i < mux->n_channels; i++)
+		if (mux->channels[i].id == id && mux->channels[i].fd >= 0)
+			return i;
+	return -1;
+}
+
+static void
+mux_add_channel(fio_mux *mux, uint32 id, int fd, int err_fd, pid_t pid)
+{
+	MuxChannel *channel;
+
+	if (mux->n_channels == mux->max_channels)
+	{
+		mux->max_channels = Max(mux->max_channels * 2, 16);
+		mux->channels = pgut_realloc(mux->channels, sizeof(MuxChannel) * mux->max_channels);
+	}
+
+	channel = &mux->channels[mux->n_channels++];
+	memset(channel, 0, sizeof(MuxChannel));
+	channel->id = id;
+	channel->fd = fd;
+	channel->err_fd = err_fd;
+	channel->pid = pid;
+}
+
+/* Forward everything the channel process wrote to stderr */
+static void
+mux_forward_stderr(fio_mux *mux, MuxChannel *channel, bool wait_eof)
+{
+	char		buf[4096];
+
+	while (channel->err_fd >= 0)
+	{
+		ssize_t		rc = read(channel->err_fd, buf, sizeof(buf));
+
+		if (rc > 0)
+			mux_send_frame(mux, channel->id, MUX_STDERR, buf, rc);
+		else if (rc < 0 && errno == EINTR)
+			continue;
+		else if (rc < 0 && errno == EAGAIN && wait_eof)
+		{
+			struct pollfd pfd = {.fd = channel->err_fd, .events = POLLIN};
+
+			poll(&pfd, 1, 1000);
+		}
+		else
+		{
+			if (rc == 0 || errno != EAGAIN)
+			{
+				close(channel->err_fd);
+				channel->err_fd = -1;
+			}
+			break;
+		}
+	}
+}
+
+/*
+ * Close channel.  If notify is true, the other side is told about it,
+ * otherwise the channel was closed by the other side.
+ */
+static void
+mux_close_channel(fio_mux *mux, int idx, bool notify)
+{
+	MuxChannel *channel = &mux->channels[idx];
+
+	/* channel process is gone, make sure its last words are delivered */
+	if (mux->agent && notify)
+		mux_forward_stderr(mux, channel, true);
+
+	if (notify)
+		mux_send_frame(mux, channel->id, MUX_CLOSE, NULL, 0);
+
+	close(channel->fd);
+	if (channel->err_fd >= 0)
+		close(channel->err_fd);
+	pg_free(channel->out.data);
+
+	/* the last channel takes place of the closed one */
+	mux->channels[idx] = mux->channels[--mux->n_channels];
+}
+
+/* Agent: fork a process serving the new channel */
+static void
+mux_agent_open_channel(fio_mux *mux, uint32 id)
+{
+	int			sv[2];
+	int			ev[2];
+	pid_t		pid;
+
+	if (socketpair(AF_UNIX, SOCK_STREAM, 0, sv) < 0 || pipe(ev) < 0)
+		elog(ERROR, "Cannot create channel: %s", strerror(errno));
+
+	pid = fork();
+	if (pid < 0)
+		elog(ERROR, "Cannot fork channel process: %s", strerror(errno));
+
+	if (pid == 0)
+	{
+		int			i;
+
+		/* keep only our own end of the channel */
+		for (i = 0; i < mux->n_channels; i++)
+		{
+			close(mux->channels[i].fd);
+			if (mux->channels[i].err_fd >= 0)
+				close(mux->channels[i].err_fd);
+		}
+		close(mux->in);
+		close(mux->out);
+		close(sv[0]);
+		close(ev[0]);
+
+		SYS_CHECK(dup2(ev[1], STDERR_FILENO));
+		close(ev[1]);
+
+		fio_communicate(sv[1], sv[1]);
+		exit(EXIT_SUCCESS);
+	}
+
+	close(sv[1]);
+	close(ev[1]);
+	mux_set_nonblock(sv[0]);
+	mux_set_nonblock(ev[0]);
+
+	mux_add_channel(mux, id, sv[0], ev[0], pid);
+}
+
+/* Process complete frames received from the SSH session */
+static void
+mux_process_frames(fio_mux *mux)
+{
+	MuxBuffer  *buf = &mux->trunk_in;
+
+	while (mux_buffer_pending(buf) >= sizeof(fio_mux_frame))
+	{
+		fio_mux_frame frame;
+		char	   *data;
+		int			idx;
+
+		memcpy(&frame, buf->data + buf->pos, sizeof(frame));
+		if (mux_buffer_pending(buf) < sizeof(frame) + frame.size)
+			break;
+		data = buf->data + buf->pos + sizeof(frame);
+
+		idx = mux_find_channel(mux, frame.channel);
+
+		switch (frame.type)
+		{
+			case MUX_OPEN:
+				if (mux->agent && idx < 0)
+					mux_agent_open_channel(mux, frame.channel);
+				break;
+			case MUX_DATA:
+				/* data for a closed channel is discarded */
+				if (idx >= 0)
+					mux_buffer_append(&mux->channels[idx].out, data, frame.size);
+				break;
+			case MUX_STDERR:
+				/* nobody may read it, so do not wait for pipe */
+				if (idx >= 0 && !mux->agent && mux->channels[idx].err_fd >= 0)
+				{
+					if (write(mux->channels[idx].err_fd, data, frame.size) < 0)
+						elog(VERBOSE, "Cannot forward agent error message: %s", strerror(errno));
+				}
+				break;
+			case MUX_CLOSE:
+				/* deliver the rest of data before closing the channel */
+				if (idx >= 0 && mux_buffer_pending(&mux->channels[idx].out) > 0)
+					mux->channels[idx].closing = true;
+				else if (idx >= 0)
+					mux_close_channel(mux, idx, false);
+				break;
+			default:
+				elog(ERROR, "Unexpected frame type in SSH session: %u", frame.type);
+		}
+
+		mux_buffer_consume(buf, sizeof(frame) + frame.size);
+	}
+}
+
+static void
+mux_lock(fio_mux *mux)
+{
+	if (!mux->agent)
+		pthread_mutex_lock(&mux->lock);
+}
+
+static void
+mux_unlock(fio_mux *mux)
+{
+	if (!mux->agent)
+		pthread_mutex_unlock(&mux->lock);
+}
+
+/*
+ * Relay data between SSH session and channels until the session is closed.
+ */
+static void
+mux_relay(fio_mux *mux)
+{
+	struct pollfd *fds = NULL;
+	int			max_fds = 0;
+	char	   *buf = pgut_malloc(MUX_READ_SIZE);
+
+	for (;;)
+	{
+		int			n_channels;
+		int			i;
+		bool		read_trunk = true;
+		bool		read_channels;
+		ssize_t		rc;
+
+		mux_lock(mux);
+
+		/* announce new channels */
+		for (i = 0; i < mux->n_channels; i++)
+		{
+			MuxChannel *channel = &mux->channels[i];
+
+			if (!mux->agent && !channel->opened)
+			{
+				mux_send_frame(mux, channel->id, MUX_OPEN, NULL, 0);
+				channel->opened = true;
+			}
+			if (mux_buffer_pending(&channel->out) > MUX_MAX_QUEUED)
+				read_trunk = false;
+		}
+		read_channels = mux_buffer_pending(&mux->trunk_out) <= MUX_MAX_QUEUED;
+
+		n_channels = mux->n_channels;
+		if (max_fds < 3 + 2 * n_channels)
+		{
+			max_fds = 3 + 2 * n_channels;
+			fds = pgut_realloc(fds, sizeof(struct pollfd) * max_fds);
+		}
+
+		fds[0].fd = read_trunk ? mux->in : -1;
+		fds[0].events = POLLIN;
+		fds[1].fd = mux_buffer_pending(&mux->trunk_out) > 0 ? mux->out : -1;
+		fds[1].events = POLLOUT;
+		fds[2].fd = mux->agent ? -1 : mux->wakeup[0];
+		fds[2].events = POLLIN;
+
+		for (i = 0; i < n_channels; i++)
+		{
+			MuxChannel *channel = &mux->channels[i];
+			struct pollfd *pfd = &fds[3 + 2 * i];
+
+			pfd->fd = channel->fd;
+			pfd->events = (read_channels && !channel->closing ? POLLIN : 0) |
+				(mux_buffer_pending(&channel->out) > 0 ? POLLOUT : 0);
+			pfd++;
+			pfd->fd = mux->agent && read_channels ? channel->err_fd : -1;
+			pfd->events = POLLIN;
+		}
+
+		mux_unlock(mux);
+
+		if (poll(fds, 3 + 2 * n_channels, -1) < 0)
+		{
+			if (errno == EINTR)
+				continue;
+			elog(ERROR, "poll() failed in SSH session relay: %s", strerror(errno));
+		}
+
+		mux_lock(mux);
+
+		/* SSH session output */
+		if (fds[1].fd >= 0 && fds[1].revents)
+		{
+			rc = write(mux->out, mux->trunk_out.data + mux->trunk_out.pos,
+					   mux_buffer_pending(&mux->trunk_out));
+			if (rc > 0)
+				mux_buffer_consume(&mux->trunk_out, rc);
+			else if (rc < 0 && errno != EAGAIN && errno != EINTR)
+				break;
+		}
+
+		/* SSH session input */
+		if (fds[0].fd >= 0 && fds[0].revents)
+		{
+			rc = read(mux->in, buf, MUX_READ_SIZE);
+			if (rc > 0)
+			{
+				mux_buffer_append(&mux->trunk_in, buf, rc);
+				mux_process_frames(mux);
+			}
+			else if (rc == 0 || (errno != EAGAIN && errno != EINTR))
+				break;
+		}
+
+		if (fds[2].fd >= 0 && fds[2].revents)
+		{
+			if (read(mux->wakeup[0], buf, MUX_READ_SIZE) < 0 && errno != EAGAIN)
+				elog(WARNING, "Cannot read wakeup pipe: %s", strerror(errno));
+		}
+
+		/*
+		 * Channels polled in this iteration, backwards, since closing
+		 * of a channel moves the last channel into its place.  Channels
+		 * closed by the other side are already gone, so check the fd.
+		 */
+		for (i = n_channels - 1; i >= 0; i--)
+		{
+			struct pollfd *pfd = &fds[3 + 2 * i];
+			MuxChannel *channel;
+
+			if (i >= mux->n_channels || mux->channels[i].fd != pfd->fd)
+				continue;
+			channel = &mux->channels[i];
+
+			if (mux->agent && pfd[1].fd >= 0 && pfd[1].revents)
+				mux_forward_stderr(mux, channel, false);
+
+			if (pfd->revents & POLLOUT)
+			{
+				rc = send(channel->fd, channel->out.data + channel->out.pos,
+						  mux_buffer_pending(&channel->out), MSG_NOSIGNAL);
+				if (rc > 0)
+					mux_buffer_consume(&channel->out, rc);
+				else if (rc < 0 && errno != EAGAIN && errno != EINTR)
+				{
+					mux_close_channel(mux, i, !channel->closing);
+					continue;
+				}
+
+				if (channel->closing && mux_buffer_pending(&channel->out) == 0)
+				{
+					mux_close_channel(mux, i, false);
+					continue;
+				}
+			}
+			else if (channel->closing && (pfd->revents & (POLLHUP | POLLERR)))
+			{
+				/* nobody is going to read the rest */
+				mux_close_channel(mux, i, false);
+				continue;
+			}
+
+			if (!channel->closing && (pfd->revents & (POLLIN | POLLHUP | POLLERR)))
+			{
+				rc = recv(channel->fd, buf, MUX_READ_SIZE, 0);
+				if (rc > 0)
+					mux_send_frame(mux, channel->id, MUX_DATA, buf, rc);
+				else if (rc == 0 || (errno != EAGAIN && errno != EINTR))
+					mux_close_channel(mux, i, true);
+			}
+		}
+
+		/* reap finished channel processes */
+		if (mux->agent)
+			while (waitpid(-1, NULL, WNOHANG) > 0);
+
+		mux_unlock(mux);
+	}
+
+	/* SSH session is gone, so are all the channels */
+	while (mux->n_channels > 0)
+		mux_close_channel(mux, mux->n_channels - 1, false);
+	if (!mux->agent)
+		mux->broken = true;
+
+	mux_unlock(mux);
+
+	pg_free(fds);
+	pg_free(buf);
+}
+
+/*
+ * Agent: serve channels of the client over in/out until the SSH session
+ * is closed.
+ */
+void
+fio_mux_agent(int in, int out)
+{
+	fio_mux    *mux = pgut_new0(fio_mux);
+
+	mux->agent = true;
+	mux->in = in;
+	mux->out = out;
+	mux_set_nonblock(in);
+	mux_set_nonblock(out);
+
+	mux_relay(mux);
+
+	/* wait for channel processes, they got EOF already */
+	while (wait(NULL) > 0);
+}
+
+static void *
+mux_relay_thread(void *arg)
+{
+	fio_mux    *mux = (fio_mux *) arg;
+	char		buf[1024];
+	ssize_t		rc;
+	int			status;
+
+	mux_relay(mux);
+
+	/* report why the session is gone, if SSH has anything to say */
+	rc = read(mux->err, buf, sizeof(buf) - 1);
+	if (rc > 0)
+	{
+		buf[rc] = '\0';
+		elog(WARNING, "SSH session is closed: %s", buf);
+	}
+	waitpid(mux->ssh_pid, &status, 0);
+	elog(LOG, "SSH process %d is terminated with status %d", mux->ssh_pid, status);
+
+	return NULL;
+}
+
+/*
+ * Client: start relay of the SSH session, the agent at the other side
+ * must be already switched into multiplexer mode.
+ */
+fio_mux *
+fio_mux_start(int in, int out, int err, pid_t ssh_pid)
+{
+	fio_mux    *mux = pgut_new0(fio_mux);
+	pthread_t	thread;
+
+	mux->agent = false;
+	mux->in = in;
+	mux->out = out;
+	mux->err = err;
+	mux->ssh_pid = ssh_pid;
+	pthread_mutex_init(&mux->lock, NULL);
+
+	if (pipe(mux->wakeup) < 0)
+		elog(ERROR, "Cannot create pipe: %s", strerror(errno));
+	mux_set_nonblock(mux->wakeup[0]);
+	mux_set_nonblock(mux->wakeup[1]);
+	mux_set_nonblock(in);
+	mux_set_nonblock(out);
+	mux_set_nonblock(err);
+
+	if (pthread_create(&thread, NULL, mux_relay_thread, mux) != 0)
+		elog(ERROR, "Cannot create SSH session relay thread");
+	pthread_detach(thread);
+
+	return mux;
+}
+
+/*
+ * Client: open a new channel, the agent connection is available
+ * through in, out and err descriptors exactly as a direct one.
+ * Returns false, if SSH session is already closed.
+ */
+bool
+fio_mux_open_channel(fio_mux *mux, int *in, int *out, int *err)
+{
+	int			sv[2];
+	int			ev[2];
+
+	if (socketpair(AF_UNIX, SOCK_STREAM, 0, sv) < 0)
+		return false;
+	if (pipe(ev) < 0)
+	{
+		close(sv[0]);
+		close(sv[1]);
+		return false;
+	}
+	mux_set_nonblock(sv[0]);
+	mux_set_nonblock(ev[1]);
+
+	pthread_mutex_lock(&mux->lock);
+	if (mux->broken)
+	{
+		pthread_mutex_unlock(&mux->lock);
+		close(sv[0]);
+		close(sv[1]);
+		close(ev[0]);
+		close(ev[1]);
+		errno = ECONNRESET;
+		return false;
+	}
+	mux_add_channel(mux, mux->next_id++, sv[0], ev[1], 0);
+	pthread_mutex_unlock(&mux->lock);
+
+	/* let the relay thread announce the channel */
+	if (write(mux->wakeup[1], "", 1) < 0 && errno != EAGAIN)
+		elog(WARNING, "Cannot write to wakeup pipe: %s", strerror(errno));
+
+	*in = sv[1];
+	*out = dup(sv[1]);
+	*err = ev[0];
+
+	return true;
+}
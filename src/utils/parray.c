@@ -18,6 +18,7 @@ struct parray
 	void **data;		/* pointer array, expanded if necessary */
 	size_t alloced;		/* number of elements allocated */
 	size_t used;		/* number of elements in use */
+	pgut_arena *arena;	/* memory of the elements, if any */
 };
 
 /*
@@ -32,6 +33,7 @@ parray_new(void)
 	a->data = NULL;
 	a->used = 0;
 	a->alloced = 0;
+	a->arena = NULL;
 
 	parray_expand(a, 1024);
 
@@ -66,10 +68,28 @@ parray_free(parray *array)
 {
 	if (array == NULL)
 		return;
+	pgut_arena_free(array->arena);
 	free(array->data);
 	free(array);
 }
 
+/*
+ * Attach arena to the array. Elements are expected to be allocated in the
+ * arena, it's released together with the array by parray_free().
+ */
+void
+parray_set_arena(parray *array, pgut_arena *arena)
+{
+	Assert(array->arena == NULL);
+	array->arena = arena;
+}
+
+pgut_arena *
+parray_get_arena(const parray *array)
+{
+	return array->arena;
+}
+
 void
 parray_append(parray *array, void *elem)
 {
@@ -217,3 +237,100 @@ bool parray_contains(parray *array, void *elem)
 	}
 	return false;
 }
+
+/*
+ * Hash index of parray elements.
+ *
+ * Open addressing with linear probing. Every slot keeps the hash of the
+ * element along with its position, so elements are compared only if their
+ * hashes match. The index is not updated by changes of the array, it has to
+ * be rebuilt after elements are added, removed or reordered.
+ */
+typedef struct parray_index_slot
+{
+	uint32		hash;
+	uint32		pos;			/* position in array plus one, 0 if empty */
+} parray_index_slot;
+
+struct parray_index
+{
+	parray	   *array;
+	uint32		(*hash) (const void *);
+	int			(*compare) (const void *, const void *);
+	uint32		mask;
+	parray_index_slot *slots;
+};
+
+/*
+ * Build hash index of the array. Hash and compare functions get pointers to
+ * array elements, like compare function of parray_qsort() does.
+ * Elements with equal keys are found in the order of their positions.
+ */
+parray_index *
+parray_index_build(parray *array, uint32 (*hash) (const void *),
+				   int (*compare) (const void *, const void *))
+{
+	parray_index *index = pgut_new(parray_index);
+	size_t		n_slots = 16;
+	size_t		i;
+
+	Assert(array->used < PG_UINT32_MAX / 2);
+
+	/* keep the index at most half full */
+	while (n_slots < array->used * 2)
+		n_slots <<= 1;
+
+	index->array = array;
+	index->hash = hash;
+	index->compare = compare;
+	index->mask = (uint32) (n_slots - 1);
+	index->slots = pgut_malloc0(sizeof(parray_index_slot) * n_slots);
+
+	for (i = 0; i < array->used; i++)
+	{
+		uint32		h = hash(&array->data[i]);
+		uint32		slot = h & index->mask;
+
+		while (index->slots[slot].pos != 0)
+			slot = (slot + 1) & index->mask;
+
+		index->slots[slot].hash = h;
+		index->slots[slot].pos = (uint32) i + 1;
+	}
+
+	return index;
+}
+
+/*
+ * Find element equal to the key. Returns pointer to the element in the
+ * array, the same way as parray_bsearch() does, or NULL.
+ */
+void *
+parray_index_find(parray_index *index, const void *key)
+{
+	uint32		h = index->hash(&key);
+	uint32		slot = h & index->mask;
+
+	while (index->slots[slot].pos != 0)
+	{
+		if (index->slots[slot].hash == h)
+		{
+			void	  **elem = &index->array->data[index->slots[slot].pos - 1];
+
+			if (index->compare(&key, elem) == 0)
+				return elem;
+		}
+		slot = (slot + 1) & index->mask;
+	}
+
+	return NULL;
+}
+
+void
+parray_index_free(parray_index *index)
+{
+	if (index == NULL)
+		return;
+	free(index->slots);
+	free(index);
+}
@@ -15,6 +15,9 @@
  * Client use "parray *" to access parray object.
  */
 typedef struct parray parray;
+typedef struct parray_index parray_index;
+
+struct pgut_arena;				/* see pgut.h */
 
 extern parray *parray_new(void);
 extern void parray_expand(parray *array, size_t newnum);
@@ -32,6 +35,13 @@ extern void *parray_bsearch(parray *array, const void *key, int(*compare)(const
 extern int parray_bsearch_index(parray *array, const void *key, int(*compare)(const void *, const void *));
 extern void parray_walk(parray *array, void (*action)(void *));
 extern bool parray_contains(parray *array, void *elem);
+extern void parray_set_arena(parray *array, struct pgut_arena *arena);
+extern struct pgut_arena *parray_get_arena(const parray *array);
+
+extern parray_index *parray_index_build(parray *array, uint32 (*hash)(const void *),
+										int (*compare)(const void *, const void *));
+extern void *parray_index_find(parray_index *index, const void *key);
+extern void parray_index_free(parray_index *index);
 
 #endif /* PARRAY_H */
 
@@ -956,6 +956,122 @@ pgut_free(void *p)
 	free(p);
 }
 
+/*
+ * Arena allocator.
+ *
+ * Memory is carved out of large blocks and released all at once by
+ * pgut_arena_free(), single allocations cannot be freed. Blocks grow
+ * twice up to ARENA_MAX_BLOCK_SIZE, so small arenas stay small.
+ * Arena is not thread-safe.
+ */
+#define ARENA_MIN_BLOCK_SIZE	(8 * 1024)
+#define ARENA_MAX_BLOCK_SIZE	(1024 * 1024)
+
+typedef struct pgut_arena_block
+{
+	struct pgut_arena_block *next;
+	size_t		size;			/* usable size of the block */
+	size_t		used;
+} pgut_arena_block;
+
+#define ARENA_BLOCK_HDRSZ	MAXALIGN(sizeof(pgut_arena_block))
+
+struct pgut_arena
+{
+	pgut_arena_block *blocks;	/* current block goes first */
+	size_t		next_block_size;
+	size_t		total_size;
+};
+
+pgut_arena *
+pgut_arena_create(void)
+{
+	pgut_arena *arena = pgut_new0(pgut_arena);
+
+	arena->next_block_size = ARENA_MIN_BLOCK_SIZE;
+	return arena;
+}
+
+void *
+pgut_arena_alloc(pgut_arena *arena, size_t size)
+{
+	pgut_arena_block *block = arena->blocks;
+	char	   *ret;
+
+	size = MAXALIGN(size);
+
+	if (block == NULL || block->size - block->used < size)
+	{
+		size_t		block_size = Max(arena->next_block_size, size);
+
+		block = pgut_malloc(ARENA_BLOCK_HDRSZ + block_size);
+		block->size = block_size;
+		block->used = 0;
+
+		/* keep the current block, if the new one is dedicated to a large chunk */
+		if (arena->blocks && block_size > arena->next_block_size)
+		{
+			block->next = arena->blocks->next;
+			arena->blocks->next = block;
+		}
+		else
+		{
+			block->next = arena->blocks;
+			arena->blocks = block;
+		}
+
+		arena->total_size += block_size;
+		arena->next_block_size = Min(arena->next_block_size * 2, ARENA_MAX_BLOCK_SIZE);
+	}
+
+	ret = (char *) block + ARENA_BLOCK_HDRSZ + block->used;
+	block->used += size;
+
+	return ret;
+}
+
+char *
+pgut_arena_strdup(pgut_arena *arena, const char *str)
+{
+	size_t		len;
+	char	   *ret;
+
+	if (str == NULL)
+		return NULL;
+
+	len = strlen(str) + 1;
+	ret = pgut_arena_alloc(arena, len);
+	memcpy(ret, str, len);
+
+	return ret;
+}
+
+/* Amount of memory allocated by the arena */
+size_t
+pgut_arena_size(pgut_arena *arena)
+{
+	return arena->total_size;
+}
+
+void
+pgut_arena_free(pgut_arena *arena)
+{
+	pgut_arena_block *block;
+
+	if (arena == NULL)
+		return;
+
+	block = arena->blocks;
+	while (block)
+	{
+		pgut_arena_block *next = block->next;
+
+		free(block);
+		block = next;
+	}
+	free(arena);
+}
+
 int
 wait_for_socket(int sock, struct timeval *timeout)
 {
@@ -71,6 +71,17 @@ extern void  pgut_free(void *p);
 #define pgut_new0(type)			((type *) pgut_malloc0(sizeof(type)))
 #define pgut_newarray(type, n)	((type *) pgut_malloc(sizeof(type) * (n)))
 
+/*
+ * arena allocator, memory is released all at once
+ */
+typedef struct pgut_arena pgut_arena;
+
+extern pgut_arena *pgut_arena_create(void);
+extern void *pgut_arena_alloc(pgut_arena *arena, size_t size);
+extern char *pgut_arena_strdup(pgut_arena *arena, const char *str);
+extern size_t pgut_arena_size(pgut_arena *arena);
+extern void  pgut_arena_free(pgut_arena *arena);
+
 /*
  * Assert
  */
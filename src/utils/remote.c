@@ -55,6 +55,17 @@ static int split_options(int argc, char* argv[], int max_options, char* options)
 
 static __thread int child_pid;
 
+/*
+ * SSH session shared by all threads of the process, every thread
+ * has its own channel in it.
+ */
+static pthread_mutex_t ssh_session_lock = PTHREAD_MUTEX_INITIALIZER;
+static fio_mux *ssh_session = NULL;
+/* protocol version of agent of the shared session and all its channels */
+static int ssh_session_agent_version = 0;
+/* remote agent is too old to multiplex connections */
+static bool ssh_session_unsupported = false;
+
 #if 0
 static void kill_child(void)
 {
@@ -69,8 +80,14 @@ void wait_ssh(void)
  * We need to wait termination of SSH process to eliminate zombies.
  */
 	int status;
+
+	/* channel of the shared SSH session has no process of its own */
+	if (child_pid == 0)
+		return;
+
 	waitpid(child_pid, &status, 0);
 	elog(LOG, "SSH process %d is terminated with status %d",  child_pid, status);
+	child_pid = 0;
 }
 
 static bool needs_quotes(const char* path)
@@ -78,7 +95,8 @@ static bool needs_quotes(const char* path)
 	return strchr(path, ' ') != NULL;
 }
 
-bool launch_agent(void)
+/* Start SSH process running remote agent and connect current thread to it */
+static bool launch_ssh(void)
 {
 	char cmd[MAX_CMDLINE_LENGTH];
 	char* ssh_argv[MAX_CMDLINE_OPTIONS];
@@ -86,7 +104,6 @@ bool launch_agent(void)
 	int outfd[2];
 	int infd[2];
 	int errfd[2];
-	int agent_version;
 
 	ssh_argc = 0;
 	ssh_argv[ssh_argc++] = instance_config.remote.proto;
@@ -176,22 +193,115 @@ bool launch_agent(void)
 		fio_redirect(infd[0], outfd[1], errfd[0]); /* write to stdout */
 	}
 
-	/* Make sure that remote agent has the same version
+	return true;
+}
+
+/* Make sure that remote agent has compatible protocol version */
+static int check_agent_version(void)
+{
+	int agent_version;
+	char agent_version_str[1024];
+
+	/*
 	 * TODO: we must also check PG version
 	 */
 	agent_version = fio_get_agent_version();
-	if (agent_version != AGENT_PROTOCOL_VERSION_NUM)
-	{
-		char agent_version_str[1024];
-		sprintf(agent_version_str, "%d.%d.%d",
-				agent_version / 10000,
-				(agent_version / 100) % 100,
-				agent_version % 100);
+	sprintf(agent_version_str, "%d.%d.%d",
+			agent_version / 10000,
+			(agent_version / 100) % 100,
+			agent_version % 100);
 
+	if (agent_version < AGENT_PROTOCOL_VERSION_MIN_NUM ||
+		agent_version > AGENT_PROTOCOL_VERSION_NUM)
+	{
 		elog(ERROR, "Remote agent protocol version %s does not match local program protocol version %s, "
 					"consider to upgrade %s binary",
 			agent_version_str, AGENT_PROTOCOL_VERSION, PROGRAM_NAME);
 	}
+	elog(LOG, "Remote agent protocol version is %s", agent_version_str);
+
+	return agent_version;
+}
+
+static void ssh_session_unlock(void *arg)
+{
+	pthread_mutex_unlock(&ssh_session_lock);
+}
+
+/*
+ * Open channel of the shared SSH session for current thread, start the
+ * session if necessary.  Must be called with ssh_session_lock held.
+ * Returns 1 if current thread is connected, 0 on failure and -1 if
+ * the remote agent cannot share SSH session.  Agent version is checked
+ * only once, when the session is started.
+ */
+static int open_ssh_channel(void)
+{
+	int in, out, err;
+
+	if (ssh_session == NULL && !ssh_session_unsupported)
+	{
+		int agent_version;
+
+		if (!launch_ssh())
+			return 0;
+
+		agent_version = check_agent_version();
+		if (agent_version < FIO_MUX_AGENT_VERSION_NUM)
+		{
+			/* keep this connection for current thread */
+			ssh_session_unsupported = true;
+			return 1;
+		}
+
+		ssh_session_agent_version = agent_version;
+		ssh_session = fio_switch_to_mux(child_pid);
+		child_pid = 0;
+		elog(LOG, "SSH session is shared by all threads");
+	}
+
+	if (ssh_session == NULL)
+		return -1;
+
+	if (!fio_mux_open_channel(ssh_session, &in, &out, &err))
+		return 0;
+
+	fio_redirect(in, out, err);
+	/* agent of the channel is forked from the agent of the session */
+	fio_set_agent_version(ssh_session_agent_version);
+	return 1;
+}
+
+/*
+ * Connect current thread to remote agent.
+ *
+ * With several threads all of them share one SSH session, see mux.c,
+ * so the cost of SSH connection is paid only once and the number
+ * of SSH sessions on remote host does not grow with number of threads.
+ * Older agents do not support it, then every thread launches its own
+ * SSH process.
+ */
+bool launch_agent(void)
+{
+	if (num_threads > 1)
+	{
+		int rc;
+
+		pthread_mutex_lock(&ssh_session_lock);
+		/* thread exits on error, do not leave the lock behind */
+		pthread_cleanup_push(ssh_session_unlock, NULL);
+		rc = open_ssh_channel();
+		pthread_cleanup_pop(1);
+
+		if (rc == 0)
+			return false;
+		if (rc == 1)
+			return true;
+	}
+
+	if (!launch_ssh())
+		return false;
 
+	check_agent_version();
 	return true;
 }
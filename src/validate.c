@@ -15,8 +15,34 @@
 
 #include "utils/thread.h"
 
+/*
+ * Validation ledger.
+ *
+ * If validation-ledger-max-age is set, every file which passed validation
+ * is recorded in VALIDATION_LEDGER_FILE of the backup directory together
+ * with its identity: size, mtime and inode of the file and its CRC from
+ * the file list.  Next validations do not read files, which identity is
+ * the same and which were validated not earlier than validation-ledger-max-age
+ * ago.  With --full-validation all files are read and the ledger is written
+ * anew.
+ */
+typedef struct
+{
+	const char *path;
+	int64		size;
+	int64		mtime;
+	uint64		inode;
+	pg_crc32	crc;
+	bool		blocks;			/* pages were validated, not only file CRC */
+	time_t		validated_at;
+} ValidationLedgerEntry;
+
 static void *pgBackupValidateFiles(void *arg);
 static void do_validate_instance(InstanceState *instanceState);
+static int ValidationLedgerEntryCompare(const void *e1, const void *e2);
+static parray *read_validation_ledger(pgBackup *backup);
+static void write_validation_ledger(pgBackup *backup, ValidationLedgerEntry *entries,
+									size_t n_entries);
 
 static bool corrupted_backup_found = false;
 static bool skipped_due_to_lock = false;
@@ -33,6 +59,13 @@ typedef struct
 	parray		*dbOid_exclude_list;
 	HeaderMap   *hdr_map;
 
+	/* validation ledger, NULL if it is disabled */
+	parray	   *ledger;			/* entries of the previous validations */
+	ValidationLedgerEntry *new_ledger;	/* entries by index of file */
+	time_t		ledger_min_time;	/* older entries are not trusted */
+	time_t		validation_time;
+	size_t		n_ledger_skipped;
+
 	/*
 	 * Return value from the thread.
 	 * 0 means there is no error, 1 - there is an error.
@@ -54,6 +87,10 @@ pgBackupValidate(pgBackup *backup, pgRestoreParams *params)
 	pthread_t  *threads;
 	validate_files_arg *threads_args;
 	int			i;
+	parray	   *ledger = NULL;
+	ValidationLedgerEntry *new_ledger = NULL;
+	size_t		n_ledger_skipped = 0;
+	time_t		validation_time = time(NULL);
 //	parray		*dbOid_exclude_list = NULL;
 
 	/* Check backup program version */
@@ -127,6 +164,16 @@ pgBackupValidate(pgBackup *backup, pgRestoreParams *params)
 //		dbOid_exclude_list = get_dbOid_exclude_list(backup, files, params->partial_db_list,
 //														params->partial_restore_type);
 
+	if (instance_config.validation_ledger_max_age > 0)
+	{
+		new_ledger = pgut_malloc0(sizeof(ValidationLedgerEntry) *
+								  Max(parray_num(files), 1));
+		if (full_validation)
+			elog(INFO, "Validation ledger is ignored, all files are validated");
+		else
+			ledger = read_validation_ledger(backup);
+	}
+
 	/* setup threads */
 	pfilearray_clear_locks(files);
 
@@ -149,6 +196,12 @@ pgBackupValidate(pgBackup *backup, pgRestoreParams *params)
 		arg->checksum_version = backup->checksum_version;
 		arg->program_version_num = backup->program_version_num;
 		arg->hdr_map = &(backup->hdr_map);
+		arg->ledger = ledger;
+		arg->new_ledger = new_ledger;
+		arg->ledger_min_time = validation_time -
+			(time_t) instance_config.validation_ledger_max_age;
+		arg->validation_time = validation_time;
+		arg->n_ledger_skipped = 0;
 //		arg->dbOid_exclude_list = dbOid_exclude_list;
 		/* By default there are some error */
 		threads_args[i].ret = 1;
@@ -166,6 +219,7 @@ pgBackupValidate(pgBackup *backup, pgRestoreParams *params)
 			corrupted = true;
 		if (arg->ret == 1)
 			validation_isok = false;
+		n_ledger_skipped += arg->n_ledger_skipped;
 	}
 	if (!validation_isok)
 		elog(ERROR, "Data files validation failed");
@@ -173,9 +227,22 @@ pgBackupValidate(pgBackup *backup, pgRestoreParams *params)
 	pfree(threads);
 	pfree(threads_args);
 
+	if (new_ledger)
+	{
+		if (n_ledger_skipped > 0)
+			elog(INFO, "Backup %s: %lu files are not read, as they are validated "
+				 "according to the validation ledger",
+				 backup_id_of(backup), (unsigned long) n_ledger_skipped);
+
+		/* files, which failed validation, are not recorded */
+		write_validation_ledger(backup, new_ledger, parray_num(files));
+		pg_free(new_ledger);
+	}
+	if (ledger)
+		parray_free(ledger);
+
 	/* cleanup */
-	parray_walk(files, pgFileFree);
-	parray_free(files);
+	pgFileListFree(files);
 	cleanup_header_map(&(backup->hdr_map));
 
 	/* Update backup status */
@@ -283,6 +350,49 @@ pgBackupValidateFiles(void *arg)
 			break;
 		}
 
+		if (arguments->new_ledger)
+		{
+			ValidationLedgerEntry *entry = &arguments->new_ledger[i];
+			ValidationLedgerEntry *prev = NULL;
+
+			entry->size = st.st_size;
+			entry->mtime = st.st_mtime;
+			entry->inode = st.st_ino;
+			entry->crc = file->crc;
+			entry->blocks = file->is_datafile && !skip_block_validation;
+
+			if (arguments->ledger)
+			{
+				ValidationLedgerEntry key;
+				ValidationLedgerEntry **found;
+
+				key.path = file->rel_path;
+				found = (ValidationLedgerEntry **)
+					parray_bsearch(arguments->ledger, &key, ValidationLedgerEntryCompare);
+				if (found)
+					prev = *found;
+			}
+
+			/* the same file was validated recently enough */
+			if (prev &&
+				prev->size == entry->size &&
+				prev->mtime == entry->mtime &&
+				prev->inode == entry->inode &&
+				prev->crc == entry->crc &&
+				(prev->blocks || !entry->blocks) &&
+				prev->validated_at >= arguments->ledger_min_time &&
+				prev->validated_at <= arguments->validation_time)
+			{
+				elog(VERBOSE, "Skip file \"%s\", it is validated according to the validation ledger",
+					 file_fullpath);
+				entry->path = file->rel_path;
+				entry->blocks = prev->blocks;
+				entry->validated_at = prev->validated_at;
+				arguments->n_ledger_skipped++;
+				continue;
+			}
+		}
+
 		/*
 		 * If option skip-block-validation is set, compute only file-level CRC for
 		 * datafiles, otherwise check them block by block.
@@ -299,6 +409,7 @@ pgBackupValidateFiles(void *arg)
 				elog(WARNING, "Invalid CRC of backup file \"%s\" : %X. Expected %X",
 						file_fullpath, crc, file->crc);
 				arguments->corrupted = true;
+				continue;
 			}
 		}
 		else
@@ -312,7 +423,17 @@ pgBackupValidateFiles(void *arg)
 								  arguments->checksum_version,
 								  arguments->program_version_num,
 								  arguments->hdr_map))
+			{
 				arguments->corrupted = true;
+				continue;
+			}
+		}
+
+		/* record the file in the ledger */
+		if (arguments->new_ledger)
+		{
+			arguments->new_ledger[i].path = file->rel_path;
+			arguments->new_ledger[i].validated_at = arguments->validation_time;
 		}
 	}
 
@@ -672,8 +793,8 @@ validate_tablespace_map(pgBackup *backup, bool no_validate)
 	if (!tablespace_map)
 	{
 		elog(LOG, "there is no file tablespace_map");
-		parray_walk(files, pgFileFree);
-		parray_free(files);
+		pgFileFree(dummy);
+		pgFileListFree(files);
 		return false;
 	}
 
@@ -695,7 +816,179 @@ validate_tablespace_map(pgBackup *backup, bool no_validate)
 	}
 
 	pgFileFree(dummy);
-	parray_walk(files, pgFileFree);
-	parray_free(files);
+	pgFileListFree(files);
 	return true;
 }
+
+static int
+ValidationLedgerEntryCompare(const void *e1, const void *e2)
+{
+	ValidationLedgerEntry *entry1 = *(ValidationLedgerEntry **) e1;
+	ValidationLedgerEntry *entry2 = *(ValidationLedgerEntry **) e2;
+
+	return strcmp(entry1->path, entry2->path);
+}
+
+/*
+ * Read validation ledger of the backup. The ledger is only a cache, so
+ * if it is missing or corrupted, NULL is returned and all files are
+ * validated.
+ */
+static parray *
+read_validation_ledger(pgBackup *backup)
+{
+	FILE	   *fp;
+	char		path[MAXPGPATH];
+	char		buf[BLCKSZ];
+	char		stdio_buf[STDIO_BUFSIZE];
+	pg_crc32	content_crc = 0;
+	int64		ledger_crc = -1;
+	parray	   *ledger;
+	pgut_arena *arena;
+
+	join_path_components(path, backup->root_dir, VALIDATION_LEDGER_FILE);
+
+	fp = fopen(path, PG_BINARY_R);
+	if (fp == NULL)
+	{
+		if (errno != ENOENT)
+			elog(WARNING, "Cannot open validation ledger \"%s\": %s",
+				 path, strerror(errno));
+		return NULL;
+	}
+	setvbuf(fp, stdio_buf, _IOFBF, STDIO_BUFSIZE);
+
+	/* Check the content first, the ledger ends with CRC of the other lines */
+	INIT_CRC32C(content_crc);
+	while (fgets(buf, lengthof(buf), fp))
+	{
+		if (strncmp(buf, "{\"ledger_crc\":", strlen("{\"ledger_crc\":")) == 0)
+		{
+			get_control_value_int64(buf, "ledger_crc", &ledger_crc, false);
+			break;
+		}
+		COMP_CRC32C(content_crc, buf, strlen(buf));
+	}
+	FIN_CRC32C(content_crc);
+
+	if (ferror(fp) || ledger_crc != (int64) content_crc)
+	{
+		elog(WARNING, "Validation ledger \"%s\" is corrupted, all files of backup %s are validated",
+			 path, backup_id_of(backup));
+		fclose(fp);
+		return NULL;
+	}
+
+	ledger = parray_new();
+	arena = pgut_arena_create();
+	parray_set_arena(ledger, arena);
+
+	rewind(fp);
+	while (fgets(buf, lengthof(buf), fp))
+	{
+		ValidationLedgerEntry *entry;
+		char		entry_path[MAXPGPATH];
+		int64		value;
+
+		if (strncmp(buf, "{\"ledger_crc\":", strlen("{\"ledger_crc\":")) == 0)
+			break;
+
+		entry = pgut_arena_alloc(arena, sizeof(ValidationLedgerEntry));
+
+		get_control_value_str(buf, "path", entry_path, sizeof(entry_path), true);
+		entry->path = pgut_arena_strdup(arena, entry_path);
+		get_control_value_int64(buf, "size", &entry->size, true);
+		get_control_value_int64(buf, "mtime", &entry->mtime, true);
+		get_control_value_int64(buf, "inode", &value, true);
+		entry->inode = (uint64) value;
+		get_control_value_int64(buf, "crc", &value, true);
+		entry->crc = (pg_crc32) value;
+		get_control_value_int64(buf, "blocks", &value, true);
+		entry->blocks = value != 0;
+		get_control_value_int64(buf, "validated_at", &value, true);
+		entry->validated_at = (time_t) value;
+
+		parray_append(ledger, entry);
+	}
+	fclose(fp);
+
+	parray_qsort(ledger, ValidationLedgerEntryCompare);
+
+	elog(LOG, "Read %lu entries of validation ledger \"%s\"",
+		 (unsigned long) parray_num(ledger), path);
+
+	return ledger;
+}
+
+/*
+ * Write validation ledger of the backup, entries without path are skipped.
+ * Failure to write the ledger is not an error, the next validation
+ * just has to read all files.
+ */
+static void
+write_validation_ledger(pgBackup *backup, ValidationLedgerEntry *entries,
+						size_t n_entries)
+{
+	FILE	   *fp;
+	char		path[MAXPGPATH];
+	char		path_temp[MAXPGPATH];
+	char		line[MAXPGPATH + 256];
+	char		stdio_buf[STDIO_BUFSIZE];
+	pg_crc32	content_crc;
+	size_t		i;
+
+	join_path_components(path, backup->root_dir, VALIDATION_LEDGER_FILE);
+	/* backups are validated under shared lock, so several writers are possible */
+	snprintf(path_temp, sizeof(path_temp), "%s.tmp.%d", path, (int) getpid());
+
+	fp = fopen(path_temp, PG_BINARY_W);
+	if (fp == NULL)
+	{
+		elog(WARNING, "Cannot open validation ledger \"%s\": %s",
+			 path_temp, strerror(errno));
+		return;
+	}
+	setvbuf(fp, stdio_buf, _IOFBF, STDIO_BUFSIZE);
+
+	INIT_CRC32C(content_crc);
+	for (i = 0; i < n_entries; i++)
+	{
+		ValidationLedgerEntry *entry = &entries[i];
+		int			len;
+
+		if (entry->path == NULL)
+			continue;
+
+		len = snprintf(line, sizeof(line),
+					   "{\"path\":\"%s\", \"size\":\"" INT64_FORMAT "\", "
+					   "\"mtime\":\"" INT64_FORMAT "\", \"inode\":\"" UINT64_FORMAT "\", "
+					   "\"crc\":\"%u\", \"blocks\":\"%d\", \"validated_at\":\"" INT64_FORMAT "\"}\n",
+					   entry->path, entry->size, entry->mtime, entry->inode,
+					   entry->crc, entry->blocks ? 1 : 0, (int64) entry->validated_at);
+
+		COMP_CRC32C(content_crc, line, len);
+		fputs(line, fp);
+	}
+	FIN_CRC32C(content_crc);
+
+	fprintf(fp, "{\"ledger_crc\":\"%u\"}\n", content_crc);
+
+	if (fflush(fp) != 0 || ferror(fp))
+	{
+		elog(WARNING, "Cannot write validation ledger \"%s\": %s",
+			 path_temp, strerror(errno));
+		fclose(fp);
+		unlink(path_temp);
+		return;
+	}
+
+	if (fclose(fp) != 0 || rename(path_temp, path) < 0)
+	{
+		elog(WARNING, "Cannot write validation ledger \"%s\": %s",
+			 path, strerror(errno));
+		unlink(path_temp);
+		return;
+	}
+
+	elog(LOG, "Validation ledger of backup %s is written", backup_id_of(backup));
+}
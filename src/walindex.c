@@ -0,0 +1,987 @@
+/*-------------------------------------------------------------------------
+ *
+ * walindex.c: index of WAL archive.
+ *
+ * Listing of a large WAL archive requires reading the directory and
+ * stat() of every file in it, which takes minutes for millions of segments.
+ * Instead, every file pushed into the archive can be recorded in the index
+ * of its timeline, and the index is read when the archive must be listed.
+ *
+ * Index of the timeline is an append-only file of fixed size records,
+ * every record is protected by its own CRC.  Removal of a file from
+ * the archive is recorded as a record with WAL_INDEX_REMOVED flag,
+ * the latest record of a file wins.  Records are written with a single
+ * write() call, so only the tail of index can be torn by a crash;
+ * invalid records are skipped while reading.
+ *
+ * Index is used only if index directory exists in the WAL archive of
+ * the instance.  It is created by rebuild-wal-index command, which also
+ * reconstructs index from the archive directory.
+ *
+ * Rebuild replaces index files by rename(), so records appended to the
+ * old file concurrently would be lost.  To prevent this, rebuild holds
+ * an exclusive lock on the lock file of index directory, and every append
+ * holds a shared lock on it.
+ *
+ * Along with the index, the summary of every archived WAL segment is kept:
+ * the range of timestamps and xids of its records.  It allows to find
+ * the segment, which may contain the recovery target, without reading all
+ * WAL from the backup to the target.  Summary of the timeline is stored
+ * the same way as its index, in append-only file of fixed size records.
+ *
+ * Portions Copyright (c) 2015-2022, Postgres Professional
+ *
+ *-------------------------------------------------------------------------
+ */
+
+#include "pg_probackup.h"
+
+#include <sys/file.h>
+#include <sys/stat.h>
+
+#include "utils/file.h"
+
+#define WAL_INDEX_SUFFIX		"idx"
+#define WAL_SUMMARY_SUFFIX		"sum"
+#define WAL_INDEX_LOCK_FILE		"lock"
+
+/* types of indexed files */
+#define WAL_INDEX_SEGMENT			1
+#define WAL_INDEX_PARTIAL			2
+#define WAL_INDEX_BACKUP_HISTORY	3
+#define WAL_INDEX_TL_HISTORY		4
+
+/* record flags */
+#define WAL_INDEX_REMOVED		0x01	/* file was removed from archive */
+#define WAL_INDEX_NO_CRC		0x02	/* checksum of file is unknown */
+
+/* records are appended by chunks of this size */
+#define WAL_INDEX_WRITE_CHUNK	2048
+
+/*
+ * Segment number is stored as it appears in file name, so
+ * the index doesn't depend on WAL segment size.
+ */
+typedef struct WalIndexRecord
+{
+	uint32		log;
+	uint32		seg;
+	uint64		size;			/* size of file in archive */
+	uint32		offset;			/* start offset of backup history file */
+	pg_crc32	crc;			/* CRC32C of uncompressed file content */
+	uint8		type;
+	uint8		compress_alg;
+	uint8		flags;
+	uint8		padding;
+	pg_crc32	rec_crc;		/* CRC32C of the fields above */
+} WalIndexRecord;
+
+typedef struct WalIndexEntry
+{
+	WalIndexRecord rec;
+	size_t		seq;			/* position of record in index */
+} WalIndexEntry;
+
+/*
+ * Segment number of the summary is stored as LSN of the segment start,
+ * so the summary doesn't depend on WAL segment size either.
+ */
+typedef struct WalSummaryRecord
+{
+	WalSegmentSummary summary;
+	pg_crc32	rec_crc;		/* CRC32C of the summary */
+	uint32		padding;
+} WalSummaryRecord;
+
+static void
+wal_index_dir(char *path, const char *archive_dir)
+{
+	join_path_components(path, archive_dir, WAL_INDEX_DIR);
+}
+
+static void
+wal_index_file_path(char *path, const char *archive_dir, TimeLineID tli,
+					const char *suffix)
+{
+	char		name[MAXFNAMELEN];
+
+	snprintf(name, sizeof(name), "%08X.%s", tli, suffix);
+	join_path_components(path, archive_dir, WAL_INDEX_DIR);
+	join_path_components(path, path, name);
+}
+
+static void
+wal_index_path(char *path, const char *archive_dir, TimeLineID tli)
+{
+	wal_index_file_path(path, archive_dir, tli, WAL_INDEX_SUFFIX);
+}
+
+static void
+wal_summary_path(char *path, const char *archive_dir, TimeLineID tli)
+{
+	wal_index_file_path(path, archive_dir, tli, WAL_SUMMARY_SUFFIX);
+}
+
+static pg_crc32
+wal_index_record_crc(const WalIndexRecord *rec)
+{
+	pg_crc32	crc;
+
+	INIT_CRC32C(crc);
+	COMP_CRC32C(crc, rec, offsetof(WalIndexRecord, rec_crc));
+	FIN_CRC32C(crc);
+
+	return crc;
+}
+
+static pg_crc32
+wal_summary_record_crc(const WalSummaryRecord *rec)
+{
+	pg_crc32	crc;
+
+	INIT_CRC32C(crc);
+	COMP_CRC32C(crc, &rec->summary, sizeof(WalSegmentSummary));
+	FIN_CRC32C(crc);
+
+	return crc;
+}
+
+/*
+ * Fill index record using the name of archived file.
+ * Returns false, if file is not indexed: temp file or unexpected name.
+ */
+static bool
+wal_index_parse_name(const char *name, TimeLineID *tli, WalIndexRecord *rec)
+{
+	CompressAlg	alg;
+
+	MemSet(rec, 0, sizeof(WalIndexRecord));
+	rec->compress_alg = NONE_COMPRESS;
+
+	if (IsTLHistoryFileName(name))
+	{
+		sscanf(name, "%08X.history", tli);
+		rec->type = WAL_INDEX_TL_HISTORY;
+		return true;
+	}
+
+	if (strspn(name, "0123456789ABCDEF") != XLOG_FNAME_LEN ||
+		sscanf(name, "%08X%08X%08X", tli, &rec->log, &rec->seg) != 3)
+		return false;
+
+	if (IsXLogFileName(name))
+		rec->type = WAL_INDEX_SEGMENT;
+	else if (IsPartialXLogFileName(name))
+		rec->type = WAL_INDEX_PARTIAL;
+	else if (IsBackupHistoryFileName(name))
+	{
+		sscanf(name + XLOG_FNAME_LEN, ".%08X.backup", &rec->offset);
+		rec->type = WAL_INDEX_BACKUP_HISTORY;
+	}
+	else if ((alg = wal_compress_alg_by_name(name, "")) != NOT_DEFINED_COMPRESS)
+	{
+		rec->type = WAL_INDEX_SEGMENT;
+		rec->compress_alg = alg;
+	}
+	else if ((alg = wal_compress_alg_by_name(name, ".partial")) != NOT_DEFINED_COMPRESS)
+	{
+		rec->type = WAL_INDEX_PARTIAL;
+		rec->compress_alg = alg;
+	}
+	else
+		return false;
+
+	return true;
+}
+
+/* Construct the name of archived file from index record */
+static void
+wal_index_record_name(char *name, TimeLineID tli, const WalIndexRecord *rec)
+{
+	size_t		len;
+
+	if (rec->type == WAL_INDEX_TL_HISTORY)
+	{
+		snprintf(name, MAXFNAMELEN, "%08X.history", tli);
+		return;
+	}
+
+	snprintf(name, MAXFNAMELEN, "%08X%08X%08X", tli, rec->log, rec->seg);
+	len = strlen(name);
+
+	if (rec->type == WAL_INDEX_BACKUP_HISTORY)
+	{
+		snprintf(name + len, MAXFNAMELEN - len, ".%08X.backup", rec->offset);
+		return;
+	}
+
+	if (rec->compress_alg != NONE_COMPRESS)
+	{
+		snprintf(name + len, MAXFNAMELEN - len, ".%s",
+				 wal_compress_suffix(rec->compress_alg));
+		len = strlen(name);
+	}
+
+	if (rec->type == WAL_INDEX_PARTIAL)
+		snprintf(name + len, MAXFNAMELEN - len, ".partial");
+}
+
+/*
+ * Lock the index directory, shared lock is taken to append records and
+ * exclusive lock to rebuild the index.  Returns descriptor of the lock file,
+ * which must be passed to wal_index_unlock(), or -1 if archive has no index.
+ */
+static int
+wal_index_lock(const char *archive_dir, bool exclusive)
+{
+	char		path[MAXPGPATH];
+	int			fd;
+	bool		waiting = false;
+
+	wal_index_dir(path, archive_dir);
+	join_path_components(path, path, WAL_INDEX_LOCK_FILE);
+
+	fd = fio_open(FIO_BACKUP_HOST, path, O_RDWR | O_CREAT | PG_BINARY);
+	if (fd < 0)
+	{
+		if (errno == ENOENT)
+			return -1;
+		elog(ERROR, "Cannot open WAL index lock file \"%s\": %s", path, strerror(errno));
+	}
+
+	while (fio_flock(fd, (exclusive ? LOCK_EX : LOCK_SH) | LOCK_NB) != 0)
+	{
+		if (errno == ENOTSUP)
+		{
+			/* agent is too old, proceed without lock */
+			elog(exclusive ? WARNING : LOG,
+				 "Cannot lock WAL index lock file \"%s\": agent doesn't support file locks",
+				 path);
+			break;
+		}
+
+		if (errno != EWOULDBLOCK)
+			elog(ERROR, "Cannot lock WAL index lock file \"%s\": %s", path, strerror(errno));
+
+		if (interrupted)
+			elog(ERROR, "Interrupted while waiting for WAL index lock");
+
+		if (!waiting)
+		{
+			elog(LOG, "Waiting for WAL index lock \"%s\"", path);
+			waiting = true;
+		}
+
+		sleep(1);
+	}
+
+	return fd;
+}
+
+static void
+wal_index_unlock(int fd)
+{
+	if (fio_close(fd) != 0)
+		elog(ERROR, "Cannot close WAL index lock file: %s", strerror(errno));
+}
+
+/*
+ * Append fixed size records to the file in index directory.
+ * Returns false if archive has no index, that is not an error.
+ */
+static bool
+wal_index_append_file(const char *archive_dir, const char *path,
+					  const void *recs, size_t rec_size, size_t n_recs,
+					  bool no_sync)
+{
+	int			lock_fd;
+	int			fd;
+	size_t		i;
+
+	/* file must be opened under the lock, rebuild may replace it */
+	lock_fd = wal_index_lock(archive_dir, false);
+	if (lock_fd < 0)
+		return false;
+
+	fd = fio_open(FIO_BACKUP_HOST, path, O_WRONLY | O_CREAT | O_APPEND | PG_BINARY);
+	if (fd < 0)
+	{
+		if (errno == ENOENT)
+		{
+			wal_index_unlock(lock_fd);
+			return false;
+		}
+		elog(ERROR, "Cannot open WAL index file \"%s\": %s", path, strerror(errno));
+	}
+
+	/* every chunk is written by a single call, so only the tail can be torn */
+	for (i = 0; i < n_recs; i += WAL_INDEX_WRITE_CHUNK)
+	{
+		size_t		len = Min(n_recs - i, WAL_INDEX_WRITE_CHUNK) * rec_size;
+
+		if (fio_write(fd, (const char *) recs + i * rec_size, len) != len)
+			elog(ERROR, "Cannot write WAL index file \"%s\": %s", path, strerror(errno));
+	}
+
+	if (fio_close(fd) != 0)
+		elog(ERROR, "Cannot close WAL index file \"%s\": %s", path, strerror(errno));
+
+	if (!no_sync && fio_sync(FIO_BACKUP_HOST, path) != 0)
+		elog(ERROR, "Cannot sync WAL index file \"%s\": %s", path, strerror(errno));
+
+	wal_index_unlock(lock_fd);
+
+	return true;
+}
+
+/*
+ * Append records to the index of timeline.
+ * Returns false if archive has no index, that is not an error.
+ */
+static bool
+wal_index_append(const char *archive_dir, TimeLineID tli,
+				 WalIndexRecord *recs, size_t n_recs, bool no_sync)
+{
+	char		path[MAXPGPATH];
+	size_t		i;
+
+	wal_index_path(path, archive_dir, tli);
+
+	for (i = 0; i < n_recs; i++)
+		recs[i].rec_crc = wal_index_record_crc(&recs[i]);
+
+	return wal_index_append_file(archive_dir, path, recs, sizeof(WalIndexRecord),
+								 n_recs, no_sync);
+}
+
+/*
+ * Record the file, just pushed into archive, in the index.
+ * crc is the checksum of uncompressed file content.
+ * Returns false if archive has no index.
+ */
+bool
+wal_index_add_file(const char *archive_dir, const char *file_name,
+				   pg_crc32 crc, bool no_sync)
+{
+	char		path[MAXPGPATH];
+	struct stat	st;
+	TimeLineID	tli;
+	WalIndexRecord rec;
+	bool		indexed;
+
+	if (!wal_index_parse_name(file_name, &tli, &rec))
+		return false;
+
+	join_path_components(path, archive_dir, file_name);
+	if (fio_stat(FIO_BACKUP_HOST, path, &st, true) != 0)
+		elog(ERROR, "Cannot stat file \"%s\": %s", path, strerror(errno));
+
+	rec.size = st.st_size;
+	rec.crc = crc;
+
+	indexed = wal_index_append(archive_dir, tli, &rec, 1, no_sync);
+	if (indexed)
+		elog(LOG, "File \"%s\" is added to WAL index", file_name);
+
+	return indexed;
+}
+
+static void
+wal_summary_to_record(WalSummaryRecord *rec, const WalSegmentSummary *summary,
+					  uint32 wal_seg_size)
+{
+	MemSet(rec, 0, sizeof(WalSummaryRecord));
+	rec->summary = *summary;
+	GetXLogRecPtr(summary->segno, 0, wal_seg_size, rec->summary.segno);
+	rec->rec_crc = wal_summary_record_crc(rec);
+}
+
+/*
+ * Record the summary of WAL segment, just pushed into archive.
+ * Nothing is done if archive has no index.
+ */
+void
+wal_summary_add(const char *archive_dir, TimeLineID tli,
+				const WalSegmentSummary *summary, uint32 wal_seg_size,
+				bool no_sync)
+{
+	char		path[MAXPGPATH];
+	WalSummaryRecord rec;
+
+	wal_summary_path(path, archive_dir, tli);
+	wal_summary_to_record(&rec, summary, wal_seg_size);
+
+	if (wal_index_append_file(archive_dir, path, &rec, sizeof(WalSummaryRecord), 1,
+							  no_sync))
+		elog(LOG, "Summary of WAL segment " UINT64_FORMAT " on timeline %i is added to WAL index",
+			 summary->segno, tli);
+}
+
+/*
+ * Record removal of WAL files of the timeline in the index.
+ * It must be done before actual removal: crash in between just leaves
+ * some unindexed files in the archive.
+ */
+void
+wal_index_remove_files(const char *archive_dir, TimeLineID tli, parray *xlog_files)
+{
+	WalIndexRecord *recs;
+	size_t		n_recs = 0;
+	int			i;
+
+	if (parray_num(xlog_files) == 0)
+		return;
+
+	recs = pgut_malloc(sizeof(WalIndexRecord) * parray_num(xlog_files));
+
+	for (i = 0; i < parray_num(xlog_files); i++)
+	{
+		xlogFile   *wal_file = (xlogFile *) parray_get(xlog_files, i);
+		TimeLineID	file_tli;
+
+		if (!wal_index_parse_name(wal_file->file.name, &file_tli, &recs[n_recs]) ||
+			file_tli != tli)
+			continue;
+
+		recs[n_recs].flags = WAL_INDEX_REMOVED;
+		n_recs++;
+	}
+
+	if (n_recs > 0 && wal_index_append(archive_dir, tli, recs, n_recs, false))
+		elog(LOG, "Removal of %lu files on timeline %i is recorded in WAL index",
+			 (unsigned long) n_recs, tli);
+
+	pg_free(recs);
+}
+
+static int
+wal_index_entry_cmp(const void *a, const void *b)
+{
+	const WalIndexEntry *e1 = (const WalIndexEntry *) a;
+	const WalIndexEntry *e2 = (const WalIndexEntry *) b;
+
+	if (e1->rec.type != e2->rec.type)
+		return e1->rec.type < e2->rec.type ? -1 : 1;
+	if (e1->rec.log != e2->rec.log)
+		return e1->rec.log < e2->rec.log ? -1 : 1;
+	if (e1->rec.seg != e2->rec.seg)
+		return e1->rec.seg < e2->rec.seg ? -1 : 1;
+	if (e1->rec.offset != e2->rec.offset)
+		return e1->rec.offset < e2->rec.offset ? -1 : 1;
+	if (e1->rec.compress_alg != e2->rec.compress_alg)
+		return e1->rec.compress_alg < e2->rec.compress_alg ? -1 : 1;
+	/* the latest record goes last */
+	if (e1->seq != e2->seq)
+		return e1->seq < e2->seq ? -1 : 1;
+	return 0;
+}
+
+static bool
+same_indexed_file(const WalIndexRecord *r1, const WalIndexRecord *r2)
+{
+	return r1->type == r2->type && r1->log == r2->log && r1->seg == r2->seg &&
+		r1->offset == r2->offset && r1->compress_alg == r2->compress_alg;
+}
+
+/*
+ * Read the whole file of index directory. Returns NULL if the file
+ * doesn't exist and missing_ok is true.
+ */
+static char *
+wal_index_read_file(const char *path, size_t *read_size, bool missing_ok)
+{
+	struct stat	st;
+	int			fd;
+	char	   *buf;
+	size_t		size;
+	size_t		done = 0;
+
+	fd = fio_open(FIO_BACKUP_HOST, path, O_RDONLY | PG_BINARY);
+	if (fd < 0)
+	{
+		if (errno == ENOENT && missing_ok)
+			return NULL;
+		elog(ERROR, "Cannot open WAL index file \"%s\": %s", path, strerror(errno));
+	}
+
+	if (fio_stat(FIO_BACKUP_HOST, path, &st, true) != 0)
+		elog(ERROR, "Cannot stat WAL index file \"%s\": %s", path, strerror(errno));
+
+	size = st.st_size;
+	buf = pgut_malloc(size + 1);
+
+	while (done < size)
+	{
+		ssize_t		rc = fio_read(fd, buf + done, size - done);
+
+		if (rc < 0)
+			elog(ERROR, "Cannot read WAL index file \"%s\": %s", path, strerror(errno));
+		/* concurrent rebuild may have replaced the file */
+		if (rc == 0)
+			break;
+		done += rc;
+	}
+	fio_close(fd);
+
+	*read_size = done;
+	return buf;
+}
+
+/*
+ * Read index of timeline and add files, which are present in archive
+ * according to the index, to the list.
+ */
+static void
+wal_index_read(parray *files, const char *path, TimeLineID tli)
+{
+	char	   *buf;
+	size_t		done;
+	size_t		pos = 0;
+	size_t		n_entries = 0;
+	size_t		n_skipped = 0;
+	size_t		i;
+	WalIndexEntry *entries;
+
+	buf = wal_index_read_file(path, &done, false);
+
+	entries = pgut_malloc(sizeof(WalIndexEntry) * (done / sizeof(WalIndexRecord) + 1));
+
+	/*
+	 * Torn record is skipped byte by byte until the next valid one,
+	 * because records appended after it are not aligned anymore.
+	 */
+	while (pos + sizeof(WalIndexRecord) <= done)
+	{
+		WalIndexEntry *entry = &entries[n_entries];
+
+		memcpy(&entry->rec, buf + pos, sizeof(WalIndexRecord));
+
+		if (entry->rec.rec_crc != wal_index_record_crc(&entry->rec))
+		{
+			n_skipped++;
+			pos++;
+			continue;
+		}
+
+		entry->seq = n_entries++;
+		pos += sizeof(WalIndexRecord);
+	}
+	pg_free(buf);
+
+	if (n_skipped > 0)
+		elog(WARNING, "WAL index file \"%s\" contains %lu bytes of invalid records, "
+			 "consider running rebuild-wal-index", path, (unsigned long) n_skipped);
+
+	qsort(entries, n_entries, sizeof(WalIndexEntry), wal_index_entry_cmp);
+
+	for (i = 0; i < n_entries; i++)
+	{
+		WalIndexRecord *rec = &entries[i].rec;
+		char		name[MAXFNAMELEN];
+		pgFile	   *file;
+
+		/* only the latest record of file matters */
+		if (i + 1 < n_entries && same_indexed_file(rec, &entries[i + 1].rec))
+			continue;
+
+		if (rec->flags & WAL_INDEX_REMOVED)
+			continue;
+
+		wal_index_record_name(name, tli, rec);
+
+		file = pgFileInit(name);
+		file->mode = S_IFREG | FILE_PERMISSION;
+		file->size = rec->size;
+		parray_append(files, file);
+	}
+
+	pg_free(entries);
+}
+
+static int
+wal_summary_cmp(const void *a, const void *b)
+{
+	const WalSegmentSummary *s1 = (const WalSegmentSummary *) a;
+	const WalSegmentSummary *s2 = (const WalSegmentSummary *) b;
+
+	if (s1->segno != s2->segno)
+		return s1->segno < s2->segno ? -1 : 1;
+	return 0;
+}
+
+/*
+ * Read summary of WAL segments of the timeline.  Returns array of summaries
+ * sorted by segment number, or NULL if there is no summary of the timeline.
+ */
+WalSegmentSummary *
+wal_summary_read(const char *archive_dir, TimeLineID tli,
+				 uint32 wal_seg_size, size_t *n_summaries)
+{
+	char		path[MAXPGPATH];
+	char	   *buf;
+	size_t		size;
+	size_t		pos = 0;
+	size_t		n_skipped = 0;
+	size_t		n = 0;
+	size_t		i;
+	WalSegmentSummary *summaries;
+
+	*n_summaries = 0;
+	wal_summary_path(path, archive_dir, tli);
+
+	buf = wal_index_read_file(path, &size, true);
+	if (buf == NULL)
+		return NULL;
+
+	summaries = pgut_malloc(sizeof(WalSegmentSummary) * (size / sizeof(WalSummaryRecord) + 1));
+
+	/* torn record is skipped byte by byte, as in the index */
+	while (pos + sizeof(WalSummaryRecord) <= size)
+	{
+		WalSummaryRecord rec;
+
+		memcpy(&rec, buf + pos, sizeof(WalSummaryRecord));
+
+		if (rec.rec_crc != wal_summary_record_crc(&rec))
+		{
+			n_skipped++;
+			pos++;
+			continue;
+		}
+
+		summaries[n] = rec.summary;
+		GetXLogSegNo(rec.summary.segno, summaries[n].segno, wal_seg_size);
+		n++;
+		pos += sizeof(WalSummaryRecord);
+	}
+	pg_free(buf);
+
+	if (n_skipped > 0)
+		elog(WARNING, "WAL summary file \"%s\" contains %lu bytes of invalid records, "
+			 "consider running rebuild-wal-index", path, (unsigned long) n_skipped);
+
+	/* the same segment may be summarized twice, it doesn't matter which summary wins */
+	qsort(summaries, n, sizeof(WalSegmentSummary), wal_summary_cmp);
+
+	*n_summaries = 0;
+	for (i = 0; i < n; i++)
+	{
+		if (*n_summaries > 0 &&
+			summaries[*n_summaries - 1].segno == summaries[i].segno)
+			continue;
+		summaries[(*n_summaries)++] = summaries[i];
+	}
+
+	return summaries;
+}
+
+/* Find summary of the segment in the array returned by wal_summary_read() */
+WalSegmentSummary *
+wal_summary_find(WalSegmentSummary *summaries, size_t n_summaries,
+				 XLogSegNo segno)
+{
+	WalSegmentSummary key;
+
+	if (summaries == NULL)
+		return NULL;
+
+	key.segno = segno;
+	return (WalSegmentSummary *) bsearch(&key, summaries, n_summaries,
+										 sizeof(WalSegmentSummary),
+										 wal_summary_cmp);
+}
+
+/*
+ * Rewrite summary of the timeline, so it contains only segments present
+ * in the archive.  Segments without summary are summarized.
+ * recs are index records of the timeline, sorted by segment number.
+ */
+static void
+wal_summary_rebuild(const char *archive_dir, TimeLineID tli,
+					const WalIndexRecord *recs, size_t n_recs,
+					uint32 wal_seg_size, bool no_sync)
+{
+	char		path[MAXPGPATH];
+	char		path_tmp[MAXPGPATH];
+	WalSegmentSummary *summaries;
+	size_t		n_summaries;
+	WalSummaryRecord *new_recs;
+	size_t		n_new_recs = 0;
+	size_t		n_summarized = 0;
+	size_t		i;
+	int			fd;
+	XLogSegNo	prev_segno = 0;
+
+	summaries = wal_summary_read(archive_dir, tli, wal_seg_size, &n_summaries);
+	new_recs = pgut_malloc(sizeof(WalSummaryRecord) * (n_recs + 1));
+
+	for (i = 0; i < n_recs; i++)
+	{
+		const WalIndexRecord *rec = &recs[i];
+		WalSegmentSummary *summary;
+		WalSegmentSummary new_summary;
+		XLogSegNo	segno;
+
+		if (rec->type != WAL_INDEX_SEGMENT)
+			continue;
+
+		segno = (XLogSegNo) rec->log * XLogSegmentsPerXLogId(wal_seg_size) + rec->seg;
+
+		/* the segment may be present both compressed and not */
+		if (n_new_recs > 0 && segno == prev_segno)
+			continue;
+		prev_segno = segno;
+
+		summary = wal_summary_find(summaries, n_summaries, segno);
+		if (summary == NULL)
+		{
+			if (interrupted)
+				elog(ERROR, "Interrupted during WAL summary rebuild");
+
+			if (!summarize_wal_segment(archive_dir, tli, segno, wal_seg_size,
+									   &new_summary))
+			{
+				elog(LOG, "Cannot summarize WAL segment " UINT64_FORMAT " on timeline %i",
+					 segno, tli);
+				continue;
+			}
+			summary = &new_summary;
+			n_summarized++;
+		}
+
+		wal_summary_to_record(&new_recs[n_new_recs++], summary, wal_seg_size);
+	}
+
+	wal_summary_path(path, archive_dir, tli);
+	snprintf(path_tmp, MAXPGPATH, "%s.tmp", path);
+
+	fd = fio_open(FIO_BACKUP_HOST, path_tmp, O_WRONLY | O_CREAT | O_TRUNC | PG_BINARY);
+	if (fd < 0)
+		elog(ERROR, "Cannot open WAL summary file \"%s\": %s", path_tmp, strerror(errno));
+
+	if (fio_write(fd, new_recs, n_new_recs * sizeof(WalSummaryRecord)) !=
+		n_new_recs * sizeof(WalSummaryRecord))
+		elog(ERROR, "Cannot write WAL summary file \"%s\": %s", path_tmp, strerror(errno));
+
+	if (fio_close(fd) != 0)
+		elog(ERROR, "Cannot close WAL summary file \"%s\": %s", path_tmp, strerror(errno));
+
+	if (!no_sync && fio_sync(FIO_BACKUP_HOST, path_tmp) != 0)
+		elog(ERROR, "Cannot sync WAL summary file \"%s\": %s", path_tmp, strerror(errno));
+
+	if (fio_rename(FIO_BACKUP_HOST, path_tmp, path) != 0)
+		elog(ERROR, "Cannot rename file \"%s\" to \"%s\": %s",
+			 path_tmp, path, strerror(errno));
+
+	elog(INFO, "WAL summary of timeline %i is rebuilt, segments: %lu, newly summarized: %lu",
+		 tli, (unsigned long) n_new_recs, (unsigned long) n_summarized);
+
+	pg_free(new_recs);
+	pg_free(summaries);
+}
+
+/*
+ * Get the list of files in WAL archive from its index, the same way
+ * dir_list_file() does.  Returns false, if archive has no index.
+ */
+bool
+wal_index_list_files(parray *files, const char *archive_dir)
+{
+	char		index_dir[MAXPGPATH];
+	parray	   *index_files;
+	struct stat	st;
+	int			i;
+
+	wal_index_dir(index_dir, archive_dir);
+
+	if (fio_stat(FIO_BACKUP_HOST, index_dir, &st, true) != 0)
+	{
+		if (errno == ENOENT)
+			return false;
+		elog(ERROR, "Cannot stat WAL index directory \"%s\": %s",
+			 index_dir, strerror(errno));
+	}
+
+	elog(LOG, "Reading WAL index \"%s\"", index_dir);
+
+	index_files = parray_new();
+	dir_list_file(index_files, index_dir, false, false, false, false, true, FIO_BACKUP_HOST);
+
+	for (i = 0; i < parray_num(index_files); i++)
+	{
+		pgFile	   *file = (pgFile *) parray_get(index_files, i);
+		TimeLineID	tli;
+		char		suffix[MAXFNAMELEN];
+		char		path[MAXPGPATH];
+
+		if (!S_ISREG(file->mode) ||
+			sscanf(file->name, "%08X.%s", &tli, suffix) != 2 ||
+			strcmp(suffix, WAL_INDEX_SUFFIX) != 0)
+			continue;
+
+		join_path_components(path, index_dir, file->name);
+		wal_index_read(files, path, tli);
+	}
+
+	parray_walk(index_files, pgFileFree);
+	parray_free(index_files);
+
+	return true;
+}
+
+/*
+ * Reconstruct index of WAL archive from the archive directory.
+ * Index directory is created, if it doesn't exist yet.
+ * Segments, which were not summarized yet, are read to build their summary.
+ */
+int
+do_rebuild_wal_index(InstanceState *instanceState, bool no_sync)
+{
+	const char *archive_dir = instanceState->instance_wal_subdir_path;
+	char		index_dir[MAXPGPATH];
+	parray	   *wal_files = parray_new();
+	parray	   *index_files = parray_new();
+	WalIndexRecord *recs;
+	size_t		n_recs = 0;
+	size_t		n_indexed = 0;
+	int			n_timelines = 0;
+	TimeLineID	cur_tli = 0;
+	int			lock_fd;
+	int			i;
+
+	wal_index_dir(index_dir, archive_dir);
+
+	if (fio_mkdir(FIO_BACKUP_HOST, index_dir, DIR_PERMISSION, false) != 0)
+		elog(ERROR, "Cannot create WAL index directory \"%s\": %s",
+			 index_dir, strerror(errno));
+
+	/* files pushed from now on wait for the rebuild to finish */
+	lock_fd = wal_index_lock(archive_dir, true);
+
+	dir_list_file(wal_files, archive_dir, false, true, false, false, true, FIO_BACKUP_HOST);
+	parray_qsort(wal_files, pgFileCompareName);
+
+	recs = pgut_malloc(sizeof(WalIndexRecord) * (parray_num(wal_files) + 1));
+
+	/* files of timeline are adjacent in the sorted list */
+	for (i = 0; i <= parray_num(wal_files); i++)
+	{
+		pgFile	   *file = NULL;
+		TimeLineID	tli = 0;
+		WalIndexRecord rec;
+
+		if (i < parray_num(wal_files))
+		{
+			file = (pgFile *) parray_get(wal_files, i);
+
+			if (path_is_prefix_of_path(WAL_INDEX_DIR, file->rel_path) ||
+				!S_ISREG(file->mode))
+				continue;
+
+			if (!wal_index_parse_name(file->name, &tli, &rec))
+			{
+				elog(VERBOSE, "File \"%s\" is not indexed", file->name);
+				continue;
+			}
+		}
+
+		/* write index of the previous timeline */
+		if (n_recs > 0 && (file == NULL || tli != cur_tli))
+		{
+			char		path[MAXPGPATH];
+			char		path_tmp[MAXPGPATH];
+			int			fd;
+			size_t		len = n_recs * sizeof(WalIndexRecord);
+
+			wal_index_path(path, archive_dir, cur_tli);
+			snprintf(path_tmp, MAXPGPATH, "%s.tmp", path);
+
+			fd = fio_open(FIO_BACKUP_HOST, path_tmp, O_WRONLY | O_CREAT | O_TRUNC | PG_BINARY);
+			if (fd < 0)
+				elog(ERROR, "Cannot open WAL index file \"%s\": %s", path_tmp, strerror(errno));
+
+			if (fio_write(fd, recs, len) != len)
+				elog(ERROR, "Cannot write WAL index file \"%s\": %s", path_tmp, strerror(errno));
+
+			if (fio_close(fd) != 0)
+				elog(ERROR, "Cannot close WAL index file \"%s\": %s", path_tmp, strerror(errno));
+
+			if (!no_sync && fio_sync(FIO_BACKUP_HOST, path_tmp) != 0)
+				elog(ERROR, "Cannot sync WAL index file \"%s\": %s", path_tmp, strerror(errno));
+
+			if (fio_rename(FIO_BACKUP_HOST, path_tmp, path) != 0)
+				elog(ERROR, "Cannot rename file \"%s\" to \"%s\": %s",
+					 path_tmp, path, strerror(errno));
+
+			elog(INFO, "WAL index of timeline %i is rebuilt, files: %lu",
+				 cur_tli, (unsigned long) n_recs);
+
+			parray_append(index_files, pgut_strdup(last_dir_separator(path) + 1));
+
+			wal_summary_rebuild(archive_dir, cur_tli, recs, n_recs,
+								instance_config.xlog_seg_size, no_sync);
+			wal_summary_path(path, archive_dir, cur_tli);
+			parray_append(index_files, pgut_strdup(last_dir_separator(path) + 1));
+			n_indexed += n_recs;
+			n_timelines++;
+			n_recs = 0;
+		}
+
+		if (file == NULL)
+			break;
+
+		cur_tli = tli;
+
+		/* checksum of the file is not calculated, it is too expensive */
+		rec.size = file->size;
+		rec.flags = WAL_INDEX_NO_CRC;
+		rec.rec_crc = wal_index_record_crc(&rec);
+		recs[n_recs++] = rec;
+	}
+
+	pg_free(recs);
+	parray_walk(wal_files, pgFileFree);
+	parray_free(wal_files);
+
+	/* remove indexes of timelines, which have no files anymore */
+	wal_files = parray_new();
+	dir_list_file(wal_files, index_dir, false, false, false, false, true, FIO_BACKUP_HOST);
+
+	for (i = 0; i < parray_num(wal_files); i++)
+	{
+		pgFile	   *file = (pgFile *) parray_get(wal_files, i);
+		char		path[MAXPGPATH];
+		int			j;
+		bool		rebuilt = false;
+
+		for (j = 0; j < parray_num(index_files); j++)
+		{
+			if (strcmp(file->name, (char *) parray_get(index_files, j)) == 0)
+			{
+				rebuilt = true;
+				break;
+			}
+		}
+
+		if (rebuilt || strcmp(file->name, WAL_INDEX_LOCK_FILE) == 0)
+			continue;
+
+		join_path_components(path, index_dir, file->name);
+		elog(LOG, "Remove obsolete WAL index file \"%s\"", path);
+
+		if (fio_remove(FIO_BACKUP_HOST, path, true) != 0)
+			elog(ERROR, "Cannot remove file \"%s\": %s", path, strerror(errno));
+	}
+
+	parray_walk(wal_files, pgFileFree);
+	parray_free(wal_files);
+	parray_walk(index_files, pfree);
+	parray_free(index_files);
+
+	wal_index_unlock(lock_fd);
+
+	elog(INFO, "WAL index of instance '%s' is rebuilt, timelines: %i, files: %lu",
+		 instanceState->instance_name, n_timelines, (unsigned long) n_indexed);
+
+	return 0;
+}
@@ -1,6 +1,7 @@
 import os
 import shutil
 import gzip
+import fcntl
 import unittest
 from .helpers.ptrack_helpers import ProbackupTest, ProbackupException, GdbException
 from datetime import datetime, timedelta
@@ -2363,6 +2364,66 @@ class ArchiveTest(ProbackupTest, unittest.TestCase):
             'LOG:  restored log file "{0}" from archive'.format(filename),
             postgres_log_content)
 
+    # @unittest.skip("skip")
+    def test_archive_get_background_prefetch(self):
+        """
+        Make sure that background prefetch worker keeps segments
+        ready for restore_command
+        """
+        backup_dir = os.path.join(self.tmp_path, self.module_name, self.fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(self.module_name, self.fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        self.set_archiving(backup_dir, 'node', node)
+
+        node.slow_start()
+
+        self.backup_node(backup_dir, 'node', node, options=['--stream'])
+
+        node.pgbench_init(scale=50)
+        self.switch_wal_segment(node)
+
+        replica = self.make_simple_node(
+            base_dir=os.path.join(self.module_name, self.fname, 'replica'))
+        replica.cleanup()
+
+        self.restore_node(
+            backup_dir, 'node', replica, replica.data_dir)
+        self.set_replica(node, replica, log_shipping=True)
+
+        restore_command = self.get_restore_command(backup_dir, 'node', replica)
+        restore_command += ' -j 2 --batch-size=4 --background-prefetch'
+
+        if node.major_version >= 12:
+            self.set_auto_conf(replica, {'restore_command': restore_command})
+        else:
+            replica.append_conf(
+                'recovery.conf', "restore_command = '{0}'".format(restore_command))
+
+        replica.slow_start(replica=True)
+        self.wait_until_replica_catch_with_master(node, replica)
+
+        self.assertEqual(
+            node.safe_psql('postgres', 'select count(*) from pgbench_accounts'),
+            replica.safe_psql('postgres', 'select count(*) from pgbench_accounts'))
+
+        with open(os.path.join(replica.logs_dir, 'postgresql.log'), 'r') as f:
+            postgres_log_content = f.read()
+
+        # most of segments are taken from prefetch directory
+        n_prefetched = postgres_log_content.count('used prefetched WAL segment')
+        n_copied = postgres_log_content.count(
+            'archive-get completed successfully, fetched: 1/')
+        self.assertGreater(n_prefetched, n_copied)
+
+        # worker follows recovery
+        self.assertTrue(os.path.isfile(os.path.join(
+            replica.data_dir, 'pg_wal', 'pbk_prefetch', 'prefetch.pid')))
+
     # @unittest.skip("skip")
     def test_archive_show_partial_files_handling(self):
         """
@@ -2555,6 +2616,351 @@ class ArchiveTest(ProbackupTest, unittest.TestCase):
             'WARNING: History file is corrupted or missing: "{0}"'.format(os.path.join(wal_dir, '00000004.history')),
             log_content)
 
+    # @unittest.expectedFailure
+    # @unittest.skip("skip")
+    def test_archive_wal_index(self):
+        """
+        Check that WAL index gives the same view of archive as
+        the directory scan and follows removal of WAL by retention
+        """
+        backup_dir = os.path.join(self.tmp_path, self.module_name, self.fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(self.module_name, self.fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        self.set_archiving(backup_dir, 'node', node, compress=self.archive_compress)
+
+        node.slow_start()
+
+        self.backup_node(backup_dir, 'node', node)
+
+        node.pgbench_init(scale=2)
+        self.switch_wal_segment(node)
+
+        output = self.run_pb([
+            'rebuild-wal-index', '-B', backup_dir, '--instance=node'])
+        self.assertIn("WAL index of instance 'node' is rebuilt", output)
+
+        wals_dir = os.path.join(backup_dir, 'wal', 'node')
+        index_dir = os.path.join(wals_dir, 'index')
+        self.assertTrue(os.path.isfile(os.path.join(index_dir, '00000001.idx')))
+
+        # these files are recorded in index by archive-push
+        node.pgbench_init(scale=2)
+        self.switch_wal_segment(node)
+
+        self.backup_node(backup_dir, 'node', node)
+
+        node.pgbench_init(scale=2)
+        self.switch_wal_segment(node)
+
+        # archiver pushes the remaining segments on shutdown
+        node.stop()
+
+        def show_archive_without_index():
+            shutil.move(index_dir, index_dir + '_moved')
+            try:
+                return self.show_archive(backup_dir, 'node')
+            finally:
+                shutil.move(index_dir + '_moved', index_dir)
+
+        def show_archive_with_index(options=[]):
+            # recovery time range is known only from WAL summary kept in index
+            timelines = self.show_archive(backup_dir, 'node', options=options)
+            for timeline in timelines:
+                self.assertIn('max-recovery-time', timeline)
+                del timeline['min-recovery-time']
+                del timeline['max-recovery-time']
+            return timelines
+
+        timelines = show_archive_with_index(options=['--log-level-file=LOG'])
+        self.assertEqual(timelines, show_archive_without_index())
+
+        with open(os.path.join(backup_dir, 'log', 'pg_probackup.log')) as f:
+            self.assertIn('Reading WAL index', f.read())
+
+        self.delete_expired(
+            backup_dir, 'node',
+            options=['--delete-wal', '--retention-redundancy=1'])
+
+        timelines = show_archive_with_index()
+        self.assertEqual(timelines, show_archive_without_index())
+        self.assertNotEqual(timelines[0]['min-segno'], '000000010000000000000001')
+
+        # index is rebuilt from the directory
+        self.run_pb([
+            'rebuild-wal-index', '-B', backup_dir, '--instance=node'])
+        self.assertEqual(show_archive_with_index(), timelines)
+
+    # @unittest.skip("skip")
+    def test_archive_wal_index_lock(self):
+        """
+        Check that archive-push waits for the lock held by rebuild
+        of WAL index, so pushed file is recorded in the rebuilt index
+        """
+        backup_dir = os.path.join(self.tmp_path, self.module_name, self.fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(self.module_name, self.fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        self.set_archiving(backup_dir, 'node', node, compress=self.archive_compress)
+
+        node.slow_start()
+        node.pgbench_init(scale=1)
+        self.switch_wal_segment(node)
+
+        self.run_pb([
+            'rebuild-wal-index', '-B', backup_dir, '--instance=node'])
+
+        wals_dir = os.path.join(backup_dir, 'wal', 'node')
+        index_dir = os.path.join(wals_dir, 'index')
+        index_file = os.path.join(index_dir, '00000001.idx')
+        index_size = os.path.getsize(index_file)
+
+        # lock is taken the same way as rebuild-wal-index does
+        with open(os.path.join(index_dir, 'lock')) as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+            node.pgbench_init(scale=1)
+            self.switch_wal_segment(node)
+            sleep(3)
+
+            self.assertEqual(os.path.getsize(index_file), index_size)
+
+        for i in range(60):
+            if os.path.getsize(index_file) > index_size:
+                break
+            sleep(1)
+
+        self.assertGreater(os.path.getsize(index_file), index_size)
+
+        node.stop()
+
+        timelines = self.show_archive(backup_dir, 'node')
+        shutil.move(index_dir, index_dir + '_moved')
+        self.assertEqual(
+            [(t['min-segno'], t['max-segno'], t['n-segments']) for t in timelines],
+            [(t['min-segno'], t['max-segno'], t['n-segments'])
+             for t in self.show_archive(backup_dir, 'node')])
+
+    # @unittest.skip("skip")
+    def test_archive_wal_summary(self):
+        """
+        Check that validation to time and xid targets skips WAL segments,
+        which cannot contain the target according to their summary
+        """
+        backup_dir = os.path.join(self.tmp_path, self.module_name, self.fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(self.module_name, self.fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        self.set_archiving(backup_dir, 'node', node, compress=self.archive_compress)
+
+        # summaries are kept along with WAL index
+        self.run_pb([
+            'rebuild-wal-index', '-B', backup_dir, '--instance=node'])
+
+        node.slow_start()
+        node.safe_psql(
+            "postgres",
+            "create table t_heap as select i from generate_series(0, 100) i")
+
+        backup_id = self.backup_node(backup_dir, 'node', node)
+
+        # records cross boundaries of these segments
+        for i in range(2):
+            node.pgbench_init(scale=3)
+            self.switch_wal_segment(node)
+
+        sleep(1)
+        target_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        sleep(1)
+
+        target_xid = node.safe_psql(
+            "postgres",
+            "insert into t_heap values (101) returning (xmin)").decode('utf-8').rstrip()
+        self.switch_wal_segment(node)
+
+        node.pgbench_init(scale=1)
+        self.switch_wal_segment(node)
+        node.stop()
+
+        wals_dir = os.path.join(backup_dir, 'wal', 'node')
+        summary_file = os.path.join(wals_dir, 'index', '00000001.sum')
+        self.assertTrue(os.path.isfile(summary_file))
+
+        output = self.validate_pb(
+            backup_dir, 'node', backup_id,
+            options=['--recovery-target-time={0}'.format(target_time)])
+        self.assertIn('According to WAL summary, recovery target is not located', output)
+        self.assertIn('INFO: Backup validation completed successfully', output)
+
+        output = self.validate_pb(
+            backup_dir, 'node', backup_id,
+            options=['--recovery-target-xid={0}'.format(target_xid)])
+        self.assertIn('According to WAL summary, recovery target is not located', output)
+        self.assertIn('INFO: Backup validation completed successfully', output)
+
+        timeline = self.show_archive(backup_dir, 'node', tli=1)
+        self.assertIn('min-recovery-time', timeline)
+        self.assertIn('max-recovery-time', timeline)
+
+        # summary is rebuilt by reading archived segments
+        os.remove(summary_file)
+        output = self.run_pb([
+            'rebuild-wal-index', '-B', backup_dir, '--instance=node'])
+        self.assertIn('WAL summary of timeline 1 is rebuilt', output)
+        self.assertNotIn('newly summarized: 0', output)
+
+        output = self.validate_pb(
+            backup_dir, 'node', backup_id,
+            options=['--recovery-target-time={0}'.format(target_time)])
+        self.assertIn('According to WAL summary, recovery target is not located', output)
+
+        # target located in skipped segment would be reached anyway,
+        # recovery to it must not include later changes
+        node.cleanup()
+        self.restore_node(
+            backup_dir, 'node', node,
+            options=[
+                '--recovery-target-xid={0}'.format(target_xid),
+                '--recovery-target-action=promote'])
+        node.slow_start()
+
+        self.assertEqual(
+            node.safe_psql("postgres", "select count(*) from t_heap").decode('utf-8').rstrip(),
+            '102')
+
+    # @unittest.skip("skip")
+    def test_archive_wal_summary_gap(self):
+        """
+        Check that validation to xid target reads the record crossing into
+        WAL segment, which has no summary, because no record starts in it
+        """
+        backup_dir = os.path.join(self.tmp_path, self.module_name, self.fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(self.module_name, self.fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'],
+            pg_options={'autovacuum': 'off'})
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        self.set_archiving(backup_dir, 'node', node, compress=self.archive_compress)
+
+        self.run_pb([
+            'rebuild-wal-index', '-B', backup_dir, '--instance=node'])
+
+        node.slow_start()
+        backup_id = self.backup_node(backup_dir, 'node', node)
+
+        node.pgbench_init(scale=1)
+
+        # the first record of transaction spans the whole segment,
+        # so no record starts in that segment and it has no summary
+        target_xid, end_lsn = node.safe_psql(
+            "postgres",
+            "begin; "
+            "select txid_current(); "
+            "select pg_logical_emit_message(true, 'test', repeat('x', 40 * 1024 * 1024)); "
+            "commit;").decode('utf-8').split()
+
+        node.pgbench_init(scale=1)
+        self.switch_wal_segment(node)
+        node.stop()
+
+        output = self.validate_pb(
+            backup_dir, 'node', backup_id,
+            options=['--recovery-target-xid={0}'.format(target_xid)])
+        self.assertIn('According to WAL summary, recovery target is not located', output)
+        self.assertIn('INFO: Backup validation completed successfully', output)
+
+        # the target is the message record, not the commit record following it
+        rec_lsn = output.split(
+            'xid {0} and LSN '.format(target_xid))[1].split()[0]
+        rec_xlogid, rec_xrecoff = rec_lsn.split('/')
+        end_xlogid, end_xrecoff = end_lsn.split('/')
+        self.assertLess(
+            (int(rec_xlogid, 16), int(rec_xrecoff, 16)),
+            (int(end_xlogid, 16), int(end_xrecoff, 16)))
+
+    # @unittest.skip("skip")
+    def test_archive_push_daemon(self):
+        """
+        Check that archive_command hands WAL files to archive-push daemon
+        and pushes them itself when the daemon is not running
+        """
+        backup_dir = os.path.join(self.tmp_path, self.module_name, self.fname, 'backup')
+        socket_path = os.path.join(self.tmp_path, self.module_name, self.fname, 'archive.sock')
+        node = self.make_simple_node(
+            base_dir=os.path.join(self.module_name, self.fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+
+        archive_command = '"{0}" archive-push -B {1} --instance=node --archive-socket={2} '.format(
+            self.probackup_path, backup_dir, socket_path)
+        if self.remote:
+            archive_command += '--remote-proto=ssh --remote-host=localhost '
+        archive_command += '--wal-file-path=%p --wal-file-name=%f'
+        self.set_archiving(
+            backup_dir, 'node', node, custom_archive_command=archive_command)
+
+        daemon_options = [
+            'archive-push', '-B', backup_dir, '--instance=node', '--daemon',
+            '--archive-socket={0}'.format(socket_path), '-j', '2', '--no-sync']
+        if self.remote:
+            daemon_options += ['--remote-proto=ssh', '--remote-host=localhost']
+        if self.archive_compress:
+            daemon_options += ['--compress']
+
+        daemon = self.run_pb(daemon_options, asynchronous=True)
+        for i in range(30):
+            if os.path.exists(socket_path):
+                break
+            sleep(1)
+        self.assertTrue(os.path.exists(socket_path))
+
+        node.slow_start()
+        node.pgbench_init(scale=5)
+        self.switch_wal_segment(node)
+
+        self.backup_node(backup_dir, 'node', node)
+
+        with open(os.path.join(node.logs_dir, 'postgresql.log')) as f:
+            log_content = f.read()
+        self.assertIn('pushed by archive-push daemon', log_content)
+        self.assertNotIn('could not rename file', log_content)
+
+        daemon.terminate()
+        out, err = daemon.communicate()
+        self.assertIn('archive-push daemon is stopped', err.decode('utf-8'))
+        self.assertFalse(os.path.exists(socket_path))
+
+        # archive_command pushes files itself
+        node.pgbench_init(scale=2)
+        self.switch_wal_segment(node)
+
+        self.backup_node(backup_dir, 'node', node)
+
+        with open(os.path.join(node.logs_dir, 'postgresql.log')) as f:
+            log_content = f.read()
+        self.assertIn('Cannot connect to archive-push daemon', log_content)
+        self.assertIn('archive-push completed successfully', log_content)
+
+        self.validate_pb(backup_dir, 'node')
+
 # TODO test with multiple not archived segments.
 # TODO corrupted file in archive.
 
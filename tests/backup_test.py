@@ -3167,3 +3167,181 @@ class BackupTest(ProbackupTest, unittest.TestCase):
                 e.message,
                 "\n Unexpected Error Message: {0}\n CMD: {1}".format(
                     repr(e.message), self.cmd))
+
+    def test_backup_filelist_binary_format(self):
+        """
+        Check that file list of backup is stored in binary format,
+        can be used by restore and merge and its corruption is detected
+        """
+        node = self.make_simple_node(
+            base_dir=os.path.join(self.module_name, self.fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        backup_dir = os.path.join(self.tmp_path, self.module_name, self.fname, 'backup')
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        node.slow_start()
+
+        node.pgbench_init(scale=5)
+
+        self.backup_node(
+            backup_dir, 'node', node, options=['--stream'])
+
+        pgbench = node.pgbench(options=['-T', '5', '-c', '2'])
+        pgbench.wait()
+
+        delta_id = self.backup_node(
+            backup_dir, 'node', node, backup_type='delta', options=['--stream'])
+
+        pgdata = self.pgdata_content(node.data_dir)
+
+        filelist_path = os.path.join(
+            backup_dir, 'backups', 'node', delta_id, 'backup_content.control')
+
+        with open(filelist_path, 'rb') as f:
+            self.assertEqual(f.read(8), b'PBKFLST\x00')
+
+        filelist = self.get_backup_filelist(backup_dir, 'node', delta_id)
+        self.assertIn('PG_VERSION', filelist)
+        self.assertEqual(filelist['PG_VERSION']['is_datafile'], '0')
+        self.assertTrue(
+            any(filelist[f]['is_datafile'] == '1' for f in filelist))
+
+        node_restored = self.make_simple_node(
+            base_dir=os.path.join(self.module_name, self.fname, 'node_restored'))
+        node_restored.cleanup()
+
+        self.restore_node(
+            backup_dir, 'node', node_restored, options=['-j', '4'])
+
+        self.compare_pgdata(pgdata, self.pgdata_content(node_restored.data_dir))
+
+        self.merge_backup(backup_dir, 'node', delta_id)
+
+        node_restored.cleanup()
+        self.restore_node(
+            backup_dir, 'node', node_restored, options=['-j', '4'])
+
+        self.compare_pgdata(pgdata, self.pgdata_content(node_restored.data_dir))
+
+        # corrupt file list of merged backup
+        with open(filelist_path, 'r+b') as f:
+            f.seek(os.path.getsize(filelist_path) - 32)
+            f.write(b'garbage')
+
+        try:
+            self.validate_pb(backup_dir, 'node', delta_id)
+            self.assertEqual(
+                1, 0,
+                "Expecting Error because of corrupted file list "
+                "\n Output: {0} \n CMD: {1}".format(
+                    repr(self.output), self.cmd))
+        except ProbackupException as e:
+            self.assertIn(
+                'WARNING: Invalid CRC of backup control file',
+                e.message,
+                "\n Unexpected Error Message: {0}\n CMD: {1}".format(
+                    repr(e.message), self.cmd))
+
+    # @unittest.skip("skip")
+    def test_backup_direct_io(self):
+        """
+        make FULL and DELTA backups reading files with direct I/O,
+        check that restored data is the same
+        """
+        node = self.make_simple_node(
+            base_dir=os.path.join(self.module_name, self.fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        backup_dir = os.path.join(self.tmp_path, self.module_name, self.fname, 'backup')
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        node.slow_start()
+
+        node.pgbench_init(scale=5)
+
+        self.backup_node(
+            backup_dir, 'node', node,
+            options=['--stream', '-j', '4', '--direct-io'])
+
+        pgbench = node.pgbench(options=['-T', '5', '-c', '2'])
+        pgbench.wait()
+
+        self.backup_node(
+            backup_dir, 'node', node, backup_type='delta',
+            options=['--stream', '-j', '4', '--direct-io'])
+
+        pgdata = self.pgdata_content(node.data_dir)
+
+        node_restored = self.make_simple_node(
+            base_dir=os.path.join(self.module_name, self.fname, 'node_restored'))
+        node_restored.cleanup()
+
+        self.restore_node(
+            backup_dir, 'node', node_restored, options=['-j', '4'])
+
+        self.compare_pgdata(pgdata, self.pgdata_content(node_restored.data_dir))
+
+    # @unittest.skip("skip")
+    def test_backup_parallel_directory_listing(self):
+        """
+        Make sure that PGDATA and tablespaces listed by several threads
+        give the same file list as listing by a single thread
+        """
+        node = self.make_simple_node(
+            base_dir=os.path.join(self.module_name, self.fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        backup_dir = os.path.join(self.tmp_path, self.module_name, self.fname, 'backup')
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        node.slow_start()
+
+        self.create_tblspace_in_node(node, 'tblspace1')
+        self.create_tblspace_in_node(node, 'tblspace2')
+
+        for i, tblspace in enumerate(['pg_default', 'tblspace1', 'tblspace2']):
+            node.safe_psql(
+                "postgres",
+                "create database db{0} tablespace {1}".format(i, tblspace))
+            node.pgbench_init(scale=1, dbname='db{0}'.format(i))
+
+        node.safe_psql("postgres", "checkpoint")
+
+        backup_id_1 = self.backup_node(
+            backup_dir, 'node', node, options=['--stream', '-j', '1'])
+
+        backup_id_2 = self.backup_node(
+            backup_dir, 'node', node,
+            options=['--stream', '-j', '4', '--log-level-file=LOG'])
+
+        # remote agent does not report into the local log
+        if not self.remote:
+            with open(os.path.join(backup_dir, 'log', 'pg_probackup.log')) as f:
+                self.assertIn('by 4 threads', f.read())
+
+        # streamed WAL differs between backups
+        filelist_1 = set(
+            path for path in self.get_backup_filelist(
+                backup_dir, 'node', backup_id_1)
+            if not path.startswith('pg_wal/'))
+        filelist_2 = set(
+            path for path in self.get_backup_filelist(
+                backup_dir, 'node', backup_id_2)
+            if not path.startswith('pg_wal/'))
+
+        self.assertEqual(filelist_1, filelist_2)
+
+        pgdata = self.pgdata_content(node.data_dir)
+
+        node.cleanup()
+        shutil.rmtree(self.get_tblspace_path(node, 'tblspace1'))
+        shutil.rmtree(self.get_tblspace_path(node, 'tblspace2'))
+
+        self.restore_node(
+            backup_dir, 'node', node, backup_id=backup_id_2, options=['-j', '4'])
+
+        self.compare_pgdata(pgdata, self.pgdata_content(node.data_dir))
@@ -291,3 +291,74 @@ class CompressionTest(ProbackupTest, unittest.TestCase):
             self.compare_pgdata(pgdata, pgdata_restored)
 
         node.slow_start()
+
+    # @unittest.skip("skip")
+    def test_compression_archive_zstd(self):
+        """
+        make archive node with zstd compression of WAL archive,
+        make full and page backups, check data correctness
+        in restored instance
+        """
+        self._check_archive_compression('zstd', '.zst')
+
+    # @unittest.skip("skip")
+    def test_compression_archive_lz4(self):
+        """
+        make archive node with lz4 compression of WAL archive,
+        make full and page backups, check data correctness
+        in restored instance
+        """
+        self._check_archive_compression('lz4', '.lz4')
+
+    def _check_archive_compression(self, compress_alg, suffix):
+        backup_dir = os.path.join(self.tmp_path, self.module_name, self.fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(self.module_name, self.fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        self.set_config(
+            backup_dir, 'node',
+            options=['--compress-algorithm={0}'.format(compress_alg)])
+        self.set_archiving(backup_dir, 'node', node, compress=False)
+        node.slow_start()
+
+        node.pgbench_init(scale=2)
+
+        try:
+            self.backup_node(
+                backup_dir, 'node', node,
+                options=['--compress-algorithm={0}'.format(compress_alg)])
+        except ProbackupException as e:
+            if "doesn't support" in e.message:
+                self.skipTest(
+                    '{0} compression is not supported by this build'.format(compress_alg))
+            raise
+
+        pgbench = node.pgbench(options=['-T', '5', '-c', '2'])
+        pgbench.wait()
+
+        page_id = self.backup_node(
+            backup_dir, 'node', node, backup_type='page',
+            options=['--compress-algorithm={0}'.format(compress_alg)])
+
+        show_backup = self.show_pb(backup_dir, 'node', page_id)
+        self.assertEqual(show_backup['compress-alg'], compress_alg)
+
+        wals_dir = os.path.join(backup_dir, 'wal', 'node')
+        wals = [f for f in os.listdir(wals_dir) if f.endswith(suffix)]
+        self.assertTrue(wals, 'No WAL segments compressed with {0}'.format(compress_alg))
+
+        self.validate_pb(backup_dir, 'node')
+
+        result = node.table_checksum("pgbench_accounts")
+        node.cleanup()
+
+        self.restore_node(
+            backup_dir, 'node', node,
+            options=["-j", "4", "--recovery-target=latest"])
+        node.slow_start()
+
+        self.assertEqual(result, node.table_checksum("pgbench_accounts"))
@@ -820,3 +820,54 @@ class DeleteTest(ProbackupTest, unittest.TestCase):
         self.assertEqual(show_backups[1]['status'], "OK")
         self.assertEqual(show_backups[2]['status'], "OK")
         self.assertEqual(show_backups[3]['status'], "OK")
+
+    # @unittest.skip("skip")
+    def test_delete_backup_and_wal_parallel(self):
+        """
+        delete backup and purge WAL by several threads,
+        backup directory must be removed completely
+        """
+        node = self.make_simple_node(
+            base_dir=os.path.join(self.module_name, self.fname, 'node'),
+            initdb_params=['--data-checksums'])
+
+        backup_dir = os.path.join(self.tmp_path, self.module_name, self.fname, 'backup')
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        self.set_archiving(backup_dir, 'node', node)
+        node.slow_start()
+
+        node.safe_psql("postgres", "create database db1")
+        node.pgbench_init(scale=2)
+
+        backup_1_id = self.backup_node(backup_dir, 'node', node)
+
+        node.pgbench_init(scale=2)
+        self.switch_wal_segment(node)
+
+        backup_2_id = self.backup_node(backup_dir, 'node', node)
+        node.stop()
+
+        wals_dir = os.path.join(backup_dir, 'wal', 'node')
+        wals = [f for f in os.listdir(wals_dir) if os.path.isfile(os.path.join(wals_dir, f))]
+        original_wal_quantity = len(wals)
+
+        self.delete_pb(
+            backup_dir, 'node', backup_1_id,
+            options=['--wal', '-j', '4'])
+
+        self.assertFalse(
+            os.path.exists(os.path.join(backup_dir, 'backups', 'node', backup_1_id)))
+
+        wals = [f for f in os.listdir(wals_dir) if os.path.isfile(os.path.join(wals_dir, f))]
+        self.assertTrue(original_wal_quantity > len(wals))
+
+        self.validate_pb(backup_dir)
+        self.assertEqual(self.show_pb(backup_dir, 'node', backup_2_id)['status'], "OK")
+
+        self.delete_pb(backup_dir, 'node', backup_2_id, options=['--wal', '-j', '4'])
+
+        self.assertFalse(
+            os.path.exists(os.path.join(backup_dir, 'backups', 'node', backup_2_id)))
+        wals = [f for f in os.listdir(wals_dir) if os.path.isfile(os.path.join(wals_dir, f))]
+        self.assertEqual(0, len(wals))
@@ -15,6 +15,7 @@ import select
 from time import sleep
 import re
 import json
+import struct
 import random
 
 idx_ptrack = {
@@ -796,10 +797,13 @@ class ProbackupTest(object):
             backup_dir, 'backups',
             instance, backup_id, 'backup_content.control')
 
-        with open(filelist_path, 'r') as f:
+        with open(filelist_path, 'rb') as f:
                 filelist_raw = f.read()
 
-        filelist_splitted = filelist_raw.splitlines()
+        if filelist_raw.startswith(b'PBKFLST\x00'):
+            return self.parse_binary_filelist(filelist_raw)
+
+        filelist_splitted = filelist_raw.decode('utf-8').splitlines()
 
         filelist = {}
         for line in filelist_splitted:
@@ -808,6 +812,56 @@ class ProbackupTest(object):
 
         return filelist
 
+    # parse file list stored in binary format (see src/filelist.c),
+    # values are returned as strings, the same way as for text format
+    def parse_binary_filelist(self, data):
+
+        compress_algs = ['none', 'none', 'zlib', 'zstd', 'lz4']
+
+        (magic, version, n_files, entry_size, reserved,
+         entries_off, index_off, strings_off, strings_size) = struct.unpack_from(
+            '<8sIIIIQQQQ', data, 0)
+
+        def get_string(off):
+            start = strings_off + off
+            return data[start:data.index(b'\x00', start)].decode('utf-8')
+
+        filelist = {}
+        for i in range(n_files):
+            (write_size, uncompressed_size, hdr_off, mode, crc, dbOid,
+             segno, n_blocks, n_headers, hdr_crc, hdr_size, path_off,
+             linked_off, is_datafile, compress_alg, reserved1,
+             reserved2) = struct.unpack_from(
+                '<qqQIIIiiiIiIIBBHI', data, entries_off + i * entry_size)
+
+            entry = {
+                'path': get_string(path_off),
+                'size': str(write_size),
+                'mode': str(mode),
+                'is_datafile': str(is_datafile),
+                'crc': str(crc),
+                'compress_alg': compress_algs[compress_alg],
+                'dbOid': str(dbOid)}
+
+            if is_datafile:
+                entry['segno'] = str(segno)
+
+            if linked_off != 0xFFFFFFFF:
+                entry['linked'] = get_string(linked_off)
+
+            if n_blocks > 0:
+                entry['n_blocks'] = str(n_blocks)
+
+            if n_headers > 0:
+                entry['n_headers'] = str(n_headers)
+                entry['hdr_crc'] = str(hdr_crc)
+                entry['hdr_off'] = str(hdr_off)
+                entry['hdr_size'] = str(hdr_size)
+
+            filelist[entry['path']] = entry
+
+        return filelist
+
     # return dict of files from filelist A,
     # which are not exists in filelist_B
     def get_backup_filelist_diff(self, filelist_A, filelist_B):
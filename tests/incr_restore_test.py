@@ -2152,4 +2152,293 @@ class IncrRestoreTest(ProbackupTest, unittest.TestCase):
             'postgres',
             'select 1')
 
+    # @unittest.skip("skip")
+    def test_incr_restore_zero_pages(self):
+        """
+        Zero pages are not written into new files during restore and
+        are zeroed in existing files during incremental restore.
+        """
+        node = self.make_simple_node(
+            base_dir=os.path.join(self.module_name, self.fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        backup_dir = os.path.join(self.tmp_path, self.module_name, self.fname, 'backup')
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        node.slow_start()
+
+        node.safe_psql(
+            'postgres',
+            'create table t1 as select i, md5(i::text) as val '
+            'from generate_series(0, 10000) i')
+
+        rel_path = node.safe_psql(
+            'postgres',
+            "select pg_relation_filepath('t1')").decode('utf-8').rstrip()
+        fullpath = os.path.join(node.data_dir, rel_path)
+
+        node.stop()
+
+        # extend relation with zero pages, as bulk extension does
+        with open(fullpath, 'ab') as f:
+            f.write(b'\0' * 8192 * 20)
+
+        node.slow_start()
+
+        self.backup_node(
+            backup_dir, 'node', node, options=['--stream'])
+
+        pgdata = self.pgdata_content(node.data_dir)
+
+        node_restored = self.make_simple_node(
+            base_dir=os.path.join(self.module_name, self.fname, 'node_restored'))
+        node_restored.cleanup()
+
+        self.restore_node(
+            backup_dir, 'node', node_restored, options=['-j', '4'])
+
+        self.compare_pgdata(pgdata, self.pgdata_content(node_restored.data_dir))
+
+        node.stop()
+
+        # garbage in place of zero pages must be zeroed
+        with open(fullpath, 'r+b') as f:
+            f.seek(-8192 * 10, os.SEEK_END)
+            f.write(b'\xff' * 8192 * 5)
+
+        self.restore_node(
+            backup_dir, 'node', node, options=['-j', '4', '-I', 'checksum'])
+
+        self.compare_pgdata(pgdata, self.pgdata_content(node.data_dir))
+
+        node.slow_start()
+
+        self.assertEqual(
+            node.safe_psql('postgres', 'select count(*) from t1').decode('utf-8').rstrip(),
+            '10001')
+
+    # @unittest.skip("skip")
+    def test_incr_restore_zero_pages_past_eof(self):
+        """
+        Zero pages past the end of existing file extend it during
+        incremental restore, with and without --punch-holes.
+        """
+        node = self.make_simple_node(
+            base_dir=os.path.join(self.module_name, self.fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        backup_dir = os.path.join(self.tmp_path, self.module_name, self.fname, 'backup')
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        node.slow_start()
+
+        node.safe_psql(
+            'postgres',
+            'create table t1 as select i, md5(i::text) as val '
+            'from generate_series(0, 10000) i')
+
+        rel_path = node.safe_psql(
+            'postgres',
+            "select pg_relation_filepath('t1')").decode('utf-8').rstrip()
+        fullpath = os.path.join(node.data_dir, rel_path)
+
+        node.stop()
+
+        # relation ends with zero pages
+        with open(fullpath, 'ab') as f:
+            f.write(b'\0' * 8192 * 20)
+        size = os.path.getsize(fullpath)
+
+        node.slow_start()
+
+        self.backup_node(
+            backup_dir, 'node', node, options=['--stream'])
+
+        pgdata = self.pgdata_content(node.data_dir)
+
+        node.stop()
+
+        for options in [[], ['--punch-holes']]:
+            # cut the file in the middle of zero pages
+            with open(fullpath, 'r+b') as f:
+                f.truncate(size - 8192 * 10)
+
+            self.restore_node(
+                backup_dir, 'node', node,
+                options=['-j', '4', '-I', 'checksum'] + options)
+
+            self.assertEqual(os.path.getsize(fullpath), size)
+            self.compare_pgdata(pgdata, self.pgdata_content(node.data_dir))
+
+        node.slow_start()
+
+        self.assertEqual(
+            node.safe_psql('postgres', 'select count(*) from t1').decode('utf-8').rstrip(),
+            '10001')
+
+    # @unittest.skip("skip")
+    def test_incr_restore_prescan_checksum(self):
+        """
+        Incremental restore in checksum mode with maps of many files
+        computed by prescan threads ahead of restore threads.
+        Failure to compute the map aborts the restore.
+        """
+        node = self.make_simple_node(
+            base_dir=os.path.join(self.module_name, self.fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        backup_dir = os.path.join(self.tmp_path, self.module_name, self.fname, 'backup')
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        node.slow_start()
+
+        node.safe_psql(
+            'postgres',
+            "do $$ begin for i in 1..100 loop "
+            "execute format('create table t%s as select i, md5(i::text) as val "
+            "from generate_series(0, 1000) i', i); "
+            "end loop; end $$")
+
+        self.backup_node(
+            backup_dir, 'node', node, options=['--stream'])
+
+        pgdata = self.pgdata_content(node.data_dir)
+
+        node.safe_psql(
+            'postgres',
+            "do $$ begin for i in 1..100 by 2 loop "
+            "execute format('update t%s set val = val || i', i); "
+            "end loop; end $$")
+
+        rel_path = node.safe_psql(
+            'postgres',
+            "select pg_relation_filepath('t2')").decode('utf-8').rstrip()
+
+        node.stop()
+
+        self.restore_node(
+            backup_dir, 'node', node,
+            options=['-j', '4', '-I', 'checksum'])
+
+        self.compare_pgdata(pgdata, self.pgdata_content(node.data_dir))
+
+        node.slow_start()
+
+        self.assertEqual(
+            node.safe_psql(
+                'postgres',
+                "select count(*) from t1 where val !~ '^[0-9a-f]+$'").decode('utf-8').rstrip(),
+            '0')
+
+        node.safe_psql(
+            'postgres',
+            "do $$ begin for i in 1..100 by 2 loop "
+            "execute format('update t%s set val = val || i', i); "
+            "end loop; end $$")
+
+        node.stop()
+
+        # map of unreadable file cannot be computed
+        os.chmod(os.path.join(node.data_dir, rel_path), 0)
+        try:
+            self.restore_node(
+                backup_dir, 'node', node,
+                options=['-j', '4', '-I', 'checksum'])
+            # we should die here because exception is what we expect to happen
+            self.assertEqual(
+                1, 0,
+                "Expecting Error because data file is not readable.\n "
+                "Output: {0} \n CMD: {1}".format(
+                    repr(self.output), self.cmd))
+        except ProbackupException as e:
+            self.assertIn(
+                'Cannot open source file', e.message,
+                '\n Unexpected Error Message: {0}\n CMD: {1}'.format(
+                    repr(e.message), self.cmd))
+
+    # @unittest.skip("skip")
+    def test_incr_restore_prescan_lsn(self):
+        """
+        Incremental restore in lsn mode with maps of many files
+        computed by prescan threads ahead of restore threads.
+        Failure to compute the map aborts the restore.
+        """
+        node = self.make_simple_node(
+            base_dir=os.path.join(self.module_name, self.fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        backup_dir = os.path.join(self.tmp_path, self.module_name, self.fname, 'backup')
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        node.slow_start()
+
+        node.safe_psql(
+            'postgres',
+            "do $$ begin for i in 1..100 loop "
+            "execute format('create table t%s as select i, md5(i::text) as val "
+            "from generate_series(0, 1000) i', i); "
+            "end loop; end $$")
+
+        self.backup_node(
+            backup_dir, 'node', node, options=['--stream'])
+
+        pgdata = self.pgdata_content(node.data_dir)
+
+        node.safe_psql(
+            'postgres',
+            "do $$ begin for i in 1..100 by 2 loop "
+            "execute format('update t%s set val = val || i', i); "
+            "end loop; end $$")
+
+        rel_path = node.safe_psql(
+            'postgres',
+            "select pg_relation_filepath('t2')").decode('utf-8').rstrip()
+
+        node.stop()
+
+        self.restore_node(
+            backup_dir, 'node', node,
+            options=['-j', '4', '-I', 'lsn'])
+
+        self.compare_pgdata(pgdata, self.pgdata_content(node.data_dir))
+
+        node.slow_start()
+
+        self.assertEqual(
+            node.safe_psql(
+                'postgres',
+                "select count(*) from t1 where val !~ '^[0-9a-f]+$'").decode('utf-8').rstrip(),
+            '0')
+
+        node.safe_psql(
+            'postgres',
+            "do $$ begin for i in 1..100 by 2 loop "
+            "execute format('update t%s set val = val || i', i); "
+            "end loop; end $$")
+
+        node.stop()
+
+        # map of unreadable file cannot be computed
+        os.chmod(os.path.join(node.data_dir, rel_path), 0)
+        try:
+            self.restore_node(
+                backup_dir, 'node', node,
+                options=['-j', '4', '-I', 'lsn'])
+            # we should die here because exception is what we expect to happen
+            self.assertEqual(
+                1, 0,
+                "Expecting Error because data file is not readable.\n "
+                "Output: {0} \n CMD: {1}".format(
+                    repr(self.output), self.cmd))
+        except ProbackupException as e:
+            self.assertIn(
+                'Cannot open source file', e.message,
+                '\n Unexpected Error Message: {0}\n CMD: {1}'.format(
+                    repr(e.message), self.cmd))
+
+
 # check that MinRecPoint and BackupStartLsn are correctly used in case of --incrementa-lsn
@@ -2732,5 +2732,117 @@ class MergeTest(ProbackupTest, unittest.TestCase):
             'postgres',
             'select 1')
 
+    # @unittest.skip("skip")
+    def test_merge_file_created_in_incremental(self):
+        """
+        Data file created in intermediate incremental backup and
+        not changed afterwards must be copied into FULL backup as is
+        """
+        backup_dir = os.path.join(self.tmp_path, self.module_name, self.fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(self.module_name, self.fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        node.slow_start()
+
+        node.pgbench_init(scale=5)
+
+        self.backup_node(
+            backup_dir, 'node', node,
+            options=['--stream', '--compress-algorithm=zlib'])
+
+        node.safe_psql(
+            'postgres',
+            'create table t_heap as select i as id, md5(i::text) as text '
+            'from generate_series(0,100000) i')
+
+        node.safe_psql(
+            'postgres',
+            'checkpoint')
+
+        self.backup_node(
+            backup_dir, 'node', node, backup_type='delta',
+            options=['--stream', '--compress-algorithm=zlib'])
+
+        pgbench = node.pgbench(options=['-T', '10', '-c', '1', '--no-vacuum'])
+        pgbench.wait()
+
+        backup_id = self.backup_node(
+            backup_dir, 'node', node, backup_type='delta',
+            options=['--stream', '--compress-algorithm=zlib'])
+
+        pgdata = self.pgdata_content(node.data_dir)
+
+        output = self.merge_backup(
+            backup_dir, 'node', backup_id,
+            options=['--log-level-console=verbose'])
+
+        relpath = node.safe_psql(
+            'postgres',
+            "select pg_relation_filepath('t_heap')").decode('utf-8').rstrip()
+
+        self.assertIn(
+            'Copying file "{0}" as is'.format(relpath), output)
+
+        node.cleanup()
+
+        self.restore_node(backup_dir, 'node', node)
+        pgdata_restored = self.pgdata_content(node.data_dir)
+        self.compare_pgdata(pgdata, pgdata_restored)
+
+    # @unittest.skip("skip")
+    def test_merge_different_compression_levels(self):
+        """
+        Pages of backups with compression level different from
+        destination backup are recompressed during merge
+        """
+        backup_dir = os.path.join(self.tmp_path, self.module_name, self.fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(self.module_name, self.fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        node.slow_start()
+
+        node.pgbench_init(scale=10)
+
+        self.backup_node(
+            backup_dir, 'node', node,
+            options=['--stream', '--compress-algorithm=zlib', '--compress-level=1'])
+
+        pgbench = node.pgbench(options=['-T', '10', '-c', '1', '--no-vacuum'])
+        pgbench.wait()
+
+        self.backup_node(
+            backup_dir, 'node', node, backup_type='delta',
+            options=['--stream', '--compress-algorithm=zlib', '--compress-level=9'])
+
+        pgbench = node.pgbench(options=['-T', '10', '-c', '1', '--no-vacuum'])
+        pgbench.wait()
+
+        backup_id = self.backup_node(
+            backup_dir, 'node', node, backup_type='delta',
+            options=['--stream', '--compress-algorithm=zlib', '--compress-level=5'])
+
+        pgdata = self.pgdata_content(node.data_dir)
+
+        self.merge_backup(backup_dir, 'node', backup_id)
+
+        show_backup = self.show_pb(backup_dir, 'node')[0]
+        self.assertEqual(show_backup['status'], 'OK')
+        self.assertEqual(show_backup['compress-level'], 5)
+
+        self.validate_pb(backup_dir, 'node')
+
+        node.cleanup()
+
+        self.restore_node(backup_dir, 'node', node)
+        pgdata_restored = self.pgdata_content(node.data_dir)
+        self.compare_pgdata(pgdata, pgdata_restored)
+
 # 1. Need new test with corrupted FULL backup
-# 2. different compression levels
@@ -665,6 +665,58 @@ class PageTest(ProbackupTest, unittest.TestCase):
         # Clean after yourself
         node.cleanup()
 
+    # @unittest.skip("skip")
+    def test_parallel_pagemap_compressed_archive(self):
+        """
+        Test for parallel reading of compressed WAL segments,
+        which are read ahead of the threads building pagemap
+        """
+        backup_dir = os.path.join(self.tmp_path, self.module_name, self.fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(self.module_name, self.fname, 'node'),
+            initdb_params=['--data-checksums'])
+        node_restored = self.make_simple_node(
+            base_dir=os.path.join(self.module_name, self.fname, 'node_restored'))
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        self.set_config(
+            backup_dir, 'node', options=['--compress-algorithm=zlib'])
+        self.set_archiving(backup_dir, 'node', node, compress=False)
+        node.slow_start()
+
+        self.backup_node(backup_dir, 'node', node)
+
+        # Fill instance with data and make several WAL segments
+        node.pgbench_init(scale=10)
+        pgbench = node.pgbench(options=['-T', '10', '-c', '2'])
+        pgbench.wait()
+
+        wals_dir = os.path.join(backup_dir, 'wal', 'node')
+        wals = [f for f in os.listdir(wals_dir) if f.endswith('.gz')]
+        self.assertTrue(len(wals) > 4)
+
+        self.backup_node(
+            backup_dir, 'node', node, backup_type="page", options=["-j", "4"])
+
+        if self.paranoia:
+            pgdata = self.pgdata_content(node.data_dir)
+
+        node_restored.cleanup()
+        self.restore_node(backup_dir, 'node', node_restored)
+
+        # Physical comparison
+        if self.paranoia:
+            pgdata_restored = self.pgdata_content(node_restored.data_dir)
+            self.compare_pgdata(pgdata, pgdata_restored)
+
+        self.set_auto_conf(node_restored, {'port': node_restored.port})
+        node_restored.slow_start()
+
+        self.assertEqual(
+            node.table_checksum("pgbench_accounts"),
+            node_restored.table_checksum("pgbench_accounts"))
+
     # @unittest.skip("skip")
     def test_page_backup_with_lost_wal_segment(self):
         """
@@ -40,3 +40,157 @@ class RemoteTest(ProbackupTest, unittest.TestCase):
         #         e.message,
         #         "\n Unexpected Error Message: {0}\n CMD: {1}".format(
         #             repr(e.message), self.cmd))
+
+    # @unittest.skip("skip")
+    def test_remote_batch(self):
+        """
+        Restore through remote agent creates many directories and syncs
+        many files, so requests are sent in several batches in flight
+        """
+        if not self.remote:
+            self.skipTest("You must enable PGPROBACKUP_SSH_REMOTE"
+                          " for run this test")
+        node = self.make_simple_node(
+            base_dir=os.path.join(self.module_name, self.fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        backup_dir = os.path.join(self.tmp_path, self.module_name, self.fname, 'backup')
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        node.slow_start()
+
+        self.create_tblspace_in_node(node, 'tblspace')
+        for i in range(10):
+            node.safe_psql(
+                "postgres",
+                "create database db{0} tablespace tblspace".format(i))
+
+        node.safe_psql(
+            "postgres",
+            "do $$ begin for i in 1..3000 loop "
+            "execute format('create table t%s as select 1 as i', i); "
+            "end loop; end $$")
+        node.safe_psql("postgres", "checkpoint")
+
+        self.backup_node(backup_dir, 'node', node, options=['--stream'])
+        pgdata = self.pgdata_content(node.data_dir)
+        node.stop()
+
+        node_restored = self.make_simple_node(
+            base_dir=os.path.join(self.module_name, self.fname, 'node_restored'))
+        node_restored.cleanup()
+        tblspace_path = self.get_tblspace_path(node, 'tblspace')
+        tblspace_new = self.get_tblspace_path(node_restored, 'tblspace')
+
+        # restored files are synced, so restore is run without --no-sync
+        self.run_pb([
+            'restore', '-B', backup_dir, '--instance=node',
+            '-D', node_restored.data_dir, '-j', '4',
+            '-T', '{0}={1}'.format(tblspace_path, tblspace_new),
+            '--remote-proto=ssh', '--remote-host=localhost'])
+
+        pgdata_restored = self.pgdata_content(node_restored.data_dir)
+        self.compare_pgdata(pgdata, pgdata_restored)
+
+        self.set_auto_conf(node_restored, {'port': node_restored.port})
+        node_restored.slow_start()
+        self.assertEqual(
+            node_restored.safe_psql(
+                "postgres", "select count(*) from pg_class where relname ~ '^t[0-9]+$'").decode('utf-8').rstrip(),
+            '3000')
+
+    # @unittest.skip("skip")
+    def test_remote_shared_ssh_session(self):
+        """
+        Threads talk to remote agent through channels of one SSH session,
+        agent version is checked once
+        """
+        if not self.remote:
+            self.skipTest("You must enable PGPROBACKUP_SSH_REMOTE"
+                          " for run this test")
+        node = self.make_simple_node(
+            base_dir=os.path.join(self.module_name, self.fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        backup_dir = os.path.join(self.tmp_path, self.module_name, self.fname, 'backup')
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        node.slow_start()
+
+        node.pgbench_init(scale=1)
+
+        self.backup_node(
+            backup_dir, 'node', node,
+            options=['--stream', '-j', '4', '--log-level-file=LOG'])
+
+        with open(os.path.join(backup_dir, 'log', 'pg_probackup.log')) as f:
+            log_content = f.read()
+
+        self.assertIn('SSH session is shared by all threads', log_content)
+        self.assertEqual(log_content.count('Start SSH client process'), 1)
+        self.assertEqual(log_content.count('Remote agent protocol version is'), 1)
+
+    # @unittest.skip("skip")
+    def test_remote_old_agent(self):
+        """
+        Remote agent, which cannot share SSH session, is started
+        by every thread, its version is checked once per connection
+        """
+        if not self.remote:
+            self.skipTest("You must enable PGPROBACKUP_SSH_REMOTE"
+                          " for run this test")
+        if not self.probackup_old_path:
+            self.skipTest("You must specify PGPROBACKUPBIN_OLD"
+                          " for run this test")
+        node = self.make_simple_node(
+            base_dir=os.path.join(self.module_name, self.fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        backup_dir = os.path.join(self.tmp_path, self.module_name, self.fname, 'backup')
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        node.slow_start()
+
+        node.pgbench_init(scale=1)
+
+        # old binary is run as remote agent
+        remote_path = os.path.join(self.tmp_path, self.module_name, self.fname, 'old_agent')
+        os.makedirs(remote_path)
+        os.symlink(
+            self.probackup_old_path,
+            os.path.join(remote_path, os.path.basename(self.probackup_path)))
+
+        try:
+            self.backup_node(
+                backup_dir, 'node', node,
+                options=[
+                    '--stream', '-j', '4', '--log-level-file=LOG',
+                    '--remote-path={0}'.format(remote_path)])
+        except ProbackupException as e:
+            if 'does not match local program protocol version' in e.message:
+                self.skipTest("Old binary is too old to be remote agent")
+            raise
+
+        with open(os.path.join(backup_dir, 'log', 'pg_probackup.log')) as f:
+            log_content = f.read()
+
+        if 'SSH session is shared by all threads' in log_content:
+            self.skipTest("Old binary can share SSH session")
+
+        n_connections = log_content.count('Start SSH client process')
+        self.assertGreater(n_connections, 1)
+        self.assertEqual(
+            log_content.count('Remote agent protocol version is'), n_connections)
+
+        pgdata = self.pgdata_content(node.data_dir)
+        node.stop()
+        node.cleanup()
+
+        self.restore_node(
+            backup_dir, 'node', node,
+            options=['-j', '4', '--remote-path={0}'.format(remote_path)])
+
+        self.compare_pgdata(pgdata, self.pgdata_content(node.data_dir))
@@ -2685,6 +2685,54 @@ class RestoreTest(ProbackupTest, unittest.TestCase):
 
         self.assertNotIn('PANIC', output)
 
+    # @unittest.skip("skip")
+    def test_partial_restore_exclude_split_file(self):
+        """
+        Data file, which is restored by block ranges, is created empty,
+        if its database is excluded
+        """
+        backup_dir = os.path.join(self.tmp_path, self.module_name, self.fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(self.module_name, self.fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        node.slow_start()
+
+        node.safe_psql('postgres', 'CREATE database db1')
+
+        # large enough to be restored by block ranges
+        node.safe_psql(
+            'db1',
+            'create table t1 as select i, repeat(md5(i::text), 3) as val '
+            'from generate_series(0, 1500000) i')
+
+        rel_path = node.safe_psql(
+            'db1',
+            "select pg_relation_filepath('t1')").decode('utf-8').rstrip()
+
+        self.backup_node(
+            backup_dir, 'node', node, options=['--stream'])
+
+        node_restored = self.make_simple_node(
+            base_dir=os.path.join(self.module_name, self.fname, 'node_restored'))
+        node_restored.cleanup()
+
+        self.restore_node(
+            backup_dir, 'node', node_restored,
+            options=['-j', '4', '--db-exclude=db1'])
+
+        fullpath = os.path.join(node_restored.data_dir, rel_path)
+        self.assertEqual(os.path.getsize(fullpath), 0)
+        self.assertEqual(os.stat(fullpath).st_blocks, 0)
+
+        self.set_auto_conf(node_restored, {'port': node_restored.port})
+        node_restored.slow_start()
+
+        node_restored.safe_psql('postgres', 'select 1')
+
     def test_partial_restore_backward_compatibility_1(self):
         """
         old binary should be of version < 2.2.0
@@ -3723,3 +3771,66 @@ class RestoreTest(ProbackupTest, unittest.TestCase):
             wal_path=os.path.join(node.data_dir, "pg_xlog")
 
         self.assertEqual(os.path.islink(wal_path), True)
+
+    # @unittest.skip("skip")
+    def test_restore_chain_block_owners(self):
+        """
+        Restore FULL with a long chain of DELTA backups, where some
+        relations are changed only in some of them. Backups, which
+        contain no final version of any block of a file, are not read.
+        """
+        node = self.make_simple_node(
+            base_dir=os.path.join(self.module_name, self.fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        backup_dir = os.path.join(self.tmp_path, self.module_name, self.fname, 'backup')
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        node.slow_start()
+
+        node.safe_psql(
+            "postgres",
+            "create table t_static as select i, md5(i::text) as val "
+            "from generate_series(0, 20000) i; "
+            "create table t_hot as select i, md5(i::text) as val "
+            "from generate_series(0, 20000) i")
+
+        static_path = node.safe_psql(
+            "postgres",
+            "select pg_relation_filepath('t_static')").decode('utf-8').rstrip()
+
+        self.backup_node(backup_dir, 'node', node, options=['--stream'])
+
+        for i in range(5):
+            node.safe_psql(
+                "postgres",
+                "update t_hot set val = md5(val) where i % 50 = {0}".format(i))
+            backup_id = self.backup_node(
+                backup_dir, 'node', node, backup_type='delta',
+                options=['--stream'])
+
+        pgdata = self.pgdata_content(node.data_dir)
+
+        node_restored = self.make_simple_node(
+            base_dir=os.path.join(self.module_name, self.fname, 'node_restored'))
+        node_restored.cleanup()
+
+        self.restore_node(
+            backup_dir, 'node', node_restored, backup_id=backup_id,
+            options=['-j', '4', '--log-level-file=VERBOSE'])
+
+        with open(os.path.join(backup_dir, 'log', 'pg_probackup.log')) as f:
+            log_content = f.read()
+            self.assertIn(
+                'File "{0}" is restored from 1 of 6 backups'.format(static_path),
+                log_content)
+
+        self.compare_pgdata(pgdata, self.pgdata_content(node_restored.data_dir))
+
+        self.set_auto_conf(node_restored, {'port': node_restored.port})
+        node_restored.slow_start()
+
+        self.assertEqual(
+            node.safe_psql("postgres", "select sum(hashtext(val)) from t_hot"),
+            node_restored.safe_psql("postgres", "select sum(hashtext(val)) from t_hot"))
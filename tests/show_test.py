@@ -1,6 +1,7 @@
 import os
 import unittest
 from .helpers.ptrack_helpers import ProbackupTest, ProbackupException
+from time import sleep
 
 
 class ShowTest(ProbackupTest, unittest.TestCase):
@@ -507,3 +508,91 @@ class ShowTest(ProbackupTest, unittest.TestCase):
                 '[0m', e.message,
                 '\n Unexpected Error Message: {0}\n CMD: {1}'.format(
                     repr(e.message), self.cmd))
+
+    # @unittest.skip("skip")
+    # @unittest.expectedFailure
+    def test_show_catalog_summary(self):
+        """
+        Backups are taken from catalog summary, but changes
+        of backup.control are not missed
+        """
+        backup_dir = os.path.join(self.tmp_path, self.module_name, self.fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(self.module_name, self.fname, 'node'),
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        node.slow_start()
+
+        self.backup_node(backup_dir, 'node', node, options=['--stream'])
+        backup_id = self.backup_node(
+            backup_dir, 'node', node, backup_type='delta', options=['--stream'])
+
+        # let timestamps of control files become trustworthy
+        sleep(3)
+
+        self.show_pb(backup_dir, 'node')
+        self.assertTrue(
+            os.path.isfile(os.path.join(backup_dir, 'backups', '.node.summary')))
+
+        output = self.run_pb([
+            'show', '-B', backup_dir, '--instance=node',
+            '--log-level-console=LOG'])
+        self.assertIn(
+            "Read 0 of 2 control files of instance 'node'", output)
+
+        self.change_backup_status(backup_dir, 'node', backup_id, 'CORRUPT')
+        self.assertEqual(
+            self.show_pb(backup_dir, 'node', backup_id)['status'], 'CORRUPT')
+
+        self.del_instance(backup_dir, 'node')
+        self.assertFalse(
+            os.path.exists(os.path.join(backup_dir, 'backups', '.node.summary')))
+
+    # @unittest.skip("skip")
+    def test_show_catalog_summary_no_control(self):
+        """
+        Backup without backup.control is taken from catalog summary,
+        so the summary is not rewritten until the control file appears
+        """
+        backup_dir = os.path.join(self.tmp_path, self.module_name, self.fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(self.module_name, self.fname, 'node'),
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        node.slow_start()
+
+        backup_id = self.backup_node(backup_dir, 'node', node, options=['--stream'])
+
+        control_path = os.path.join(
+            backup_dir, 'backups', 'node', backup_id, 'backup.control')
+        summary_path = os.path.join(backup_dir, 'backups', '.node.summary')
+
+        with open(control_path, 'rb') as f:
+            control = f.read()
+        os.remove(control_path)
+
+        # let timestamps become trustworthy
+        sleep(3)
+
+        self.show_pb(backup_dir, 'node')
+        summary_stat = os.stat(summary_path)
+
+        output = self.run_pb([
+            'show', '-B', backup_dir, '--instance=node',
+            '--log-level-console=LOG'])
+        self.assertIn(
+            "Read 0 of 1 control files of instance 'node'", output)
+        self.assertIn("doesn't exist", output)
+
+        self.assertEqual(
+            (summary_stat.st_ino, summary_stat.st_mtime_ns),
+            (os.stat(summary_path).st_ino, os.stat(summary_path).st_mtime_ns))
+
+        with open(control_path, 'wb') as f:
+            f.write(control)
+        self.assertEqual(
+            self.show_pb(backup_dir, 'node', backup_id)['status'], 'OK')
@@ -4051,6 +4051,90 @@ class ValidateTest(ProbackupTest, unittest.TestCase):
             tblspace_new,
             "Symlink '{0}' do not points to '{1}'".format(tablespace_link, tblspace_new))
 
+    # @unittest.skip("skip")
+    def test_validate_ledger(self):
+        """
+        Check that files recorded in the validation ledger are not reread,
+        unless they are changed or --full-validation is used
+        """
+        backup_dir = os.path.join(self.tmp_path, self.module_name, self.fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(self.module_name, self.fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        self.set_config(
+            backup_dir, 'node', options=['--validation-ledger-max-age=1d'])
+        node.slow_start()
+
+        node.pgbench_init(scale=3)
+
+        file_path = node.safe_psql(
+            "postgres",
+            "select pg_relation_filepath('pgbench_accounts')").decode('utf-8').rstrip()
+
+        # validation after backup fills the ledger
+        backup_id = self.backup_node(
+            backup_dir, 'node', node, options=['--stream'])
+
+        ledger = os.path.join(
+            backup_dir, 'backups', 'node', backup_id, 'validation_ledger')
+        self.assertTrue(os.path.exists(ledger))
+
+        output = self.validate_pb(
+            backup_dir, 'node', backup_id=backup_id, options=['-j', '4'])
+        self.assertIn(
+            'files are not read, as they are validated according to the validation ledger',
+            output)
+
+        output = self.validate_pb(
+            backup_dir, 'node', backup_id=backup_id, options=['--full-validation'])
+        self.assertIn(
+            'Validation ledger is ignored, all files are validated', output)
+        self.assertNotIn('files are not read', output)
+
+        # damaged ledger is not trusted
+        with open(ledger, 'r+b') as f:
+            f.seek(10)
+            f.write(b"X")
+            f.flush()
+            f.close
+
+        output = self.validate_pb(backup_dir, 'node', backup_id=backup_id)
+        self.assertIn('is corrupted, all files of backup', output)
+        self.assertNotIn('files are not read', output)
+
+        # make sure modification time of the damaged file differs
+        time.sleep(1)
+
+        file = os.path.join(
+            backup_dir, 'backups', 'node', backup_id, 'database', file_path)
+        with open(file, 'r+b') as f:
+            f.seek(42000)
+            f.write(b"\xff" * 64)
+            f.flush()
+            f.close
+
+        try:
+            self.validate_pb(backup_dir, 'node', backup_id=backup_id)
+            self.assertEqual(
+                1, 0,
+                "Expecting Error because backup file is corrupted.\n "
+                "Output: {0} \n CMD: {1}".format(
+                    self.output, self.cmd))
+        except ProbackupException as e:
+            self.assertIn(
+                'WARNING: Backup {0} data files are corrupted'.format(backup_id),
+                e.message,
+                '\n Unexpected Error Message: {0}\n CMD: {1}'.format(
+                    repr(e.message), self.cmd))
+
+        self.assertEqual(
+            'CORRUPT',
+            self.show_pb(backup_dir, 'node', backup_id)['status'])
+
 # validate empty backup list
 # page from future during validate
 # page from future during backup